@@ -0,0 +1,88 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/17 11:30
+@FileName       : bench_archive.py
+@Project        : BilibiliMangaDownloader
+@Description    : benchmark single-pass archive writer against loose files + create_zip
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import pathlib
+import tempfile
+from argparse import ArgumentParser
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from bilibili_manga_downloader.archive_writer import ChapterArchiveWriter
+from bilibili_manga_downloader.file_handler import FileHandler
+
+
+def _read_proc_io() -> dict[str, int]:
+    """读取当前进程的 I/O 统计, 非 Linux 平台返回空字典"""
+    try:
+        with open('/proc/self/io', 'r', encoding='utf-8') as f:
+            return {k: int(v) for k, v in (line.split(': ') for line in f.read().splitlines())}
+    except OSError:
+        return {}
+
+
+async def _two_pass(root: FileHandler, pages: list[bytes], chapter: int) -> None:
+    folder = root(f'two_pass_{chapter}')
+    for index, data in enumerate(pages):
+        async with folder(f'page_{index}.jpg').async_open('wb') as af:
+            await af.write(data)
+    await folder.create_zip()
+
+
+async def _single_pass(root: FileHandler, pages: list[bytes], chapter: int) -> None:
+    order = list(range(len(pages)))
+    random.shuffle(order)
+    archive_file = root(f'single_pass_{chapter}.cbz')
+    async with ChapterArchiveWriter(output_file=archive_file, page_count=len(pages)) as writer:
+        for index in order:
+            await writer.add_page(index, arcname=f'page_{index}.jpg', data=pages[index])
+
+
+async def _run(name: str, func, root: FileHandler, pages: list[bytes], chapters: int) -> dict[str, float]:
+    io_start = _read_proc_io()
+    start = time.perf_counter()
+    for chapter in range(chapters):
+        await func(root, pages, chapter)
+    elapsed = time.perf_counter() - start
+    io_end = _read_proc_io()
+
+    result = {'wall_time': elapsed}
+    for key in ('rchar', 'wchar', 'read_bytes', 'write_bytes'):
+        if key in io_start:
+            result[key] = io_end[key] - io_start[key]
+    print(f'{name:>12}: ' + ', '.join(f'{k}={v:.3f}' if isinstance(v, float) else f'{k}={v}'
+                                      for k, v in result.items()))
+    return result
+
+
+async def main() -> None:
+    parser = ArgumentParser(description='章节压缩文件写入性能测试')
+    parser.add_argument('--chapters', type=int, default=5, help='测试章节数')
+    parser.add_argument('--pages', type=int, default=40, help='每章节页数')
+    parser.add_argument('--page-size', type=int, default=512 * 1024, help='每页大小, 单位字节')
+    args = parser.parse_args()
+
+    # 随机数据与 JPEG/WebP 一样几乎不可再压缩
+    pages = [os.urandom(args.page_size) for _ in range(args.pages)]
+    payload = args.chapters * args.pages * args.page_size
+    print(f'chapters={args.chapters}, pages={args.pages}, page_size={args.page_size}, payload={payload}')
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = FileHandler(temp_dir)
+        await _run('two-pass', _two_pass, root, pages, args.chapters)
+        await _run('single-pass', _single_pass, root, pages, args.chapters)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,191 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/17 19:00
+@FileName       : bench_download.py
+@Project        : BilibiliMangaDownloader
+@Description    : end-to-end download_manga benchmark against the local mock server
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import pathlib
+import platform
+import resource
+import tempfile
+import subprocess
+import urllib.request
+from argparse import ArgumentParser
+
+_BENCHMARK_DIR = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(_BENCHMARK_DIR.parent))
+
+from mock_server import MockServerConfig, create_argument_parser as create_mock_argument_parser
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _count_sockets() -> int:
+    """当前进程打开的 socket 数, 非 Linux 平台返回 -1"""
+    try:
+        fds = os.listdir('/proc/self/fd')
+    except OSError:
+        return -1
+    count = 0
+    for fd in fds:
+        try:
+            if os.readlink(f'/proc/self/fd/{fd}').startswith('socket:'):
+                count += 1
+        except OSError:
+            continue
+    return count
+
+
+def _peak_rss() -> int:
+    """进程峰值 RSS, 单位字节"""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def _cpu_time() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _start_mock_server(config: MockServerConfig) -> subprocess.Popen:
+    args = [sys.executable, str(_BENCHMARK_DIR / 'mock_server.py')]
+    for name, value in config.dict().items():
+        if value is not None:
+            args.extend([f'--{name.replace("_", "-")}', str(value)])
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if 'listening' not in line:
+        process.kill()
+        raise RuntimeError(f'mock server failed to start: {line!r}')
+    return process
+
+
+def _fetch_stats(base_url: str) -> dict[str, int]:
+    with urllib.request.urlopen(f'{base_url}/stats') as rp:
+        return json.loads(rp.read())
+
+
+async def _sample_sockets(samples: list[int], interval: float) -> None:
+    while True:
+        samples.append(_count_sockets())
+        await asyncio.sleep(interval)
+
+
+async def _run_download(args, root: pathlib.Path) -> tuple[float, int]:
+    from bilibili_manga_downloader.downloader import download_manga
+    from bilibili_manga_downloader.file_handler import FileHandler
+    from bilibili_manga_downloader.image_variant import ImageVariantPolicy
+    from bilibili_manga_downloader.scheduler import SchedulerConfig
+
+    # 将下载目录重定向到临时目录, 避免在仓库中留下测试文件
+    FileHandler._local_root = root
+
+    samples: list[int] = []
+    sampler = asyncio.create_task(_sample_sockets(samples, interval=0.05))
+    start = time.perf_counter()
+    try:
+        scheduler_config = SchedulerConfig()
+        scheduler_config.cdn_limit.max = args.cdn_concurrency
+        scheduler_config.fetch_workers = max(scheduler_config.fetch_workers, args.cdn_concurrency)
+        image_variant = ImageVariantPolicy(width=args.image_width, quality=args.image_quality,
+                                           format=args.image_format)
+        if args.events:
+            from bilibili_manga_downloader.download_config import DownloaderConfig
+            from bilibili_manga_downloader.download_run import DownloadRun, DownloadSpec
+
+            config = DownloaderConfig(single_pass=args.single_pass, chunk_size=args.chunk_size,
+                                      scheduler_config=scheduler_config, image_variant=image_variant,
+                                      validate_images=not args.no_validate)
+            async for _ in DownloadRun(DownloadSpec(comic_id=args.comic_id), config=config):
+                pass
+        else:
+            await download_manga(comic_id=args.comic_id, single_pass=args.single_pass, chunk_size=args.chunk_size,
+                                 scheduler_config=scheduler_config, image_variant=image_variant,
+                                 validate_images=not args.no_validate)
+    finally:
+        elapsed = time.perf_counter() - start
+        sampler.cancel()
+    return elapsed, max(samples, default=-1)
+
+
+def main() -> None:
+    parser = ArgumentParser(description='下载性能测试, 在本地模拟服务端上完整运行 download_manga',
+                            parents=[create_mock_argument_parser()], conflict_handler='resolve', add_help=False)
+    parser.add_argument('-h', '--help', action='help')
+    parser.add_argument('--comic-id', type=int, default=1)
+    parser.add_argument('--single-pass', action='store_true')
+    parser.add_argument('--chunk-size', type=int, default=64 * 1024)
+    parser.add_argument('--cdn-concurrency', type=int, default=64)
+    parser.add_argument('--image-format', type=str, default=None)
+    parser.add_argument('--image-width', type=int, default=None)
+    parser.add_argument('--image-quality', type=int, default=None)
+    parser.add_argument('--events', action='store_true', help='通过 DownloadRun 下载并迭代全部进度事件')
+    parser.add_argument('--no-validate', action='store_true', help='下载时不校验图片内容')
+    parser.add_argument('--label', type=str, default='', help='写入结果的版本标签, 例如 git commit')
+    parser.add_argument('--output', type=str, default='', help='结果 JSON 文件路径, 默认只打印')
+    args = parser.parse_args()
+
+    mock_config = MockServerConfig(**{k: v for k, v in vars(args).items() if k in MockServerConfig.__fields__})
+    mock_config.port = _free_port()
+    base_url = f'http://{mock_config.host}:{mock_config.port}'
+    # 必须在导入 bilibili_manga_downloader 之前设置
+    os.environ['BILIBILI_ACCOUNT_API_URL'] = base_url
+    os.environ['BILIBILI_MANGA_API_URL'] = base_url
+
+    # 导入耗时不计入 CPU 时间
+    import bilibili_manga_downloader.downloader
+
+    process = _start_mock_server(mock_config)
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cpu_start = _cpu_time()
+            elapsed, peak_sockets = asyncio.run(_run_download(args, pathlib.Path(temp_dir)))
+            cpu_time = _cpu_time() - cpu_start
+        stats = _fetch_stats(base_url)
+    finally:
+        process.terminate()
+        process.wait()
+
+    pages = mock_config.episodes * mock_config.pages
+    result = {
+        'label': args.label,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'config': {**mock_config.dict(), 'single_pass': args.single_pass, 'chunk_size': args.chunk_size,
+                   'cdn_concurrency': args.cdn_concurrency, 'image_format': args.image_format,
+                   'image_width': args.image_width, 'image_quality': args.image_quality,
+                   'events': args.events, 'validate_images': not args.no_validate},
+        'wall_time': elapsed,
+        'pages': pages,
+        'pages_per_sec': pages / elapsed,
+        'bytes': stats['cdn_bytes'],
+        'bytes_per_sec': stats['cdn_bytes'] / elapsed,
+        'bytes_per_chapter': stats['cdn_bytes'] / mock_config.episodes,
+        'cpu_time': cpu_time,
+        'peak_rss': _peak_rss(),
+        'peak_sockets': peak_sockets,
+        'server_stats': stats
+    }
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 05:45
+@FileName       : bench_events.py
+@Project        : BilibiliMangaDownloader
+@Description    : per page cost of creating and dispatching download progress events
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import sys
+import json
+import time
+import asyncio
+import pathlib
+from argparse import ArgumentParser
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from bilibili_manga_downloader.download_run import DownloadRun, DownloadSpec
+from bilibili_manga_downloader.events import ChapterArchived, ChapterPlanned, PageDone, ResultCollector
+
+
+_MODES: tuple[str, ...] = ('no_events', 'collector', 'stream')
+"""no_events: 流水线未设置事件回调; collector: 只汇总下载结果; stream: 汇总结果并由另一个协程迭代全部事件"""
+
+
+async def _emit(on_event, chapters: int, pages: int, page_interval: int) -> None:
+    """按流水线的顺序产生事件, 每 page_interval 个图片让出一次事件循环, 模拟图片下载的间隔"""
+    started_at = time.perf_counter()
+    for ep_id in range(chapters):
+        if on_event is not None:
+            on_event(ChapterPlanned(1, ep_id, page_count=pages, stored_count=0, blob_count=0))
+        for index in range(pages):
+            if on_event is not None:
+                on_event(PageDone(1, ep_id, index=index, image_path='/bfs/manga/0123456789abcdef.jpg',
+                                  size=200 * 1024, latency=time.perf_counter() - started_at, cached=False))
+            if index % page_interval == 0:
+                await asyncio.sleep(0)
+        if on_event is not None:
+            on_event(ChapterArchived(1, ep_id, archive_path='/download/1/ep.zip', size=pages * 200 * 1024,
+                                     page_count=pages, fail_count=0))
+
+
+async def _run(mode: str, args) -> dict[str, float]:
+    consumed = 0
+    loop_start = time.thread_time()
+    start = time.perf_counter()
+    if mode == 'no_events':
+        await _emit(None, args.chapters, args.pages, args.page_interval)
+    elif mode == 'collector':
+        collector = ResultCollector(1)
+        await _emit(collector, args.chapters, args.pages, args.page_interval)
+        collector.result()
+    else:
+        run = DownloadRun(DownloadSpec(comic_id=1))
+        collector = ResultCollector(1, forward=run._on_event)
+
+        async def _produce():
+            await _emit(collector, args.chapters, args.pages, args.page_interval)
+            return collector.result()
+
+        # 以模拟的事件源代替 download_manga, 只测量事件的创建、汇总及在协程之间传递的开销
+        run._run = _produce
+        async for _ in run:
+            consumed += 1
+    elapsed = time.perf_counter() - start
+    cpu = time.thread_time() - loop_start
+
+    pages = args.chapters * args.pages
+    return {'wall_time_ms': elapsed * 1000, 'cpu_us_per_page': cpu / pages * 1e6, 'events_consumed': consumed}
+
+
+def main() -> None:
+    parser = ArgumentParser(description='下载进度事件的创建及分发开销测试')
+    parser.add_argument('--chapters', type=int, default=200, help='模拟的章节数')
+    parser.add_argument('--pages', type=int, default=500, help='每章节页数')
+    parser.add_argument('--page-interval', type=int, default=1, help='每隔多少个图片让出一次事件循环')
+    parser.add_argument('--repeat', type=int, default=3, help='重复次数, 取最小值')
+    parser.add_argument('--output', type=str, default='', help='结果 JSON 文件路径, 默认只打印')
+    args = parser.parse_args()
+
+    results: dict[str, dict[str, float]] = {}
+    for mode in _MODES:
+        runs = [asyncio.run(_run(mode, args)) for _ in range(args.repeat)]
+        results[mode] = min(runs, key=lambda x: x['cpu_us_per_page'])
+    baseline = results['no_events']['cpu_us_per_page']
+    for result in results.values():
+        result['overhead_us_per_page'] = result['cpu_us_per_page'] - baseline
+
+    print(f'pages={args.chapters * args.pages}, page_interval={args.page_interval}')
+    columns = list(next(iter(results.values())))
+    print(f'{"mode":<12}' + ''.join(f'{x:>24}' for x in columns))
+    for mode, result in results.items():
+        print(f'{mode:<12}' + ''.join(f'{result[x]:>24.2f}' for x in columns))
+
+    if args.output:
+        pathlib.Path(args.output).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding='utf-8')
+
+
+if __name__ == '__main__':
+    main()
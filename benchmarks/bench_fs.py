@@ -0,0 +1,222 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 03:30
+@FileName       : bench_fs.py
+@Project        : BilibiliMangaDownloader
+@Description    : per-page syscall and thread hop cost of writing downloaded pages
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import pathlib
+import tempfile
+import aiofiles
+from copy import deepcopy
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from bilibili_manga_downloader.file_handler import FileHandler
+from bilibili_manga_downloader.fs import WriterConfig, WriterPool, directory_cache
+
+
+_COUNTED_OS_FUNCTIONS: tuple[str, ...] = (
+    'stat', 'lstat', 'open', 'close', 'mkdir', 'replace', 'fsync', 'ftruncate', 'posix_fallocate', 'unlink'
+)
+"""统计调用次数的 os 函数, 每次调用对应一次系统调用; 写入次数另外从 /proc/self/io 读取"""
+
+
+class _SyscallCounter(object):
+    """统计文件相关的系统调用次数
+
+    包装 os 模块中的函数统计 stat、mkdir、replace 等调用, 内置 open 通过 audit hook 统计,
+    write 次数读取 /proc/self/io 的 syscw, 每次内置 open 计入一次对应的 close
+    """
+
+    def __init__(self):
+        self.counts: dict[str, int] = {}
+        self.enabled = False
+        self._originals = {name: getattr(os, name) for name in _COUNTED_OS_FUNCTIONS if hasattr(os, name)}
+        sys.addaudithook(self._audit)
+        for name, func in self._originals.items():
+            setattr(os, name, self._wrap(name, func))
+
+    def _count(self, name: str, value: int = 1) -> None:
+        if self.enabled:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def _wrap(self, name: str, func):
+        def _wrapper(*args, **kwargs):
+            self._count(name)
+            return func(*args, **kwargs)
+        return _wrapper
+
+    def _audit(self, event: str, args: tuple) -> None:
+        # os.open 同样触发 open 事件(mode 为 None), 已由包装函数统计
+        if event == 'open' and args[1] is not None and isinstance(args[0], (str, bytes, os.PathLike)):
+            self._count('open')
+            self._count('close')
+
+    @staticmethod
+    def _syscw() -> int:
+        try:
+            with open('/proc/self/io', 'rb') as f:
+                for line in f:
+                    if line.startswith(b'syscw:'):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return 0
+
+    def start(self) -> None:
+        self.counts = {}
+        self._write_start = self._syscw()
+        self.enabled = True
+
+    def stop(self) -> dict[str, int]:
+        self.enabled = False
+        # 读取 /proc/self/io 本身不计入
+        self.counts['write'] = self._syscw() - self._write_start
+        return self.counts
+
+
+class _CountingExecutor(ThreadPoolExecutor):
+    """统计提交次数的默认线程池, 每次提交即一次事件循环与线程之间的切换"""
+    submit_count: int = 0
+
+    def submit(self, *args, **kwargs):
+        _CountingExecutor.submit_count += 1
+        return super().submit(*args, **kwargs)
+
+
+class _ReferenceFileHandler(object):
+    """改用 fs 模块之前的 FileHandler 写入路径, 作为对照: 每次派生路径 deepcopy, 打开文件前检查文件及父目录"""
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+
+    def __call__(self, *args) -> "_ReferenceFileHandler":
+        new_obj = deepcopy(self)
+        new_obj.path = self.path.joinpath(*[str(x) for x in args])
+        return new_obj
+
+    @property
+    def parent(self) -> "_ReferenceFileHandler":
+        new_obj = deepcopy(self)
+        new_obj.path = self.path.parent
+        return new_obj
+
+    @asynccontextmanager
+    async def async_open(self, mode):
+        if self.path.exists() and self.path.is_file():
+            pass
+        elif not self.path.exists():
+            if not self.path.parent.exists():
+                pathlib.Path.mkdir(self.path.parent, parents=True)
+        async with aiofiles.open(file=self.path, mode=mode) as _afh:
+            yield _afh
+
+
+def _chunks(data: bytes, chunk_size: int) -> list[bytes]:
+    return [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+async def _reference_page(folder: _ReferenceFileHandler, name: str, chunks: list[bytes]) -> None:
+    file = folder(name)
+    temp_file = file.parent(f'{file.path.name}.part')
+    async with temp_file.async_open('wb') as af:
+        for chunk in chunks:
+            await af.write(chunk)
+    os.replace(temp_file.path, file.path)
+    file.path.stat()
+
+
+async def _pool_page(folder: FileHandler, name: str, chunks: list[bytes], pool: WriterPool) -> None:
+    file = folder(name)
+    temp_file = pool.open(file.path.with_name(f'{file.path.name}.part'), size=sum(map(len, chunks)))
+    for chunk in chunks:
+        await temp_file.write(chunk)
+    await temp_file.commit(file.path)
+
+
+async def _run(mode: str, root: pathlib.Path, args, chunks: list[bytes], counter: _SyscallCounter) -> dict[str, float]:
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(_CountingExecutor())
+    pool = WriterPool(config=WriterConfig(fsync=args.fsync, threads=args.threads))
+    queue: asyncio.Queue[tuple[int, int]] = asyncio.Queue()
+    for chapter in range(args.chapters):
+        for page in range(args.pages):
+            queue.put_nowait((chapter, page))
+
+    async def _worker() -> None:
+        while not queue.empty():
+            chapter, page = queue.get_nowait()
+            name = f'{chapter}_page_{page}.jpg'
+            if mode == 'reference':
+                await _reference_page(_ReferenceFileHandler(root / mode / f'chapter_{chapter}'), name, chunks)
+            else:
+                await _pool_page(FileHandler(mode, f'chapter_{chapter}'), name, chunks, pool)
+
+    FileHandler._local_root = root
+    _CountingExecutor.submit_count = 0
+    counter.start()
+    loop_start = time.thread_time()
+    start = time.perf_counter()
+    await asyncio.gather(*(_worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    loop_cpu = time.thread_time() - loop_start
+    counts = counter.stop()
+    hops = _CountingExecutor.submit_count + pool.job_count
+    await pool.close()
+
+    pages = args.chapters * args.pages
+    result = {
+        'wall_time_s': elapsed,
+        'loop_cpu_us_per_page': loop_cpu / pages * 1e6,
+        'thread_hops_per_page': hops / pages,
+        'syscalls_per_page': sum(counts.values()) / pages,
+    }
+    result.update({f'{k}_per_page': v / pages for k, v in sorted(counts.items())})
+    return result
+
+
+def main() -> None:
+    parser = ArgumentParser(description='图片文件写入的系统调用及线程切换开销测试')
+    parser.add_argument('--chapters', type=int, default=20, help='测试章节数')
+    parser.add_argument('--pages', type=int, default=50, help='每章节页数')
+    parser.add_argument('--page-size', type=int, default=200 * 1024, help='每页大小, 单位字节')
+    parser.add_argument('--chunk-size', type=int, default=64 * 1024, help='下载时的数据块大小, 单位字节')
+    parser.add_argument('--concurrency', type=int, default=64, help='同时写入的图片数')
+    parser.add_argument('--threads', type=int, default=4, help='写入线程数')
+    parser.add_argument('--fsync', action='store_true', help='完成文件前 fsync')
+    parser.add_argument('--output', type=str, default='', help='结果 JSON 文件路径, 默认只打印')
+    args = parser.parse_args()
+
+    chunks = _chunks(os.urandom(args.page_size), args.chunk_size)
+    counter = _SyscallCounter()
+    results: dict[str, dict[str, float]] = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for mode in ('reference', 'writer_pool'):
+            results[mode] = asyncio.run(_run(mode, pathlib.Path(temp_dir), args, chunks, counter))
+    directory_cache.forget(temp_dir)
+
+    print(f'pages={args.chapters * args.pages}, page_size={args.page_size}, chunk_size={args.chunk_size}, '
+          f'concurrency={args.concurrency}, fsync={args.fsync}')
+    columns = sorted(set().union(*results.values()), key=lambda x: (not x.endswith('s'), x))
+    print(f'{"":<24}' + ''.join(f'{x:>14}' for x in results))
+    for column in columns:
+        print(f'{column:<24}' + ''.join(f'{results[x].get(column, 0.0):>14.2f}' for x in results))
+
+    if args.output:
+        pathlib.Path(args.output).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding='utf-8')
+
+
+if __name__ == '__main__':
+    main()
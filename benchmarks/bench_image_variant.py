@@ -0,0 +1,58 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/17 22:00
+@FileName       : bench_image_variant.py
+@Project        : BilibiliMangaDownloader
+@Description    : compare bytes transferred per chapter across image variant policies
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import sys
+import json
+import pathlib
+import tempfile
+import subprocess
+from argparse import ArgumentParser
+
+_BENCHMARK_DIR = pathlib.Path(__file__).resolve().parent
+
+_POLICIES: dict[str, list[str]] = {
+    'original': [],
+    'webp': ['--image-format', 'webp'],
+    'webp_q75': ['--image-format', 'webp', '--image-quality', '75'],
+    'avif_q75': ['--image-format', 'avif', '--image-quality', '75'],
+    'w800_webp_q75': ['--image-width', '800', '--image-format', 'webp', '--image-quality', '75'],
+}
+"""参与比较的图片规格策略, 值为传递给 bench_download.py 的参数"""
+
+
+def main() -> None:
+    parser = ArgumentParser(description='比较不同图片规格策略下每章节的传输数据量, 其余参数传递给 bench_download.py')
+    parser.add_argument('--output', type=str, default='', help='结果 JSON 文件路径, 默认只打印')
+    args, bench_args = parser.parse_known_args()
+
+    results: dict[str, dict] = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name, policy_args in _POLICIES.items():
+            output_file = pathlib.Path(temp_dir, f'{name}.json')
+            subprocess.run(
+                [sys.executable, str(_BENCHMARK_DIR / 'bench_download.py'), *bench_args, *policy_args,
+                 '--label', name, '--output', str(output_file)],
+                check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            results[name] = json.loads(output_file.read_text(encoding='utf-8'))
+
+    original = results['original']['bytes_per_chapter']
+    print(f'{"policy":>16} {"bytes/chapter":>14} {"ratio":>7} {"pages/s":>9}')
+    for name, result in results.items():
+        print(f'{name:>16} {result["bytes_per_chapter"]:>14.0f} {result["bytes_per_chapter"] / original:>7.2%} '
+              f'{result["pages_per_sec"]:>9.1f}')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 00:00
+@FileName       : bench_import.py
+@Project        : BilibiliMangaDownloader
+@Description    : cold import and startup time benchmark with a budget check
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import sys
+import json
+import time
+import pathlib
+import statistics
+import subprocess
+from argparse import ArgumentParser
+
+
+_ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+_HEAVY_MODULES: tuple[str, ...] = ('aiohttp', 'pydantic', 'loguru', 'aiofiles')
+"""导入包时不应被导入的依赖"""
+
+_CHECK_SIDE_EFFECTS = f"""
+import sys
+import bilibili_manga_downloader
+print('HEAVY=' + ','.join(x for x in {_HEAVY_MODULES!r} if x in sys.modules))
+"""
+
+
+def _parse_importtime(stderr: str) -> dict[str, tuple[int, int]]:
+    """解析 -X importtime 的输出, 返回各模块的 (self, cumulative) 耗时, 单位微秒"""
+    result: dict[str, tuple[int, int]] = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        result[name.strip()] = (int(self_us), int(cumulative_us))
+    return result
+
+
+def _import_time(module: str) -> tuple[int, dict[str, tuple[int, int]]]:
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=_ROOT, capture_output=True, text=True, check=True
+    )
+    modules = _parse_importtime(process.stderr)
+    return modules[module][1], modules
+
+
+def _wall_time(args: list[str]) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, *args], cwd=_ROOT, capture_output=True, check=True)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = ArgumentParser(description='导入及启动耗时测试, 超出预算时以非 0 状态退出')
+    parser.add_argument('--runs', type=int, default=5, help='每项测试的运行次数, 取中位数')
+    parser.add_argument('--import-budget-ms', type=float, default=30,
+                        help='import bilibili_manga_downloader 的累计导入耗时预算, 单位毫秒')
+    parser.add_argument('--help-budget-ms', type=float, default=100,
+                        help='download_bilibili_manga.py -h 相对于空解释器启动的额外耗时预算, 单位毫秒')
+    parser.add_argument('--top', type=int, default=10, help='列出导入 download_manga 时自身耗时最长的模块数')
+    parser.add_argument('--output', type=str, default='', help='结果 JSON 文件路径, 默认只打印')
+    args = parser.parse_args()
+
+    package_import_us = statistics.median(_import_time('bilibili_manga_downloader')[0] for _ in range(args.runs))
+    full_import_us, modules = _import_time('bilibili_manga_downloader.downloader')
+    interpreter = statistics.median(_wall_time(['-c', 'pass']) for _ in range(args.runs))
+    cli_help = statistics.median(_wall_time(['download_bilibili_manga.py', '-h']) for _ in range(args.runs))
+
+    side_effects = subprocess.run(
+        [sys.executable, '-c', _CHECK_SIDE_EFFECTS], cwd=_ROOT, capture_output=True, text=True, check=True
+    )
+    heavy_modules = [x for x in side_effects.stdout.strip().splitlines()[-1][len('HEAVY='):].split(',') if x]
+    import_output = '\n'.join(side_effects.stdout.strip().splitlines()[:-1] + side_effects.stderr.splitlines())
+
+    result = {
+        'package_import_ms': package_import_us / 1000,
+        'downloader_import_ms': full_import_us / 1000,
+        'interpreter_ms': interpreter * 1000,
+        'cli_help_ms': cli_help * 1000,
+        'cli_help_overhead_ms': (cli_help - interpreter) * 1000,
+        'heavy_modules_on_import': heavy_modules,
+        'import_output': import_output
+    }
+    for key, value in result.items():
+        print(f'{key:>24}: {value:.2f}' if isinstance(value, float) else f'{key:>24}: {value!r}')
+
+    print('slowest modules when importing bilibili_manga_downloader.downloader:')
+    for name, (self_us, cumulative_us) in sorted(modules.items(), key=lambda x: x[1][0], reverse=True)[:args.top]:
+        print(f'{self_us / 1000:>10.2f} ms  {cumulative_us / 1000:>10.2f} ms  {name}')
+
+    if args.output:
+        pathlib.Path(args.output).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding='utf-8')
+
+    failures: list[str] = []
+    if result['package_import_ms'] > args.import_budget_ms:
+        failures.append(f'package import {result["package_import_ms"]:.2f} ms > {args.import_budget_ms} ms')
+    if result['cli_help_overhead_ms'] > args.help_budget_ms:
+        failures.append(f'cli -h overhead {result["cli_help_overhead_ms"]:.2f} ms > {args.help_budget_ms} ms')
+    if heavy_modules:
+        failures.append(f'package import loads {", ".join(heavy_modules)}')
+    if import_output:
+        failures.append('package import writes output')
+    if failures:
+        print('over budget: ' + '; '.join(failures), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 06:45
+@FileName       : bench_integrity.py
+@Project        : BilibiliMangaDownloader
+@Description    : per page cost of streaming image validation and verify scan
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import os
+import sys
+import json
+import time
+import pathlib
+import tempfile
+from argparse import ArgumentParser
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+
+from bilibili_manga_downloader.http_fetcher import StreamDigest
+from bilibili_manga_downloader.integrity import ImageValidator, validate_file
+from mock_server import _image_frame
+
+
+def _image(image_format: str, size: int) -> bytes:
+    head, tail = _image_frame(image_format, 1100, 1600, size)
+    return head + os.urandom(size - len(head) - len(tail)) + tail
+
+
+def _stream_cost(data: bytes, chunk_size: int, pages: int, *, validate: bool, digest: bool) -> float:
+    """模拟下载过程中逐块处理数据的开销, 返回每个图片的 CPU 时间, 单位微秒"""
+    chunks = [data[x:x + chunk_size] for x in range(0, len(data), chunk_size)]
+    validator = ImageValidator(width=1100, height=1600)
+    stream_digest = StreamDigest()
+    start = time.process_time()
+    for _ in range(pages):
+        if validate:
+            validator.reset()
+        if digest:
+            stream_digest.reset()
+        for chunk in chunks:
+            if validate:
+                validator.update(chunk)
+            if digest:
+                stream_digest.update(chunk)
+        if validate:
+            validator.finish(len(data))
+    return (time.process_time() - start) / pages * 1e6
+
+
+def _scan_cost(data: bytes, pages: int) -> float:
+    """校验磁盘上图片文件的开销, 返回每个图片的耗时, 单位微秒"""
+    with tempfile.TemporaryDirectory() as folder:
+        paths = [os.path.join(folder, f'{x}.jpg') for x in range(pages)]
+        for path in paths:
+            with open(path, 'wb') as f:
+                f.write(data)
+        start = time.perf_counter()
+        for path in paths:
+            validate_file(path, width=1100, height=1600)
+        return (time.perf_counter() - start) / pages * 1e6
+
+
+def main() -> None:
+    parser = ArgumentParser(description='图片校验开销测试')
+    parser.add_argument('--image-size', type=int, default=256 * 1024, help='图片大小, 单位字节')
+    parser.add_argument('--chunk-size', type=int, default=64 * 1024, help='下载数据块大小, 单位字节')
+    parser.add_argument('--pages', type=int, default=2000, help='图片数')
+    parser.add_argument('--output', type=str, default='', help='结果 JSON 文件路径, 默认只打印')
+    args = parser.parse_args()
+
+    results: dict[str, dict[str, float]] = {}
+    for image_format in ('jpg', 'png', 'webp', 'avif'):
+        data = _image(image_format, args.image_size)
+        results[image_format] = {
+            'validate_us_per_page': _stream_cost(data, args.chunk_size, args.pages, validate=True, digest=False),
+            'sha256_us_per_page': _stream_cost(data, args.chunk_size, args.pages, validate=False, digest=True),
+            'scan_us_per_page': _scan_cost(data, min(args.pages, 500)),
+        }
+
+    print(f'image_size={args.image_size}, chunk_size={args.chunk_size}, pages={args.pages}')
+    columns = list(next(iter(results.values())))
+    print(f'{"format":<8}' + ''.join(f'{x:>24}' for x in columns))
+    for image_format, result in results.items():
+        print(f'{image_format:<8}' + ''.join(f'{result[x]:>24.2f}' for x in columns))
+
+    if args.output:
+        pathlib.Path(args.output).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding='utf-8')
+
+
+if __name__ == '__main__':
+    main()
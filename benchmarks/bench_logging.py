@@ -0,0 +1,135 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 02:30
+@FileName       : bench_logging.py
+@Project        : BilibiliMangaDownloader
+@Description    : event loop stall caused by logging under load
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import sys
+import json
+import time
+import asyncio
+import pathlib
+import statistics
+from argparse import ArgumentParser
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from bilibili_manga_downloader.logger import LoggingConfig, configure_logging, logger, shutdown_logging
+
+
+class _SlowStream(object):
+    """模拟终端的输出流, 每次写入阻塞固定时间"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.writes = 0
+
+    def write(self, message: str) -> None:
+        self.writes += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def flush(self) -> None:
+        pass
+
+
+_MODES: dict[str, LoggingConfig | None] = {
+    'no_sink': None,
+    'sync': LoggingConfig(level='DEBUG'),
+    'background': LoggingConfig(level='DEBUG', background=True),
+    'info_fstring': LoggingConfig(level='INFO'),
+    'info_lazy': LoggingConfig(level='INFO'),
+}
+"""测试的日志配置, info_* 模式下每个图片的 debug 日志被过滤, 分别使用 f-string 及延迟格式化的写法"""
+
+
+async def _monitor(stop: asyncio.Event, interval: float, lags: list[float]) -> None:
+    """每隔 interval 检查一次事件循环的调度延迟"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(max(time.perf_counter() - start - interval, 0.0))
+
+
+async def _worker(mode: str, pages: int, page_interval: float, logging_time: list[float]) -> None:
+    """模拟下载流水线的 fetch worker, 每完成一个图片输出一条 info 日志及一条带参数的 debug 日志"""
+    kwargs = {'url': 'https://i0.hdslb.com/bfs/manga/0123456789abcdef.jpg?token=0123456789abcdef', 'timeout': 20}
+    for index in range(pages):
+        await asyncio.sleep(page_interval)
+        start = time.perf_counter()
+        if mode == 'info_lazy':
+            logger.opt(colors=True).debug('<lc>Decorator Retry</lc> | <ly>{}</ly> kwargs={}', 'fetch', kwargs)
+        else:
+            logger.opt(colors=True).debug(f'<lc>Decorator Retry</lc> | <ly>{"fetch"}</ly> kwargs={kwargs!r}')
+        logger.info('下载图片资源({})完成', index)
+        logging_time.append(time.perf_counter() - start)
+
+
+async def _run(mode: str, args) -> dict[str, float]:
+    lags: list[float] = []
+    logging_time: list[float] = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(_monitor(stop, args.monitor_interval, lags))
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        _worker(mode, args.pages // args.workers, args.page_interval, logging_time) for _ in range(args.workers)
+    ))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await monitor
+
+    lags.sort()
+    return {
+        'elapsed_s': elapsed,
+        'pages_per_s': len(logging_time) / elapsed,
+        'logging_time_ms': sum(logging_time) * 1000,
+        'logging_us_per_page': statistics.mean(logging_time) * 1e6,
+        'loop_lag_p50_ms': lags[len(lags) // 2] * 1000,
+        'loop_lag_p99_ms': lags[int(len(lags) * 0.99)] * 1000,
+        'loop_lag_max_ms': lags[-1] * 1000,
+        'loop_lag_total_ms': sum(lags) * 1000
+    }
+
+
+def main() -> None:
+    parser = ArgumentParser(description='日志在高负载下造成的事件循环阻塞测试')
+    parser.add_argument('--pages', type=int, default=20000, help='模拟的图片数')
+    parser.add_argument('--workers', type=int, default=64, help='模拟的 fetch worker 数')
+    parser.add_argument('--page-interval', type=float, default=0.01, help='单个 worker 完成一个图片的间隔, 单位秒')
+    parser.add_argument('--sink-latency-us', type=float, default=50, help='模拟终端每次写入的阻塞时间, 单位微秒')
+    parser.add_argument('--monitor-interval', type=float, default=0.005, help='检查事件循环调度延迟的间隔, 单位秒')
+    parser.add_argument('--modes', type=str, default=','.join(_MODES), help='测试的日志模式, 以逗号分隔')
+    parser.add_argument('--output', type=str, default='', help='结果 JSON 文件路径, 默认只打印')
+    args = parser.parse_args()
+
+    real_stdout = sys.stdout
+    results: dict[str, dict[str, float]] = {}
+    for mode in args.modes.split(','):
+        stream = _SlowStream(args.sink_latency_us / 1e6)
+        sys.stdout = stream
+        try:
+            if _MODES[mode] is None:
+                shutdown_logging()
+            else:
+                configure_logging(_MODES[mode])
+            results[mode] = asyncio.run(_run(mode, args))
+            shutdown_logging()
+        finally:
+            sys.stdout = real_stdout
+        results[mode]['sink_writes'] = stream.writes
+
+    columns = list(next(iter(results.values())))
+    print(f'{"mode":<14}' + ''.join(f'{x:>22}' for x in columns))
+    for mode, result in results.items():
+        print(f'{mode:<14}' + ''.join(f'{result[x]:>22.2f}' for x in columns))
+
+    if args.output:
+        pathlib.Path(args.output).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding='utf-8')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 00:30
+@FileName       : bench_model.py
+@Project        : BilibiliMangaDownloader
+@Description    : ComicDetail json decoding and model parsing micro benchmark
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import sys
+import json
+import pathlib
+import timeit
+from argparse import ArgumentParser
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from pydantic import BaseModel, AnyUrl
+
+from bilibili_manga_downloader import json_codec
+from bilibili_manga_downloader.model import MangaEp
+
+
+class _ReferenceMangaEp(BaseModel):
+    """改用 __slots__ model 之前的 pydantic 版本, 作为对照"""
+    class _Data(BaseModel):
+        class _EpInfo(BaseModel):
+            id: int
+            ord: int
+            title: str
+            short_title: str
+            cover: AnyUrl
+
+        id: int
+        title: str
+        horizontal_cover: AnyUrl
+        square_cover: AnyUrl
+        vertical_cover: AnyUrl
+        last_ord: int
+        is_finish: int
+        evaluate: str
+        total: int
+        ep_list: list[_EpInfo]
+
+    code: int
+    msg: str
+    data: _Data
+
+    @property
+    def all_ep_list(self) -> list[int]:
+        return [x.id for x in self.data.ep_list]
+
+
+def _comic_detail(chapters: int) -> dict:
+    """生成包含指定章节数的 ComicDetail 接口返回数据"""
+    cover = 'https://manga.hdslb.com/bfs/manga-static/{}.jpg'
+    return {
+        'code': 0,
+        'msg': '',
+        'data': {
+            'id': 31031,
+            'title': '基准测试漫画',
+            'horizontal_cover': cover.format('horizontal'),
+            'square_cover': cover.format('square'),
+            'vertical_cover': cover.format('vertical'),
+            'last_ord': chapters,
+            'is_finish': 0,
+            'evaluate': '用于基准测试的合成数据',
+            'total': chapters,
+            'ep_list': [
+                {
+                    'id': 500000 + i,
+                    'ord': i,
+                    'title': f'第{i}话 标题',
+                    'short_title': str(i),
+                    'cover': cover.format(f'ep{i}'),
+                    'pay_mode': 0,
+                    'is_locked': False
+                } for i in range(chapters, 0, -1)
+            ]
+        }
+    }
+
+
+def _best(func, *, runs: int, number: int) -> float:
+    """多次运行取最短耗时, 单位毫秒"""
+    return min(timeit.repeat(func, repeat=runs, number=number)) / number * 1000
+
+
+def main() -> None:
+    parser = ArgumentParser(description='ComicDetail 解析耗时测试')
+    parser.add_argument('--chapters', type=int, default=5000, help='合成数据的章节数')
+    parser.add_argument('--runs', type=int, default=5, help='每项测试的重复次数, 取最短耗时')
+    parser.add_argument('--number', type=int, default=5, help='每次重复的运行次数')
+    parser.add_argument('--output', type=str, default='', help='结果 JSON 文件路径, 默认只打印')
+    args = parser.parse_args()
+
+    obj = _comic_detail(args.chapters)
+    text = json.dumps(obj, ensure_ascii=False)
+    raw = text.encode('utf-8')
+    ep_ids = [x['id'] for x in obj['data']['ep_list']]
+    result: dict[str, float] = {'payload_kb': len(raw) / 1024}
+
+    for backend in json_codec.JSON_BACKENDS:
+        try:
+            json_codec.set_json_backend(backend)
+        except ImportError:
+            continue
+        result[f'decode_{backend}_ms'] = _best(lambda: json_codec.json_loads(text), runs=args.runs, number=args.number)
+    json_codec.set_json_backend()
+
+    reference = _ReferenceMangaEp.parse_obj(obj)
+    manga_ep = MangaEp.parse_obj(obj)
+    assert reference.all_ep_list == manga_ep.all_ep_list
+
+    result['parse_pydantic_ms'] = _best(lambda: _ReferenceMangaEp.parse_obj(obj), runs=args.runs, number=args.number)
+    result['parse_slots_ms'] = _best(lambda: MangaEp.parse_obj(obj), runs=args.runs, number=args.number)
+    result['parse_speedup'] = result['parse_pydantic_ms'] / result['parse_slots_ms']
+
+    # 检查每个章节是否属于漫画, 对应下载及守护进程中校验指定章节 id 的开销
+    result['lookup_all_ep_list_ms'] = _best(
+        lambda: [x in reference.all_ep_list for x in ep_ids[:500]], runs=args.runs, number=1
+    ) * len(ep_ids) / 500
+    result['lookup_ep_index_ms'] = _best(
+        lambda: [x in manga_ep.ep_index for x in ep_ids], runs=args.runs, number=args.number
+    )
+
+    sample = MangaEp.parse_obj(obj)
+    result['ep_list_kb_pydantic'] = sum(sys.getsizeof(x.__dict__) for x in reference.data.ep_list) / 1024
+    result['ep_list_kb_slots'] = sum(sys.getsizeof(x) for x in sample.data.ep_list) / 1024
+
+    print(f'json backend: {json_codec.json_backend()}, chapters: {args.chapters}')
+    for key, value in result.items():
+        print(f'{key:>24}: {value:.3f}')
+
+    if args.output:
+        pathlib.Path(args.output).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding='utf-8')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/17 19:00
+@FileName       : mock_server.py
+@Project        : BilibiliMangaDownloader
+@Description    : local stand-in for bilibili manga api and image cdn
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import os
+import json
+import time
+import zlib
+import random
+import asyncio
+from argparse import ArgumentParser
+
+from aiohttp import web
+from pydantic import BaseModel
+
+
+class MockServerConfig(BaseModel):
+    """模拟服务端配置"""
+    host: str = '127.0.0.1'
+    port: int = 8800
+    episodes: int = 20
+    """每部漫画的章节数"""
+    pages: int = 20
+    """每章节图片数"""
+    image_size: int = 256 * 1024
+    """图片平均大小, 单位字节"""
+    image_size_jitter: float = 0.25
+    """图片大小随机浮动比例"""
+    original_width: int = 1100
+    """原图宽度, 原图高度按 1100x1600 的比例计算"""
+    api_latency: float = 0.02
+    """api 响应延迟, 单位秒"""
+    cdn_latency: float = 0.05
+    """图片首字节延迟, 单位秒"""
+    bandwidth: int = 0
+    """单个连接的图片传输带宽, 单位字节每秒, 为 0 时不限制"""
+    error_rate: float = 0.0
+    """图片请求返回 500 或 429 的概率"""
+    retry_after: int = 1
+    """429 响应携带的 Retry-After, 单位秒"""
+    token_ttl: float = 0.0
+    """图片 token 有效时间, 单位秒, 为 0 时不过期, 过期后返回 403"""
+    token_expire_rate: float = 0.0
+    """图片 token 提前失效的概率"""
+    corrupt_rate: float = 0.0
+    """图片请求返回 200 但内容为 HTML 错误页或被截断的概率"""
+    seed: int | None = None
+
+
+_FORMAT_RATIO: dict[str, float] = {'jpg': 1.0, 'png': 2.5, 'webp': 0.7, 'avif': 0.5}
+"""各格式相对于同等质量 jpg 的大致体积比例"""
+
+
+def _variant_ratio(variant: str, *, original_width: int) -> float:
+    """估算 @{w}w_{q}q.{fmt} 规格图片相对于原图的体积比例, 体积近似与像素数成正比"""
+    params, _, image_format = variant.rpartition('.')
+    ratio = _FORMAT_RATIO.get(image_format, 1.0)
+    for param in filter(None, params.split('_')):
+        if param.endswith('w') and param[:-1].isdigit():
+            ratio *= min(int(param[:-1]) / original_width, 1.0) ** 2
+        elif param.endswith('q') and param[:-1].isdigit():
+            # 原图约为 90 质量, 质量越低体积下降越快
+            ratio *= (int(param[:-1]) / 90) ** 1.5
+    return ratio
+
+
+def _variant_size(variant: str, *, original_width: int, original_height: int) -> tuple[int, int]:
+    """@{w}w_{q}q.{fmt} 规格图片的尺寸, 宽度不超过原图宽度, 高度按原图宽高比计算"""
+    width = original_width
+    for param in filter(None, variant.rpartition('.')[0].split('_')):
+        if param.endswith('w') and param[:-1].isdigit():
+            width = min(int(param[:-1]), original_width)
+    return width, round(width * original_height / original_width)
+
+
+def _image_frame(image_format: str, width: int, height: int, size: int) -> tuple[bytes, bytes]:
+    """各格式最小的文件头及文件结尾, 文件头中包含图片尺寸, 中间以随机数据填充至 size 字节"""
+    if image_format == 'png':
+        ihdr = b'IHDR' + width.to_bytes(4, 'big') + height.to_bytes(4, 'big') + bytes((8, 2, 0, 0, 0))
+        head = b'\x89PNG\r\n\x1a\n' + (13).to_bytes(4, 'big') + ihdr + zlib.crc32(ihdr).to_bytes(4, 'big')
+        return head, b'\x00\x00\x00\x00IEND\xaeB`\x82'
+    if image_format == 'webp':
+        head = (b'RIFF' + (size - 8).to_bytes(4, 'little') + b'WEBP' + b'VP8X' + (10).to_bytes(4, 'little')
+                + bytes(4) + (width - 1).to_bytes(3, 'little') + (height - 1).to_bytes(3, 'little'))
+        return head, b''
+    if image_format == 'avif':
+        head = (b'\x00\x00\x00\x14ftypavif\x00\x00\x00\x00mif1'
+                + b'\x00\x00\x00\x14ispe' + bytes(4) + width.to_bytes(4, 'big') + height.to_bytes(4, 'big'))
+        return head, b''
+    sof = b'\xff\xc0\x00\x11\x08' + height.to_bytes(2, 'big') + width.to_bytes(2, 'big') + b'\x03' + bytes(9)
+    return b'\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00' + sof, b'\xff\xd9'
+
+
+class MockMangaServer(object):
+    """模拟 bilibili 漫画 api 及图片 CDN, 提供 nav、ComicDetail、GetImageIndex、ImageToken 接口及图片下载路由"""
+
+    def __init__(self, config: MockServerConfig | None = None):
+        self.config = MockServerConfig() if config is None else config
+        self._random = random.Random(self.config.seed)
+        max_ratio = max(_FORMAT_RATIO.values())
+        self._payload = os.urandom(int(self.config.image_size * (1 + self.config.image_size_jitter) * max_ratio) + 1)
+        self._token_count = 0
+        self._tokens: dict[str, float] = {}
+        self._runner: web.AppRunner | None = None
+        self.stats: dict[str, int] = {
+            'nav': 0, 'detail': 0, 'index': 0, 'token': 0, 'cdn': 0, 'cdn_bytes': 0,
+            'http_403': 0, 'http_429': 0, 'http_500': 0, 'corrupt': 0
+        }
+
+    @property
+    def base_url(self) -> str:
+        return f'http://{self.config.host}:{self.config.port}'
+
+    @property
+    def original_height(self) -> int:
+        return self.config.original_width * 16 // 11
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/x/web-interface/nav', self._nav)
+        app.router.add_post('/twirp/comic.v1.Comic/ComicDetail', self._detail)
+        app.router.add_post('/twirp/comic.v1.Comic/GetImageIndex', self._index)
+        app.router.add_post('/twirp/comic.v1.Comic/ImageToken', self._token)
+        app.router.add_get('/bfs/manga/{path:.*}', self._cdn)
+        app.router.add_get('/stats', self._stats)
+        return app
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.create_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host=self.config.host, port=self.config.port).start()
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _image_size(self, image_path: str) -> int:
+        # 同一图片每次返回相同大小, 使重试及续传的结果可比较
+        original_path, _, variant = image_path.partition('@')
+        jitter = random.Random(original_path).uniform(-self.config.image_size_jitter, self.config.image_size_jitter)
+        size = self.config.image_size * (1 + jitter)
+        if variant:
+            size *= _variant_ratio(variant, original_width=self.config.original_width)
+        return max(int(size), 64)
+
+    async def _nav(self, request: web.Request) -> web.Response:
+        self.stats['nav'] += 1
+        await asyncio.sleep(self.config.api_latency)
+        return web.json_response({'code': 0, 'message': '0', 'data': {'isLogin': True, 'uname': 'mock', 'mid': '1'}})
+
+    async def _detail(self, request: web.Request) -> web.Response:
+        self.stats['detail'] += 1
+        await asyncio.sleep(self.config.api_latency)
+        comic_id = int((await request.json())['comic_id'])
+        cover = f'{self.base_url}/bfs/manga/cover.jpg'
+        return web.json_response({'code': 0, 'msg': '', 'data': {
+            'id': comic_id, 'title': f'mock_comic_{comic_id}', 'horizontal_cover': cover, 'square_cover': cover,
+            'vertical_cover': cover, 'last_ord': self.config.episodes, 'is_finish': 1, 'evaluate': '',
+            'total': self.config.episodes,
+            'ep_list': [
+                {'id': comic_id * 100000 + x, 'ord': x, 'title': f'title {x}', 'short_title': f'{x}', 'cover': cover}
+                for x in range(self.config.episodes, 0, -1)
+            ]
+        }})
+
+    async def _index(self, request: web.Request) -> web.Response:
+        self.stats['index'] += 1
+        await asyncio.sleep(self.config.api_latency)
+        ep_id = int((await request.json())['ep_id'])
+        return web.json_response({'code': 0, 'msg': '', 'data': {
+            'path': f'/bfs/manga/{ep_id}.index',
+            'images': [
+                {'path': f'/bfs/manga/{ep_id}/{x}.jpg', 'x': self.config.original_width,
+                 'y': self.original_height}
+                for x in range(self.config.pages)
+            ]
+        }})
+
+    async def _token(self, request: web.Request) -> web.Response:
+        self.stats['token'] += 1
+        await asyncio.sleep(self.config.api_latency)
+        urls = json.loads((await request.json())['urls'])
+        data = []
+        now = time.monotonic()
+        for url in urls:
+            self._token_count += 1
+            token = f'mock{self._token_count}'
+            self._tokens[token] = 0.0 if self._random.random() < self.config.token_expire_rate else now
+            data.append({'url': f'{self.base_url}{url}', 'token': token})
+        return web.json_response({'code': 0, 'msg': '', 'data': data})
+
+    def _token_valid(self, token: str | None) -> bool:
+        issued_at = self._tokens.get(token or '')
+        if issued_at is None or issued_at == 0.0:
+            return False
+        return self.config.token_ttl <= 0 or time.monotonic() - issued_at < self.config.token_ttl
+
+    async def _cdn(self, request: web.Request) -> web.StreamResponse:
+        self.stats['cdn'] += 1
+        await asyncio.sleep(self.config.cdn_latency)
+        if not self._token_valid(request.query.get('token')):
+            self.stats['http_403'] += 1
+            return web.Response(status=403)
+        if self._random.random() < self.config.error_rate:
+            if self._random.random() < 0.5:
+                self.stats['http_429'] += 1
+                return web.Response(status=429, headers={'Retry-After': str(self.config.retry_after)})
+            self.stats['http_500'] += 1
+            return web.Response(status=500)
+
+        if self._random.random() < self.config.corrupt_rate:
+            self.stats['corrupt'] += 1
+            if self._random.random() < 0.5:
+                return web.Response(text='<html><body>502 Bad Gateway</body></html>', content_type='text/html')
+            # 不携带 Content-Length 的截断响应, 只能通过图片结尾发现
+            truncated = True
+        else:
+            truncated = False
+
+        size = self._image_size(request.path)
+        original_path, _, variant = request.path.partition('@')
+        image_format = (variant or original_path).rsplit('.', 1)[-1]
+        width, height = _variant_size(variant, original_width=self.config.original_width,
+                                      original_height=self.original_height)
+        head, tail = _image_frame(image_format, width, height, size)
+        body_size = size - len(head) - len(tail)
+        if truncated:
+            body_size //= 2
+            response = web.StreamResponse(headers={'Content-Type': f'image/{image_format}'})
+        else:
+            response = web.StreamResponse(headers={
+                'Content-Type': f'image/{image_format}', 'Content-Length': str(size)
+            })
+        await response.prepare(request)
+        chunk_size = 64 * 1024
+        chunks = [head, *(self._payload[x:min(x + chunk_size, body_size)] for x in range(0, body_size, chunk_size))]
+        if not truncated:
+            chunks.append(tail)
+        for chunk in chunks:
+            await response.write(chunk)
+            self.stats['cdn_bytes'] += len(chunk)
+            if self.config.bandwidth > 0:
+                await asyncio.sleep(len(chunk) / self.config.bandwidth)
+        await response.write_eof()
+        return response
+
+    async def _stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+
+def create_argument_parser() -> ArgumentParser:
+    parser = ArgumentParser(description='本地模拟 bilibili 漫画 api 及图片 CDN')
+    for name, field in MockServerConfig.__fields__.items():
+        parser.add_argument(f'--{name.replace("_", "-")}', type=field.type_, default=field.default)
+    return parser
+
+
+async def _serve(config: MockServerConfig) -> None:
+    server = MockMangaServer(config)
+    await server.start()
+    print(f'mock server listening on {server.base_url}', flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == '__main__':
+    _args = create_argument_parser().parse_args()
+    try:
+        asyncio.run(_serve(MockServerConfig(**vars(_args))))
+    except KeyboardInterrupt:
+        pass
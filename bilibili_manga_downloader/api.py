@@ -0,0 +1,174 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/17 12:00
+@FileName       : api.py
+@Project        : BilibiliMangaDownloader
+@Description    : bilibili manga api
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import os
+import json
+from functools import lru_cache
+from typing import NamedTuple
+from aiohttp import ClientSession
+
+from .config import BilibiliCookiesConfig
+from .http_fetcher import fetch_get_json, fetch_post_json
+from .logger import logger
+from .metadata_cache import MetadataCache
+from .model import VerifyResult, MangaEp, EpImage, ImageToken
+
+
+ACCOUNT_API_URL: str = os.environ.get('BILIBILI_ACCOUNT_API_URL', 'https://api.bilibili.com')
+"""账号 api 地址, 可通过环境变量 BILIBILI_ACCOUNT_API_URL 指定, 用于在本地模拟服务端上测试"""
+MANGA_API_URL: str = os.environ.get('BILIBILI_MANGA_API_URL', 'https://manga.bilibili.com')
+"""漫画 api 地址, 可通过环境变量 BILIBILI_MANGA_API_URL 指定"""
+
+
+class Credentials(NamedTuple):
+    """单个请求身份使用的 cookies 及代理"""
+    cookies: dict | None
+    proxy: str | None = None
+    """代理地址, 为 None 时使用 session 配置的代理"""
+
+
+class BilibiliApiError(RuntimeError):
+    """bilibili api 返回非 0 code 异常"""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f'bilibili api error: {message}')
+        self.code = code
+        self.message = message
+
+
+@lru_cache(maxsize=1)
+def get_cookies_config() -> BilibiliCookiesConfig:
+    """B站 Cookies 配置, 在第一次使用时读取 .env 文件并提示下载范围"""
+    logger.opt(colors=True).warning('<ly>请注意, 本工具只能下载哔哩哔哩漫画的免费章节和用户已订阅章节, 不能下载收费章节!</ly>')
+    logger.opt(colors=True).warning('<ly>若想要下载用户已订阅章节, 请在 .env 文件中正确配置您的用户 cookies!</ly>')
+    return BilibiliCookiesConfig(_env_file='.env', _env_file_encoding='utf-8')
+
+
+def __getattr__(name: str):
+    # 兼容原有的模块属性 cookies_config
+    if name == 'cookies_config':
+        return get_cookies_config()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def _credentials(credentials: Credentials | None) -> Credentials:
+    """未指定身份时使用 .env 中配置的 cookies 及 session 配置的代理"""
+    return Credentials(cookies=get_cookies_config().cookies) if credentials is None else credentials
+
+
+async def query_account(*, session: ClientSession, credentials: Credentials | None = None) -> VerifyResult:
+    """获取 cookies 对应的账号登录状态
+
+    :param credentials: 请求使用的 cookies 及代理, 默认使用 .env 中配置的 cookies
+    """
+    credentials = _credentials(credentials)
+    verify_url = f'{ACCOUNT_API_URL}/x/web-interface/nav'
+    result = await fetch_get_json(
+        url=verify_url, cookies=credentials.cookies, proxy=credentials.proxy, session=session, rate_group='account'
+    )
+    return VerifyResult.parse_obj(result)
+
+
+async def verify_bilibili_cookie(*, session: ClientSession) -> None:
+    """验证 .env 中配置的 Bilibili cookie 是否有效, 无效时清除已配置的 cookie"""
+    verify = await query_account(session=session)
+    if verify.code != 0 or not verify.data.isLogin:
+        get_cookies_config().clear()
+        logger.opt(colors=True).warning(f'<r>Bilibili cookies 验证失败</r>, 登录状态异常, {verify.message}')
+    else:
+        logger.opt(colors=True).success(f'<lg>Bilibili cookie 已验证</lg>, 登录用户: {verify.data.uname}')
+
+
+async def query_manga_ep(
+        comic_id: int,
+        *,
+        session: ClientSession,
+        cache: MetadataCache | None = None,
+        credentials: Credentials | None = None
+) -> MangaEp:
+    """根据漫画 cm id 获取章节 id 列表
+
+    :param cache: 元数据缓存, 提供时优先使用未过期的缓存数据, 并缓存请求成功的结果
+    :param credentials: 请求使用的 cookies 及代理, 默认使用 .env 中配置的 cookies
+    """
+    query_params = {'comic_id': str(comic_id)}
+    if cache is not None and (result := cache.get('ComicDetail', query_params)) is not None:
+        return MangaEp.parse_obj(result)
+
+    url = f'{MANGA_API_URL}/twirp/comic.v1.Comic/ComicDetail?device=pc&platform=web'
+    credentials = _credentials(credentials)
+    result = await fetch_post_json(
+        url=url, session=session, cookies=credentials.cookies, proxy=credentials.proxy, json=query_params
+    )
+    manga_ep = MangaEp.parse_obj(result)
+    if cache is not None and manga_ep.code == 0:
+        cache.set('ComicDetail', query_params, result)
+    return manga_ep
+
+
+async def query_ep_image(
+        ep_id: int,
+        *,
+        session: ClientSession,
+        cache: MetadataCache | None = None,
+        credentials: Credentials | None = None
+) -> EpImage:
+    """根据章节 ep id 获取图片路径
+
+    :param cache: 元数据缓存, 提供时优先使用未过期的缓存数据, 并缓存请求成功的结果
+    :param credentials: 请求使用的 cookies 及代理, 默认使用 .env 中配置的 cookies
+    """
+    query_params = {'ep_id': str(ep_id)}
+    if cache is not None and (result := cache.get('GetImageIndex', query_params)) is not None:
+        return EpImage.parse_obj(result)
+
+    url = f'{MANGA_API_URL}/twirp/comic.v1.Comic/GetImageIndex?device=pc&platform=web'
+    credentials = _credentials(credentials)
+    result = await fetch_post_json(
+        url=url, session=session, cookies=credentials.cookies, proxy=credentials.proxy, json=query_params
+    )
+    ep_image = EpImage.parse_obj(result)
+    if cache is not None and ep_image.code == 0:
+        cache.set('GetImageIndex', query_params, result)
+    return ep_image
+
+
+async def query_image_token(
+        image_paths: list[str],
+        *,
+        session: ClientSession,
+        credentials: Credentials | None = None
+) -> ImageToken:
+    """根据一批章节图片 path 获取下载图片所需要的 token, 返回结果与 image_paths 顺序一致
+
+    :param credentials: 请求使用的 cookies 及代理, 默认使用 .env 中配置的 cookies
+    """
+    url = f'{MANGA_API_URL}/twirp/comic.v1.Comic/ImageToken?device=pc&platform=web'
+    quote_path = json.dumps(image_paths)
+    query_params = {'urls': quote_path}
+    credentials = _credentials(credentials)
+    result = await fetch_post_json(
+        url=url, session=session, cookies=credentials.cookies, proxy=credentials.proxy, json=query_params
+    )
+    return ImageToken.parse_obj(result)
+
+
+__all__ = [
+    'ACCOUNT_API_URL',
+    'MANGA_API_URL',
+    'BilibiliApiError',
+    'Credentials',
+    'get_cookies_config',
+    'query_account',
+    'verify_bilibili_cookie',
+    'query_manga_ep',
+    'query_ep_image',
+    'query_image_token'
+]
@@ -0,0 +1,214 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/17 21:00
+@FileName       : archive_pool.py
+@Project        : BilibiliMangaDownloader
+@Description    : process pool backed chapter archive packer
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import os
+import re
+import gzip
+import asyncio
+import contextlib
+import pathlib
+import tarfile
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from pydantic import BaseModel
+
+from .archive_writer import REPRODUCIBLE_FILE_MODE, compression_for, reproducible_zip_info
+from .file_handler import FileHandler
+from .formats import ARCHIVE_FORMATS
+
+
+_ZIP_FORMATS: frozenset[str] = frozenset({'zip', 'cbz'})
+_TAR_MODES: dict[str, str] = {'tar': 'w', 'tar.gz': 'w:gz', 'tar.xz': 'w:xz'}
+_TEMP_SUFFIXES: tuple[str, ...] = ('.part', '.tmp')
+"""下载或写入过程中的临时文件后缀, 这些文件不是已完成的图片, 不能被打包"""
+
+
+class ArchiveConfig(BaseModel):
+    """章节压缩配置"""
+    processes: int = max(os.cpu_count() or 1, 1)
+    """压缩进程数, 为 0 时不使用进程池, 在默认线程池中压缩"""
+    queue_size: int = 8
+    """等待压缩的章节数上限, 队列已满时下载阶段等待"""
+    compression_levels: dict[str, int] = {'zip': 6, 'cbz': 0, 'tar': 0, 'tar.gz': 6, 'tar.xz': 6}
+    """各格式的压缩级别, 0 表示不压缩(zip/cbz 使用 ZIP_STORED), 未配置的格式使用 6"""
+    start_method: str | None = None
+    """进程池启动方式, 例如 fork、spawn、forkserver, 默认使用平台默认值"""
+    reproducible: bool = False
+    """是否生成可复现的压缩文件, 条目使用固定的修改时间及权限, 相同图片在任何节点上生成完全相同的压缩文件"""
+
+    def compression_level(self, archive_format: str) -> int:
+        return self.compression_levels.get(archive_format, 6)
+
+
+def _page_sort_key(path: pathlib.Path) -> tuple[int, str]:
+    """按文件名末尾的页码排序, 保证压缩文件中页面顺序与章节一致"""
+    matched = re.search(r'(\d+)$', path.stem)
+    return (int(matched.group(1)) if matched else -1), path.name
+
+
+def _is_page_file(path: pathlib.Path) -> bool:
+    """是否为已完成的图片文件, 排除临时文件及隐藏文件"""
+    return path.is_file() and not path.name.startswith('.') and not path.name.endswith(_TEMP_SUFFIXES)
+
+
+def archive_format_of(file: FileHandler) -> str:
+    """根据压缩文件名判断格式"""
+    name = file.path.name.lower()
+    for archive_format in sorted(ARCHIVE_FORMATS, key=len, reverse=True):
+        if name.endswith(f'.{archive_format}'):
+            return archive_format
+    raise ValueError(f'Unsupported archive format: {file.path.name}')
+
+
+def _reproducible_tar_info(tar_info: tarfile.TarInfo) -> tarfile.TarInfo:
+    tar_info.mtime = 0
+    tar_info.mode = REPRODUCIBLE_FILE_MODE
+    tar_info.uid = tar_info.gid = 0
+    tar_info.uname = tar_info.gname = ''
+    return tar_info
+
+
+def pack_directory(
+        input_dir: str,
+        output_file: str,
+        archive_format: str,
+        compression_level: int,
+        reproducible: bool = False
+) -> int:
+    """将目录中的文件打包为压缩文件, 在子进程中运行, 参数及返回值均需可以被 pickle
+
+    先写入同目录下的临时文件, 完成后原子地重命名为目标文件; 目录中未完成的临时文件不会被打包,
+    zip/cbz 中已压缩的图片使用 ZIP_STORED, 其余文件按压缩级别压缩
+
+    :param input_dir: 被压缩的目录
+    :param output_file: 输出的压缩文件
+    :param archive_format: 压缩文件格式
+    :param compression_level: 压缩级别
+    :param reproducible: 是否使用固定的修改时间及权限, 使输出只取决于文件名及内容
+    :return: 压缩文件大小
+    """
+    input_path = pathlib.Path(input_dir)
+    output_path = pathlib.Path(output_file)
+    temp_path = output_path.with_name(f'{output_path.name}.part')
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    files = sorted((x for x in input_path.rglob('*') if _is_page_file(x)), key=_page_sort_key)
+
+    try:
+        if archive_format in _ZIP_FORMATS:
+            default = zipfile.ZIP_DEFLATED if compression_level > 0 else zipfile.ZIP_STORED
+            with zipfile.ZipFile(temp_path, mode='w') as zip_f:
+                for file in files:
+                    arcname = file.relative_to(input_path).as_posix()
+                    compression = compression_for(arcname, default)
+                    level = compression_level if compression == zipfile.ZIP_DEFLATED else None
+                    if reproducible:
+                        zip_f.writestr(reproducible_zip_info(arcname, compression), file.read_bytes(),
+                                       compresslevel=level)
+                    else:
+                        zip_f.write(file, arcname=arcname, compress_type=compression, compresslevel=level)
+        elif archive_format in _TAR_MODES:
+            mode = _TAR_MODES[archive_format]
+            kwargs = {}
+            if mode == 'w:gz':
+                kwargs['compresslevel'] = compression_level
+            elif mode == 'w:xz':
+                kwargs['preset'] = compression_level
+            tar_filter = _reproducible_tar_info if reproducible else None
+            with contextlib.ExitStack() as stack:
+                if mode == 'w:gz' and reproducible:
+                    # tarfile 写入的 gzip 头部包含当前时间及临时文件名, 改为自行创建不含二者的 GzipFile
+                    raw = stack.enter_context(open(temp_path, 'wb'))
+                    gz = stack.enter_context(gzip.GzipFile(
+                        filename='', mode='wb', compresslevel=compression_level, fileobj=raw, mtime=0
+                    ))
+                    tar_f = stack.enter_context(tarfile.open(fileobj=gz, mode='w'))
+                else:
+                    tar_f = stack.enter_context(tarfile.open(temp_path, mode=mode, **kwargs))
+                for file in files:
+                    tar_f.add(file, arcname=file.relative_to(input_path).as_posix(), filter=tar_filter)
+        else:
+            raise ValueError(f'Unsupported archive format: {archive_format}')
+        os.replace(temp_path, output_path)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    return output_path.stat().st_size
+
+
+class ArchivePool(object):
+    """章节压缩进程池
+
+    压缩在独立的进程中进行, 不占用事件循环所在进程的 CPU 及默认线程池,
+    下载流水线可以在前面的章节压缩期间继续下载后续章节
+    """
+
+    def __init__(self, config: ArchiveConfig | None = None):
+        self.config = ArchiveConfig() if config is None else config
+        self._executor: ProcessPoolExecutor | None = None
+        self._in_flight: int = 0
+
+    def __repr__(self) -> str:
+        return f'<ArchivePool(processes={self.config.processes}, in_flight={self._in_flight})>'
+
+    async def __aenter__(self) -> "ArchivePool":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.close()
+
+    @property
+    def in_flight(self) -> int:
+        """正在压缩的章节数"""
+        return self._in_flight
+
+    def _get_executor(self) -> ProcessPoolExecutor | None:
+        if self.config.processes <= 0:
+            return None
+        if self._executor is None:
+            mp_context = None
+            if self.config.start_method is not None:
+                mp_context = multiprocessing.get_context(self.config.start_method)
+            self._executor = ProcessPoolExecutor(max_workers=self.config.processes, mp_context=mp_context)
+        return self._executor
+
+    async def pack(self, folder: FileHandler, output_file: FileHandler) -> FileHandler:
+        """将章节目录打包为压缩文件, 格式由输出文件后缀决定
+
+        :param folder: 章节目录
+        :param output_file: 输出的压缩文件
+        """
+        archive_format = archive_format_of(output_file)
+        loop = asyncio.get_running_loop()
+        self._in_flight += 1
+        try:
+            await loop.run_in_executor(
+                self._get_executor(), pack_directory,
+                str(folder.path), str(output_file.path), archive_format, self.config.compression_level(archive_format),
+                self.config.reproducible
+            )
+        finally:
+            self._in_flight -= 1
+        return output_file
+
+    async def close(self) -> None:
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            await asyncio.get_running_loop().run_in_executor(None, executor.shutdown)
+
+
+__all__ = [
+    'ARCHIVE_FORMATS',
+    'ArchiveConfig',
+    'ArchivePool',
+    'archive_format_of',
+    'pack_directory'
+]
@@ -0,0 +1,175 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/17 11:00
+@FileName       : archive_writer.py
+@Project        : BilibiliMangaDownloader
+@Description    : single-pass chapter archive writer
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import asyncio
+import pathlib
+import zipfile
+
+from .file_handler import FileHandler, run_sync
+from .fs import directory_cache
+
+
+_STORED_SUFFIXES: frozenset[str] = frozenset({'.jpg', '.jpeg', '.png', '.webp', '.avif', '.gif'})
+"""已经过压缩的图片格式, 写入压缩文件时不再进行 DEFLATE 压缩"""
+
+ARCHIVE_SUFFIXES: frozenset[str] = frozenset({'.zip', '.cbz'})
+"""支持的压缩文件格式"""
+
+REPRODUCIBLE_DATE_TIME: tuple[int, int, int, int, int, int] = (1980, 1, 1, 0, 0, 0)
+"""可复现压缩文件中所有条目使用的修改时间, 即 zip 格式可以表示的最早时间"""
+REPRODUCIBLE_FILE_MODE: int = 0o644
+"""可复现压缩文件中所有条目使用的文件权限"""
+
+
+def reproducible_zip_info(arcname: str, compress_type: int) -> zipfile.ZipInfo:
+    """使用固定修改时间及权限的压缩文件条目, 相同内容在任何节点、任何时间生成的压缩文件完全相同"""
+    zip_info = zipfile.ZipInfo(arcname, date_time=REPRODUCIBLE_DATE_TIME)
+    zip_info.external_attr = REPRODUCIBLE_FILE_MODE << 16
+    zip_info.compress_type = compress_type
+    return zip_info
+
+
+def compression_for(filename: str, default: int = zipfile.ZIP_DEFLATED) -> int:
+    """根据文件名后缀选择写入压缩文件时使用的压缩方式"""
+    if pathlib.PurePath(filename).suffix.lower() in _STORED_SUFFIXES:
+        return zipfile.ZIP_STORED
+    return default
+
+
+class ChapterArchiveWriter(object):
+    """章节压缩文件写入工具
+
+    每张图片下载完成后立即追加到章节压缩文件中, 不再先写入单独的图片文件,
+    乱序到达的图片会暂存到其前序页面写入或跳过后再按页码顺序写入
+    """
+
+    def __init__(
+            self,
+            output_file: FileHandler,
+            page_count: int,
+            *,
+            compression: int = zipfile.ZIP_DEFLATED,
+            reproducible: bool = False
+    ):
+        """
+        :param output_file: 输出的压缩文件, 后缀需为 .zip 或 .cbz
+        :param page_count: 章节总页数
+        :param compression: 非图片文件使用的压缩方式
+        :param reproducible: 是否使用固定的修改时间及权限写入条目
+        """
+        if output_file.path.suffix.lower() not in ARCHIVE_SUFFIXES:
+            raise ValueError(f'Output file suffix must be one of {", ".join(sorted(ARCHIVE_SUFFIXES))}')
+
+        self.output_file = output_file
+        self._temp_file = output_file.parent(f'{output_file.path.name}.part')
+        self._page_count = page_count
+        self._compression = compression
+        self._reproducible = reproducible
+        self._next_index = 0
+        self._pending: dict[int, tuple[str, bytes] | None] = {}
+        self._written_count = 0
+        self._zip_file: zipfile.ZipFile | None = None
+        self._lock = asyncio.Lock()
+
+    def __repr__(self) -> str:
+        return f'<ChapterArchiveWriter(output_file={self.output_file}, written={self._written_count})>'
+
+    async def __aenter__(self) -> "ChapterArchiveWriter":
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        if exc_type is None:
+            await self.close()
+        else:
+            await self.abort()
+
+    @property
+    def written_count(self) -> int:
+        return self._written_count
+
+    @run_sync
+    def _open(self) -> None:
+        directory_cache.ensure(self._temp_file.path.parent)
+        self._zip_file = zipfile.ZipFile(self._temp_file.path, mode='w', compression=self._compression)
+
+    @run_sync
+    def _write_pages(self, pages: list[tuple[str, bytes]]) -> None:
+        for arcname, data in pages:
+            compress_type = compression_for(arcname, self._compression)
+            if self._reproducible:
+                self._zip_file.writestr(reproducible_zip_info(arcname, compress_type), data)
+            else:
+                self._zip_file.writestr(arcname, data, compress_type=compress_type)
+
+    @run_sync
+    def _close(self, *, keep: bool) -> None:
+        self._zip_file.close()
+        self._zip_file = None
+        if keep:
+            self._temp_file.replace(self.output_file)
+        else:
+            self._temp_file.delete()
+
+    async def open(self) -> None:
+        await self._open()
+
+    async def _flush(self) -> None:
+        """写入所有已可按顺序写入的页面"""
+        async with self._lock:
+            pages: list[tuple[str, bytes]] = []
+            while self._next_index in self._pending:
+                page = self._pending.pop(self._next_index)
+                if page is not None:
+                    pages.append(page)
+                self._next_index += 1
+            if pages:
+                await self._write_pages(pages)
+                self._written_count += len(pages)
+
+    async def add_page(self, index: int, arcname: str, data: bytes) -> None:
+        """添加章节页面
+
+        :param index: 页码, 从 0 开始
+        :param arcname: 页面在压缩文件中的文件名
+        :param data: 页面内容
+        """
+        self._pending[index] = (arcname, data)
+        await self._flush()
+
+    async def skip_page(self, index: int) -> None:
+        """跳过下载失败的页面, 使后续页面可以继续写入"""
+        self._pending[index] = None
+        await self._flush()
+
+    async def close(self) -> FileHandler:
+        """写入剩余页面并完成压缩文件"""
+        for index in range(self._next_index, self._page_count):
+            self._pending.setdefault(index, None)
+        await self._flush()
+        async with self._lock:
+            await self._close(keep=True)
+        return self.output_file
+
+    async def abort(self) -> None:
+        """放弃写入, 删除未完成的压缩文件"""
+        async with self._lock:
+            if self._zip_file is not None:
+                await self._close(keep=False)
+
+
+__all__ = [
+    'ARCHIVE_SUFFIXES',
+    'REPRODUCIBLE_DATE_TIME',
+    'REPRODUCIBLE_FILE_MODE',
+    'ChapterArchiveWriter',
+    'compression_for',
+    'reproducible_zip_info'
+]
@@ -0,0 +1,237 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/17 23:00
+@FileName       : blob_store.py
+@Project        : BilibiliMangaDownloader
+@Description    : content-addressed page store
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import os
+import time
+import shutil
+import pathlib
+import sqlite3
+from typing import Iterable, NamedTuple
+
+from .file_handler import FileHandler
+from .fs import directory_cache
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS paths (
+    image_path TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS paths_digest ON paths (digest);
+CREATE TABLE IF NOT EXISTS refs (
+    ref_path TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS refs_digest ON refs (digest);
+"""
+
+INDEX_FILE_NAME: str = 'index.sqlite3'
+"""存储索引文件名, 位于存储目录下"""
+
+
+class BlobRecord(NamedTuple):
+    """图片 path 对应的内容"""
+    digest: str
+    size: int
+
+
+class GcReport(NamedTuple):
+    """垃圾回收结果"""
+    removed: int
+    freed_bytes: int
+    kept: int
+
+
+class BlobStore(object):
+    """按内容 sha256 寻址的图片存储
+
+    每份内容只在存储目录中保存一次, 图片 path 到内容的映射记录在索引中,
+    章节目录中的图片是指向存储内容的硬链接, 不支持硬链接时退化为复制;
+    已存储的图片 path 无需再次下载, 不同章节或不同次运行中内容相同的图片也只占用一份空间
+    """
+
+    def __init__(self, root: FileHandler):
+        """
+        :param root: 存储目录
+        """
+        self.root = root
+        self._connection: sqlite3.Connection | None = None
+
+    def __repr__(self) -> str:
+        return f'<BlobStore(root={self.root})>'
+
+    def __enter__(self) -> "BlobStore":
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            raise RuntimeError('Blob store is not opened')
+        return self._connection
+
+    def open(self) -> None:
+        if self._connection is not None:
+            return
+        if not self.root.path.exists():
+            pathlib.Path.mkdir(self.root.path, parents=True)
+        self._connection = sqlite3.connect(
+            self.root(INDEX_FILE_NAME).path, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def blob_file(self, digest: str) -> FileHandler:
+        return self.root(digest[:2], digest)
+
+    def _has_blob(self, record: BlobRecord) -> bool:
+        try:
+            return self.blob_file(record.digest).path.stat().st_size == record.size
+        except OSError:
+            return False
+
+    def lookup(self, image_path: str) -> BlobRecord | None:
+        """获取已存储的图片 path 对应的内容, 未存储或内容文件已丢失时返回 None"""
+        row = self.connection.execute('SELECT digest, size FROM paths WHERE image_path=?', (image_path,)).fetchone()
+        if row is None:
+            return None
+        record = BlobRecord(*row)
+        return record if self._has_blob(record) else None
+
+    def lookup_many(self, image_paths: Iterable[str]) -> dict[str, BlobRecord]:
+        """批量获取已存储的图片 path 对应的内容"""
+        result: dict[str, BlobRecord] = {}
+        for image_path in image_paths:
+            record = self.lookup(image_path)
+            if record is not None:
+                result[image_path] = record
+        return result
+
+    def _record_path(self, image_path: str, digest: str, size: int) -> None:
+        self.connection.execute(
+            'INSERT OR REPLACE INTO paths (image_path, digest, size, updated_at) VALUES (?, ?, ?, ?)',
+            (image_path, digest, size, time.time())
+        )
+
+    def _record_ref(self, ref_file: FileHandler, digest: str) -> None:
+        self.connection.execute(
+            'INSERT OR REPLACE INTO refs (ref_path, digest, updated_at) VALUES (?, ?, ?)',
+            (ref_file.resolve_path, digest, time.time())
+        )
+
+    @staticmethod
+    def _link_or_copy(source: pathlib.Path, target: pathlib.Path) -> None:
+        """原子地将 target 替换为 source 的硬链接, 不支持硬链接时复制"""
+        temp_target = target.with_name(f'{target.name}.part')
+        temp_target.unlink(missing_ok=True)
+        try:
+            os.link(source, temp_target)
+        except OSError:
+            shutil.copyfile(source, temp_target)
+        os.replace(temp_target, target)
+
+    def put_file(self, image_path: str, file: FileHandler, digest: str) -> None:
+        """存储已下载的图片文件, 内容已存在时将该文件替换为指向已有内容的硬链接
+
+        :param image_path: 图片 path
+        :param file: 已下载的图片文件
+        :param digest: 图片内容 sha256
+        """
+        blob_file = self.blob_file(digest)
+        size = file.path.stat().st_size
+        if blob_file.path.exists():
+            if not os.path.samefile(blob_file.path, file.path):
+                self._link_or_copy(blob_file.path, file.path)
+        else:
+            blob_file.path.parent.mkdir(parents=True, exist_ok=True)
+            self._link_or_copy(file.path, blob_file.path)
+        self._record_path(image_path, digest, size)
+        self._record_ref(file, digest)
+
+    def put_bytes(self, image_path: str, data: bytes, digest: str) -> None:
+        """存储图片内容, 用于不保留单独图片文件的单次写入模式"""
+        blob_file = self.blob_file(digest)
+        if not blob_file.path.exists():
+            blob_file.path.parent.mkdir(parents=True, exist_ok=True)
+            temp_file = blob_file.path.with_name(f'{digest}.part')
+            temp_file.write_bytes(data)
+            os.replace(temp_file, blob_file.path)
+        self._record_path(image_path, digest, len(data))
+
+    def forget(self, image_path: str) -> None:
+        """移除图片 path 与内容的对应关系, 用于已存储的内容损坏时使该图片重新下载, 内容本身由 gc 清理"""
+        self.connection.execute('DELETE FROM paths WHERE image_path=?', (image_path,))
+
+    def link_to(self, digest: str, target: FileHandler) -> None:
+        """在目标位置创建指向已存储内容的硬链接"""
+        directory_cache.ensure(target.path.parent)
+        self._link_or_copy(self.blob_file(digest).path, target.path)
+        self._record_ref(target, digest)
+
+    def read_bytes(self, digest: str) -> bytes:
+        return self.blob_file(digest).path.read_bytes()
+
+    def _is_referenced(self, blob_path: pathlib.Path, digest: str) -> bool:
+        if blob_path.stat().st_nlink > 1:
+            return True
+        # 不支持硬链接时章节目录中保存的是复制的文件
+        rows = self.connection.execute('SELECT ref_path FROM refs WHERE digest=?', (digest,)).fetchall()
+        return any(pathlib.Path(x[0]).exists() for x in rows)
+
+    def gc(self, *, dry_run: bool = False, min_age: float = 0) -> GcReport:
+        """删除没有任何章节目录引用的内容及其索引, 单次写入模式存入的内容不被章节目录引用, 只作为下载缓存
+
+        :param dry_run: 只统计, 不删除
+        :param min_age: 只删除修改时间早于 min_age 秒前的内容, 避免删除正在进行的下载刚写入的内容
+        """
+        removed = freed_bytes = kept = 0
+        now = time.time()
+        for blob_path in self.root.path.glob('??/*'):
+            if not blob_path.is_file() or blob_path.name.endswith('.part'):
+                continue
+            digest = blob_path.name
+            stat = blob_path.stat()
+            if now - stat.st_mtime < min_age or self._is_referenced(blob_path, digest):
+                kept += 1
+                continue
+            removed += 1
+            freed_bytes += stat.st_size
+            if not dry_run:
+                blob_path.unlink(missing_ok=True)
+                self.connection.execute('DELETE FROM paths WHERE digest=?', (digest,))
+                self.connection.execute('DELETE FROM refs WHERE digest=?', (digest,))
+                if not any(blob_path.parent.iterdir()):
+                    blob_path.parent.rmdir()
+
+        if not dry_run:
+            # 清理指向已删除文件的引用记录
+            rows = self.connection.execute('SELECT ref_path FROM refs').fetchall()
+            stale = [(x[0],) for x in rows if not pathlib.Path(x[0]).exists()]
+            self.connection.executemany('DELETE FROM refs WHERE ref_path=?', stale)
+        return GcReport(removed=removed, freed_bytes=freed_bytes, kept=kept)
+
+
+__all__ = [
+    'BlobRecord',
+    'BlobStore',
+    'GcReport'
+]
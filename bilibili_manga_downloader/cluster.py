@@ -0,0 +1,372 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 04:30
+@FileName       : cluster.py
+@Project        : BilibiliMangaDownloader
+@Description    : multi-node download: coordinator and lease queue worker
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import os
+import socket
+import asyncio
+from aiohttp import ClientSession
+from contextlib import nullcontext
+from typing import Any, AsyncIterator, Iterable, NamedTuple
+
+from .blob_store import BlobStore
+from .download_config import DownloaderConfig
+from .downloader import (
+    BLOB_STORE_DIR_NAME,
+    MANIFEST_FILE_NAME,
+    METADATA_CACHE_FILE_NAME,
+    ChapterJob,
+    DownloadPipeline,
+    chapter_folder_name,
+    check_archive_suffix,
+    comic_folder_name
+)
+from .file_handler import FileHandler, run_sync
+from .identity_pool import IdentityPool
+from .job_queue import ChapterEntry, JobQueue, Lease, QueueOptions
+from .logger import logger
+from .manifest import DownloadManifest
+from .metadata_cache import MetadataCache
+from .scheduler import DownloadScheduler
+from .session import create_session
+from .sync import query_comic
+
+
+QUEUE_FILE_NAME: str = 'job_queue.sqlite3'
+"""默认的任务队列文件名, 位于下载目录下, 多个节点使用时需指定共享文件系统上的路径"""
+
+
+class EnqueueReport(NamedTuple):
+    """单部漫画加入队列的结果"""
+    comic_id: int
+    title: str | None
+    total: int
+    added: int
+    error: str | None = None
+
+
+class WorkerReport(NamedTuple):
+    """worker 的运行结果"""
+    worker_id: str
+    claimed: int
+    done: int
+    failed: int
+    skipped: int
+    lost: int
+
+
+def default_worker_id() -> str:
+    """默认的 worker 标识, 由主机名及进程 id 组成"""
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+def _queue_options(config: DownloaderConfig) -> QueueOptions:
+    return QueueOptions(
+        archive_suffix=config.archive_suffix,
+        single_pass=config.single_pass,
+        compression_level=config.archive_config.compression_levels.get(config.archive_suffix),
+        image_variant=config.image_variant
+    )
+
+
+def _apply_queue_options(config: DownloaderConfig, options: QueueOptions) -> DownloaderConfig:
+    """使用队列中的配置覆盖影响输出内容的配置项, 并生成可复现的压缩文件"""
+    archive_config = config.archive_config.copy(deep=True)
+    archive_config.reproducible = True
+    if options.compression_level is not None:
+        archive_config.compression_levels[options.archive_suffix] = options.compression_level
+    return config.copy(update={
+        'archive_suffix': options.archive_suffix,
+        'single_pass': options.single_pass,
+        'image_variant': options.image_variant,
+        'archive_config': archive_config
+    })
+
+
+async def enqueue_library(
+        comic_ids: Iterable[int],
+        *,
+        queue_file: FileHandler | None = None,
+        config: DownloaderConfig | None = None,
+        session: ClientSession | None = None,
+        **options: Any
+) -> list[EnqueueReport]:
+    """协调者: 获取各漫画章节列表, 将全部章节加入任务队列, 由各节点上的 worker 领取下载
+
+    章节目录名在此时生成并保存在队列中, 影响输出内容的配置(压缩格式、压缩级别、图片规格等)同时写入队列,
+    worker 使用队列中的配置, 因此无论章节由哪个节点下载, 输出的文件路径及内容都相同
+
+    :param comic_ids: 漫画 id 列表
+    :param queue_file: 任务队列文件, 默认为下载目录下的 job_queue.sqlite3
+    :param config: 下载配置
+    :param session: 共享的 ClientSession, 提供时不会在完成后关闭
+    :param options: 覆盖 config 中的同名配置项
+    :return: 各漫画加入队列的结果
+    """
+    config = DownloaderConfig.with_options(config, **options)
+    comic_ids = list(dict.fromkeys(comic_ids))
+    check_archive_suffix(config.archive_suffix, single_pass=config.single_pass)
+    queue_file = FileHandler('download', QUEUE_FILE_NAME) if queue_file is None else queue_file
+    reports: list[EnqueueReport] = []
+
+    with JobQueue(file=queue_file) as queue, \
+            MetadataCache(file=FileHandler('download', METADATA_CACHE_FILE_NAME),
+                          force_refresh=config.refresh_metadata) as metadata_cache:
+        await run_sync(queue.set_options)(_queue_options(config))
+        async with (create_session(config.session_config) if session is None else nullcontext(session)) as session:
+            # 只使用调度器的 api 请求并发限制, 不添加任何阶段
+            scheduler = DownloadScheduler(config=config.scheduler_config)
+            results = await asyncio.gather(*(
+                query_comic(x, session=session, scheduler=scheduler, cache=metadata_cache) for x in comic_ids
+            ))
+
+        for comic_id, manga_ep in results:
+            if isinstance(manga_ep, Exception):
+                logger.error(f'获取漫画({comic_id})章节失败, {manga_ep}')
+                reports.append(EnqueueReport(comic_id=comic_id, title=None, total=0, added=0, error=str(manga_ep)))
+                continue
+            comic_folder = comic_folder_name(manga_ep)
+            entries = [
+                ChapterEntry(comic_id=comic_id, ep_id=ep.id, ord=ep.ord, comic_folder=comic_folder,
+                             chapter_folder=chapter_folder_name(ep.id, ep.short_title, ep.title))
+                for ep in manga_ep.data.ep_list
+            ]
+            added = await run_sync(queue.add_chapters)(entries)
+            reports.append(EnqueueReport(comic_id=comic_id, title=manga_ep.data.title, total=len(entries), added=added))
+            logger.info(f'漫画"{manga_ep.data.title}"共 {len(entries)} 章, 新加入队列 {added} 章')
+
+        stats = await run_sync(queue.stats)()
+    logger.success(f'加入队列完成, 共 {len(reports)} 部漫画, 队列中等待: {stats.pending}, 下载中: {stats.leased}, '
+                   f'已完成: {stats.done}, 失败: {stats.failed}')
+    return reports
+
+
+class QueueWorker(object):
+    """任务队列 worker, 从队列中逐个领取章节交给下载流水线, 下载期间定期续约, 章节完成后立即提交结果
+
+    章节只在流水线入口队列有空位时才会领取, 因此每个 worker 持有的租约数不超过流水线中的章节数;
+    队列暂时没有可领取的章节时定期轮询, 直到队列中没有等待领取或正在下载的章节后退出
+    """
+
+    def __init__(
+            self,
+            queue: JobQueue,
+            *,
+            worker_id: str,
+            manifest: DownloadManifest | None = None,
+            archive_suffix: str = 'zip',
+            poll_interval: float = 5
+    ):
+        """
+        :param queue: 任务队列
+        :param worker_id: worker 标识, 在所有节点中唯一
+        :param manifest: 下载清单, 提供时已完整下载的章节直接标记为完成
+        :param archive_suffix: 章节压缩文件格式
+        :param poll_interval: 没有可领取的章节时轮询队列的间隔, 单位秒
+        """
+        self.queue = queue
+        self.worker_id = worker_id
+        self.manifest = manifest
+        self.archive_suffix = archive_suffix
+        self.poll_interval = poll_interval
+        self._leases: dict[tuple[int, int], Lease] = {}
+        self._completions: set[asyncio.Task] = set()
+        self.claimed: int = 0
+        self.done: int = 0
+        self.failed: int = 0
+        self.skipped: int = 0
+        self.lost: int = 0
+
+    def __repr__(self) -> str:
+        return f'<QueueWorker(worker_id={self.worker_id}, leases={len(self._leases)})>'
+
+    @property
+    def report(self) -> WorkerReport:
+        return WorkerReport(worker_id=self.worker_id, claimed=self.claimed, done=self.done, failed=self.failed,
+                            skipped=self.skipped, lost=self.lost)
+
+    def _is_stored(self, chapter: ChapterJob) -> bool:
+        if self.manifest is None:
+            return False
+        record = self.manifest.get_archive(chapter.comic_id, chapter.ep_id)
+        return self.manifest.verify_archive(record, chapter.archive_file)
+
+    async def _claim(self) -> ChapterJob | None:
+        """领取一个章节, 本地已完整下载的章节直接标记为完成后继续领取"""
+        while True:
+            leases = await run_sync(self.queue.claim)(self.worker_id, limit=1)
+            if not leases:
+                return None
+            lease = leases[0]
+            self.claimed += 1
+            chapter = ChapterJob(
+                comic_id=lease.comic_id, ep_id=lease.ep_id,
+                folder=FileHandler('download', lease.comic_folder, lease.chapter_folder),
+                archive_suffix=self.archive_suffix
+            )
+            if await run_sync(self._is_stored)(chapter):
+                logger.debug('漫画章节({})已下载, 跳过', lease.ep_id)
+                await run_sync(self.queue.complete)(lease, self.worker_id)
+                self.skipped += 1
+                continue
+            self._leases[(lease.comic_id, lease.ep_id)] = lease
+            logger.info('已领取漫画章节({}), 第 {} 次领取', lease.ep_id, lease.attempt)
+            return chapter
+
+    async def iter_chapters(self) -> AsyncIterator[ChapterJob]:
+        """逐个领取章节, 队列中没有等待领取或正在下载的章节时结束"""
+        while True:
+            chapter = await self._claim()
+            if chapter is not None:
+                yield chapter
+                continue
+            stats = await run_sync(self.queue.stats)()
+            if stats.is_drained:
+                return
+            # 其余章节正在其他 worker 或本 worker 的流水线中下载, 等待完成或租约过期后重新分配
+            await asyncio.sleep(self.poll_interval)
+
+    async def heartbeat(self) -> None:
+        """每隔租约时长的三分之一为持有的全部租约续约, 直到被取消"""
+        while True:
+            await asyncio.sleep(self.queue.lease_seconds / 3)
+            if not self._leases:
+                continue
+            lost = await run_sync(self.queue.heartbeat)(self.worker_id, list(self._leases.values()))
+            for lease in lost:
+                # 流水线中的章节仍会继续下载, 输出与新的持有者完全相同, 只是结果不再提交
+                logger.warning('漫画章节({})的租约已过期并被重新分配', lease.ep_id)
+                self._leases.pop((lease.comic_id, lease.ep_id), None)
+                self.lost += 1
+
+    async def _complete(self, lease: Lease, error: str | None) -> None:
+        try:
+            accepted = await run_sync(self.queue.complete)(lease, self.worker_id, error=error)
+        except Exception as e:
+            logger.error('提交漫画章节({})结果失败, {}', lease.ep_id, e)
+            return
+        if not accepted:
+            logger.warning('漫画章节({})的租约已失效, 结果未提交', lease.ep_id)
+            self.lost += 1
+        elif error is None:
+            self.done += 1
+        else:
+            self.failed += 1
+
+    def on_chapter_finished(self, chapter: ChapterJob) -> None:
+        """流水线的章节完成回调, 有图片下载失败的章节同样视为失败, 由队列重新分配"""
+        lease = self._leases.pop((chapter.comic_id, chapter.ep_id), None)
+        if lease is None:
+            return
+        if chapter.error is not None:
+            error = str(chapter.error) or type(chapter.error).__name__
+        elif chapter.fail_count:
+            error = f'{chapter.fail_count} pages failed'
+        else:
+            error = None
+        task = asyncio.create_task(self._complete(lease, error))
+        self._completions.add(task)
+        task.add_done_callback(self._completions.discard)
+
+    async def close(self) -> None:
+        """等待已完成章节的结果提交, 并归还仍持有的租约"""
+        if self._completions:
+            await asyncio.gather(*self._completions, return_exceptions=True)
+        released = await run_sync(self.queue.release)(self.worker_id)
+        if released:
+            logger.info(f'已归还 {released} 个未完成章节的租约')
+        self._leases.clear()
+
+
+async def run_worker(
+        *,
+        queue_file: FileHandler | None = None,
+        worker_id: str | None = None,
+        lease_seconds: float = 300,
+        max_attempts: int = 3,
+        poll_interval: float = 5,
+        config: DownloaderConfig | None = None,
+        session: ClientSession | None = None,
+        **options: Any
+) -> WorkerReport:
+    """worker: 从任务队列中领取章节下载, 直到队列中没有等待领取或正在下载的章节
+
+    压缩格式、压缩级别及图片规格使用协调者写入队列的配置, 压缩文件总是可复现的, 其余配置(并发、连接池、
+    身份池等)使用本节点的配置; 下载目录、清单及图片内容存储位于本节点的下载目录下
+
+    :param queue_file: 任务队列文件, 默认为下载目录下的 job_queue.sqlite3
+    :param worker_id: worker 标识, 默认由主机名及进程 id 组成
+    :param lease_seconds: 租约时长, 单位秒, 所有 worker 应使用相同的值
+    :param max_attempts: 单个章节的领取次数上限
+    :param poll_interval: 没有可领取的章节时轮询队列的间隔, 单位秒
+    :param config: 本节点的下载配置
+    :param session: 共享的 ClientSession, 提供时不会在完成后关闭
+    :param options: 覆盖 config 中的同名配置项
+    :return: worker 的运行结果
+    """
+    config = DownloaderConfig.with_options(config, **options)
+    queue_file = FileHandler('download', QUEUE_FILE_NAME) if queue_file is None else queue_file
+    worker_id = default_worker_id() if worker_id is None else worker_id
+
+    with JobQueue(file=queue_file, lease_seconds=lease_seconds, max_attempts=max_attempts) as queue:
+        queue_options = await run_sync(queue.get_options)()
+        if queue_options is None:
+            raise ValueError(f'任务队列({queue_file.resolve_path})中没有章节, 请先加入漫画')
+        config = _apply_queue_options(config, queue_options)
+        check_archive_suffix(config.archive_suffix, single_pass=config.single_pass)
+
+        blob_store = BlobStore(root=FileHandler('download', BLOB_STORE_DIR_NAME)) if config.dedup else None
+        with DownloadManifest(file=FileHandler('download', MANIFEST_FILE_NAME)) as manifest, \
+                MetadataCache(file=FileHandler('download', METADATA_CACHE_FILE_NAME),
+                              force_refresh=config.refresh_metadata) as metadata_cache, \
+                (blob_store if blob_store is not None else nullcontext()):
+            worker = QueueWorker(
+                queue, worker_id=worker_id, manifest=manifest, archive_suffix=config.archive_suffix,
+                poll_interval=poll_interval
+            )
+            async with (create_session(config.session_config) if session is None else nullcontext(session)) as session:
+                identity_pool = IdentityPool(config.identity_pool)
+                await identity_pool.verify(session=session)
+
+                pipeline = DownloadPipeline(
+                    session=session, scheduler_config=config.scheduler_config, chunk_size=config.chunk_size,
+                    byte_budget=config.byte_budget, single_pass=config.single_pass, manifest=manifest,
+                    metadata_cache=metadata_cache, warm_up_connections=config.session_config.warm_up_connections,
+                    archive_config=config.archive_config, writer_config=config.writer_config,
+                    image_variant=config.image_variant, blob_store=blob_store,
+                    validate_images=config.validate_images,
+                    identity_pool=identity_pool, on_chapter_finished=worker.on_chapter_finished
+                )
+                logger.info(f'worker {worker_id} 开始领取任务队列中的章节')
+                heartbeat = asyncio.create_task(worker.heartbeat())
+                try:
+                    await pipeline.run(worker.iter_chapters())
+                finally:
+                    heartbeat.cancel()
+                    await asyncio.gather(heartbeat, return_exceptions=True)
+                    await worker.close()
+
+        stats = await run_sync(queue.stats)()
+
+    report = worker.report
+    logger.success(f'worker {worker_id} 完成, 领取: {report.claimed}, 完成: {report.done}, 失败: {report.failed}, '
+                   f'已下载跳过: {report.skipped}, 租约失效: {report.lost}')
+    logger.info(f'任务队列中已完成: {stats.done}, 失败: {stats.failed}')
+    return report
+
+
+__all__ = [
+    'QUEUE_FILE_NAME',
+    'EnqueueReport',
+    'QueueWorker',
+    'WorkerReport',
+    'default_worker_id',
+    'enqueue_library',
+    'run_worker'
+]
@@ -0,0 +1,194 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/17 16:00
+@FileName       : concurrency.py
+@Project        : BilibiliMangaDownloader
+@Description    : AIMD adaptive concurrency limiter
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import math
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, NamedTuple
+
+from aiohttp import ClientResponseError
+from asyncio.exceptions import TimeoutError as _TimeoutError
+from pydantic import BaseModel
+
+from .api import BilibiliApiError
+from .logger import logger
+from .rate_limiter import rate_wait_seconds
+
+
+_THROTTLE_STATUS: frozenset[int] = frozenset({412, 429})
+"""表示请求被限流的 http 状态码"""
+
+
+class AdaptiveLimitConfig(BaseModel):
+    """自适应并发限制配置"""
+    enabled: bool = True
+    """是否启用自适应调整, 关闭时并发限制固定为 initial"""
+    initial: int = 8
+    """初始并发限制"""
+    min: int = 1
+    """并发限制下限"""
+    max: int = 64
+    """并发限制上限"""
+    window: int = 32
+    """每次评估是否提高并发限制所需的样本数"""
+    latency_target: float = 2.0
+    """窗口内 p95 延迟上限, 单位秒, 超过时降低并发限制"""
+    error_rate_threshold: float = 0.05
+    """窗口内错误率上限, 超过时降低并发限制"""
+    increase_step: int = 1
+    """加性增加的步长"""
+    decrease_factor: float = 0.5
+    """乘性减少的系数"""
+
+
+class LimitChange(NamedTuple):
+    """并发限制调整记录"""
+    time: float
+    old_limit: int
+    new_limit: int
+    reason: str
+
+
+def classify_throttle(exception: BaseException) -> str | None:
+    """判断异常是否表示服务端过载或限流, 是则返回原因, 否则返回 None"""
+    for e in (exception, exception.__cause__):
+        if isinstance(e, _TimeoutError):
+            return 'timeout'
+        if isinstance(e, ClientResponseError) and e.status in _THROTTLE_STATUS:
+            return f'http {e.status}'
+        if isinstance(e, BilibiliApiError):
+            return f'api code {e.code}'
+    return None
+
+
+class AdaptiveLimiter(object):
+    """AIMD 自适应并发限制
+
+    每累计 window 个样本评估一次, p95 延迟及错误率均正常时加性提高并发限制,
+    遇到超时、412/429 或 api 返回非 0 code 时立即乘性降低;
+    调整前已发出的请求产生的错误不会再次触发降低, 避免一次拥塞使并发限制连续减半
+    """
+
+    def __init__(self, name: str, config: AdaptiveLimitConfig | None = None):
+        self.name = name
+        self.config = AdaptiveLimitConfig() if config is None else config
+        self._limit = max(self.config.min, min(self.config.initial, self.config.max))
+        self._in_flight = 0
+        self._epoch = 0
+        self._samples: list[tuple[float, bool]] = []
+        self._condition = asyncio.Condition()
+        self.history: deque[LimitChange] = deque(maxlen=256)
+
+    def __repr__(self) -> str:
+        return f'<AdaptiveLimiter(name={self.name}, limit={self._limit}, in_flight={self._in_flight})>'
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def last_change(self) -> LimitChange | None:
+        return self.history[-1] if self.history else None
+
+    def _set_limit(self, new_limit: int, reason: str) -> None:
+        new_limit = max(self.config.min, min(new_limit, self.config.max))
+        if new_limit == self._limit:
+            return
+        change = LimitChange(time=time.time(), old_limit=self._limit, new_limit=new_limit, reason=reason)
+        self.history.append(change)
+        self._limit = new_limit
+        self._epoch += 1
+        self._samples.clear()
+        logger.debug('并发限制调整 {}: {} -> {}, 原因: {}', self.name, change.old_limit, change.new_limit, reason)
+
+    def _decrease(self, reason: str) -> None:
+        self._set_limit(int(self._limit * self.config.decrease_factor), reason=reason)
+
+    def _evaluate(self) -> None:
+        latencies = sorted(x[0] for x in self._samples if x[1])
+        error_rate = sum(1 for x in self._samples if not x[1]) / len(self._samples)
+        p95 = latencies[math.ceil(len(latencies) * 0.95) - 1] if latencies else 0.0
+
+        if error_rate > self.config.error_rate_threshold:
+            self._decrease(reason=f'error rate {error_rate:.1%}')
+        elif p95 > self.config.latency_target:
+            self._decrease(reason=f'p95 latency {p95:.3f}s')
+        elif self._in_flight >= self._limit - 1:
+            # 只有并发已接近限制时才有必要继续提高
+            self._set_limit(self._limit + self.config.increase_step, reason=f'healthy, p95 latency {p95:.3f}s')
+        self._samples.clear()
+
+    def record(self, epoch: int, latency: float, exception: BaseException | None = None) -> None:
+        """记录一次请求结果
+
+        :param epoch: 请求开始时的调整轮次
+        :param latency: 请求耗时, 单位秒
+        :param exception: 请求失败时的异常
+        """
+        if not self.config.enabled or epoch != self._epoch:
+            return
+
+        if exception is not None and (reason := classify_throttle(exception)) is not None:
+            return self._decrease(reason=reason)
+
+        self._samples.append((latency, exception is None))
+        if len(self._samples) >= self.config.window:
+            self._evaluate()
+
+    async def acquire(self) -> int:
+        """等待空闲并发名额, 返回当前调整轮次"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self._limit)
+            self._in_flight += 1
+            return self._epoch
+
+    async def release(self) -> None:
+        async with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """占用一个并发名额, 并根据块内请求的耗时及异常调整并发限制, 块内等待速率限制的时间不计入耗时"""
+        epoch = await self.acquire()
+        start = time.monotonic() - rate_wait_seconds()
+        try:
+            yield
+        except Exception as e:
+            self.record(epoch, time.monotonic() - rate_wait_seconds() - start, exception=e)
+            raise
+        else:
+            self.record(epoch, time.monotonic() - rate_wait_seconds() - start)
+        finally:
+            await self.release()
+
+    def snapshot(self) -> dict[str, object]:
+        """当前并发限制及最近一次调整原因"""
+        last_change = self.last_change
+        return {
+            'limit': self._limit,
+            'in_flight': self._in_flight,
+            'last_change_reason': None if last_change is None else last_change.reason,
+            'changes': len(self.history)
+        }
+
+
+__all__ = [
+    'AdaptiveLimitConfig',
+    'AdaptiveLimiter',
+    'LimitChange',
+    'classify_throttle'
+]
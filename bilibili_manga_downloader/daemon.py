@@ -0,0 +1,424 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/17 23:30
+@FileName       : daemon.py
+@Project        : BilibiliMangaDownloader
+@Description    : long-running download daemon with a local job api
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import time
+import asyncio
+import itertools
+from contextlib import ExitStack
+from typing import Any, AsyncIterator
+
+from aiohttp import ClientSession, web
+from pydantic import BaseModel, ValidationError
+
+from .api import MANGA_API_URL, BilibiliApiError, query_manga_ep
+from .blob_store import BlobStore
+from .download_config import DownloaderConfig
+from .downloader import (
+    BLOB_STORE_DIR_NAME,
+    MANIFEST_FILE_NAME,
+    METADATA_CACHE_FILE_NAME,
+    ChapterJob,
+    DownloadPipeline,
+    check_archive_suffix,
+    create_chapter_jobs
+)
+from .file_handler import FileHandler
+from .identity_pool import IdentityPool
+from .logger import logger
+from .manifest import DownloadManifest
+from .metadata_cache import MetadataCache
+from .metrics import metrics_registry
+from .session import create_session
+
+
+JOB_QUEUED: str = 'queued'
+JOB_RUNNING: str = 'running'
+JOB_DONE: str = 'done'
+JOB_FAILED: str = 'failed'
+JOB_CANCELLED: str = 'cancelled'
+
+
+class DaemonConfig(BaseModel):
+    """守护进程配置"""
+    host: str = '127.0.0.1'
+    port: int = 8700
+    unix_socket: str | None = None
+    """Unix socket 路径, 提供时只监听该 socket 而不监听 host:port"""
+    history_size: int = 10000
+    """保留的已结束任务数, 超出时删除最早结束的任务"""
+
+
+class JobRequest(BaseModel):
+    """提交任务的请求内容"""
+    comic_id: int
+    ep_ids: list[int] | None = None
+    """需要下载的章节 id, 默认为全部章节"""
+    priority: int = 0
+    """优先级, 数值越大越先下载"""
+
+
+class DownloadJob(object):
+    """守护进程中的下载任务"""
+    __slots__ = ('job_id', 'comic_id', 'ep_ids', 'priority', 'status', 'title', 'chapter_count', 'stored_count',
+                 'finished_count', 'fail_count', 'chapters', 'page_count', 'page_finished_count', 'page_fail_count',
+                 'error', 'created_at', 'started_at', 'finished_at')
+
+    def __init__(self, job_id: int, request: JobRequest):
+        self.job_id = job_id
+        self.comic_id = request.comic_id
+        self.ep_ids = request.ep_ids
+        self.priority = request.priority
+        self.status: str = JOB_QUEUED
+        self.title: str | None = None
+        self.chapter_count: int = 0
+        self.stored_count: int = 0
+        self.finished_count: int = 0
+        self.fail_count: int = 0
+        self.chapters: list[ChapterJob] = []
+        """已进入流水线且尚未完成的章节"""
+        self.page_count: int = 0
+        self.page_finished_count: int = 0
+        self.page_fail_count: int = 0
+        self.error: str | None = None
+        self.created_at: float = time.time()
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+
+    def __repr__(self) -> str:
+        return f'<DownloadJob(job_id={self.job_id}, comic_id={self.comic_id}, status={self.status})>'
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+    def _finish(self, status: str, error: str | None = None) -> None:
+        self.status = status
+        self.error = error
+        self.finished_at = time.time()
+
+    def to_dict(self) -> dict[str, Any]:
+        """任务状态及进度, 进度按已处理的图片数计算"""
+        page_count = self.page_count + sum(len(x.image_paths) for x in self.chapters)
+        page_finished = self.page_finished_count + sum(x.finished_count for x in self.chapters)
+        page_failed = self.page_fail_count + sum(x.fail_count for x in self.chapters)
+        return {
+            'job_id': self.job_id,
+            'comic_id': self.comic_id,
+            'ep_ids': self.ep_ids,
+            'priority': self.priority,
+            'status': self.status,
+            'title': self.title,
+            'chapters': {
+                'total': self.chapter_count, 'stored': self.stored_count,
+                'finished': self.finished_count, 'failed': self.fail_count
+            },
+            'pages': {'total': page_count, 'finished': page_finished, 'failed': page_failed},
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+
+class DownloadDaemon(object):
+    """下载守护进程
+
+    在整个生命周期内复用同一个 ClientSession、已验证的 cookie 及一条下载流水线,
+    通过本地 HTTP 或 Unix socket 接口接收任务, 所有任务的章节按优先级进入同一个调度器
+
+    接口:
+        POST /jobs          提交任务, 内容为 {"comic_id": 1, "ep_ids": [1, 2], "priority": 0}
+        GET /jobs           列出全部任务
+        GET /jobs/{job_id}  获取任务状态及进度
+        DELETE /jobs/{job_id}  取消任务, 已进入流水线的章节会继续完成
+        GET /status         守护进程状态
+        GET /metrics        Prometheus 格式的指标
+    """
+
+    def __init__(
+            self,
+            config: DaemonConfig | None = None,
+            *,
+            downloader_config: DownloaderConfig | None = None,
+            **options: Any
+    ):
+        """
+        :param config: 守护进程配置
+        :param downloader_config: 下载配置, 所有任务共享, 守护进程总是使用固定的下载目录
+        :param options: 覆盖 downloader_config 中的同名配置项
+        """
+        self.config = DaemonConfig() if config is None else config
+        self.downloader_config = DownloaderConfig.with_options(downloader_config, **options)
+        check_archive_suffix(self.downloader_config.archive_suffix, single_pass=self.downloader_config.single_pass)
+
+        self.jobs: dict[int, DownloadJob] = {}
+        self._job_ids = itertools.count(1)
+        self._sequence = itertools.count()
+        self._queue: asyncio.PriorityQueue[tuple[int, int, ChapterJob | None]] = asyncio.PriorityQueue()
+        self._chapter_jobs: dict[int, list[DownloadJob]] = {}
+        self._active_chapters: dict[tuple[int, int], ChapterJob] = {}
+        """排队中及正在下载的章节, 同一章节同时只在流水线中出现一次, 重复提交的任务共享同一个章节任务"""
+        self._started_chapters: set[int] = set()
+        self._expand_tasks: set[asyncio.Task] = set()
+        self._started_at: float = time.time()
+
+        self.session: ClientSession | None = None
+        self.manifest: DownloadManifest | None = None
+        self.pipeline: DownloadPipeline | None = None
+
+    def __repr__(self) -> str:
+        return f'<DownloadDaemon(jobs={len(self.jobs)}, queued_chapters={self._queue.qsize()})>'
+
+    def submit(self, request: JobRequest) -> DownloadJob:
+        """提交任务, 章节列表在后台获取后按优先级进入流水线"""
+        if self.pipeline is None:
+            raise RuntimeError('Download daemon is not running')
+        job = DownloadJob(job_id=next(self._job_ids), request=request)
+        self.jobs[job.job_id] = job
+        task = asyncio.create_task(self._expand_job(job))
+        self._expand_tasks.add(task)
+        task.add_done_callback(self._expand_tasks.discard)
+        self._evict_history()
+        return job
+
+    def cancel(self, job: DownloadJob) -> None:
+        """取消任务, 尚未进入流水线的章节被跳过"""
+        if not job.is_finished:
+            job._finish(JOB_CANCELLED)
+
+    def _evict_history(self) -> None:
+        finished = [x for x in self.jobs.values() if x.is_finished]
+        overflow = len(finished) - self.config.history_size
+        if overflow > 0:
+            for job in sorted(finished, key=lambda x: x.finished_at)[:overflow]:
+                del self.jobs[job.job_id]
+
+    async def _expand_job(self, job: DownloadJob) -> None:
+        """获取任务的章节列表, 并将本地尚未完整下载的章节放入优先队列"""
+        try:
+            async with self.pipeline.scheduler.request_slot(MANGA_API_URL, group='api'):
+                manga_ep = await query_manga_ep(
+                    comic_id=job.comic_id, session=self.session, cache=self.pipeline.metadata_cache
+                )
+                if manga_ep.code != 0:
+                    raise BilibiliApiError(code=manga_ep.code, message=manga_ep.msg)
+            if job.ep_ids is not None and (unknown := set(job.ep_ids).difference(manga_ep.ep_index)):
+                raise ValueError(f'章节 {", ".join(map(str, sorted(unknown)))} 不属于漫画"{manga_ep.data.title}"')
+        except Exception as e:
+            logger.error(f'任务({job.job_id})获取漫画({job.comic_id})章节失败, {e}')
+            return job._finish(JOB_FAILED, error=str(e))
+
+        if job.is_finished:
+            return
+        # 守护进程使用固定的下载目录, 由下载清单跳过已下载的章节;
+        # 尚未完成的章节可能已由此前提交的任务放入队列或正在下载, 此时只登记到已有的章节任务
+        chapters = list(create_chapter_jobs(
+            manga_ep, ep_ids=None if job.ep_ids is None else set(job.ep_ids),
+            archive_suffix=self.downloader_config.archive_suffix, manifest=self.manifest
+        ))
+        job.title = manga_ep.data.title
+        job.chapter_count = len(chapters)
+        job.stored_count = len(manga_ep.data.ep_list if job.ep_ids is None else set(job.ep_ids)) - len(chapters)
+        if not chapters:
+            return job._finish(JOB_DONE)
+
+        for chapter in chapters:
+            active = self._active_chapters.get((chapter.comic_id, chapter.ep_id))
+            if active is None:
+                self._active_chapters[(chapter.comic_id, chapter.ep_id)] = chapter
+                self._chapter_jobs[id(chapter)] = [job]
+                self._queue.put_nowait((-job.priority, next(self._sequence), chapter))
+                continue
+            jobs = self._chapter_jobs[id(active)]
+            if id(active) in self._started_chapters:
+                self._start_job(job, active)
+            elif job.priority > max(x.priority for x in jobs):
+                # 以更高的优先级再次放入队列, 先取出的一次进入流水线, 另一次被跳过
+                self._queue.put_nowait((-job.priority, next(self._sequence), active))
+            jobs.append(job)
+        logger.info(f'任务({job.job_id})漫画"{job.title}"新增 {len(chapters)} 章, 优先级 {job.priority}')
+
+    def _release_chapter(self, chapter: ChapterJob) -> list[DownloadJob]:
+        """章节离开队列或流水线, 返回登记在该章节上的全部任务"""
+        self._started_chapters.discard(id(chapter))
+        key = (chapter.comic_id, chapter.ep_id)
+        if self._active_chapters.get(key) is chapter:
+            del self._active_chapters[key]
+        return self._chapter_jobs.pop(id(chapter), [])
+
+    @staticmethod
+    def _start_job(job: DownloadJob, chapter: ChapterJob) -> None:
+        if job.status == JOB_QUEUED:
+            job.status = JOB_RUNNING
+            job.started_at = time.time()
+        job.chapters.append(chapter)
+
+    def _on_chapter_finished(self, chapter: ChapterJob) -> None:
+        for job in self._release_chapter(chapter):
+            if chapter in job.chapters:
+                job.chapters.remove(chapter)
+            job.page_count += len(chapter.image_paths)
+            job.page_finished_count += chapter.finished_count
+            job.page_fail_count += chapter.fail_count
+            job.finished_count += 1
+            if chapter.error is not None:
+                job.fail_count += 1
+            if job.finished_count == job.chapter_count and not job.is_finished:
+                if job.fail_count:
+                    job._finish(JOB_FAILED, error=f'{job.fail_count} 个章节下载失败')
+                else:
+                    job._finish(JOB_DONE)
+
+    async def _iter_chapters(self) -> AsyncIterator[ChapterJob]:
+        """按优先级逐个取出章节, 流水线入口有空位时才会取出下一个章节, 高优先级任务可以插队"""
+        while True:
+            _, _, chapter = await self._queue.get()
+            if chapter is None:
+                return
+            jobs = self._chapter_jobs.get(id(chapter))
+            if jobs is None or id(chapter) in self._started_chapters:
+                # 已离开队列或因优先级提升而重复放入队列的章节
+                continue
+            jobs = [x for x in jobs if x.status != JOB_CANCELLED]
+            if not jobs:
+                self._release_chapter(chapter)
+                continue
+            self._chapter_jobs[id(chapter)] = jobs
+            self._started_chapters.add(id(chapter))
+            for job in jobs:
+                self._start_job(job, chapter)
+            yield chapter
+
+    def status(self) -> dict[str, Any]:
+        """守护进程状态"""
+        counts: dict[str, int] = {}
+        for job in self.jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            'uptime': time.time() - self._started_at,
+            'identities': self.pipeline.identity_pool.snapshot() if self.pipeline is not None else [],
+            'jobs': counts,
+            'queued_chapters': self._queue.qsize(),
+            'stage_queue_depth': self.pipeline.scheduler.queue_depth() if self.pipeline is not None else {},
+            'limits': self.pipeline.scheduler.limits() if self.pipeline is not None else {}
+        }
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/jobs', self._post_job)
+        app.router.add_get('/jobs', self._list_jobs)
+        app.router.add_get('/jobs/{job_id:\\d+}', self._get_job)
+        app.router.add_delete('/jobs/{job_id:\\d+}', self._delete_job)
+        app.router.add_get('/status', self._get_status)
+        app.router.add_get('/metrics', self._get_metrics)
+        return app
+
+    async def _post_job(self, request: web.Request) -> web.Response:
+        try:
+            job_request = JobRequest.parse_obj(await request.json())
+        except (ValueError, ValidationError) as e:
+            return web.json_response({'error': str(e)}, status=400)
+        job = self.submit(job_request)
+        return web.json_response(job.to_dict(), status=201)
+
+    async def _list_jobs(self, request: web.Request) -> web.Response:
+        status = request.query.get('status')
+        return web.json_response([x.to_dict() for x in self.jobs.values() if status is None or x.status == status])
+
+    def _job_of(self, request: web.Request) -> DownloadJob:
+        job = self.jobs.get(int(request.match_info['job_id']))
+        if job is None:
+            raise web.HTTPNotFound(text='job not found')
+        return job
+
+    async def _get_job(self, request: web.Request) -> web.Response:
+        return web.json_response(self._job_of(request).to_dict())
+
+    async def _delete_job(self, request: web.Request) -> web.Response:
+        job = self._job_of(request)
+        self.cancel(job)
+        return web.json_response(job.to_dict())
+
+    async def _get_status(self, request: web.Request) -> web.Response:
+        return web.json_response(self.status())
+
+    async def _get_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=metrics_registry.to_prometheus(), content_type='text/plain')
+
+    async def serve(self, *, stop_event: asyncio.Event | None = None) -> None:
+        """启动守护进程并持续运行, 直到 stop_event 被设置或被取消
+
+        :param stop_event: 停止信号, 设置后不再接收新任务, 等待已进入流水线的章节完成后退出
+        """
+        config = self.downloader_config
+        with ExitStack() as stack:
+            self.manifest = stack.enter_context(DownloadManifest(file=FileHandler('download', MANIFEST_FILE_NAME)))
+            metadata_cache = stack.enter_context(MetadataCache(file=FileHandler('download', METADATA_CACHE_FILE_NAME),
+                                                               force_refresh=config.refresh_metadata))
+            blob_store = None
+            if config.dedup:
+                blob_store = stack.enter_context(BlobStore(root=FileHandler('download', BLOB_STORE_DIR_NAME)))
+
+            async with create_session(config.session_config) as self.session:
+                identity_pool = IdentityPool(config.identity_pool)
+                await identity_pool.verify(session=self.session)
+
+                self.pipeline = DownloadPipeline(
+                    session=self.session, scheduler_config=config.scheduler_config, chunk_size=config.chunk_size,
+                    byte_budget=config.byte_budget, single_pass=config.single_pass,
+                    manifest=self.manifest, metadata_cache=metadata_cache,
+                    warm_up_connections=config.session_config.warm_up_connections,
+                    archive_config=config.archive_config, writer_config=config.writer_config,
+                    image_variant=config.image_variant, blob_store=blob_store,
+                    validate_images=config.validate_images,
+                    identity_pool=identity_pool, on_chapter_finished=self._on_chapter_finished
+                )
+                pipeline_task = asyncio.create_task(self.pipeline.run(self._iter_chapters()))
+
+                runner = web.AppRunner(self.create_app())
+                await runner.setup()
+                if self.config.unix_socket:
+                    site = web.UnixSite(runner, path=self.config.unix_socket)
+                    address = f'unix:{self.config.unix_socket}'
+                else:
+                    site = web.TCPSite(runner, host=self.config.host, port=self.config.port)
+                    address = f'http://{self.config.host}:{self.config.port}'
+                await site.start()
+                logger.success(f'下载守护进程已启动, 监听 {address}')
+
+                try:
+                    await (stop_event or asyncio.Event()).wait()
+                finally:
+                    await runner.cleanup()
+                    for task in self._expand_tasks:
+                        task.cancel()
+                    # 按最高优先级放入结束标记, 尚未进入流水线的章节不再下载
+                    self._queue.put_nowait((-(1 << 62), next(self._sequence), None))
+                    if stop_event is None or not stop_event.is_set():
+                        pipeline_task.cancel()
+                    await asyncio.gather(pipeline_task, return_exceptions=True)
+                    for job in self.jobs.values():
+                        if not job.is_finished:
+                            job._finish(JOB_CANCELLED, error='守护进程已停止')
+                    self.pipeline = None
+                    logger.info('下载守护进程已停止')
+
+
+__all__ = [
+    'JOB_CANCELLED',
+    'JOB_DONE',
+    'JOB_FAILED',
+    'JOB_QUEUED',
+    'JOB_RUNNING',
+    'DaemonConfig',
+    'DownloadDaemon',
+    'DownloadJob',
+    'JobRequest'
+]
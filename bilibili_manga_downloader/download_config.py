@@ -0,0 +1,75 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 00:00
+@FileName       : download_config.py
+@Project        : BilibiliMangaDownloader
+@Description    : explicit downloader configuration
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+from typing import Any, Optional
+from pydantic import BaseModel
+
+from .archive_pool import ArchiveConfig
+from .fs import WriterConfig
+from .identity_pool import IdentityPoolConfig
+from .image_variant import ImageVariantPolicy
+from .scheduler import SchedulerConfig
+from .session import SessionConfig
+
+
+class DownloaderConfig(BaseModel):
+    """下载配置, 汇总 download_manga、sync_library 及守护进程使用的全部配置项"""
+    chunk_size: int = 64 * 1024
+    """分块下载的数据块大小, 单位字节, 为 0 时一次性读取全部响应内容"""
+    byte_budget: int = 32 * 1024 * 1024
+    """全局在途数据量上限, 单位字节"""
+    single_pass: bool = False
+    """是否将图片直接写入章节压缩文件, 不再保留单独的图片文件"""
+    archive_suffix: str = 'zip'
+    """章节压缩文件格式, 单次写入模式下只支持 zip 或 cbz"""
+    resume: bool = False
+    """断点续传模式, 使用固定的下载目录, 跳过清单中已校验的章节及图片"""
+    refresh_metadata: bool = False
+    """忽略已缓存的章节列表及图片列表, 重新请求并更新缓存"""
+    dedup: bool = False
+    """是否使用图片内容存储, 已下载过的图片直接从存储中链接, 内容相同的图片只保存一份;
+    章节目录中的图片与存储共用硬链接, 不支持硬链接时改为复制, 存储失败时保留独立的图片文件"""
+    validate_images: bool = True
+    """是否在下载过程中校验图片格式、尺寸及是否完整, 校验失败的图片单独重新下载"""
+    scheduler_config: SchedulerConfig = SchedulerConfig()
+    """调度器配置, 包括单个 host 并发数限制及各阶段 worker 数"""
+    session_config: SessionConfig = SessionConfig()
+    """连接池配置, 仅在未提供 session 时用于创建新的 session"""
+    archive_config: ArchiveConfig = ArchiveConfig()
+    """章节压缩配置, 包括压缩进程数及各格式的压缩级别"""
+    writer_config: WriterConfig = WriterConfig()
+    """图片文件写入线程池配置, 包括写入线程数、fsync 及预分配空间"""
+    image_variant: ImageVariantPolicy = ImageVariantPolicy()
+    """图片规格策略, 默认下载原图"""
+    identity_pool: IdentityPoolConfig = IdentityPoolConfig()
+    """请求身份池配置, 默认使用 .env 中配置的 cookies 作为唯一身份"""
+
+    class Config:
+        extra = 'forbid'
+
+    @classmethod
+    def with_options(cls, config: Optional["DownloaderConfig"] = None, **options: Any) -> "DownloaderConfig":
+        """在 config 的基础上覆盖指定的配置项, 兼容以关键字参数传入配置的调用方式, 值为 None 的配置项使用默认值
+
+        :param config: 基础配置, 默认为全部使用默认值的配置
+        :param options: 覆盖的配置项
+        """
+        unknown = set(options) - set(cls.__fields__)
+        if unknown:
+            raise TypeError(f'Unexpected download options: {", ".join(sorted(unknown))}')
+        options = {k: v for k, v in options.items() if v is not None}
+        if config is None:
+            return cls(**options)
+        return config.copy(update=options) if options else config
+
+
+__all__ = [
+    'DownloaderConfig'
+]
@@ -0,0 +1,132 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 05:30
+@FileName       : download_run.py
+@Project        : BilibiliMangaDownloader
+@Description    : embeddable download api streaming progress events
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import asyncio
+from aiohttp import ClientSession
+from collections import deque
+from typing import AsyncIterator
+
+from pydantic import BaseModel
+
+from .download_config import DownloaderConfig
+from .downloader import download_manga
+from .events import DownloadEvent, DownloadResult
+
+
+class DownloadSpec(BaseModel):
+    """下载任务描述"""
+    comic_id: int
+    ep_ids: list[int] | None = None
+    """需要下载的章节 id, 默认为全部章节"""
+
+    class Config:
+        extra = 'forbid'
+
+
+class DownloadRun(object):
+    """可嵌入的下载任务, 以异步迭代的方式逐个产出下载进度事件, 完成后提供结构化的下载结果
+
+    用法::
+
+        run = DownloadRun(DownloadSpec(comic_id=31031), config=config)
+        async for event in run:
+            if isinstance(event, PageDone):
+                ...
+        result = run.result
+
+    事件在事件循环中直接追加到队列, 只在迭代方等待时才唤醒, 不会在每个事件上调度额外的任务;
+    不迭代事件时可以直接 await run.wait(), 事件仍会在队列中累积到任务结束
+    """
+
+    def __init__(
+            self,
+            spec: DownloadSpec,
+            *,
+            config: DownloaderConfig | None = None,
+            session: ClientSession | None = None
+    ):
+        """
+        :param spec: 下载任务描述
+        :param config: 下载配置
+        :param session: 共享的 ClientSession, 提供时不会在下载完成后关闭
+        """
+        self.spec = spec
+        self.config = config
+        self.session = session
+        self.result: DownloadResult | None = None
+        """下载结果, 任务完成后可用"""
+        self._events: deque[DownloadEvent] = deque()
+        self._waiter: asyncio.Future | None = None
+        self._task: asyncio.Task | None = None
+
+    def __repr__(self) -> str:
+        return f'<DownloadRun(comic_id={self.spec.comic_id}, done={self.done}, buffered={len(self._events)})>'
+
+    def __aiter__(self) -> AsyncIterator[DownloadEvent]:
+        return self.events()
+
+    @property
+    def done(self) -> bool:
+        return self._task is not None and self._task.done()
+
+    def _on_event(self, event: DownloadEvent) -> None:
+        self._events.append(event)
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def _run(self) -> DownloadResult:
+        self.result = await download_manga(
+            self.spec.comic_id, ep_ids=self.spec.ep_ids, config=self.config, session=self.session,
+            on_event=self._on_event
+        )
+        return self.result
+
+    def start(self) -> None:
+        """开始下载, 重复调用时不做任何事"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            self._task.add_done_callback(self._on_done)
+
+    async def events(self) -> AsyncIterator[DownloadEvent]:
+        """逐个产出下载进度事件, 下载出错时在产出全部已发生的事件后抛出异常"""
+        self.start()
+        while True:
+            while self._events:
+                yield self._events.popleft()
+            if self._task.done():
+                break
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        self._task.result()
+
+    async def wait(self) -> DownloadResult:
+        """等待下载完成并返回下载结果"""
+        self.start()
+        return await asyncio.shield(self._task)
+
+    async def cancel(self) -> None:
+        """取消下载并等待清理完成"""
+        if self._task is None or self._task.done():
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+
+__all__ = [
+    'DownloadRun',
+    'DownloadSpec'
+]
@@ -0,0 +1,857 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/17 12:00
+@FileName       : downloader.py
+@Project        : BilibiliMangaDownloader
+@Description    : manga download pipeline
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+import re
+from aiohttp import ClientSession
+from contextlib import nullcontext
+from datetime import datetime
+from functools import partial
+from collections import Counter
+from typing import Any, AsyncIterable, Awaitable, Callable, Container, Iterable, Iterator, NamedTuple, TypeVar
+
+from .api import (
+    MANGA_API_URL,
+    BilibiliApiError,
+    query_manga_ep,
+    query_ep_image,
+    query_image_token
+)
+from .archive_pool import ARCHIVE_FORMATS, ArchiveConfig, ArchivePool
+from .archive_writer import ARCHIVE_SUFFIXES, ChapterArchiveWriter
+from .blob_store import BlobRecord, BlobStore, GcReport
+from .download_config import DownloaderConfig
+from .events import (
+    ChapterArchived,
+    ChapterFailed,
+    ChapterPlanned,
+    DownloadResult,
+    EventHandler,
+    PageDone,
+    PageFailed,
+    PageRetry,
+    ResultCollector
+)
+from .file_handler import FileHandler, run_sync
+from .fs import WriterConfig, WriterPool
+from .http_fetcher import ByteBudget, StreamDigest, fetch_bytes, download_file
+from .identity_pool import SOURCE_CDN, Identity, IdentityPool
+from .image_variant import ImageVariantPolicy
+from .integrity import ImageIntegrityError, ImageValidator
+from .logger import logger
+from .manifest import STATUS_DONE, STATUS_FAILED, DownloadManifest, file_checksum
+from .metadata_cache import MetadataCache
+from .metrics import metrics_registry
+from .model import MangaEp, EpImage
+from .retry_policy import RetryBudget, TokenExpiredError
+from .scheduler import DownloadScheduler, SchedulerConfig
+from .session import create_session, warm_up
+from .token_resolver import ImageTokenResolver
+
+
+MANIFEST_FILE_NAME: str = 'manifest.sqlite3'
+"""下载清单文件名, 位于下载目录下"""
+METADATA_CACHE_FILE_NAME: str = 'metadata_cache.sqlite3'
+"""元数据缓存文件名, 位于下载目录下"""
+BLOB_STORE_DIR_NAME: str = '.blobs'
+"""图片内容存储目录名, 位于下载目录下"""
+
+T = TypeVar("T")
+
+
+class PlanItem(NamedTuple):
+    """离线下载计划中的单个章节"""
+    ep_id: int
+    ord: int
+    title: str
+    page_count: int | None
+
+
+class ChapterJob(object):
+    """章节下载任务"""
+    __slots__ = ('comic_id', 'ep_id', 'folder', 'archive_file', 'image_paths', 'image_sizes', 'archive_writer',
+                 'identity', 'finished_count', 'fail_count', 'error', 'finished', '_resolved_folder')
+
+    def __init__(self, comic_id: int, ep_id: int, folder: FileHandler, *, archive_suffix: str = 'zip'):
+        self.comic_id = comic_id
+        self.ep_id = ep_id
+        self.folder = folder
+        self.archive_file = folder.parent(f'{folder.path.name}.{archive_suffix}')
+        self.image_paths: list[str] = []
+        self.image_sizes: list[tuple[int, int]] = []
+        """图片列表中各原图的宽度及高度, 用于校验下载的图片"""
+        self.archive_writer: ChapterArchiveWriter | None = None
+        self.identity: Identity | None = None
+        self.finished_count: int = 0
+        self.fail_count: int = 0
+        self.error: BaseException | None = None
+        self.finished: bool = False
+        """章节是否已完成或已失败, 已失败章节中剩余的图片不再下载, 也不会创建压缩文件"""
+        self._resolved_folder: str | None = None
+
+    @property
+    def resolved_folder(self) -> str:
+        """章节目录的绝对路径, 只解析一次, 不再为每个图片重复解析路径中的每一级目录"""
+        if self._resolved_folder is None:
+            self._resolved_folder = self.folder.resolve_path
+        return self._resolved_folder
+
+    def __repr__(self) -> str:
+        return f'<ChapterJob(ep_id={self.ep_id}, pages={len(self.image_paths)})>'
+
+
+class PageJob(object):
+    """图片下载任务"""
+    __slots__ = ('chapter', 'index', 'image_path', 'file_name', 'blob', 'data', 'reserved', 'size', 'checksum',
+                 'error', 'started_at', '_file')
+
+    def __init__(self, chapter: ChapterJob, index: int, image_path: str):
+        self.chapter = chapter
+        self.index = index
+        self.image_path = image_path
+        self.file_name = f'{chapter.ep_id}_page_{index}.{image_path.split(".")[-1]}'
+        self.blob: BlobRecord | None = None
+        self.data: bytes | None = None
+        self.reserved: int = 0
+        """data 占用的全局在途数据量, 在写入阶段写入压缩文件后释放"""
+        self.size: int | None = None
+        self.checksum: str | None = None
+        self.error: BaseException | None = None
+        self.started_at: float = 0.0
+        self._file: FileHandler | None = None
+
+    @property
+    def file(self) -> FileHandler:
+        """图片文件"""
+        if self._file is None:
+            self._file = self.chapter.folder(self.file_name)
+        return self._file
+
+    @property
+    def file_path(self) -> str:
+        """图片在清单中记录的位置, 单次写入模式下为压缩文件中的条目"""
+        if self.chapter.archive_writer is not None:
+            return f'{self.chapter.archive_file.resolve_path}!/{self.file_name}'
+        return os.path.join(self.chapter.resolved_folder, self.file_name)
+
+    def __repr__(self) -> str:
+        return f'<PageJob(ep_id={self.chapter.ep_id}, index={self.index})>'
+
+
+class DownloadPipeline(object):
+    """漫画下载流水线
+
+    章节依次经过: 获取图片列表(index) -> 获取图片 token(token) -> 下载图片(fetch) -> 写入图片(write) -> 压缩(archive)
+    """
+
+    def __init__(
+            self,
+            *,
+            session: ClientSession,
+            scheduler_config: SchedulerConfig | None = None,
+            chunk_size: int = 64 * 1024,
+            byte_budget: int = 32 * 1024 * 1024,
+            single_pass: bool = False,
+            manifest: DownloadManifest | None = None,
+            metadata_cache: MetadataCache | None = None,
+            retry_budget: RetryBudget | None = None,
+            token_refresh_limit: int = 2,
+            warm_up_connections: int = 4,
+            archive_config: ArchiveConfig | None = None,
+            writer_config: WriterConfig | None = None,
+            image_variant: ImageVariantPolicy | None = None,
+            blob_store: BlobStore | None = None,
+            identity_pool: IdentityPool | None = None,
+            validate_images: bool = True,
+            integrity_retry_limit: int = 2,
+            on_chapter_finished: Callable[[ChapterJob], None] | None = None,
+            on_event: EventHandler | None = None
+    ):
+        """
+        :param session: 共享的 ClientSession
+        :param scheduler_config: 调度器配置
+        :param chunk_size: 分块下载的数据块大小, 单位字节
+        :param byte_budget: 全局在途数据量上限, 单位字节
+        :param single_pass: 是否将图片直接写入章节压缩文件
+        :param manifest: 下载清单
+        :param metadata_cache: 元数据缓存
+        :param retry_budget: 图片下载的全局重试预算, 默认每条流水线使用独立的预算
+        :param token_refresh_limit: 单个图片因 token 失效而重新获取 token 的次数上限
+        :param warm_up_connections: 获取到第一批图片 token 后预先建立的图片 host 连接数, 为 0 时不预热
+        :param archive_config: 章节压缩配置, 非单次写入模式下章节在独立的进程池中压缩
+        :param writer_config: 图片文件写入线程池配置, 非单次写入模式下图片经该线程池写入, buffer_size 不超过 chunk_size
+        :param image_variant: 图片规格策略, 在获取 token 前应用, 默认下载原图
+        :param blob_store: 图片内容存储, 提供时已存储的图片直接从存储中链接而不再下载, 新下载的图片存入存储
+        :param identity_pool: 请求身份池, 章节任务在身份之间分配, 默认使用 .env 中配置的 cookies 作为唯一身份
+        :param validate_images: 是否在下载过程中校验图片格式、尺寸及是否完整, 校验失败的图片不会写入目标位置
+        :param integrity_retry_limit: 单个图片校验失败后重新下载的次数上限
+        :param on_chapter_finished: 章节下载完成或失败后的回调, 失败时章节的 error 不为 None
+        :param on_event: 下载进度事件回调, 为 None 时不创建任何事件
+        """
+        self.session = session
+        self.chunk_size = chunk_size
+        self.byte_budget = ByteBudget(limit=byte_budget)
+        self.single_pass = single_pass
+        self.manifest = manifest
+        self.metadata_cache = metadata_cache
+        self.retry_budget = RetryBudget() if retry_budget is None else retry_budget
+        self.token_refresh_limit = token_refresh_limit
+        self.warm_up_connections = warm_up_connections
+        self._warm_up_task: asyncio.Task | None = None
+        self.identity_pool = IdentityPool() if identity_pool is None else identity_pool
+        self._token_resolvers: dict[Identity, ImageTokenResolver] = {}
+        self.archive_pool = ArchivePool(config=archive_config)
+        writer_config = WriterConfig() if writer_config is None else writer_config
+        if 0 < chunk_size < writer_config.buffer_size:
+            # 数据块交给写入缓冲后即释放在途数据量, 缓冲不超过一个数据块时未计入的数据才不会随并发数成倍增加
+            writer_config = writer_config.copy(update={'buffer_size': chunk_size})
+        self.writer_pool = WriterPool(config=writer_config)
+        self.image_variant = ImageVariantPolicy() if image_variant is None else image_variant
+        self.blob_store = blob_store
+        self.validate_images = validate_images
+        self.integrity_retry_limit = integrity_retry_limit
+        self.on_chapter_finished = on_chapter_finished
+        self.on_event = on_event
+
+        self.chapter_count: int = 0
+        self.fail_chapter_count: int = 0
+        self.comic_chapter_count: Counter[int] = Counter()
+        self.comic_fail_chapter_count: Counter[int] = Counter()
+
+        self.scheduler = DownloadScheduler(config=scheduler_config)
+        config = self.scheduler.config
+        # 各阶段未处理的异常使图片或章节失败, 章节总会完成并释放身份, 不会停留在未完成状态
+        self.scheduler.add_stage('index', self._handle_index, worker_num=config.index_workers,
+                                 on_error=self._fail_chapter)
+        self.scheduler.add_stage('token', self._handle_token, worker_num=config.token_workers,
+                                 on_error=self._fail_chapter)
+        self.scheduler.add_stage('fetch', self._handle_fetch, worker_num=config.fetch_workers,
+                                 on_error=self._fail_page)
+        self.scheduler.add_stage('write', self._handle_write, worker_num=config.write_workers,
+                                 on_error=self._fail_written_page)
+        # 压缩阶段的 worker 数不少于压缩进程数, 使所有进程都能同时工作
+        self.scheduler.add_stage(
+            'archive', self._handle_archive,
+            worker_num=max(config.archive_workers, self.archive_pool.config.processes),
+            queue_size=self.archive_pool.config.queue_size,
+            on_error=self._fail_chapter
+        )
+
+    def token_resolver(self, identity: Identity) -> ImageTokenResolver:
+        """身份对应的图片 token 缓存, 各身份的 token 分别获取及缓存"""
+        token_resolver = self._token_resolvers.get(identity)
+        if token_resolver is None:
+            token_resolver = self._token_resolvers[identity] = ImageTokenResolver(
+                query_func=partial(query_image_token, session=self.session, credentials=identity.credentials)
+            )
+        return token_resolver
+
+    async def _with_identity(self, chapter: ChapterJob, func: Callable[[Identity], Awaitable[T]]) -> T:
+        """使用章节的身份调用 func, 遇到与身份有关的错误时换用其他尚未尝试过的身份, 没有可用的身份时抛出最后一次的错误"""
+        tried: list[Identity] = []
+        while True:
+            if chapter.identity is None:
+                chapter.identity = await self.identity_pool.acquire(ep_id=chapter.ep_id, exclude=tried)
+                if chapter.identity is None:
+                    raise RuntimeError(f'no identity is able to access chapter {chapter.ep_id}')
+            try:
+                result = await func(chapter.identity)
+            except Exception as e:
+                if self.identity_pool.report(chapter.identity, e, ep_id=chapter.ep_id) is None:
+                    raise
+                tried.append(chapter.identity)
+                self.identity_pool.release(chapter.identity)
+                chapter.identity = await self.identity_pool.acquire(ep_id=chapter.ep_id, exclude=tried)
+                if chapter.identity is None:
+                    raise
+                logger.debug('漫画章节({})改用身份 {}, 原因: {}', chapter.ep_id, chapter.identity.name, e)
+            else:
+                self.identity_pool.record_entitled(chapter.identity, chapter.ep_id)
+                return result
+
+    def _finish_chapter(self, chapter: ChapterJob, error: BaseException | None = None) -> None:
+        if chapter.finished:
+            return
+        chapter.finished = True
+        if chapter.identity is not None:
+            self.identity_pool.release(chapter.identity)
+            chapter.identity = None
+        if error is not None:
+            chapter.error = error
+            self.fail_chapter_count += 1
+            self.comic_fail_chapter_count[chapter.comic_id] += 1
+            if self.on_event is not None:
+                self.on_event(ChapterFailed(chapter.comic_id, chapter.ep_id, error=error))
+        if self.on_chapter_finished is not None:
+            self.on_chapter_finished(chapter)
+
+    async def _fail_chapter(self, chapter: ChapterJob, exception: Exception) -> None:
+        """处理阶段中未处理的异常使章节失败, 放弃未完成的压缩文件"""
+        if chapter.finished:
+            return
+        logger.error('处理漫画章节({})失败, {}', chapter.ep_id, exception)
+        if chapter.archive_writer is not None:
+            try:
+                await chapter.archive_writer.abort()
+            except Exception as e:
+                logger.warning('放弃漫画章节({})压缩文件失败, {}', chapter.ep_id, e)
+        self._finish_chapter(chapter, error=exception)
+
+    async def _fail_page(self, page: PageJob, exception: Exception) -> None:
+        """下载阶段中未处理的异常使图片失败, 图片仍交给写入阶段统计"""
+        page.error = exception
+        await self._release_data(page)
+        await self.scheduler.submit('write', page)
+
+    async def _hold_data(self, page: PageJob, data: bytes) -> None:
+        """单次写入模式下图片内容在写入压缩文件前一直保存在内存中, 需要占用全局在途数据量直到写入阶段"""
+        page.reserved = await self.byte_budget.acquire(len(data))
+        page.data = data
+
+    async def _release_data(self, page: PageJob) -> None:
+        page.data = None
+        if page.reserved:
+            reserved, page.reserved = page.reserved, 0
+            await self.byte_budget.release(reserved)
+
+    async def _fail_written_page(self, page: PageJob, exception: Exception) -> None:
+        """写入阶段中未处理的异常无法确定图片是否已统计, 使整个章节失败"""
+        await self._fail_chapter(page.chapter, exception)
+
+    async def _query_ep_image(self, chapter: ChapterJob, identity: Identity) -> EpImage:
+        async with self.scheduler.request_slot(MANGA_API_URL, group='api'):
+            ep_image = await query_ep_image(
+                ep_id=chapter.ep_id, session=self.session, cache=self.metadata_cache, credentials=identity.credentials
+            )
+            if ep_image.code != 0:
+                raise BilibiliApiError(code=ep_image.code, message=ep_image.msg)
+        return ep_image
+
+    async def _resolve_tokens(self, identity: Identity, image_paths: list[str]) -> dict[str, str]:
+        async with self.scheduler.request_slot(MANGA_API_URL, group='api'):
+            return await self.token_resolver(identity).resolve(image_paths)
+
+    async def _handle_index(self, chapter: ChapterJob) -> None:
+        """为章节分配身份并获取章节图片列表, 已预先提供图片列表的章节(例如修复已下载的章节)直接获取 token"""
+        if not chapter.image_paths:
+            try:
+                ep_image = await self._with_identity(chapter, partial(self._query_ep_image, chapter))
+            except Exception as e:
+                logger.error('获取漫画章节({})图片资源失败, {}', chapter.ep_id, e)
+                return self._finish_chapter(chapter, error=e)
+
+            chapter.image_paths = self.image_variant.apply(ep_image)
+            chapter.image_sizes = [(x.x, x.y) for x in ep_image.data.images]
+        await self.scheduler.submit('token', chapter)
+
+    @run_sync
+    def _verified_pages(self, chapter: ChapterJob) -> set[str]:
+        """获取清单中已记录且与磁盘文件一致的图片, 单次写入模式下图片不单独保存, 总是需要重新下载"""
+        if self.manifest is None or self.single_pass:
+            return set()
+        records = self.manifest.get_pages(chapter.comic_id, chapter.ep_id)
+        return {
+            image_path for index, image_path in enumerate(chapter.image_paths)
+            if self.manifest.verify_file(
+                records.get(image_path),
+                PageJob(chapter=chapter, index=index, image_path=image_path).file,
+                verify_checksum=True
+            )
+        }
+
+    async def _handle_token(self, chapter: ChapterJob) -> None:
+        """批量获取章节图片 token, 并逐个创建图片下载任务"""
+        try:
+            verified_pages = await self._verified_pages(chapter)
+            pending_paths = [x for x in chapter.image_paths if x not in verified_pages]
+            stored_blobs = {} if self.blob_store is None else self.blob_store.lookup_many(pending_paths)
+            resource_urls = await self._with_identity(
+                chapter, partial(self._resolve_tokens, image_paths=[x for x in pending_paths if x not in stored_blobs])
+            )
+        except Exception as e:
+            logger.error('获取漫画章节({})图片资源 token 失败, {}', chapter.ep_id, e)
+            return self._finish_chapter(chapter, error=e)
+
+        if resource_urls and self._warm_up_task is None and self.warm_up_connections > 0:
+            # 图片 host 只有在获取到 token 后才能确定, 在第一批图片排队期间预先建立连接
+            self._warm_up_task = asyncio.create_task(warm_up(
+                self.session, next(iter(resource_urls.values())), connections=self.warm_up_connections
+            ))
+
+        if verified_pages or stored_blobs:
+            logger.info('已成功获取章节({})图片资源, 共 {} 张图片, 跳过已下载的 {} 张图片, 已存储的 {} 张图片, 开始下载',
+                        chapter.ep_id, len(chapter.image_paths), len(verified_pages), len(stored_blobs))
+        else:
+            logger.info('已成功获取章节({})图片资源, 共 {} 张图片, 开始下载', chapter.ep_id, len(chapter.image_paths))
+
+        if self.on_event is not None:
+            self.on_event(ChapterPlanned(
+                chapter.comic_id, chapter.ep_id, page_count=len(chapter.image_paths),
+                stored_count=len(verified_pages), blob_count=len(stored_blobs)
+            ))
+
+        if self.single_pass:
+            chapter.archive_writer = ChapterArchiveWriter(
+                output_file=chapter.archive_file, page_count=len(chapter.image_paths),
+                reproducible=self.archive_pool.config.reproducible
+            )
+            try:
+                await chapter.archive_writer.open()
+            except Exception as e:
+                logger.error('创建漫画章节({})压缩文件失败, {}', chapter.ep_id, e)
+                return self._finish_chapter(chapter, error=e)
+
+        chapter.finished_count = len(verified_pages)
+        if chapter.finished_count == len(chapter.image_paths):
+            return await self.scheduler.submit('archive', chapter)
+
+        # 下游队列已满时在此等待, 图片下载任务只在有空闲 worker 时才会被创建
+        for index, image_path in enumerate(chapter.image_paths):
+            if image_path in verified_pages:
+                continue
+            page = PageJob(chapter=chapter, index=index, image_path=image_path)
+            page.blob = stored_blobs.get(image_path)
+            await self.scheduler.submit('fetch', page)
+
+    def _retry_handler(self, page: PageJob) -> Callable[[int, BaseException, float], None] | None:
+        """图片下载重试时产生 PageRetry 事件的回调, 未设置事件回调时为 None"""
+        if self.on_event is None:
+            return None
+
+        def _on_retry(attempt: int, error: BaseException, delay: float) -> None:
+            self.on_event(PageRetry(page.chapter.comic_id, page.chapter.ep_id, index=page.index,
+                                    image_path=page.image_path, attempt=attempt, error=error, delay=delay))
+
+        return _on_retry
+
+    def _page_validator(self, page: PageJob) -> ImageValidator | None:
+        """图片的校验器, 图片列表中没有尺寸时只校验格式及是否完整, 缩放后的图片只校验宽高比"""
+        if not self.validate_images:
+            return None
+        image_sizes = page.chapter.image_sizes
+        width, height = image_sizes[page.index] if page.index < len(image_sizes) else (None, None)
+        return ImageValidator(width=width, height=height, exact='@' not in page.image_path)
+
+    async def _fetch_page(self, page: PageJob, image_url: str, validator: ImageValidator | None) -> None:
+        need_checksum = self.manifest is not None or self.blob_store is not None
+        proxy = page.chapter.identity.proxy
+        on_retry = self._retry_handler(page)
+        async with self.scheduler.request_slot(image_url, group='cdn'):
+            if page.chapter.archive_writer is not None:
+                data = await fetch_bytes(url=image_url, session=self.session, chunk_size=self.chunk_size,
+                                         byte_budget=self.byte_budget, retry_budget=self.retry_budget,
+                                         validator=validator, proxy=proxy, on_retry=on_retry)
+                await self._hold_data(page, data)
+                page.size = len(page.data)
+                page.checksum = hashlib.sha256(page.data).hexdigest() if need_checksum else None
+            else:
+                digest = StreamDigest() if need_checksum else None
+                file = await download_file(url=image_url, file=page.file, session=self.session,
+                                           chunk_size=self.chunk_size, byte_budget=self.byte_budget, digest=digest,
+                                           validator=validator, writer_pool=self.writer_pool,
+                                           retry_budget=self.retry_budget, proxy=proxy, on_retry=on_retry)
+                page.size = file.path.stat().st_size
+                page.checksum = digest.hexdigest() if digest is not None else None
+
+        if self.blob_store is not None:
+            try:
+                if page.data is not None:
+                    await run_sync(self.blob_store.put_bytes)(page.image_path, page.data, page.checksum)
+                else:
+                    await run_sync(self.blob_store.put_file)(page.image_path, page.file, page.checksum)
+            except OSError as e:
+                # 存储失败不影响已下载的图片, 章节目录中保留独立的图片文件
+                logger.warning('存储图片资源({})失败, {}, 保留独立的图片文件', page.image_path, e)
+
+    async def _load_blob(self, page: PageJob) -> bool:
+        """从图片内容存储中获取图片, 存储的内容已丢失时返回 False, 改为重新下载"""
+        try:
+            if page.chapter.archive_writer is not None:
+                await self._hold_data(page, await run_sync(self.blob_store.read_bytes)(page.blob.digest))
+            else:
+                await run_sync(self.blob_store.link_to)(page.blob.digest, page.file)
+        except OSError as e:
+            logger.debug('读取已存储的图片资源({})失败, {}, 重新下载', page.image_path, e)
+            page.blob = None
+            return False
+        page.size = page.blob.size
+        page.checksum = page.blob.digest
+        metrics_registry.inc('blob_hits_total')
+        return True
+
+    async def _resolve_token(self, page: PageJob, token_resolver: ImageTokenResolver) -> str:
+        """获取单个图片的资源 url, token 仍然有效时直接使用缓存, 不占用 api 请求名额"""
+        if token_resolver.is_valid(page.image_path):
+            return await token_resolver.resolve_one(page.image_path)
+        async with self.scheduler.request_slot(MANGA_API_URL, group='api'):
+            return await token_resolver.resolve_one(page.image_path)
+
+    async def _fetch_with_token(
+            self,
+            page: PageJob,
+            token_resolver: ImageTokenResolver,
+            validator: ImageValidator | None
+    ) -> None:
+        """下载单个图片, 资源 token 失效时重新获取 token 后再下载, 而不是重复请求已失效的 url"""
+        for refresh_count in range(self.token_refresh_limit + 1):
+            # token 在排队期间可能已过期, 此时会重新获取, 与批量获取 token 一样受 api 并发限制
+            image_url = await self._resolve_token(page, token_resolver)
+            try:
+                return await self._fetch_page(page, image_url, validator)
+            except TokenExpiredError as e:
+                token_resolver.invalidate(page.image_path)
+                metrics_registry.inc('token_refresh_total')
+                if refresh_count >= self.token_refresh_limit:
+                    raise
+                if self.on_event is not None:
+                    self.on_event(PageRetry(page.chapter.comic_id, page.chapter.ep_id, index=page.index,
+                                            image_path=page.image_path, attempt=refresh_count + 1, error=e,
+                                            delay=0.0))
+                logger.debug('图片资源({}) token 已失效, 重新获取 token', page.image_path)
+
+    async def _handle_fetch(self, page: PageJob) -> None:
+        """下载单个图片, 校验失败时只重新下载该图片, 不影响同一章节的其他图片"""
+        if page.chapter.finished:
+            # 章节已失败, 不再下载剩余的图片
+            page.error = page.chapter.error
+            return await self.scheduler.submit('write', page)
+        if self.on_event is not None:
+            page.started_at = time.perf_counter()
+        if page.blob is not None and await self._load_blob(page):
+            return await self.scheduler.submit('write', page)
+
+        identity = page.chapter.identity
+        token_resolver = self.token_resolver(identity)
+        validator = self._page_validator(page)
+        try:
+            for invalid_count in range(self.integrity_retry_limit + 1):
+                try:
+                    await self._fetch_with_token(page, token_resolver, validator)
+                    break
+                except ImageIntegrityError as e:
+                    # 错误页或被截断的内容可能由异常的 CDN 节点返回, 重新获取 token 以便请求新的 url
+                    token_resolver.invalidate(page.image_path)
+                    metrics_registry.inc('integrity_failures_total')
+                    if invalid_count >= self.integrity_retry_limit:
+                        raise
+                    if self.on_event is not None:
+                        self.on_event(PageRetry(page.chapter.comic_id, page.chapter.ep_id, index=page.index,
+                                                image_path=page.image_path, attempt=invalid_count + 1, error=e,
+                                                delay=0.0))
+                    logger.warning('图片资源({})校验失败, {}, 重新下载', page.image_path, e)
+        except Exception as e:
+            logger.error('下载图片资源({})失败, {}', page.image_path, e)
+            self.identity_pool.report(identity, e, ep_id=page.chapter.ep_id, source=SOURCE_CDN)
+            page.error = e
+        await self.scheduler.submit('write', page)
+
+    async def _handle_write(self, page: PageJob) -> None:
+        """单次写入模式下将图片写入章节压缩文件, 并统计章节完成情况"""
+        chapter = page.chapter
+        if chapter.archive_writer is not None:
+            try:
+                if page.error is None:
+                    with metrics_registry.timer('disk_write_seconds', mode='archive'):
+                        await chapter.archive_writer.add_page(page.index, arcname=page.file_name, data=page.data)
+                else:
+                    await chapter.archive_writer.skip_page(page.index)
+            except Exception as e:
+                logger.error('写入图片资源({})失败, {}', page.image_path, e)
+                page.error = e
+        await self._release_data(page)
+
+        if self.manifest is not None:
+            self.manifest.record_page(
+                chapter.comic_id, chapter.ep_id, page.image_path, file_path=page.file_path,
+                status=STATUS_DONE if page.error is None else STATUS_FAILED, size=page.size, checksum=page.checksum
+            )
+
+        if self.on_event is not None:
+            if page.error is None:
+                self.on_event(PageDone(chapter.comic_id, chapter.ep_id, index=page.index, image_path=page.image_path,
+                                       size=page.size, latency=time.perf_counter() - page.started_at,
+                                       cached=page.blob is not None))
+            else:
+                self.on_event(PageFailed(chapter.comic_id, chapter.ep_id, index=page.index,
+                                         image_path=page.image_path, error=page.error))
+
+        if page.error is not None:
+            chapter.fail_count += 1
+        chapter.finished_count += 1
+        if chapter.finished_count == len(chapter.image_paths) and not chapter.finished:
+            await self.scheduler.submit('archive', chapter)
+
+    async def _handle_archive(self, chapter: ChapterJob) -> None:
+        """创建章节压缩文件"""
+        all_count = len(chapter.image_paths)
+        logger.info('下载漫画章节({})完成, 成功: {}, 失败: {}, 开始创建压缩文件',
+                    chapter.ep_id, all_count - chapter.fail_count, chapter.fail_count)
+        try:
+            if chapter.archive_writer is not None:
+                with metrics_registry.timer('archive_seconds', mode='single_pass'):
+                    archive_file = await chapter.archive_writer.close()
+            else:
+                with metrics_registry.timer('archive_seconds', mode='process_pool'):
+                    archive_file = await self.archive_pool.pack(chapter.folder, output_file=chapter.archive_file)
+        except Exception as e:
+            logger.error('压缩漫画章节({})失败, {}', chapter.ep_id, e)
+            if self.manifest is not None:
+                self.manifest.record_archive(
+                    chapter.comic_id, chapter.ep_id, file_path=chapter.archive_file.resolve_path,
+                    status=STATUS_FAILED, page_count=all_count, fail_count=chapter.fail_count
+                )
+            return self._finish_chapter(chapter, error=e)
+
+        if self.manifest is not None or self.on_event is not None:
+            size = archive_file.path.stat().st_size
+            if self.manifest is not None:
+                checksum = await run_sync(file_checksum)(archive_file.path)
+                self.manifest.record_archive(
+                    chapter.comic_id, chapter.ep_id, file_path=archive_file.resolve_path, status=STATUS_DONE,
+                    page_count=all_count, fail_count=chapter.fail_count, size=size, checksum=checksum
+                )
+            if self.on_event is not None:
+                self.on_event(ChapterArchived(chapter.comic_id, chapter.ep_id, archive_path=archive_file.resolve_path,
+                                              size=size, page_count=all_count, fail_count=chapter.fail_count))
+
+        logger.info('漫画章节({})下载压缩成功, 文件路径: {}', chapter.ep_id, archive_file.resolve_path)
+        self._finish_chapter(chapter)
+
+    def _count_chapter(self, chapter: ChapterJob) -> ChapterJob:
+        self.chapter_count += 1
+        self.comic_chapter_count[chapter.comic_id] += 1
+        return chapter
+
+    async def run(self, chapters: Iterable[ChapterJob] | AsyncIterable[ChapterJob]) -> None:
+        """下载全部章节, 章节任务仅在入口队列有空位时才会从 chapters 中取出, 可以包含多部漫画的章节"""
+        if isinstance(chapters, AsyncIterable):
+            source = (self._count_chapter(x) async for x in chapters)
+        else:
+            source = (self._count_chapter(x) for x in chapters)
+        try:
+            await self.scheduler.run(source, stage_name='index')
+        finally:
+            if self._warm_up_task is not None and not self._warm_up_task.done():
+                self._warm_up_task.cancel()
+            await self.archive_pool.close()
+            await self.writer_pool.close()
+
+
+def _replace_filename(filename: str) -> str:
+    """移除文件名中的特殊字符"""
+    filename = re.sub(r'[\\/:*"<>|]', '_', filename)
+    filename = re.sub(r'\?', '？', filename)
+    return filename
+
+
+def check_archive_suffix(archive_suffix: str, *, single_pass: bool) -> None:
+    """检查章节压缩文件格式是否可用"""
+    if archive_suffix not in ARCHIVE_FORMATS:
+        raise ValueError(f'不支持的压缩文件格式: {archive_suffix}, 可选: {", ".join(ARCHIVE_FORMATS)}')
+    if single_pass and f'.{archive_suffix}' not in ARCHIVE_SUFFIXES:
+        raise ValueError(f'单次写入模式只支持 {", ".join(sorted(ARCHIVE_SUFFIXES))} 格式')
+
+
+def comic_folder_name(manga_ep: MangaEp, t_suffix: str | None = None) -> str:
+    """漫画下载目录名
+
+    :param manga_ep: 漫画章节列表
+    :param t_suffix: 目录名后缀, 为空时使用固定的目录名
+    """
+    comic_folder = f'{manga_ep.data.id}_{_replace_filename(manga_ep.data.title)}'
+    if t_suffix:
+        comic_folder = f'{comic_folder}_{t_suffix}'
+    return comic_folder
+
+
+def chapter_folder_name(ep_id: int, short_title: str, title: str) -> str:
+    """章节下载目录名"""
+    return f'{ep_id}_{_replace_filename(short_title)}_{_replace_filename(title)}'
+
+
+def create_chapter_jobs(
+        manga_ep: MangaEp,
+        *,
+        ep_ids: Container[int] | None = None,
+        t_suffix: str | None = None,
+        archive_suffix: str = 'zip',
+        manifest: DownloadManifest | None = None
+) -> Iterator[ChapterJob]:
+    """按章节顺序逐个创建漫画的章节下载任务
+
+    :param manga_ep: 漫画章节列表
+    :param ep_ids: 需要下载的章节 id, 默认为全部章节
+    :param t_suffix: 漫画下载目录的后缀, 为空时使用固定的下载目录
+    :param archive_suffix: 章节压缩文件格式
+    :param manifest: 下载清单, 提供时跳过已完整下载且压缩文件与记录一致的章节
+    """
+    comic_id = manga_ep.data.id
+    archives = manifest.get_archives(comic_id) if manifest is not None else {}
+    comic_folder = comic_folder_name(manga_ep, t_suffix)
+
+    for ep in manga_ep.data.ep_list:
+        if ep_ids is not None and ep.id not in ep_ids:
+            continue
+
+        chapter = ChapterJob(
+            comic_id=comic_id,
+            ep_id=ep.id,
+            folder=FileHandler('download', comic_folder, chapter_folder_name(ep.id, ep.short_title, ep.title)),
+            archive_suffix=archive_suffix
+        )
+        if manifest is not None and manifest.verify_archive(archives.get(ep.id), chapter.archive_file):
+            logger.debug('漫画章节({})已下载, 跳过', ep.id)
+            continue
+        yield chapter
+
+
+async def download_manga(
+        comic_id: int,
+        ep_index: int | None = None,
+        *,
+        ep_ids: Iterable[int] | None = None,
+        config: DownloaderConfig | None = None,
+        session: ClientSession | None = None,
+        on_event: EventHandler | None = None,
+        **options: Any
+) -> DownloadResult:
+    """下载漫画
+
+    :param comic_id: 漫画 id
+    :param ep_index: 章节 id
+    :param ep_ids: 需要下载的多个章节 id, 与 ep_index 同时提供时合并, 默认为全部章节
+    :param config: 下载配置, 包括并发、连接池、压缩及图片规格等全部配置项
+    :param session: 共享的 ClientSession, 提供时不会在下载完成后关闭
+    :param on_event: 下载进度事件回调, 在事件循环中同步调用
+    :param options: 覆盖 config 中的同名配置项, 例如 single_pass=True
+    :return: 各章节的下载状态及统计
+    """
+    config = DownloaderConfig.with_options(config, **options)
+    collector = ResultCollector(comic_id, forward=on_event)
+    if ep_index is not None or ep_ids is not None:
+        ep_ids = set(() if ep_ids is None else ep_ids) | (set() if ep_index is None else {ep_index})
+    check_archive_suffix(config.archive_suffix, single_pass=config.single_pass)
+    t_suffix: str = datetime.now().strftime('%Y%m%d-%H%M%S')
+    blob_store = BlobStore(root=FileHandler('download', BLOB_STORE_DIR_NAME)) if config.dedup else None
+    with DownloadManifest(file=FileHandler('download', MANIFEST_FILE_NAME)) as manifest, \
+            MetadataCache(file=FileHandler('download', METADATA_CACHE_FILE_NAME),
+                          force_refresh=config.refresh_metadata) as metadata_cache, \
+            (blob_store if blob_store is not None else nullcontext()):
+        async with (create_session(config.session_config) if session is None else nullcontext(session)) as session:
+            identity_pool = IdentityPool(config.identity_pool)
+            await identity_pool.verify(session=session)
+
+            try:
+                manga_ep = await query_manga_ep(comic_id=comic_id, session=session, cache=metadata_cache)
+                if manga_ep.code != 0:
+                    raise BilibiliApiError(code=manga_ep.code, message=manga_ep.msg)
+            except Exception as e:
+                logger.error(f'获取漫画({comic_id})章节失败, {e}')
+                raise e
+
+            logger.info(f'已获取漫画"{manga_ep.data.title}"章节列表, 共 {manga_ep.data.total} 章')
+            collector.title = manga_ep.data.title
+
+            if ep_ids is not None and not ep_ids.issubset(manga_ep.ep_index):
+                raise ValueError(f'指定的章节 id 不属于漫画"{manga_ep.data.title}"')
+
+            pipeline = DownloadPipeline(
+                session=session, scheduler_config=config.scheduler_config, chunk_size=config.chunk_size,
+                byte_budget=config.byte_budget, single_pass=config.single_pass, manifest=manifest,
+                metadata_cache=metadata_cache, warm_up_connections=config.session_config.warm_up_connections,
+                archive_config=config.archive_config, writer_config=config.writer_config,
+                image_variant=config.image_variant, blob_store=blob_store, validate_images=config.validate_images,
+                identity_pool=identity_pool, on_event=collector
+            )
+            chapters = list(create_chapter_jobs(
+                manga_ep,
+                ep_ids=ep_ids,
+                t_suffix=None if config.resume else t_suffix,
+                archive_suffix=config.archive_suffix,
+                manifest=manifest if config.resume else None
+            ))
+            new_ep_ids = {x.ep_id for x in chapters}
+            for ep in manga_ep.data.ep_list:
+                if ep_ids is None or ep.id in ep_ids:
+                    collector.add_chapter(ep.id, stored=ep.id not in new_ep_ids)
+            await pipeline.run(chapters)
+
+            all_count = pipeline.chapter_count
+            fail_count = pipeline.fail_chapter_count
+            logger.info(f'下载漫画"{manga_ep.data.title}"完成, 成功: {all_count - fail_count}, 失败: {fail_count}')
+            logger.debug(f'元数据缓存命中: {metadata_cache.hits}, 未命中: {metadata_cache.misses}')
+            logger.debug(f'图片请求数: {pipeline.retry_budget.requests}, 重试次数: {pipeline.retry_budget.retries}')
+            logger.debug(f'图片内容存储命中: {metrics_registry.get_counter("blob_hits_total"):.0f}')
+            logger.info('并发限制: ' + ', '.join(
+                f'{name}={x["limit"]}(最近调整原因: {x["last_change_reason"]})'
+                for name, x in pipeline.scheduler.limits().items()
+            ))
+
+    logger.success(f'漫画"{manga_ep.data.title}"下载任务全部完成')
+    return collector.result()
+
+
+def plan_download(comic_id: int) -> list[PlanItem]:
+    """仅使用本地元数据缓存生成漫画的下载计划, 不进行任何网络请求
+
+    :param comic_id: 漫画 id
+    :return: 各章节及其已知的图片数量, 图片列表未缓存的章节图片数量为 None
+    """
+    with MetadataCache(file=FileHandler('download', METADATA_CACHE_FILE_NAME), offline=True) as metadata_cache:
+        result = metadata_cache.get('ComicDetail', {'comic_id': str(comic_id)})
+        if result is None:
+            raise ValueError(f'漫画({comic_id})的章节列表尚未缓存')
+        manga_ep = MangaEp.parse_obj(result)
+
+        plan: list[PlanItem] = []
+        for ep in manga_ep.data.ep_list:
+            ep_result = metadata_cache.get('GetImageIndex', {'ep_id': str(ep.id)})
+            page_count = None if ep_result is None else len(EpImage.parse_obj(ep_result).all_image_path)
+            plan.append(PlanItem(ep_id=ep.id, ord=ep.ord, title=f'{ep.short_title} {ep.title}', page_count=page_count))
+
+    known_count = sum(1 for x in plan if x.page_count is not None)
+    logger.info(f'漫画"{manga_ep.data.title}"共 {len(plan)} 章, 其中 {known_count} 章图片列表已缓存, '
+                f'已知图片共 {sum(x.page_count for x in plan if x.page_count is not None)} 张')
+    return plan
+
+
+def gc_blob_store(*, dry_run: bool = False, min_age: float = 3600) -> GcReport:
+    """删除图片内容存储中已没有任何章节目录引用的内容
+
+    :param dry_run: 只统计可以删除的内容, 不删除
+    :param min_age: 只删除修改时间早于 min_age 秒前的内容, 避免删除正在进行的下载刚存入的内容
+    """
+    with BlobStore(root=FileHandler('download', BLOB_STORE_DIR_NAME)) as blob_store:
+        report = blob_store.gc(dry_run=dry_run, min_age=min_age)
+    action = '可删除' if dry_run else '已删除'
+    logger.info(f'图片内容存储清理完成, {action} {report.removed} 个未被引用的内容, '
+                f'共 {report.freed_bytes / 1024 / 1024:.2f} MB, 保留 {report.kept} 个')
+    return report
+
+
+__all__ = [
+    'MANIFEST_FILE_NAME',
+    'METADATA_CACHE_FILE_NAME',
+    'BLOB_STORE_DIR_NAME',
+    'PlanItem',
+    'ChapterJob',
+    'DownloadPipeline',
+    'PageJob',
+    'chapter_folder_name',
+    'check_archive_suffix',
+    'comic_folder_name',
+    'create_chapter_jobs',
+    'download_manga',
+    'gc_blob_store',
+    'plan_download'
+]
@@ -0,0 +1,326 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 05:00
+@FileName       : events.py
+@Project        : BilibiliMangaDownloader
+@Description    : typed download progress events and structured download result
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import time
+from typing import Any, Callable, NamedTuple
+
+
+class DownloadEvent(object):
+    """下载进度事件基类
+
+    事件只在流水线设置了事件回调时才会创建, 每个事件只是一个 __slots__ 对象, 创建及分发的开销与一次 dict 查找相当
+    """
+    __slots__ = ('comic_id', 'ep_id', 'timestamp')
+    kind: str = 'event'
+    """事件类型名称, 用于序列化及不便使用 isinstance 的场合"""
+    _field_names: tuple[str, ...] = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        names: list[str] = []
+        for klass in reversed(cls.__mro__):
+            names.extend(x for x in klass.__dict__.get('__slots__', ()) if x not in names)
+        cls._field_names = tuple(names)
+
+    def __init__(self, comic_id: int, ep_id: int):
+        self.comic_id = comic_id
+        self.ep_id = ep_id
+        self.timestamp = time.time()
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f'{x}={getattr(self, x)!r}' for x in self._field_names if x != 'timestamp')
+        return f'<{type(self).__name__}({fields})>'
+
+    def to_dict(self) -> dict[str, Any]:
+        """转换为可以 JSON 序列化的字典, 异常转换为字符串"""
+        result: dict[str, Any] = {'kind': self.kind}
+        for name in self._field_names:
+            value = getattr(self, name)
+            result[name] = f'{type(value).__name__}: {value}' if isinstance(value, BaseException) else value
+        return result
+
+
+DownloadEvent._field_names = DownloadEvent.__slots__
+
+
+class ChapterPlanned(DownloadEvent):
+    """章节图片列表已获取, 即将开始下载"""
+    __slots__ = ('page_count', 'stored_count', 'blob_count')
+    kind = 'chapter_planned'
+
+    def __init__(self, comic_id: int, ep_id: int, *, page_count: int, stored_count: int, blob_count: int):
+        """
+        :param page_count: 章节总页数
+        :param stored_count: 本地已下载且校验通过, 不再下载的页数
+        :param blob_count: 从图片内容存储中链接, 不再下载的页数
+        """
+        super().__init__(comic_id, ep_id)
+        self.page_count = page_count
+        self.stored_count = stored_count
+        self.blob_count = blob_count
+
+
+class PageDone(DownloadEvent):
+    """图片下载并写入完成"""
+    __slots__ = ('index', 'image_path', 'size', 'latency', 'cached')
+    kind = 'page_done'
+
+    def __init__(self, comic_id: int, ep_id: int, *, index: int, image_path: str, size: int | None,
+                 latency: float, cached: bool):
+        """
+        :param index: 页码, 从 0 开始
+        :param image_path: 图片资源路径
+        :param size: 图片大小, 单位字节
+        :param latency: 从开始下载到写入完成的耗时, 单位秒, 包括重试及排队等待写入的时间
+        :param cached: 是否从图片内容存储中链接, 没有实际下载
+        """
+        super().__init__(comic_id, ep_id)
+        self.index = index
+        self.image_path = image_path
+        self.size = size
+        self.latency = latency
+        self.cached = cached
+
+
+class PageRetry(DownloadEvent):
+    """图片下载失败, 即将重试"""
+    __slots__ = ('index', 'image_path', 'attempt', 'error', 'delay')
+    kind = 'page_retry'
+
+    def __init__(self, comic_id: int, ep_id: int, *, index: int, image_path: str, attempt: int,
+                 error: BaseException, delay: float):
+        """
+        :param index: 页码, 从 0 开始
+        :param image_path: 图片资源路径
+        :param attempt: 已失败的次数
+        :param error: 本次失败的原因
+        :param delay: 重试前的等待时间, 单位秒, 资源 token 失效时立即重新获取 token, 为 0
+        """
+        super().__init__(comic_id, ep_id)
+        self.index = index
+        self.image_path = image_path
+        self.attempt = attempt
+        self.error = error
+        self.delay = delay
+
+
+class PageFailed(DownloadEvent):
+    """图片下载或写入失败, 不再重试"""
+    __slots__ = ('index', 'image_path', 'error')
+    kind = 'page_failed'
+
+    def __init__(self, comic_id: int, ep_id: int, *, index: int, image_path: str, error: BaseException):
+        super().__init__(comic_id, ep_id)
+        self.index = index
+        self.image_path = image_path
+        self.error = error
+
+
+class ChapterArchived(DownloadEvent):
+    """章节压缩文件创建完成"""
+    __slots__ = ('archive_path', 'size', 'page_count', 'fail_count')
+    kind = 'chapter_archived'
+
+    def __init__(self, comic_id: int, ep_id: int, *, archive_path: str, size: int, page_count: int,
+                 fail_count: int):
+        """
+        :param archive_path: 压缩文件路径
+        :param size: 压缩文件大小, 单位字节
+        :param page_count: 章节总页数
+        :param fail_count: 下载失败而未包含在压缩文件中的页数
+        """
+        super().__init__(comic_id, ep_id)
+        self.archive_path = archive_path
+        self.size = size
+        self.page_count = page_count
+        self.fail_count = fail_count
+
+
+class ChapterFailed(DownloadEvent):
+    """章节下载失败, 例如获取图片列表、图片 token 或创建压缩文件失败"""
+    __slots__ = ('error',)
+    kind = 'chapter_failed'
+
+    def __init__(self, comic_id: int, ep_id: int, *, error: BaseException):
+        super().__init__(comic_id, ep_id)
+        self.error = error
+
+
+EventHandler = Callable[[DownloadEvent], None]
+"""事件回调, 在事件循环中同步调用, 不应阻塞"""
+
+CHAPTER_DONE: str = 'done'
+"""章节已下载并压缩, 可能有部分图片下载失败"""
+CHAPTER_FAILED: str = 'failed'
+"""章节下载失败"""
+CHAPTER_STORED: str = 'stored'
+"""章节此前已完整下载, 本次跳过"""
+CHAPTER_PENDING: str = 'pending'
+"""章节尚未完成, 仅在下载被中断时出现"""
+
+
+class ChapterResult(NamedTuple):
+    """单个章节的下载结果"""
+    comic_id: int
+    ep_id: int
+    status: str
+    page_count: int
+    done_count: int
+    fail_count: int
+    retry_count: int
+    byte_count: int
+    archive_path: str | None = None
+    error: BaseException | None = None
+
+
+class DownloadResult(NamedTuple):
+    """单次下载的结果"""
+    comic_id: int
+    title: str | None
+    chapters: list[ChapterResult]
+    elapsed: float
+
+    @property
+    def ok(self) -> bool:
+        """全部章节均已完整下载"""
+        return all(x.status in (CHAPTER_DONE, CHAPTER_STORED) and not x.fail_count for x in self.chapters)
+
+    @property
+    def failed_chapters(self) -> list[ChapterResult]:
+        """下载失败或有图片下载失败的章节"""
+        return [x for x in self.chapters if x.status not in (CHAPTER_DONE, CHAPTER_STORED) or x.fail_count]
+
+    @property
+    def page_count(self) -> int:
+        return sum(x.done_count for x in self.chapters)
+
+    @property
+    def byte_count(self) -> int:
+        return sum(x.byte_count for x in self.chapters)
+
+
+class _ChapterStats(object):
+    __slots__ = ('status', 'page_count', 'done_count', 'fail_count', 'retry_count', 'byte_count', 'archive_path', 'error')
+
+    def __init__(self):
+        self.status: str = CHAPTER_PENDING
+        self.page_count: int = 0
+        self.done_count: int = 0
+        self.fail_count: int = 0
+        self.retry_count: int = 0
+        self.byte_count: int = 0
+        self.archive_path: str | None = None
+        self.error: BaseException | None = None
+
+
+class ResultCollector(object):
+    """从事件中汇总各章节的下载结果, 本身即是一个事件回调, 可以与其他回调串联
+
+    按事件类型查表分发, 每个事件只更新对应章节的几个计数
+    """
+
+    def __init__(self, comic_id: int, *, forward: EventHandler | None = None):
+        """
+        :param comic_id: 漫画 id
+        :param forward: 汇总后继续转发事件的回调
+        """
+        self.comic_id = comic_id
+        self.forward = forward
+        self.title: str | None = None
+        self._chapters: dict[int, _ChapterStats] = {}
+        self._start = time.perf_counter()
+        self._handlers: dict[type, Callable[[_ChapterStats, Any], None]] = {
+            ChapterPlanned: self._on_planned,
+            PageDone: self._on_page_done,
+            PageRetry: self._on_page_retry,
+            PageFailed: self._on_page_failed,
+            ChapterArchived: self._on_archived,
+            ChapterFailed: self._on_chapter_failed,
+        }
+
+    def __repr__(self) -> str:
+        return f'<ResultCollector(comic_id={self.comic_id}, chapters={len(self._chapters)})>'
+
+    def __call__(self, event: DownloadEvent) -> None:
+        stats = self._chapters.get(event.ep_id)
+        if stats is None:
+            stats = self._chapters[event.ep_id] = _ChapterStats()
+        self._handlers[type(event)](stats, event)
+        if self.forward is not None:
+            self.forward(event)
+
+    def add_chapter(self, ep_id: int, *, stored: bool = False) -> None:
+        """登记需要下载的章节, 使结果按章节顺序排列并包含未产生任何事件的章节
+
+        :param ep_id: 章节 id
+        :param stored: 章节此前已完整下载, 本次跳过
+        """
+        stats = self._chapters.setdefault(ep_id, _ChapterStats())
+        if stored:
+            stats.status = CHAPTER_STORED
+
+    @staticmethod
+    def _on_planned(stats: _ChapterStats, event: ChapterPlanned) -> None:
+        stats.page_count = event.page_count
+        stats.done_count += event.stored_count
+
+    @staticmethod
+    def _on_page_done(stats: _ChapterStats, event: PageDone) -> None:
+        stats.done_count += 1
+        if event.size is not None:
+            stats.byte_count += event.size
+
+    @staticmethod
+    def _on_page_retry(stats: _ChapterStats, event: PageRetry) -> None:
+        stats.retry_count += 1
+
+    @staticmethod
+    def _on_page_failed(stats: _ChapterStats, event: PageFailed) -> None:
+        stats.fail_count += 1
+
+    @staticmethod
+    def _on_archived(stats: _ChapterStats, event: ChapterArchived) -> None:
+        stats.status = CHAPTER_DONE
+        stats.archive_path = event.archive_path
+
+    @staticmethod
+    def _on_chapter_failed(stats: _ChapterStats, event: ChapterFailed) -> None:
+        stats.status = CHAPTER_FAILED
+        stats.error = event.error
+
+    def result(self) -> DownloadResult:
+        chapters = [
+            ChapterResult(
+                comic_id=self.comic_id, ep_id=ep_id, status=x.status, page_count=x.page_count,
+                done_count=x.done_count, fail_count=x.fail_count, retry_count=x.retry_count, byte_count=x.byte_count,
+                archive_path=x.archive_path, error=x.error
+            ) for ep_id, x in self._chapters.items()
+        ]
+        return DownloadResult(comic_id=self.comic_id, title=self.title, chapters=chapters,
+                              elapsed=time.perf_counter() - self._start)
+
+
+__all__ = [
+    'CHAPTER_DONE',
+    'CHAPTER_FAILED',
+    'CHAPTER_PENDING',
+    'CHAPTER_STORED',
+    'ChapterArchived',
+    'ChapterFailed',
+    'ChapterPlanned',
+    'ChapterResult',
+    'DownloadEvent',
+    'DownloadResult',
+    'EventHandler',
+    'PageDone',
+    'PageFailed',
+    'PageRetry',
+    'ResultCollector'
+]
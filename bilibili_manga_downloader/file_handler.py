@@ -14,17 +14,21 @@ import asyncio
 import pathlib
 import aiofiles
 import zipfile
-from copy import deepcopy
 from asyncio import Future
 from typing import TypeVar, ParamSpec, Generator, Callable, Coroutine, Awaitable, Optional, Any
-from functools import wraps, partial
+from functools import wraps, partial, lru_cache
 from contextlib import asynccontextmanager
 
+from .fs import directory_cache
 
-_root_folder: pathlib.Path = pathlib.Path(os.path.abspath(sys.path[0]))
-"""下载文件夹路径"""
-if not _root_folder.exists():
-    _root_folder.mkdir()
+
+@lru_cache(maxsize=1)
+def root_folder() -> pathlib.Path:
+    """下载文件夹路径, 在第一次使用时确定并创建, 导入模块时不访问文件系统"""
+    folder = pathlib.Path(os.path.abspath(sys.path[0]))
+    if not folder.exists():
+        folder.mkdir()
+    return folder
 
 
 P = ParamSpec("P")
@@ -70,26 +74,30 @@ async def semaphore_gather(
 
 class FileHandler(object):
     """文件操作工具"""
-    _local_root: pathlib.Path = _root_folder
+    _local_root: pathlib.Path | None = None
+    """根目录, 为 None 时使用 root_folder()"""
 
     def __init__(self, *args: str):
-        self.path = self._local_root
+        self.path = root_folder() if self._local_root is None else self._local_root
         if args:
             self.path = self.path.joinpath(*[str(x) for x in args])
 
     def __repr__(self) -> str:
         return f'<FileHandler(path={self.path})>'
 
-    def __call__(self, *args) -> "FileHandler":
-        new_obj = deepcopy(self)
-        new_obj.path = self.path.joinpath(*[str(x) for x in args])
+    def _derive(self, path: pathlib.Path) -> "FileHandler":
+        """以新路径创建同类实例, 不再 deepcopy 整个实例, 每个图片都会调用"""
+        new_obj = object.__new__(type(self))
+        new_obj.__dict__.update(self.__dict__)
+        new_obj.path = path
         return new_obj
 
+    def __call__(self, *args) -> "FileHandler":
+        return self._derive(self.path.joinpath(*[str(x) for x in args]))
+
     @property
     def parent(self) -> "FileHandler":
-        new_obj = deepcopy(self)
-        new_obj.path = self.path.parent
-        return new_obj
+        return self._derive(self.path.parent)
 
     @staticmethod
     def check_directory(func: Callable[P, R]) -> Callable[P, R]:
@@ -105,24 +113,31 @@ class FileHandler(object):
 
     @staticmethod
     def check_file(func: Callable[P, R]) -> Callable[P, R]:
-        """装饰一个方法, 需要实例 path 为文件时才能运行"""
+        """装饰一个方法, 运行前确保实例 path 所在目录存在
+
+        不再预先检查 path 是否为文件, path 为目录时由打开文件时的 IsADirectoryError 报告;
+        所在目录通过 directory_cache 创建, 同一目录只产生一次系统调用, 且不存在先检查再创建的竞争
+        """
         @wraps(func)
         def _wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
             self: "FileHandler" = args[0]
-            if self.path.exists() and self.path.is_file():
-                return func(*args, **kwargs)
-            elif not self.path.exists():
-                if not self.path.parent.exists():
-                    pathlib.Path.mkdir(self.path.parent, parents=True)
-                return func(*args, **kwargs)
-            else:
-                raise ValueError(f'"{self.path}" is not a file, or file {self.path} not exists')
+            directory_cache.ensure(self.path.parent)
+            return func(*args, **kwargs)
         return _wrapper
 
     @property
     def resolve_path(self) -> str:
         return str(self.path.resolve())
 
+    def replace(self, target: "FileHandler") -> "FileHandler":
+        """将当前文件原子地重命名为目标文件, 目标文件已存在时将被覆盖"""
+        os.replace(self.path, target.path)
+        return target
+
+    def delete(self) -> None:
+        """删除当前文件, 文件不存在时忽略"""
+        self.path.unlink(missing_ok=True)
+
     @asynccontextmanager
     @check_file
     async def async_open(self, mode, encoding: str | None = None, **kwargs):
@@ -147,8 +162,7 @@ class FileHandler(object):
         if output_file.path.suffix != '.zip':
             raise ValueError('Output file suffix must be ".zip"')
 
-        if not output_file.path.parent.exists():
-            pathlib.Path.mkdir(output_file.path.parent, parents=True)
+        directory_cache.ensure(output_file.path.parent)
 
         with zipfile.ZipFile(output_file.path.resolve(), mode='w', compression=compression) as zip_f:
             for file in input_files:
@@ -185,5 +199,6 @@ class FileHandler(object):
 
 __all__ = [
     'FileHandler',
+    'root_folder',
     'semaphore_gather'
 ]
@@ -0,0 +1,22 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 00:00
+@FileName       : formats.py
+@Project        : BilibiliMangaDownloader
+@Description    : supported archive and image formats
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+
+ARCHIVE_FORMATS: tuple[str, ...] = ('zip', 'cbz', 'tar', 'tar.gz', 'tar.xz')
+"""支持的章节压缩文件格式"""
+
+IMAGE_FORMATS: tuple[str, ...] = ('jpg', 'png', 'webp', 'avif')
+"""图片服务支持转换的格式"""
+
+
+__all__ = [
+    'ARCHIVE_FORMATS',
+    'IMAGE_FORMATS'
+]
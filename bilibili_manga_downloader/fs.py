@@ -0,0 +1,301 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 03:00
+@FileName       : fs.py
+@Project        : BilibiliMangaDownloader
+@Description    : low overhead file writing: directory cache and bounded writer thread pool
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import os
+import asyncio
+import pathlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, TypeVar
+
+from pydantic import BaseModel
+
+
+T = TypeVar("T")
+
+_OPEN_FLAGS: int = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0) | getattr(os, 'O_CLOEXEC', 0)
+
+
+class DirectoryCache(object):
+    """已创建目录的缓存
+
+    同一目录只在第一次使用时调用 os.makedirs(exist_ok=True), 之后不再产生任何系统调用;
+    makedirs 本身容忍目录已存在, 因此多个线程或进程同时创建同一目录时不会出现先检查再创建的竞争
+    """
+
+    def __init__(self, max_size: int = 65536):
+        """
+        :param max_size: 缓存的目录数上限, 超过时清空缓存
+        """
+        self.max_size = max_size
+        self._created: set[str] = set()
+
+    def __repr__(self) -> str:
+        return f'<DirectoryCache(size={len(self._created)})>'
+
+    def ensure(self, directory: str | os.PathLike) -> None:
+        """确保目录存在"""
+        key = os.fspath(directory)
+        if key in self._created:
+            return
+        os.makedirs(key, exist_ok=True)
+        if len(self._created) >= self.max_size:
+            self._created.clear()
+        self._created.add(key)
+
+    def ensure_parent(self, file: str | os.PathLike) -> None:
+        """确保文件所在目录存在"""
+        self.ensure(os.path.dirname(os.fspath(file)))
+
+    def forget(self, directory: str | os.PathLike) -> None:
+        """移除缓存的目录, 用于目录在缓存后被删除的情况"""
+        self._created.discard(os.fspath(directory))
+
+
+directory_cache = DirectoryCache()
+"""全局共享的已创建目录缓存"""
+
+
+def _preallocate(fd: int, size: int) -> None:
+    """按文件最终大小预先分配磁盘空间, 减少文件碎片及写入时的元数据更新, 平台或文件系统不支持时忽略"""
+    if size <= 0 or not hasattr(os, 'posix_fallocate'):
+        return
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except OSError:
+        pass
+
+
+class WriterConfig(BaseModel):
+    """文件写入线程池配置"""
+    threads: int = 4
+    """写入线程数"""
+    max_pending: int = 64
+    """已提交但尚未完成的写入任务数上限, 超过时提交方等待"""
+    buffer_size: int = 256 * 1024
+    """单个文件在内存中合并的数据量, 达到后才提交一次写入, 不超过该大小的文件只需在提交时写入一次;
+    合并中的数据不计入下载的在途数据量, 下载流水线中不超过下载数据块大小
+    """
+    batch_size: int = 32
+    """单次合并完成(写入剩余数据, fsync, 关闭及重命名)的文件数上限"""
+    fsync: bool = False
+    """完成文件前是否 fsync 文件及其所在目录, 同一批次中同一目录只 fsync 一次"""
+    preallocate: bool = True
+    """是否根据 Content-Length 预先分配文件空间"""
+
+
+class PooledFile(object):
+    """通过 WriterPool 写入的文件
+
+    数据先在内存中合并, 达到 buffer_size 后才在写入线程中写入, 文件在第一次写入时才打开;
+    同一文件的操作由文件锁串行化, 因此取消后提交的清理任务会等待仍在运行的写入完成
+    """
+    __slots__ = ('pool', 'path', 'size', 'written', '_fd', '_buffer', '_lock', '_started')
+
+    def __init__(self, pool: "WriterPool", path: pathlib.Path, *, size: int | None = None):
+        self.pool = pool
+        self.path = path
+        self.size = size
+        self.written: int = 0
+        self._fd: int | None = None
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self._started: bool = False
+
+    def __repr__(self) -> str:
+        return f'<PooledFile(path={self.path}, written={self.written}, buffered={len(self._buffer)})>'
+
+    def _open_sync(self) -> None:
+        directory_cache.ensure_parent(self.path)
+        try:
+            self._fd = os.open(self.path, _OPEN_FLAGS, 0o644)
+        except FileNotFoundError:
+            # 缓存后目录已被删除
+            directory_cache.forget(self.path.parent)
+            directory_cache.ensure_parent(self.path)
+            self._fd = os.open(self.path, _OPEN_FLAGS, 0o644)
+        if self.pool.config.preallocate and self.size:
+            _preallocate(self._fd, self.size)
+
+    def _write_sync(self, data: bytes | bytearray) -> None:
+        with self._lock:
+            if self._fd is None:
+                self._open_sync()
+            view = memoryview(data)
+            while view:
+                view = view[os.write(self._fd, view):]
+            self.written += len(data)
+
+    def _commit_sync(self, target: pathlib.Path, *, fsync: bool) -> None:
+        data, self._buffer = self._buffer, bytearray()
+        self._write_sync(data)
+        with self._lock:
+            try:
+                if self.size and self.written != self.size:
+                    # 预先分配的空间多于实际写入的数据
+                    os.ftruncate(self._fd, self.written)
+                if fsync:
+                    os.fsync(self._fd)
+            finally:
+                os.close(self._fd)
+                self._fd = None
+            os.replace(self.path, target)
+
+    def _discard_sync(self) -> None:
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            self.path.unlink(missing_ok=True)
+
+    async def write(self, data: bytes) -> None:
+        """写入数据, 只在合并的数据达到 buffer_size 时等待写入线程"""
+        self._buffer += data
+        if len(self._buffer) >= self.pool.config.buffer_size:
+            data, self._buffer = self._buffer, bytearray()
+            self._started = True
+            await self.pool.run(self._write_sync, data)
+
+    async def commit(self, target: pathlib.Path) -> None:
+        """写入剩余数据并关闭文件, 然后原子地重命名为目标文件"""
+        self._started = True
+        await self.pool.commit(self, target)
+
+    def discard(self) -> None:
+        """放弃写入并删除文件, 不等待清理完成, 可以在任务被取消时调用"""
+        self._buffer = bytearray()
+        if self._started:
+            self.pool.submit(self._discard_sync)
+
+
+class WriterPool(object):
+    """专用的有界文件写入线程池
+
+    写入不再占用默认线程池, 同时进行的写入任务数有上限; 完成文件的操作(写入剩余数据, fsync, 关闭及重命名)
+    按批次合并到一次线程切换中进行, 并发下载大量小文件时减少事件循环与线程之间的切换
+    """
+
+    def __init__(self, config: WriterConfig | None = None):
+        self.config = WriterConfig() if config is None else config
+        self.job_count: int = 0
+        """已提交到写入线程的任务数, 即线程切换次数"""
+        self._executor: ThreadPoolExecutor | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._commits: list[tuple[PooledFile, pathlib.Path, asyncio.Future]] = []
+        self._commit_task: asyncio.Task | None = None
+
+    def __repr__(self) -> str:
+        return f'<WriterPool(threads={self.config.threads}, jobs={self.job_count}, pending={len(self._commits)})>'
+
+    async def __aenter__(self) -> "WriterPool":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.close()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=max(self.config.threads, 1), thread_name_prefix='writer')
+        return self._executor
+
+    def open(self, path: pathlib.Path, *, size: int | None = None) -> PooledFile:
+        """创建写入文件, 文件在第一次实际写入时才打开
+
+        :param path: 文件路径, 通常为目标文件同目录下的临时文件
+        :param size: 文件的预期大小, 例如 Content-Length, 用于预先分配空间
+        """
+        return PooledFile(self, path, size=size)
+
+    async def run(self, func: Callable[..., T], *args) -> T:
+        """在写入线程中运行 func, 已提交的任务数达到上限时等待"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # 模块共享的写入线程池可能先后在多个事件循环中使用
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(max(self.config.max_pending, 1))
+        async with self._semaphore:
+            self.job_count += 1
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+
+    def submit(self, func: Callable[..., T], *args) -> None:
+        """在写入线程中运行 func, 不等待完成"""
+        self.job_count += 1
+        self._get_executor().submit(func, *args)
+
+    def _commit_batch(self, items: list[tuple[PooledFile, pathlib.Path]]) -> list[BaseException | None]:
+        errors: list[BaseException | None] = []
+        directories: set[pathlib.Path] = set()
+        for file, target in items:
+            try:
+                file._commit_sync(target, fsync=self.config.fsync)
+            except Exception as e:
+                errors.append(e)
+                file._discard_sync()
+            else:
+                errors.append(None)
+                directories.add(target.parent)
+        if self.config.fsync and hasattr(os, 'O_DIRECTORY'):
+            # 同一批次中的重命名只需对其所在目录 fsync 一次即可持久化
+            for directory in directories:
+                fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+        return errors
+
+    async def _commit_loop(self) -> None:
+        while self._commits:
+            batch, self._commits = self._commits[:self.config.batch_size], self._commits[self.config.batch_size:]
+            try:
+                errors = await self.run(self._commit_batch, [(file, target) for file, target, _ in batch])
+            except BaseException as e:
+                errors = [e] * len(batch)
+            for (_, _, future), error in zip(batch, errors):
+                if future.done():
+                    continue
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
+
+    async def commit(self, file: PooledFile, target: pathlib.Path) -> None:
+        """完成文件并重命名为目标文件, 同时等待完成的文件合并为一批在一次线程切换中处理"""
+        future = asyncio.get_running_loop().create_future()
+        self._commits.append((file, target, future))
+        if self._commit_task is None or self._commit_task.done():
+            self._commit_task = asyncio.create_task(self._commit_loop())
+        await future
+
+    async def close(self) -> None:
+        if self._commit_task is not None:
+            await asyncio.gather(self._commit_task, return_exceptions=True)
+            self._commit_task = None
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            await asyncio.get_running_loop().run_in_executor(None, executor.shutdown)
+
+
+@lru_cache(maxsize=1)
+def default_writer_pool() -> WriterPool:
+    """模块共享的写入线程池, 用于未指定写入线程池的调用方, 在第一次使用时创建"""
+    return WriterPool()
+
+
+__all__ = [
+    'DirectoryCache',
+    'PooledFile',
+    'WriterConfig',
+    'WriterPool',
+    'default_writer_pool',
+    'directory_cache'
+]
@@ -8,14 +8,31 @@
 @Software       : PyCharm 
 """
 
+import time
+import asyncio
+import hashlib
 import inspect
-from aiohttp import ClientSession, ClientTimeout
+from aiohttp import ClientPayloadError, ClientResponse, ClientSession
 from asyncio.exceptions import TimeoutError as _TimeoutError
-from typing import TypeVar, ParamSpec, Callable, Coroutine, Any
+from typing import TypeVar, ParamSpec, AsyncIterator, Callable, Coroutine, Any
 from functools import wraps
+from contextlib import asynccontextmanager, nullcontext
 
 from .file_handler import FileHandler
+from .fs import PooledFile, WriterPool, default_writer_pool
+from .integrity import ImageValidator
+from .json_codec import json_loads
 from .logger import logger
+from .metrics import metrics_registry
+from .retry_policy import (
+    FATAL,
+    REFRESH_TOKEN,
+    RetryBudget,
+    RetryBudgetExhaustedError,
+    RetryPolicy,
+    TokenExpiredError
+)
+from .session import client_timeout, session_proxy, session_rate_limiter
 
 
 _DEFAULT_HEADERS = {
@@ -45,41 +62,147 @@ class ExceededAttemptError(Exception):
     """重试次数超过限制异常"""
 
 
-def retry(attempt_limit: int = 3):
-    """装饰器, 自动重试, 仅用于异步函数
+class ContentLengthMismatchError(ClientPayloadError):
+    """实际接收数据长度与 Content-Length 不一致异常"""
 
-    :param attempt_limit: 重试次数上限
+
+class StreamDigest(object):
+    """在下载过程中计算已接收数据的摘要, 每次(重新)开始下载时重置"""
+
+    def __init__(self, name: str = 'sha256'):
+        self.name = name
+        self._hash = hashlib.new(name)
+
+    def __repr__(self) -> str:
+        return f'<StreamDigest(name={self.name})>'
+
+    def reset(self) -> None:
+        self._hash = hashlib.new(self.name)
+
+    def update(self, data: bytes) -> None:
+        self._hash.update(data)
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+
+class ByteBudget(object):
+    """全局在途数据量限制, 用于在并发数提高时保持内存占用有界"""
+
+    def __init__(self, limit: int):
+        """
+        :param limit: 已从连接中读取但尚未写入磁盘的数据量上限, 单位字节
+        """
+        if limit < 1:
+            raise ValueError('limit must be greater than 0')
+        self._limit = limit
+        self._in_flight = 0
+        self._condition = asyncio.Condition()
+
+    def __repr__(self) -> str:
+        return f'<ByteBudget(in_flight={self._in_flight}, limit={self._limit})>'
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def acquire(self, size: int) -> int:
+        """占用指定数据量直到调用 release, 单次占用超过上限时按上限计算, 返回实际占用的数据量"""
+        size = min(size, self._limit)
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight + size <= self._limit)
+            self._in_flight += size
+        return size
+
+    async def release(self, size: int) -> None:
+        """释放 acquire 返回的数据量"""
+        async with self._condition:
+            self._in_flight -= size
+            self._condition.notify_all()
+
+    @asynccontextmanager
+    async def reserve(self, size: int) -> AsyncIterator[int]:
+        """在块内占用指定数据量, 单次占用超过上限时按上限计算"""
+        size = await self.acquire(size)
+        try:
+            yield size
+        finally:
+            await self.release(size)
+
+
+async def _wait_rate_limit(session: ClientSession, group: str) -> None:
+    """等待 session 对应请求分组的速率限制令牌, 每次请求(包括重试)都需要一个令牌"""
+    rate_limiter = session_rate_limiter(session)
+    if rate_limiter is not None:
+        await rate_limiter.acquire(group)
+
+
+def retry(attempt_limit: int = 3, *, policy: RetryPolicy | None = None, refresh_token: bool = False):
+    """装饰器, 按重试策略自动重试, 仅用于异步函数
+
+    被装饰的函数额外接受 retry_budget 参数, 提供时每次重试都需要占用该预算;
+    以及 on_retry 参数, 提供时每次重试前以已失败次数、异常及等待时间调用;
+    不可恢复的错误直接抛出, 资源 token 失效的错误不会原样重试, 而是抛出 TokenExpiredError 交由调用方重新获取 token
+
+    :param attempt_limit: 重试次数上限, 未提供 policy 时使用
+    :param policy: 重试策略
+    :param refresh_token: 被装饰的函数是否请求携带 token 的资源 url, 未提供 policy 时使用,
+        只有此时 401/403 才会抛出 TokenExpiredError, 请求 api 时 401/403 原样抛出
     """
+    policy = RetryPolicy(attempt_limit=attempt_limit, refresh_token=refresh_token) if policy is None else policy
 
     def decorator(func: Callable[P, Coroutine[None, None, R]]) -> Callable[P, Coroutine[None, None, R]]:
         if not inspect.iscoroutinefunction(func):
             raise ValueError('The decorated function must be coroutine function')
 
+        _module = inspect.getmodule(func)
+        _func_name = f'{_module.__name__ if _module is not None else "Unknown"}.{func.__name__}'
+
         @wraps(func)
         async def _wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            retry_budget: RetryBudget | None = kwargs.pop('retry_budget', None)
+            on_retry: Callable[[int, BaseException, float], None] | None = kwargs.pop('on_retry', None)
+            if retry_budget is not None:
+                retry_budget.record_request()
+
             attempts_num = 0
-            _module = inspect.getmodule(func)
-            while attempts_num < attempt_limit:
+            while True:
                 try:
                     return await func(*args, **kwargs)
-                except _TimeoutError:
-                    logger.opt(colors=True).debug(
-                        f'<lc>Decorator Retry</lc> | <ly>{_module.__name__ if _module is not None else "Unknown"}.'
-                        f'{func.__name__}</ly> <r>Attempted {attempts_num + 1} times</r> <c>></c> <r>TimeoutError</r>')
                 except Exception as e:
-                    logger.opt(colors=True).warning(
-                        f'<lc>Decorator Retry</lc> | <ly>{_module.__name__ if _module is not None else "Unknown"}.'
-                        f'{func.__name__}</ly> <r>Attempted {attempts_num + 1} times</r> <c>></c> '
-                        f'<r>Exception {e.__class__.__name__}</r>: {e}')
-                finally:
                     attempts_num += 1
-            else:
-                logger.opt(colors=True).error(
-                    f'<lc>Decorator Retry</lc> | <ly>{_module.__name__ if _module is not None else "Unknown"}.'
-                    f'{func.__name__}</ly> <r>Attempted {attempts_num} times</r> <c>></c> '
-                    f'<r>Exception ExceededAttemptError</r>: The number of failures exceeds the limit of attempts. '
-                    f'<lc>Parameters(args={args}, kwargs={kwargs})</lc>')
-                raise ExceededAttemptError('The number of failures exceeds the limit of attempts')
+                    category = policy.classify(e)
+                    if category == FATAL:
+                        raise
+                    if category == REFRESH_TOKEN:
+                        raise TokenExpiredError(f'Resource token expired, {e}') from e
+
+                    if attempts_num >= policy.attempt_limit:
+                        logger.opt(colors=True).error(
+                            '<lc>Decorator Retry</lc> | <ly>{}</ly> <r>Attempted {} times</r> '
+                            '<c>></c> <r>Exception ExceededAttemptError</r>: '
+                            'The number of failures exceeds the limit of attempts. '
+                            '<lc>Parameters(args={}, kwargs={})</lc>', _func_name, attempts_num, args, kwargs)
+                        raise ExceededAttemptError('The number of failures exceeds the limit of attempts') from e
+                    if retry_budget is not None and not retry_budget.try_acquire():
+                        raise RetryBudgetExhaustedError(f'Retry budget exhausted, {retry_budget}') from e
+
+                    delay = policy.compute_delay(attempts_num, exception=e)
+                    metrics_registry.inc('retries_total', function=func.__name__, category=category)
+                    if on_retry is not None:
+                        on_retry(attempts_num, e, delay)
+                    # 日志参数在级别过滤之后才会格式化, 未输出的日志不产生格式化开销
+                    if isinstance(e, _TimeoutError):
+                        logger.opt(colors=True).debug(
+                            '<lc>Decorator Retry</lc> | <ly>{}</ly> <r>Attempted {} times</r> '
+                            '<c>></c> <r>TimeoutError</r>, retry after {:.2f}s', _func_name, attempts_num, delay)
+                    else:
+                        logger.opt(colors=True).warning(
+                            '<lc>Decorator Retry</lc> | <ly>{}</ly> <r>Attempted {} times</r> '
+                            '<c>></c> <r>Exception {}</r>: {}, retry after {:.2f}s',
+                            _func_name, attempts_num, e.__class__.__name__, e, delay)
+                    await asyncio.sleep(delay)
+
         return _wrapper
 
     return decorator
@@ -93,17 +216,24 @@ async def fetch_get_json(
         params: dict | None = None,
         headers: dict | None = None,
         cookies: dict | None = None,
-        proxy:  dict | None = None,
+        proxy: str | None = None,
         timeout: int = 5,
+        rate_group: str = 'manga',
         **kwargs
 ) -> Any:
-    """使用 get 方法获取并解析 json 数据"""
+    """使用 get 方法获取并解析 json 数据
+
+    :param rate_group: 请求速率限制分组
+    """
     headers = _DEFAULT_HEADERS if headers is None else headers
-    timeout = ClientTimeout(total=timeout)
+    timeout = client_timeout(timeout)
+    proxy = session_proxy(session) if proxy is None else proxy
+    await _wait_rate_limit(session, rate_group)
 
     async with session.get(
             url=url, params=params, headers=headers, cookies=cookies, proxy=proxy, timeout=timeout, **kwargs) as rp:
-        result = await rp.json()
+        rp.raise_for_status()
+        result = await rp.json(loads=json_loads)
     return result
 
 
@@ -115,21 +245,94 @@ async def fetch_post_json(
         params: dict | None = None,
         headers: dict | None = None,
         cookies: dict | None = None,
-        proxy:  dict | None = None,
+        proxy: str | None = None,
         timeout: int = 5,
+        rate_group: str = 'manga',
         **kwargs
 ) -> Any:
-    """使用 post 方法获取并解析 json 数据"""
+    """使用 post 方法获取并解析 json 数据
+
+    :param rate_group: 请求速率限制分组
+    """
     headers = _DEFAULT_HEADERS if headers is None else headers
-    timeout = ClientTimeout(total=timeout)
+    timeout = client_timeout(timeout)
+    proxy = session_proxy(session) if proxy is None else proxy
+    await _wait_rate_limit(session, rate_group)
 
     async with session.post(
             url=url, params=params, headers=headers, cookies=cookies, proxy=proxy, timeout=timeout, **kwargs) as rp:
-        result = await rp.json()
+        rp.raise_for_status()
+        result = await rp.json(loads=json_loads)
     return result
 
 
-@retry(attempt_limit=3)
+async def _iter_chunks(rp: ClientResponse, chunk_size: int, byte_budget: ByteBudget | None) -> AsyncIterator[bytes]:
+    """按 chunk_size 分块读取响应内容, 数据块在被使用方处理完成前持续占用 byte_budget"""
+    while True:
+        budget = nullcontext() if byte_budget is None else byte_budget.reserve(chunk_size)
+        async with budget:
+            chunk = await rp.content.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _check_content_length(rp: ClientResponse, received_size: int) -> None:
+    """校验实际接收数据长度与 Content-Length 是否一致"""
+    # 响应经过 gzip 等编码时 Content-Length 为编码后长度, 无法直接比较
+    if (rp.content_length is not None
+            and 'Content-Encoding' not in rp.headers
+            and received_size != rp.content_length):
+        raise ContentLengthMismatchError(f'Content-Length is {rp.content_length}, but {received_size} bytes received')
+
+
+@retry(attempt_limit=3, refresh_token=True)
+async def fetch_bytes(
+        url: str,
+        session: ClientSession,
+        *,
+        params: dict | None = None,
+        headers: dict | None = None,
+        cookies: dict | None = None,
+        proxy: str | None = None,
+        timeout: int = 20,
+        chunk_size: int = 64 * 1024,
+        byte_budget: ByteBudget | None = None,
+        validator: ImageValidator | None = None,
+        rate_group: str = 'cdn',
+        **kwargs
+) -> bytes:
+    """分块读取全部响应内容并校验 Content-Length
+
+    :param chunk_size: 单次读取的数据块大小
+    :param byte_budget: 全局在途数据量限制, 仅在读取数据块时占用, 返回的数据需由调用方另行占用
+    :param validator: 校验图片内容, 校验失败时抛出 ImageIntegrityError
+    :param rate_group: 请求速率限制分组
+    """
+    headers = _DEFAULT_HEADERS if headers is None else headers
+    timeout = client_timeout(timeout)
+    proxy = session_proxy(session) if proxy is None else proxy
+    await _wait_rate_limit(session, rate_group)
+    if validator is not None:
+        validator.reset()
+
+    async with session.get(
+            url=url, params=params, headers=headers, cookies=cookies, proxy=proxy, timeout=timeout, **kwargs) as rp:
+        rp.raise_for_status()
+        result = bytearray()
+        with metrics_registry.timer('http_body_seconds', function='fetch_bytes'):
+            async for chunk in _iter_chunks(rp, chunk_size=chunk_size, byte_budget=byte_budget):
+                result.extend(chunk)
+                if validator is not None:
+                    validator.update(chunk)
+        metrics_registry.inc('http_bytes_total', len(result), function='fetch_bytes')
+        _check_content_length(rp, received_size=len(result))
+        if validator is not None:
+            validator.finish(len(result))
+    return bytes(result)
+
+
+@retry(attempt_limit=3, refresh_token=True)
 async def download_file(
         url: str,
         file: FileHandler,
@@ -138,25 +341,95 @@ async def download_file(
         params: dict | None = None,
         headers: dict | None = None,
         cookies: dict | None = None,
-        proxy: dict | None = None,
+        proxy: str | None = None,
         timeout: int = 20,
+        chunk_size: int = 64 * 1024,
+        byte_budget: ByteBudget | None = None,
+        digest: StreamDigest | None = None,
+        validator: ImageValidator | None = None,
+        writer_pool: WriterPool | None = None,
+        rate_group: str = 'cdn',
         **kwargs
 ) -> FileHandler:
-    """下载文件到指定位置"""
+    """下载文件到指定位置
+
+    数据按 chunk_size 分块读取, 经写入线程池写入同目录下的临时文件, 校验 Content-Length 及图片内容后原子地重命名为目标文件,
+    校验失败时丢弃临时文件, 不会在目标位置留下不完整的文件
+
+    :param chunk_size: 单次读取的数据块大小, 为 0 时一次性读取全部响应内容
+    :param byte_budget: 全局在途数据量限制
+    :param digest: 下载过程中计算已接收数据的摘要
+    :param validator: 下载过程中校验图片内容, 校验失败时抛出 ImageIntegrityError
+    :param writer_pool: 文件写入线程池, 默认使用模块共享的写入线程池
+    :param rate_group: 请求速率限制分组
+    """
     headers = _DEFAULT_HEADERS if headers is None else headers
-    timeout = ClientTimeout(total=timeout)
+    timeout = client_timeout(timeout)
+    proxy = session_proxy(session) if proxy is None else proxy
+    writer_pool = default_writer_pool() if writer_pool is None else writer_pool
+    await _wait_rate_limit(session, rate_group)
+    if digest is not None:
+        digest.reset()
+    if validator is not None:
+        validator.reset()
 
-    async with session.get(
-            url=url, params=params, headers=headers, cookies=cookies, proxy=proxy, timeout=timeout, **kwargs) as rp:
-        result = await rp.read()
+    temp_file: PooledFile | None = None
+    try:
+        async with session.get(
+                url=url, params=params, headers=headers, cookies=cookies, proxy=proxy, timeout=timeout, **kwargs
+        ) as rp:
+            rp.raise_for_status()
+            received_size = 0
+            write_time = 0.0
+            body_start = time.perf_counter()
+            expected_size = rp.content_length if 'Content-Encoding' not in rp.headers else None
+            temp_file = writer_pool.open(file.path.with_name(f'{file.path.name}.part'), size=expected_size)
+            if chunk_size <= 0:
+                result = await rp.read()
+                received_size = len(result)
+                write_start = time.perf_counter()
+                await temp_file.write(result)
+                write_time += time.perf_counter() - write_start
+                if digest is not None:
+                    digest.update(result)
+                if validator is not None:
+                    validator.update(result)
+            else:
+                async for chunk in _iter_chunks(rp, chunk_size=chunk_size, byte_budget=byte_budget):
+                    write_start = time.perf_counter()
+                    await temp_file.write(chunk)
+                    write_time += time.perf_counter() - write_start
+                    received_size += len(chunk)
+                    if digest is not None:
+                        digest.update(chunk)
+                    if validator is not None:
+                        validator.update(chunk)
+            _check_content_length(rp, received_size=received_size)
+            if validator is not None:
+                validator.finish(received_size)
+            # 响应体传输耗时不包含写入磁盘的时间, 便于区分网络及磁盘瓶颈
+            body_time = time.perf_counter() - body_start - write_time
+        write_start = time.perf_counter()
+        await temp_file.commit(file.path)
+        write_time += time.perf_counter() - write_start
+    except BaseException:
+        if temp_file is not None:
+            temp_file.discard()
+        raise
 
-    async with file.async_open('wb') as af:
-        await af.write(result)
+    metrics_registry.observe('http_body_seconds', body_time, function='download_file')
+    metrics_registry.observe('disk_write_seconds', write_time, mode='file')
+    metrics_registry.inc('http_bytes_total', received_size, function='download_file')
     return file
 
 
 __all__ = [
+    'ByteBudget',
+    'ContentLengthMismatchError',
+    'ExceededAttemptError',
+    'StreamDigest',
     'fetch_get_json',
     'fetch_post_json',
+    'fetch_bytes',
     'download_file'
 ]
@@ -0,0 +1,312 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 02:00
+@FileName       : identity_pool.py
+@Project        : BilibiliMangaDownloader
+@Description    : pool of account cookies and egress proxies
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import time
+import asyncio
+import pathlib
+from typing import Iterable
+
+from aiohttp import ClientSession, ClientResponseError
+from pydantic import BaseModel, validator
+
+from .api import BilibiliApiError, Credentials, get_cookies_config, query_account
+from .logger import logger
+from .metrics import metrics_registry
+
+
+IDENTITY_STRATEGIES: tuple[str, ...] = ('round_robin', 'least_loaded')
+"""分配章节任务时选择身份的策略: 依次轮流使用, 或使用进行中章节数最少的身份"""
+
+_AUTH_STATUS: frozenset[int] = frozenset({401, 403})
+"""表示身份认证失败的 http 状态码"""
+_THROTTLE_STATUS: frozenset[int] = frozenset({412, 429})
+"""表示请求被限流的 http 状态码"""
+
+AUTH_ERROR: str = 'auth'
+"""身份认证失败, 身份在较长时间内不再使用"""
+THROTTLE_ERROR: str = 'throttle'
+"""身份或其出口 IP 被限流, 身份在短时间内不再使用"""
+DENIED_ERROR: str = 'denied'
+"""身份无权访问该章节, 该章节改用其他身份"""
+
+SOURCE_API: str = 'api'
+"""错误来自账号或漫画 api, 请求携带身份的 cookies"""
+SOURCE_CDN: str = 'cdn'
+"""错误来自图片 CDN, 请求只携带图片 token, 401/403 表示 token 失效而不是身份认证失败"""
+
+
+class IdentityConfig(BaseModel):
+    """单个请求身份: 一组账号 cookies 及出口代理"""
+    name: str = ''
+    """身份名称, 仅用于日志及状态展示, 为空时按序号命名"""
+    sessdata: str | None = None
+    bili_jct: str | None = None
+    proxy: str | None = None
+    """出口代理地址, 为 None 时使用连接池配置的代理"""
+
+
+class IdentityPoolConfig(BaseModel):
+    """请求身份池配置"""
+    identities: list[IdentityConfig] = []
+    """全部请求身份, 为空时使用 .env 中配置的 cookies 作为唯一身份"""
+    strategy: str = 'least_loaded'
+    """选择身份的策略, round_robin 或 least_loaded"""
+    auth_quarantine: float = 1800
+    """身份认证失败后暂停使用的时间, 单位秒"""
+    throttle_quarantine: float = 60
+    """身份被限流后暂停使用的时间, 单位秒"""
+
+    @validator('strategy')
+    def _check_strategy(cls, value: str) -> str:
+        if value not in IDENTITY_STRATEGIES:
+            raise ValueError(f'strategy must be one of {", ".join(IDENTITY_STRATEGIES)}')
+        return value
+
+
+def load_identity_pool_config(file: str | pathlib.Path) -> IdentityPoolConfig:
+    """从 JSON 文件读取身份池配置, 文件内容为 IdentityPoolConfig 对象, 或只包含身份列表的数组"""
+    text = pathlib.Path(file).read_text(encoding='utf-8')
+    if text.lstrip().startswith('['):
+        return IdentityPoolConfig.parse_raw(f'{{"identities": {text}}}')
+    return IdentityPoolConfig.parse_raw(text)
+
+
+def classify_identity_error(exception: BaseException, *, source: str = SOURCE_API) -> str | None:
+    """判断异常是否与请求身份有关, 是则返回错误类别, 否则返回 None
+
+    :param exception: 异常
+    :param source: 发生错误的请求来源, 图片 CDN 返回的 401/403 不视为身份认证失败
+    """
+    for e in (exception, exception.__cause__):
+        if isinstance(e, ClientResponseError) and e.status in _AUTH_STATUS:
+            # api 返回 401/403 时即使被包装为 TokenExpiredError 也是身份认证失败, 图片 CDN 返回时只是图片 token 失效
+            return AUTH_ERROR if source == SOURCE_API else None
+        if isinstance(e, ClientResponseError) and e.status in _THROTTLE_STATUS:
+            return THROTTLE_ERROR
+        if isinstance(e, BilibiliApiError):
+            return DENIED_ERROR
+    return None
+
+
+class Identity(object):
+    """身份池中的单个身份及其使用状态"""
+    __slots__ = ('name', 'cookies', 'proxy', 'uname', 'in_flight', 'assigned_count', 'error_count',
+                 'quarantined_until', 'quarantine_reason', 'entitled_ep_ids', 'denied_ep_ids')
+
+    def __init__(self, name: str, *, cookies: dict | None, proxy: str | None = None):
+        self.name = name
+        self.cookies = cookies
+        self.proxy = proxy
+        self.uname: str | None = None
+        self.in_flight: int = 0
+        self.assigned_count: int = 0
+        self.error_count: int = 0
+        self.quarantined_until: float = 0.0
+        self.quarantine_reason: str | None = None
+        self.entitled_ep_ids: set[int] = set()
+        """已确认可以访问的章节"""
+        self.denied_ep_ids: set[int] = set()
+        """已确认无权访问的章节"""
+
+    def __repr__(self) -> str:
+        return f'<Identity(name={self.name}, in_flight={self.in_flight}, proxy={self.proxy})>'
+
+    @property
+    def credentials(self) -> Credentials:
+        return Credentials(cookies=self.cookies, proxy=self.proxy)
+
+    def is_available(self, now: float) -> bool:
+        return now >= self.quarantined_until
+
+    def snapshot(self, now: float) -> dict[str, object]:
+        return {
+            'name': self.name,
+            'logged_in': self.uname is not None,
+            'proxy': self.proxy,
+            'in_flight': self.in_flight,
+            'assigned': self.assigned_count,
+            'errors': self.error_count,
+            'quarantined_for': max(self.quarantined_until - now, 0.0),
+            'quarantine_reason': self.quarantine_reason if not self.is_available(now) else None,
+            'entitled_chapters': len(self.entitled_ep_ids),
+            'denied_chapters': len(self.denied_ep_ids)
+        }
+
+
+class IdentityPool(object):
+    """请求身份池
+
+    章节任务在获取图片列表前分配一个身份, 此后该章节的 api 请求使用该身份的 cookies, 所有请求使用该身份的代理;
+    身份遇到认证失败或限流时暂停使用一段时间, 遇到无权访问的章节时改用其他身份, 但不会暂停最后一个可用的身份
+    """
+
+    def __init__(self, config: IdentityPoolConfig | None = None):
+        self.config = IdentityPoolConfig() if config is None else config
+        if self.config.identities:
+            self.identities: list[Identity] = [
+                Identity(
+                    x.name or f'identity-{index}',
+                    cookies={'SESSDATA': x.sessdata, 'bili_jct': x.bili_jct} if x.sessdata and x.bili_jct else None,
+                    proxy=x.proxy
+                ) for index, x in enumerate(self.config.identities)
+            ]
+        else:
+            self.identities = [Identity('default', cookies=get_cookies_config().cookies)]
+        self._next_index = 0
+
+    def __repr__(self) -> str:
+        return f'<IdentityPool(identities={self.identities}, strategy={self.config.strategy})>'
+
+    async def _verify_one(self, identity: Identity, session: ClientSession) -> None:
+        try:
+            verify = await query_account(session=session, credentials=identity.credentials)
+        except Exception as e:
+            logger.opt(colors=True).warning(f'<r>身份 {identity.name} 验证失败</r>, {e}')
+            self.quarantine(identity, AUTH_ERROR, reason=f'verify failed, {e}')
+            return
+
+        if verify.code != 0 or not verify.data.isLogin:
+            identity.cookies = None
+            if not self.config.identities:
+                # 唯一身份来自 .env 配置时, 与 verify_bilibili_cookie 一致地清除已配置的 cookie
+                get_cookies_config().clear()
+            logger.opt(colors=True).warning(
+                f'<r>身份 {identity.name} 的 Bilibili cookies 验证失败</r>, 登录状态异常, {verify.message}, '
+                f'该身份只能下载免费章节'
+            )
+        else:
+            identity.uname = verify.data.uname
+            logger.opt(colors=True).success(
+                f'<lg>身份 {identity.name} 的 Bilibili cookie 已验证</lg>, 登录用户: {verify.data.uname}'
+            )
+
+    async def verify(self, *, session: ClientSession) -> None:
+        """并行验证全部配置了 cookies 的身份, cookies 无效的身份只用于下载免费章节, 请求失败的身份暂停使用"""
+        identities = [x for x in self.identities if x.cookies]
+        if not identities:
+            logger.opt(colors=True).warning('<r>未配置 bilibili 用户 Cookies</r>, <ly>只能下载免费章节</ly>')
+            return
+        await asyncio.gather(*(self._verify_one(x, session) for x in identities))
+
+    def _candidates(self, ep_id: int | None, exclude: Iterable[Identity]) -> list[Identity]:
+        excluded = set(map(id, exclude))
+        candidates = [
+            x for x in self.identities
+            if id(x) not in excluded and (ep_id is None or ep_id not in x.denied_ep_ids)
+        ]
+        if ep_id is not None:
+            # 优先使用已确认可以访问该章节的身份
+            entitled = [x for x in candidates if ep_id in x.entitled_ep_ids]
+            candidates = entitled or candidates
+        return candidates
+
+    def _select(self, candidates: list[Identity]) -> Identity:
+        if self.config.strategy == 'round_robin':
+            count = len(self.identities)
+            order = {id(x): index for index, x in enumerate(self.identities)}
+            identity = min(candidates, key=lambda x: (order[id(x)] - self._next_index) % count)
+            self._next_index = (order[id(identity)] + 1) % count
+            return identity
+        return min(candidates, key=lambda x: (x.in_flight, x.assigned_count))
+
+    async def acquire(self, *, ep_id: int | None = None, exclude: Iterable[Identity] = ()) -> Identity | None:
+        """为章节分配身份, 可用的身份都在暂停中时等待, 没有任何身份可以访问该章节时返回 None
+
+        :param ep_id: 章节 id, 跳过已确认无权访问该章节的身份
+        :param exclude: 不使用的身份, 例如该章节已经尝试失败的身份
+        """
+        candidates = self._candidates(ep_id, exclude)
+        if not candidates:
+            return None
+
+        while True:
+            now = time.monotonic()
+            available = [x for x in candidates if x.is_available(now)]
+            if available:
+                break
+            await asyncio.sleep(min(x.quarantined_until for x in candidates) - now)
+
+        identity = self._select(available)
+        identity.in_flight += 1
+        identity.assigned_count += 1
+        metrics_registry.inc('identity_assigned_total', identity=identity.name)
+        return identity
+
+    @staticmethod
+    def release(identity: Identity) -> None:
+        identity.in_flight -= 1
+
+    def quarantine(self, identity: Identity, category: str, *, reason: str) -> bool:
+        """暂停使用身份, 身份是最后一个可用的身份时不暂停
+
+        :return: 是否已暂停
+        """
+        now = time.monotonic()
+        if not any(x.is_available(now) for x in self.identities if x is not identity):
+            logger.debug(f'身份 {identity.name} 是唯一可用的身份, 不暂停使用, 原因: {reason}')
+            return False
+        seconds = self.config.auth_quarantine if category == AUTH_ERROR else self.config.throttle_quarantine
+        identity.quarantined_until = max(identity.quarantined_until, now + seconds)
+        identity.quarantine_reason = reason
+        metrics_registry.inc('identity_quarantined_total', identity=identity.name, category=category)
+        logger.warning(f'身份 {identity.name} 暂停使用 {seconds:.0f} 秒, 原因: {reason}')
+        return True
+
+    def report(
+            self,
+            identity: Identity,
+            exception: BaseException,
+            *,
+            ep_id: int | None = None,
+            source: str = SOURCE_API
+    ) -> str | None:
+        """报告使用身份时发生的错误, 认证失败或限流时暂停使用该身份, 无权访问时记录该章节
+
+        :param source: 发生错误的请求来源, SOURCE_API 或 SOURCE_CDN
+        :return: 错误类别, 与身份无关的错误返回 None
+        """
+        category = classify_identity_error(exception, source=source)
+        if category is None:
+            return None
+        identity.error_count += 1
+        if category == DENIED_ERROR:
+            if ep_id is not None:
+                identity.denied_ep_ids.add(ep_id)
+                identity.entitled_ep_ids.discard(ep_id)
+        else:
+            self.quarantine(identity, category, reason=f'{category}, {exception}')
+        return category
+
+    @staticmethod
+    def record_entitled(identity: Identity, ep_id: int) -> None:
+        """记录身份可以访问该章节"""
+        identity.entitled_ep_ids.add(ep_id)
+        identity.denied_ep_ids.discard(ep_id)
+
+    def snapshot(self) -> list[dict[str, object]]:
+        """各身份的使用状态"""
+        now = time.monotonic()
+        return [x.snapshot(now) for x in self.identities]
+
+
+__all__ = [
+    'AUTH_ERROR',
+    'DENIED_ERROR',
+    'IDENTITY_STRATEGIES',
+    'SOURCE_API',
+    'SOURCE_CDN',
+    'THROTTLE_ERROR',
+    'Identity',
+    'IdentityConfig',
+    'IdentityPool',
+    'IdentityPoolConfig',
+    'classify_identity_error',
+    'load_identity_pool_config'
+]
@@ -0,0 +1,89 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/17 22:00
+@FileName       : image_variant.py
+@Project        : BilibiliMangaDownloader
+@Description    : image size and format variant policy
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+from pydantic import BaseModel, validator
+
+from .formats import IMAGE_FORMATS
+from .model import EpImage
+
+
+class ImageVariantPolicy(BaseModel):
+    """图片规格策略
+
+    bilibili 图片服务支持在图片 path 后附加 @{宽度}w_{质量}q.{格式} 后缀获取缩放或转码后的图片,
+    默认不附加后缀, 下载原图
+    """
+    width: int | None = None
+    """目标宽度, 单位像素, 原图不超过该宽度时保持原宽度"""
+    quality: int | None = None
+    """有损格式的图片质量, 1-100"""
+    format: str | None = None
+    """目标格式, 为 None 时保持原格式"""
+
+    @validator('width')
+    def _check_width(cls, value: int | None) -> int | None:
+        if value is not None and value < 1:
+            raise ValueError('width must be greater than 0')
+        return value
+
+    @validator('quality')
+    def _check_quality(cls, value: int | None) -> int | None:
+        if value is not None and not 1 <= value <= 100:
+            raise ValueError('quality must be between 1 and 100')
+        return value
+
+    @validator('format')
+    def _check_format(cls, value: str | None) -> str | None:
+        if value is not None:
+            value = value.lower().lstrip('.')
+            if value == 'jpeg':
+                value = 'jpg'
+            if value not in IMAGE_FORMATS:
+                raise ValueError(f'format must be one of {", ".join(IMAGE_FORMATS)}')
+        return value
+
+    @property
+    def is_original(self) -> bool:
+        return self.width is None and self.quality is None and self.format is None
+
+    def variant_path(self, path: str, width: int | None = None) -> str:
+        """根据策略及原图宽度生成请求的图片 path
+
+        :param path: GetImageIndex 返回的原图 path
+        :param width: 原图宽度, 已知时不会请求比原图更宽的图片
+        """
+        if self.is_original:
+            return path
+
+        params: list[str] = []
+        if self.width is not None and (width is None or self.width < width):
+            params.append(f'{self.width}w')
+        if self.quality is not None:
+            params.append(f'{self.quality}q')
+
+        original_format = path.rsplit('.', 1)[-1].lower()
+        target_format = original_format if self.format is None else self.format
+        if not params and target_format == original_format:
+            # 不缩放也不转码时请求原图, 避免图片服务重新编码
+            return path
+        if not params and width is not None:
+            # 只转码时显式指定原图宽度
+            params.append(f'{width}w')
+        return f'{path}@{"_".join(params)}.{target_format}'
+
+    def apply(self, ep_image: EpImage) -> list[str]:
+        """获取章节全部图片按策略生成的 path"""
+        return [self.variant_path(x.path, width=x.x) for x in ep_image.data.images]
+
+
+__all__ = [
+    'IMAGE_FORMATS',
+    'ImageVariantPolicy'
+]
@@ -0,0 +1,280 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 06:00
+@FileName       : integrity.py
+@Project        : BilibiliMangaDownloader
+@Description    : header-only image integrity validation
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import os
+import pathlib
+from typing import NamedTuple
+
+
+_MAX_HEADER_SIZE: int = 256 * 1024
+"""解析图片头部时最多读取的数据量, jpeg 的 EXIF、ICC 等 APP 段位于 SOF 之前, 通常远小于该值"""
+_TAIL_SIZE: int = 16
+"""校验文件结尾时保留的数据量"""
+
+_JPEG_SOF_MARKERS: frozenset[int] = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+"""包含图片尺寸的 jpeg SOF 段标记, 排除同一范围内的 DHT、JPG 及 DAC"""
+_PNG_SIGNATURE: bytes = b'\x89PNG\r\n\x1a\n'
+_PNG_TRAILER: bytes = b'IEND\xaeB`\x82'
+_ASPECT_TOLERANCE: int = 2
+"""缩放后的图片高度与按原图宽高比计算的高度之间允许的误差, 单位像素"""
+
+
+class ImageIntegrityError(ValueError):
+    """图片内容校验失败异常, 例如 CDN 返回的 HTML 错误页、被截断的图片或尺寸与图片列表不符的图片"""
+
+
+class ImageInfo(NamedTuple):
+    """从图片头部解析出的信息"""
+    format: str
+    width: int | None
+    height: int | None
+    declared_size: int | None = None
+    """文件头中声明的文件总大小, 目前只有 webp 提供"""
+
+
+def _describe(data: bytes) -> str:
+    return repr(bytes(data[:16]))
+
+
+def _parse_jpeg(data: bytes, *, final: bool) -> ImageInfo | None:
+    index = 2
+    while index + 4 <= len(data):
+        if data[index] != 0xFF:
+            raise ImageIntegrityError(f'Invalid jpeg segment at offset {index}')
+        marker = data[index + 1]
+        if marker == 0xFF:
+            # 段之间的填充字节
+            index += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            index += 2
+            continue
+        if marker == 0xD9 or marker == 0xDA:
+            raise ImageIntegrityError('Jpeg image data starts before frame header')
+        length = int.from_bytes(data[index + 2:index + 4], 'big')
+        if marker in _JPEG_SOF_MARKERS:
+            if index + 9 > len(data):
+                break
+            height = int.from_bytes(data[index + 5:index + 7], 'big')
+            width = int.from_bytes(data[index + 7:index + 9], 'big')
+            return ImageInfo('jpg', width, height)
+        index += 2 + length
+    if final:
+        raise ImageIntegrityError('Jpeg frame header not found, image is truncated')
+    return None
+
+
+def _parse_webp(data: bytes, *, final: bool) -> ImageInfo | None:
+    if len(data) < 30:
+        if final:
+            raise ImageIntegrityError('Webp header is truncated')
+        return None
+    declared_size = int.from_bytes(data[4:8], 'little') + 8
+    chunk = data[12:16]
+    if chunk == b'VP8 ':
+        if data[23:26] != b'\x9d\x01\x2a':
+            raise ImageIntegrityError('Invalid webp VP8 frame header')
+        width = int.from_bytes(data[26:28], 'little') & 0x3FFF
+        height = int.from_bytes(data[28:30], 'little') & 0x3FFF
+    elif chunk == b'VP8L':
+        if data[20] != 0x2F:
+            raise ImageIntegrityError('Invalid webp VP8L signature')
+        bits = int.from_bytes(data[21:25], 'little')
+        width = (bits & 0x3FFF) + 1
+        height = ((bits >> 14) & 0x3FFF) + 1
+    elif chunk == b'VP8X':
+        width = int.from_bytes(data[24:27], 'little') + 1
+        height = int.from_bytes(data[27:30], 'little') + 1
+    else:
+        raise ImageIntegrityError(f'Unknown webp chunk {chunk!r}')
+    return ImageInfo('webp', width, height, declared_size)
+
+
+def _parse_avif(data: bytes, *, final: bool) -> ImageInfo | None:
+    # 图片尺寸位于 meta 盒子中的 ispe 属性, 不解析完整的盒子结构, 只查找 ispe
+    index = data.find(b'ispe')
+    if index >= 0 and index + 16 <= len(data):
+        width = int.from_bytes(data[index + 8:index + 12], 'big')
+        height = int.from_bytes(data[index + 12:index + 16], 'big')
+        return ImageInfo('avif', width, height)
+    if final or len(data) >= _MAX_HEADER_SIZE:
+        return ImageInfo('avif', None, None)
+    return None
+
+
+def parse_image_header(data: bytes, *, final: bool = False) -> ImageInfo | None:
+    """根据文件头识别图片格式并解析图片尺寸, 不解码图片数据
+
+    :param data: 文件开头的数据
+    :param final: data 是否已是全部可用的数据, 为 False 时数据不足返回 None 以等待更多数据
+    :return: 图片信息, 数据不足以解析时返回 None
+    """
+    if len(data) < 12:
+        if final:
+            raise ImageIntegrityError(f'Image is too small ({len(data)} bytes): {_describe(data)}')
+        return None
+    if data[:3] == b'\xff\xd8\xff':
+        return _parse_jpeg(data, final=final)
+    if data[:8] == _PNG_SIGNATURE:
+        if len(data) < 24:
+            if final:
+                raise ImageIntegrityError('Png header is truncated')
+            return None
+        if data[12:16] != b'IHDR':
+            raise ImageIntegrityError('Png IHDR chunk not found')
+        return ImageInfo('png', int.from_bytes(data[16:20], 'big'), int.from_bytes(data[20:24], 'big'))
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return _parse_webp(data, final=final)
+    if data[4:8] == b'ftyp' and data[8:12] in (b'avif', b'avis', b'mif1', b'msf1'):
+        return _parse_avif(data, final=final)
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return ImageInfo('gif', int.from_bytes(data[6:8], 'little'), int.from_bytes(data[8:10], 'little'))
+    raise ImageIntegrityError(f'Unrecognized image content: {_describe(data)}')
+
+
+def check_trailer(info: ImageInfo, tail: bytes, size: int) -> None:
+    """根据各格式的文件结尾或声明的文件大小检查图片是否被截断
+
+    :param info: 图片信息
+    :param tail: 文件结尾的数据
+    :param size: 文件大小
+    """
+    if info.declared_size is not None:
+        # RIFF 块按偶数字节对齐, 允许末尾一个填充字节
+        if size not in (info.declared_size, info.declared_size + 1):
+            raise ImageIntegrityError(f'Image declares {info.declared_size} bytes, but {size} bytes received')
+    elif info.format == 'jpg':
+        # 部分编码器在 EOI 之后填充 0
+        if not tail.rstrip(b'\x00').endswith(b'\xff\xd9'):
+            raise ImageIntegrityError('Jpeg end of image marker not found, image is truncated')
+    elif info.format == 'png':
+        if not tail.endswith(_PNG_TRAILER):
+            raise ImageIntegrityError('Png IEND chunk not found, image is truncated')
+    elif info.format == 'gif':
+        if not tail.endswith(b'\x3b'):
+            raise ImageIntegrityError('Gif trailer not found, image is truncated')
+
+
+def check_dimensions(info: ImageInfo, width: int | None, height: int | None, *, exact: bool = True) -> None:
+    """检查图片尺寸与图片列表中的尺寸是否一致
+
+    :param info: 图片信息
+    :param width: 图片列表中的原图宽度, 未知时不检查
+    :param height: 图片列表中的原图高度, 未知时不检查
+    :param exact: 是否要求尺寸完全一致, 缩放后的图片只检查宽度不超过原图且宽高比一致
+    """
+    if not width or not height or info.width is None or info.height is None:
+        return
+    if exact:
+        if (info.width, info.height) != (width, height):
+            raise ImageIntegrityError(f'Image size is {info.width}x{info.height}, expected {width}x{height}')
+    elif info.width > width or abs(info.height - round(info.width * height / width)) > _ASPECT_TOLERANCE:
+        raise ImageIntegrityError(f'Image size is {info.width}x{info.height}, '
+                                  f'which is not a downscale of {width}x{height}')
+
+
+class ImageValidator(object):
+    """流式图片校验
+
+    在下载过程中逐块接收数据, 只保留文件开头(直到解析出图片尺寸)及结尾的少量数据,
+    每个数据块的开销只是一次切片, 不解码图片, 也不需要在写入后重新读取文件
+    """
+    __slots__ = ('width', 'height', 'exact', 'info', '_head', '_tail')
+
+    def __init__(self, *, width: int | None = None, height: int | None = None, exact: bool = True):
+        """
+        :param width: 图片列表中的原图宽度, 未知时不检查尺寸
+        :param height: 图片列表中的原图高度, 未知时不检查尺寸
+        :param exact: 是否要求尺寸完全一致, 下载缩放后的图片时为 False
+        """
+        self.width = width
+        self.height = height
+        self.exact = exact
+        self.info: ImageInfo | None = None
+        self._head = bytearray()
+        self._tail = b''
+
+    def __repr__(self) -> str:
+        return f'<ImageValidator(expected={self.width}x{self.height}, info={self.info})>'
+
+    def reset(self) -> None:
+        """丢弃已接收的数据, 用于重新下载"""
+        self.info = None
+        self._head = bytearray()
+        self._tail = b''
+
+    def update(self, data: bytes) -> None:
+        """接收一个数据块, 文件头无法识别时立即抛出, 不必等待下载完成"""
+        if not data:
+            return
+        if self.info is None:
+            self._head += data[:_MAX_HEADER_SIZE - len(self._head)]
+            self.info = parse_image_header(self._head, final=len(self._head) >= _MAX_HEADER_SIZE)
+            if self.info is not None:
+                check_dimensions(self.info, self.width, self.height, exact=self.exact)
+                self._head = bytearray()
+        self._tail = data[-_TAIL_SIZE:] if len(data) >= _TAIL_SIZE else (self._tail + data)[-_TAIL_SIZE:]
+
+    def finish(self, size: int) -> ImageInfo:
+        """全部数据接收完成后检查文件结尾
+
+        :param size: 接收的数据总大小
+        """
+        if self.info is None:
+            self.info = parse_image_header(bytes(self._head), final=True)
+            check_dimensions(self.info, self.width, self.height, exact=self.exact)
+            self._head = bytearray()
+        check_trailer(self.info, self._tail, size)
+        return self.info
+
+    def validate(self, data: bytes) -> ImageInfo:
+        """校验完整的图片数据"""
+        self.reset()
+        self.update(data)
+        return self.finish(len(data))
+
+
+def validate_file(
+        path: str | os.PathLike,
+        *,
+        width: int | None = None,
+        height: int | None = None,
+        exact: bool = True
+) -> ImageInfo:
+    """校验磁盘上的图片文件, 只读取文件开头及结尾
+
+    :param path: 图片文件
+    :param width: 图片列表中的原图宽度, 未知时不检查尺寸
+    :param height: 图片列表中的原图高度, 未知时不检查尺寸
+    :param exact: 是否要求尺寸完全一致
+    """
+    validator = ImageValidator(width=width, height=height, exact=exact)
+    path = pathlib.Path(path)
+    with path.open('rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        head = f.read(min(size, 64 * 1024))
+        validator.update(head)
+        while validator.info is None and len(head) < size and f.tell() < _MAX_HEADER_SIZE:
+            validator.update(f.read(64 * 1024))
+        if size > f.tell():
+            f.seek(max(size - _TAIL_SIZE, f.tell()))
+            validator.update(f.read())
+    return validator.finish(size)
+
+
+__all__ = [
+    'ImageInfo',
+    'ImageIntegrityError',
+    'ImageValidator',
+    'check_dimensions',
+    'check_trailer',
+    'parse_image_header',
+    'validate_file'
+]
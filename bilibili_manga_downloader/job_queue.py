@@ -0,0 +1,310 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 04:00
+@FileName       : job_queue.py
+@Project        : BilibiliMangaDownloader
+@Description    : lease-based chapter job queue shared by several download nodes
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import time
+import pathlib
+import sqlite3
+import threading
+from typing import Iterable, NamedTuple
+
+from pydantic import BaseModel
+
+from .file_handler import FileHandler
+from .image_variant import ImageVariantPolicy
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chapters (
+    comic_id INTEGER NOT NULL,
+    ep_id INTEGER NOT NULL,
+    ord REAL NOT NULL,
+    comic_folder TEXT NOT NULL,
+    chapter_folder TEXT NOT NULL,
+    status TEXT NOT NULL,
+    owner TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    released INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (comic_id, ep_id)
+);
+CREATE INDEX IF NOT EXISTS chapters_status ON chapters (status, lease_until);
+"""
+
+JOB_PENDING: str = 'pending'
+"""等待领取"""
+JOB_LEASED: str = 'leased'
+"""已被 worker 领取, 租约到期前未续约时重新分配"""
+JOB_DONE: str = 'done'
+"""下载并压缩完成"""
+JOB_FAILED: str = 'failed'
+"""失败次数达到上限"""
+
+
+class QueueOptions(BaseModel):
+    """影响输出文件内容的下载配置, 由协调者写入队列, 所有 worker 使用相同的配置, 使输出与下载节点无关"""
+    archive_suffix: str = 'zip'
+    """章节压缩文件格式"""
+    single_pass: bool = False
+    """是否将图片直接写入章节压缩文件"""
+    compression_level: int | None = None
+    """章节压缩级别, 为空时使用默认级别"""
+    image_variant: ImageVariantPolicy = ImageVariantPolicy()
+    """图片规格策略"""
+
+
+class ChapterEntry(NamedTuple):
+    """加入队列的章节, 目录名由协调者生成, 不受各节点获取到的标题变化影响"""
+    comic_id: int
+    ep_id: int
+    ord: float
+    comic_folder: str
+    chapter_folder: str
+
+
+class Lease(NamedTuple):
+    """worker 领取的章节租约, attempt 作为防护令牌, 租约被重新分配后旧的持有者无法再续约或完成"""
+    comic_id: int
+    ep_id: int
+    comic_folder: str
+    chapter_folder: str
+    attempt: int
+
+
+class QueueStats(NamedTuple):
+    """队列中各状态的章节数"""
+    pending: int
+    leased: int
+    done: int
+    failed: int
+
+    @property
+    def is_drained(self) -> bool:
+        """是否已没有等待领取或正在下载的章节"""
+        return self.pending == 0 and self.leased == 0
+
+
+class JobQueue(object):
+    """基于租约的章节任务队列, 使用共享文件系统上的 SQLite 数据库在多个节点之间分配章节
+
+    worker 领取章节后需在租约到期前续约, 进程退出或节点失联导致租约过期的章节会重新分配给其他 worker;
+    所有修改均在 BEGIN IMMEDIATE 事务中进行, 同一时刻只有一个节点可以修改队列
+    """
+
+    def __init__(
+            self,
+            file: FileHandler,
+            *,
+            lease_seconds: float = 300,
+            max_attempts: int = 3,
+            busy_timeout: float = 30
+    ):
+        """
+        :param file: 队列数据库文件, 多个节点使用时需位于共享文件系统上
+        :param lease_seconds: 租约时长, 单位秒
+        :param max_attempts: 单个章节的领取次数上限, 不包括正常归还的领取次数, 达到后标记为失败
+        :param busy_timeout: 等待其他节点释放数据库锁的时长, 单位秒
+        """
+        self.file = file
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.busy_timeout = busy_timeout
+        self._connection: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f'<JobQueue(file={self.file}, lease_seconds={self.lease_seconds})>'
+
+    def __enter__(self) -> "JobQueue":
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            raise RuntimeError('Job queue is not opened')
+        return self._connection
+
+    def open(self) -> None:
+        if self._connection is not None:
+            return
+        if not self.file.path.parent.exists():
+            pathlib.Path.mkdir(self.file.path.parent, parents=True)
+        self._connection = sqlite3.connect(
+            self.file.path, isolation_level=None, check_same_thread=False, timeout=self.busy_timeout
+        )
+        # WAL 依赖共享内存, 在 NFS 等网络文件系统上不可用, 使用回滚日志并在每次提交时完整同步
+        self._connection.execute('PRAGMA journal_mode=DELETE')
+        self._connection.execute('PRAGMA synchronous=FULL')
+        self._connection.executescript(_SCHEMA)
+        columns = {x[1] for x in self._connection.execute('PRAGMA table_info(chapters)')}
+        if 'released' not in columns:
+            # 旧版本创建的队列数据库
+            self._connection.execute('ALTER TABLE chapters ADD COLUMN released INTEGER NOT NULL DEFAULT 0')
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _transaction(self, statements: Iterable[tuple[str, tuple]]) -> list[int]:
+        """在一个写事务中依次执行语句, 返回各语句修改的行数"""
+        connection = self.connection
+        with self._lock:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                row_counts = [connection.execute(sql, params).rowcount for sql, params in statements]
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+        return row_counts
+
+    def set_options(self, options: QueueOptions) -> None:
+        self._transaction([('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', ('options', options.json()))])
+
+    def get_options(self) -> QueueOptions | None:
+        with self._lock:
+            row = self.connection.execute('SELECT value FROM meta WHERE key=?', ('options',)).fetchone()
+        return None if row is None else QueueOptions.parse_raw(row[0])
+
+    def add_chapters(self, chapters: Iterable[ChapterEntry]) -> int:
+        """加入章节, 已在队列中的章节保持不变, 已失败的章节重新等待领取
+
+        重新等待领取的章节之前的领取次数全部不再计入上限, 但 attempts 本身不会减少, 仍可作为防护令牌
+
+        :return: 新加入及重新等待领取的章节数
+        """
+        now = time.time()
+        return sum(self._transaction(
+            (
+                'INSERT INTO chapters (comic_id, ep_id, ord, comic_folder, chapter_folder, status, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (comic_id, ep_id) DO UPDATE SET status=excluded.status, released=attempts, error=NULL, '
+                'updated_at=excluded.updated_at WHERE chapters.status=?',
+                (*x, JOB_PENDING, now, JOB_FAILED)
+            ) for x in chapters
+        ))
+
+    def claim(self, worker_id: str, *, limit: int = 1) -> list[Lease]:
+        """按加入顺序领取等待中或租约已过期的章节
+
+        :param worker_id: worker 标识
+        :param limit: 领取的章节数上限
+        """
+        now = time.time()
+        connection = self.connection
+        with self._lock:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.execute(
+                    'UPDATE chapters SET status=?, owner=NULL, lease_until=NULL, error=?, updated_at=? '
+                    'WHERE status=? AND lease_until<? AND attempts-released>=?',
+                    (JOB_FAILED, 'lease expired', now, JOB_LEASED, now, self.max_attempts)
+                )
+                rows = connection.execute(
+                    'SELECT comic_id, ep_id, comic_folder, chapter_folder, attempts FROM chapters '
+                    'WHERE status=? OR (status=? AND lease_until<?) ORDER BY rowid LIMIT ?',
+                    (JOB_PENDING, JOB_LEASED, now, limit)
+                ).fetchall()
+                connection.executemany(
+                    'UPDATE chapters SET status=?, owner=?, lease_until=?, attempts=attempts+1, updated_at=? '
+                    'WHERE comic_id=? AND ep_id=?',
+                    [(JOB_LEASED, worker_id, now + self.lease_seconds, now, x[0], x[1]) for x in rows]
+                )
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+        return [Lease(*x[:4], attempt=x[4] + 1) for x in rows]
+
+    def heartbeat(self, worker_id: str, leases: Iterable[Lease]) -> list[Lease]:
+        """为仍持有的租约续约
+
+        :return: 已过期并被重新分配或已被其他 worker 完成, 无法续约的租约
+        """
+        leases = list(leases)
+        until = time.time() + self.lease_seconds
+        row_counts = self._transaction(
+            (
+                'UPDATE chapters SET lease_until=? '
+                'WHERE comic_id=? AND ep_id=? AND status=? AND owner=? AND attempts=?',
+                (until, x.comic_id, x.ep_id, JOB_LEASED, worker_id, x.attempt)
+            ) for x in leases
+        )
+        return [lease for lease, count in zip(leases, row_counts) if count == 0]
+
+    def complete(self, lease: Lease, worker_id: str, *, error: str | None = None) -> bool:
+        """完成章节, 失败且领取次数未达到上限的章节重新等待领取
+
+        :return: 租约是否仍然有效, 租约已被重新分配时不修改章节状态
+        """
+        if error is None:
+            status, params = '?', (JOB_DONE,)
+        else:
+            # 正常归还的领取不计入次数, 因此不能直接比较 lease.attempt
+            status = 'CASE WHEN attempts-released<? THEN ? ELSE ? END'
+            params = (self.max_attempts, JOB_PENDING, JOB_FAILED)
+        row_counts = self._transaction([(
+            f'UPDATE chapters SET status={status}, owner=NULL, lease_until=NULL, error=?, updated_at=? '
+            'WHERE comic_id=? AND ep_id=? AND status=? AND owner=? AND attempts=?',
+            (*params, error, time.time(), lease.comic_id, lease.ep_id, JOB_LEASED, worker_id, lease.attempt)
+        )])
+        return row_counts[0] > 0
+
+    def release(self, worker_id: str) -> int:
+        """归还 worker 持有的全部租约, 用于 worker 正常退出, 归还的章节不计入领取次数
+
+        attempts 保持不变, 只记录归还次数, 使同一 worker 之后重新领取时旧租约的防护令牌仍然失效
+
+        :return: 归还的章节数
+        """
+        return self._transaction([(
+            'UPDATE chapters SET status=?, owner=NULL, lease_until=NULL, released=released+1, updated_at=? '
+            'WHERE status=? AND owner=?',
+            (JOB_PENDING, time.time(), JOB_LEASED, worker_id)
+        )])[0]
+
+    def stats(self) -> QueueStats:
+        with self._lock:
+            rows = self.connection.execute('SELECT status, COUNT(*) FROM chapters GROUP BY status').fetchall()
+        counts = dict(rows)
+        return QueueStats(
+            pending=counts.get(JOB_PENDING, 0), leased=counts.get(JOB_LEASED, 0),
+            done=counts.get(JOB_DONE, 0), failed=counts.get(JOB_FAILED, 0)
+        )
+
+    def failed_chapters(self) -> list[tuple[int, int, str | None]]:
+        """已失败的章节及最后一次失败的原因"""
+        with self._lock:
+            return self.connection.execute(
+                'SELECT comic_id, ep_id, error FROM chapters WHERE status=? ORDER BY rowid', (JOB_FAILED,)
+            ).fetchall()
+
+
+__all__ = [
+    'JOB_DONE',
+    'JOB_FAILED',
+    'JOB_LEASED',
+    'JOB_PENDING',
+    'ChapterEntry',
+    'JobQueue',
+    'Lease',
+    'QueueOptions',
+    'QueueStats'
+]
@@ -0,0 +1,99 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 00:30
+@FileName       : json_codec.py
+@Project        : BilibiliMangaDownloader
+@Description    : pluggable json decoder and encoder
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import os
+import json
+from importlib import import_module
+from typing import Any, Callable
+
+
+JSON_BACKENDS: tuple[str, ...] = ('orjson', 'ujson', 'json')
+"""按优先级排列的 json 实现, 默认使用第一个可以导入的实现"""
+
+
+def _orjson_codec() -> tuple[Callable[[str | bytes], Any], Callable[[Any], str]]:
+    orjson = import_module('orjson')
+    return orjson.loads, lambda obj: orjson.dumps(obj).decode('utf-8')
+
+
+def _ujson_codec() -> tuple[Callable[[str | bytes], Any], Callable[[Any], str]]:
+    ujson = import_module('ujson')
+    return ujson.loads, lambda obj: ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False)
+
+
+def _json_codec() -> tuple[Callable[[str | bytes], Any], Callable[[Any], str]]:
+    return json.loads, lambda obj: json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+_CODEC_FACTORIES: dict[str, Callable[[], tuple[Callable[[str | bytes], Any], Callable[[Any], str]]]] = {
+    'orjson': _orjson_codec,
+    'ujson': _ujson_codec,
+    'json': _json_codec
+}
+
+_backend: str = 'json'
+_loads: Callable[[str | bytes], Any] = json.loads
+_dumps: Callable[[Any], str] = _json_codec()[1]
+
+
+def set_json_backend(name: str | None = None) -> str:
+    """选择 json 实现
+
+    :param name: orjson、ujson 或 json, 为 None 时使用环境变量 BILIBILI_MANGA_JSON 指定的实现,
+        未指定时按 JSON_BACKENDS 的顺序使用第一个可以导入的实现
+    :return: 实际使用的实现
+    """
+    global _backend, _loads, _dumps
+
+    name = os.environ.get('BILIBILI_MANGA_JSON') if name is None else name
+    if name:
+        if name not in _CODEC_FACTORIES:
+            raise ValueError(f'Unsupported json backend: {name}, must be one of {", ".join(JSON_BACKENDS)}')
+        candidates = (name,)
+    else:
+        candidates = JSON_BACKENDS
+
+    for candidate in candidates:
+        try:
+            _loads, _dumps = _CODEC_FACTORIES[candidate]()
+        except ImportError:
+            if name:
+                raise
+            continue
+        _backend = candidate
+        break
+    return _backend
+
+
+def json_backend() -> str:
+    """当前使用的 json 实现"""
+    return _backend
+
+
+def json_loads(data: str | bytes) -> Any:
+    """解析 json 数据, 接受 str 或 bytes"""
+    return _loads(data)
+
+
+def json_dumps(obj: Any) -> str:
+    """序列化为紧凑的 json 字符串, 不转义非 ASCII 字符"""
+    return _dumps(obj)
+
+
+set_json_backend()
+
+
+__all__ = [
+    'JSON_BACKENDS',
+    'json_backend',
+    'json_dumps',
+    'json_loads',
+    'set_json_backend'
+]
@@ -2,14 +2,22 @@
 @Author         : Ailitonia
 @Date           : 2022/05/25 19:25
 @FileName       : logger.py
-@Project        : BilibiliMangaDownloader 
+@Project        : BilibiliMangaDownloader
 @Description    : logger
 @GitHub         : https://github.com/Ailitonia
-@Software       : PyCharm 
+@Software       : PyCharm
 """
 
 import sys
+import atexit
+import queue
+import threading
 import loguru
+from typing import Any, Callable, TextIO
+
+from pydantic import BaseModel
+
+from .json_codec import json_dumps
 
 
 logger = loguru.logger
@@ -30,6 +38,198 @@ logger_id = logger.add(
     format=default_format,
 )
 
+
+class LoggingConfig(BaseModel):
+    """日志配置"""
+    level: str | int = 0
+    """终端日志级别"""
+    module_levels: dict[str, str | int] = {}
+    """按模块名前缀单独指定的日志级别, 例如 {"bilibili_manga_downloader.http_fetcher": "WARNING"}"""
+    background: bool = False
+    """是否在后台线程中写入终端日志, 避免终端输出缓慢时阻塞事件循环"""
+    queue_size: int = 10000
+    """后台写入队列长度上限, 队列已满时丢弃新的日志并在之后提示丢弃数量"""
+    json_file: str | None = None
+    """JSON lines 格式日志文件路径, 每行一条日志, 为 None 时不输出"""
+    json_level: str | int = 'DEBUG'
+    """JSON lines 日志级别"""
+
+
+class BackgroundSink(object):
+    """在后台线程中写入日志的 sink, 事件循环中只需将已格式化的日志放入队列"""
+
+    def __init__(self, stream: TextIO, *, queue_size: int = 10000, close_stream: bool = False):
+        """
+        :param stream: 写入的流
+        :param queue_size: 队列长度上限, 队列已满时丢弃新的日志
+        :param close_stream: 停止时是否关闭 stream
+        """
+        self.stream = stream
+        self.close_stream = close_stream
+        self.dropped = 0
+        self._queue: queue.Queue[str | None] = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._work, name='logger-writer', daemon=True)
+        self._thread.start()
+
+    def __repr__(self) -> str:
+        return f'<BackgroundSink(stream={self.stream!r}, queued={self._queue.qsize()}, dropped={self.dropped})>'
+
+    def write(self, message: str) -> None:
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self) -> tuple[list[str], bool]:
+        """阻塞等待至少一条日志, 然后取出队列中已有的全部日志, 返回日志及是否收到停止标记"""
+        messages: list[str] = []
+        message = self._queue.get()
+        while message is not None:
+            messages.append(message)
+            try:
+                message = self._queue.get_nowait()
+            except queue.Empty:
+                return messages, False
+        return messages, True
+
+    def _work(self) -> None:
+        stopped = False
+        while not stopped:
+            messages, stopped = self._drain()
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                messages.append(f'... {dropped} log messages dropped, log queue is full\n')
+            # 连续的日志合并为一次写入及 flush
+            if messages:
+                self.stream.write(''.join(messages))
+                self.stream.flush()
+        if self.close_stream:
+            self.stream.close()
+
+    def stop(self) -> None:
+        """写入队列中剩余的日志后停止后台线程"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+
+def _json_line(record: dict[str, Any]) -> str:
+    """将日志记录序列化为一行 JSON, 日志内容已移除颜色标记, 不修改日志记录"""
+    data = {
+        'time': record['time'].timestamp(),
+        'level': record['level'].name,
+        'name': record['name'],
+        'function': record['function'],
+        'line': record['line'],
+        'message': record['message']
+    }
+    if record['extra']:
+        data['extra'] = {k: v for k, v in record['extra'].items() if not k.startswith('_')}
+    if record['exception'] is not None:
+        data['exception'] = repr(record['exception'].value)
+    return f'{json_dumps(data)}\n'
+
+
+class JsonLinesSink(object):
+    """JSON lines 格式的 sink, 直接序列化日志记录后写入, 日志记录由全部 sink 共享, 不能写入格式化的中间结果"""
+
+    def __init__(self, write: Callable[[str], Any], *, flush: Callable[[], Any] | None = None):
+        """
+        :param write: 写入一行日志的函数, 例如文件的 write 或 BackgroundSink.write
+        :param flush: 每次写入后调用的函数, 后台写入时由后台线程 flush, 不需要提供
+        """
+        self._write = write
+        self._flush = flush
+
+    def __call__(self, message: Any) -> None:
+        self._write(_json_line(message.record))
+        if self._flush is not None:
+            self._flush()
+
+
+_handler_ids: list[int] = [logger_id]
+_background_sinks: list[BackgroundSink] = []
+_opened_streams: list[TextIO] = []
+
+
+def _level_filter(level: str | int, module_levels: dict[str, str | int]) -> tuple[int, dict[str, str | int]]:
+    """返回 sink 的最低级别及按模块过滤的级别
+
+    sink 的最低级别取全部级别中的最小值, 低于该级别的日志在创建记录前就被忽略, 不产生任何格式化开销
+    """
+    levels = [level, *module_levels.values()]
+    min_level = min(x if isinstance(x, int) else logger.level(x).no for x in levels)
+    return min_level, {'': level, **module_levels}
+
+
+def shutdown_logging() -> None:
+    """移除全部日志 sink, 并等待后台线程写入剩余的日志"""
+    for handler_id in _handler_ids:
+        try:
+            logger.remove(handler_id)
+        except ValueError:
+            pass
+    _handler_ids.clear()
+    for sink in _background_sinks:
+        sink.stop()
+    _background_sinks.clear()
+    for stream in _opened_streams:
+        stream.close()
+    _opened_streams.clear()
+
+
+def configure_logging(config: LoggingConfig | None = None) -> None:
+    """按配置替换默认的日志 sink
+
+    终端 sink 只输出不低于对应级别的日志; 日志调用在级别过滤之前不会格式化以大括号占位的参数,
+    因此高频调用应使用 logger.debug('... {}', value) 而不是 f-string
+    """
+    config = LoggingConfig() if config is None else config
+    shutdown_logging()
+
+    def _sink(stream: TextIO, *, close_stream: bool = False):
+        if not config.background:
+            return stream
+        sink = BackgroundSink(stream, queue_size=config.queue_size, close_stream=close_stream)
+        _background_sinks.append(sink)
+        return sink.write
+
+    min_level, level_filter = _level_filter(config.level, config.module_levels)
+    _handler_ids.append(logger.add(
+        _sink(sys.stdout),
+        level=min_level,
+        filter=level_filter,
+        colorize=True,
+        diagnose=False,
+        format=default_format,
+    ))
+
+    if config.json_file is not None:
+        min_level, level_filter = _level_filter(config.json_level, config.module_levels)
+        stream = open(config.json_file, 'a', encoding='utf-8')
+        if config.background:
+            json_sink = JsonLinesSink(_sink(stream, close_stream=True))
+        else:
+            _opened_streams.append(stream)
+            json_sink = JsonLinesSink(stream.write, flush=stream.flush)
+        _handler_ids.append(logger.add(
+            json_sink,
+            level=min_level,
+            filter=level_filter,
+            colorize=False,
+            diagnose=False,
+            format='{message}',
+        ))
+
+
+atexit.register(shutdown_logging)
+
+
 __all__ = [
-    'logger'
+    'BackgroundSink',
+    'JsonLinesSink',
+    'LoggingConfig',
+    'configure_logging',
+    'logger',
+    'shutdown_logging'
 ]
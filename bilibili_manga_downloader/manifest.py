@@ -0,0 +1,243 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/17 13:00
+@FileName       : manifest.py
+@Project        : BilibiliMangaDownloader
+@Description    : persistent per-page download manifest
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import time
+import hashlib
+import pathlib
+import sqlite3
+from typing import NamedTuple
+
+from .file_handler import FileHandler
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    comic_id INTEGER NOT NULL,
+    ep_id INTEGER NOT NULL,
+    image_path TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    status TEXT NOT NULL,
+    size INTEGER,
+    checksum TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (comic_id, ep_id, image_path)
+);
+CREATE TABLE IF NOT EXISTS archives (
+    comic_id INTEGER NOT NULL,
+    ep_id INTEGER NOT NULL,
+    file_path TEXT NOT NULL,
+    status TEXT NOT NULL,
+    page_count INTEGER,
+    fail_count INTEGER,
+    size INTEGER,
+    checksum TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (comic_id, ep_id)
+);
+"""
+
+STATUS_DONE: str = 'done'
+"""下载并写入完成"""
+STATUS_FAILED: str = 'failed'
+"""下载或写入失败"""
+
+
+def file_checksum(path: pathlib.Path, *, chunk_size: int = 1024 * 1024) -> str:
+    """计算文件 sha256"""
+    digest = hashlib.sha256()
+    with path.open('rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PageRecord(NamedTuple):
+    """图片下载记录"""
+    file_path: str
+    status: str
+    size: int | None
+    checksum: str | None
+
+
+class ArchiveRecord(NamedTuple):
+    """章节压缩文件记录"""
+    file_path: str
+    status: str
+    page_count: int | None
+    fail_count: int | None
+    size: int | None
+    checksum: str | None
+
+
+class DownloadManifest(object):
+    """下载清单, 使用 SQLite 持久化记录每张图片及每个章节压缩文件的下载状态
+
+    每条记录只在对应文件已完整写入并重命名后才会以单条语句提交,
+    因此进程在任意时刻被中断时清单中都不会出现指向不完整文件的已完成记录
+    """
+
+    def __init__(self, file: FileHandler):
+        """
+        :param file: 清单数据库文件
+        """
+        self.file = file
+        self._connection: sqlite3.Connection | None = None
+
+    def __repr__(self) -> str:
+        return f'<DownloadManifest(file={self.file})>'
+
+    def __enter__(self) -> "DownloadManifest":
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            raise RuntimeError('Manifest is not opened')
+        return self._connection
+
+    def open(self) -> None:
+        if self._connection is not None:
+            return
+        if not self.file.path.parent.exists():
+            pathlib.Path.mkdir(self.file.path.parent, parents=True)
+        # isolation_level=None 时每条语句自动提交, 配合 WAL 保证中断后数据库状态一致
+        self._connection = sqlite3.connect(self.file.path, isolation_level=None, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def get_page(self, comic_id: int, ep_id: int, image_path: str) -> PageRecord | None:
+        row = self.connection.execute(
+            'SELECT file_path, status, size, checksum FROM pages WHERE comic_id=? AND ep_id=? AND image_path=?',
+            (comic_id, ep_id, image_path)
+        ).fetchone()
+        return None if row is None else PageRecord(*row)
+
+    def get_pages(self, comic_id: int, ep_id: int) -> dict[str, PageRecord]:
+        rows = self.connection.execute(
+            'SELECT image_path, file_path, status, size, checksum FROM pages WHERE comic_id=? AND ep_id=?',
+            (comic_id, ep_id)
+        ).fetchall()
+        return {row[0]: PageRecord(*row[1:]) for row in rows}
+
+    def list_pages(self, comic_id: int | None = None) -> list[tuple[int, int, str, PageRecord]]:
+        """按章节顺序获取全部图片记录, 用于校验已下载的文件
+
+        :param comic_id: 漫画 id, 默认为全部漫画
+        :return: 各图片的漫画 id、章节 id、图片 path 及下载记录
+        """
+        sql = 'SELECT comic_id, ep_id, image_path, file_path, status, size, checksum FROM pages'
+        params: tuple = ()
+        if comic_id is not None:
+            sql += ' WHERE comic_id=?'
+            params = (comic_id,)
+        rows = self.connection.execute(f'{sql} ORDER BY comic_id, ep_id', params).fetchall()
+        return [(row[0], row[1], row[2], PageRecord(*row[3:])) for row in rows]
+
+    def record_page(
+            self,
+            comic_id: int,
+            ep_id: int,
+            image_path: str,
+            *,
+            file_path: str,
+            status: str,
+            size: int | None = None,
+            checksum: str | None = None
+    ) -> None:
+        self.connection.execute(
+            'INSERT OR REPLACE INTO pages (comic_id, ep_id, image_path, file_path, status, size, checksum, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (comic_id, ep_id, image_path, file_path, status, size, checksum, time.time())
+        )
+
+    def get_archive(self, comic_id: int, ep_id: int) -> ArchiveRecord | None:
+        row = self.connection.execute(
+            'SELECT file_path, status, page_count, fail_count, size, checksum FROM archives '
+            'WHERE comic_id=? AND ep_id=?',
+            (comic_id, ep_id)
+        ).fetchone()
+        return None if row is None else ArchiveRecord(*row)
+
+    def get_archives(self, comic_id: int) -> dict[int, ArchiveRecord]:
+        rows = self.connection.execute(
+            'SELECT ep_id, file_path, status, page_count, fail_count, size, checksum FROM archives WHERE comic_id=?',
+            (comic_id,)
+        ).fetchall()
+        return {row[0]: ArchiveRecord(*row[1:]) for row in rows}
+
+    def record_archive(
+            self,
+            comic_id: int,
+            ep_id: int,
+            *,
+            file_path: str,
+            status: str,
+            page_count: int | None = None,
+            fail_count: int | None = None,
+            size: int | None = None,
+            checksum: str | None = None
+    ) -> None:
+        self.connection.execute(
+            'INSERT OR REPLACE INTO archives '
+            '(comic_id, ep_id, file_path, status, page_count, fail_count, size, checksum, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (comic_id, ep_id, file_path, status, page_count, fail_count, size, checksum, time.time())
+        )
+
+    @staticmethod
+    def verify_file(
+            record: PageRecord | ArchiveRecord | None,
+            file: FileHandler,
+            *,
+            verify_checksum: bool = False
+    ) -> bool:
+        """校验记录是否已完成且与磁盘上的文件一致
+
+        :param record: 清单记录
+        :param file: 期望的文件位置
+        :param verify_checksum: 是否读取文件内容校验 sha256, 否则只比较文件大小
+        """
+        if record is None or record.status != STATUS_DONE or record.file_path != file.resolve_path:
+            return False
+        try:
+            if file.path.stat().st_size != record.size:
+                return False
+        except OSError:
+            return False
+        if verify_checksum and record.checksum is not None:
+            return file_checksum(file.path) == record.checksum
+        return True
+
+    @classmethod
+    def verify_archive(cls, record: ArchiveRecord | None, file: FileHandler) -> bool:
+        """章节压缩文件是否已完整下载且与磁盘上的文件一致, 有失败图片的章节不视为已完成"""
+        if record is None or record.fail_count:
+            return False
+        return cls.verify_file(record, file)
+
+
+__all__ = [
+    'STATUS_DONE',
+    'STATUS_FAILED',
+    'ArchiveRecord',
+    'DownloadManifest',
+    'PageRecord',
+    'file_checksum'
+]
@@ -0,0 +1,190 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/17 15:00
+@FileName       : metadata_cache.py
+@Project        : BilibiliMangaDownloader
+@Description    : on-disk api metadata cache
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import json
+import time
+import pathlib
+import sqlite3
+from typing import Any
+
+from .file_handler import FileHandler
+from .json_codec import json_dumps, json_loads
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (
+    endpoint TEXT NOT NULL,
+    params TEXT NOT NULL,
+    value TEXT NOT NULL,
+    stored_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (endpoint, params)
+);
+CREATE INDEX IF NOT EXISTS metadata_accessed_at ON metadata (accessed_at);
+"""
+
+DEFAULT_TTL: dict[str, float] = {
+    'ComicDetail': 10 * 60,
+    'GetImageIndex': 30 * 24 * 60 * 60,
+}
+"""各接口缓存的默认有效时间, 单位秒; 章节列表会随更新变化, 已发布章节的图片列表几乎不会变化"""
+
+
+class MetadataCache(object):
+    """api 元数据磁盘缓存
+
+    以接口名称及请求参数为键缓存接口返回的原始数据, 每个接口使用独立的有效时间,
+    缓存条目数超过上限时按最近访问时间淘汰至上限的 90%
+    """
+
+    def __init__(
+            self,
+            file: FileHandler,
+            *,
+            ttl: dict[str, float] | None = None,
+            default_ttl: float = 10 * 60,
+            max_entries: int = 100000,
+            force_refresh: bool = False,
+            offline: bool = False
+    ):
+        """
+        :param file: 缓存数据库文件
+        :param ttl: 各接口缓存的有效时间, 单位秒, 未配置的接口使用 DEFAULT_TTL 或 default_ttl
+        :param default_ttl: 未配置接口的缓存有效时间
+        :param max_entries: 缓存条目数上限
+        :param force_refresh: 忽略已有缓存, 总是重新请求并更新缓存
+        :param offline: 离线模式, 忽略有效时间使用全部已有缓存
+        """
+        self.file = file
+        self.ttl = {**DEFAULT_TTL, **(ttl or {})}
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.force_refresh = force_refresh
+        self.offline = offline
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.expired: int = 0
+        self._connection: sqlite3.Connection | None = None
+        self._entry_count: int = 0
+        """缓存条目数的估计值, 只增加不减少直到重新统计, 覆盖已有条目时会多计, 因此不小于实际条目数"""
+
+    def __repr__(self) -> str:
+        return f'<MetadataCache(file={self.file}, hits={self.hits}, misses={self.misses})>'
+
+    def __enter__(self) -> "MetadataCache":
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            raise RuntimeError('Metadata cache is not opened')
+        return self._connection
+
+    def open(self) -> None:
+        if self._connection is not None:
+            return
+        if not self.file.path.parent.exists():
+            pathlib.Path.mkdir(self.file.path.parent, parents=True)
+        self._connection = sqlite3.connect(self.file.path, isolation_level=None, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(_SCHEMA)
+        self._entry_count = self._count_entries()
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    @staticmethod
+    def _key(params: dict[str, Any]) -> str:
+        return json.dumps(params, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+
+    def get_ttl(self, endpoint: str) -> float:
+        return self.ttl.get(endpoint, self.default_ttl)
+
+    def get(self, endpoint: str, params: dict[str, Any]) -> Any | None:
+        """获取缓存的接口数据, 不存在或已过期时返回 None
+
+        :param endpoint: 接口名称
+        :param params: 请求参数
+        """
+        if self.force_refresh:
+            self.misses += 1
+            return None
+
+        key = self._key(params)
+        row = self.connection.execute(
+            'SELECT value, stored_at FROM metadata WHERE endpoint=? AND params=?', (endpoint, key)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        value, stored_at = row
+        now = time.time()
+        if not self.offline and now - stored_at >= self.get_ttl(endpoint):
+            self.expired += 1
+            self.misses += 1
+            return None
+
+        self.connection.execute(
+            'UPDATE metadata SET accessed_at=? WHERE endpoint=? AND params=?', (now, endpoint, key)
+        )
+        self.hits += 1
+        return json_loads(value)
+
+    def set(self, endpoint: str, params: dict[str, Any], value: Any) -> None:
+        """写入接口数据, 并在超过条目数上限时淘汰最久未访问的条目"""
+        now = time.time()
+        self.connection.execute(
+            'INSERT OR REPLACE INTO metadata (endpoint, params, value, stored_at, accessed_at) VALUES (?, ?, ?, ?, ?)',
+            (endpoint, self._key(params), json_dumps(value), now, now)
+        )
+        self._entry_count += 1
+        if self._entry_count > self.max_entries:
+            self._evict()
+
+    def _count_entries(self) -> int:
+        return self.connection.execute('SELECT COUNT(*) FROM metadata').fetchone()[0]
+
+    def _evict(self) -> None:
+        """重新统计条目数并淘汰最久未访问的条目至上限的 90%, 之后至少再写入上限的 10% 才需要再次统计"""
+        count = self._count_entries()
+        target = self.max_entries - self.max_entries // 10
+        if count > target:
+            count -= self.connection.execute(
+                'DELETE FROM metadata WHERE rowid IN (SELECT rowid FROM metadata ORDER BY accessed_at LIMIT ?)',
+                (count - target,)
+            ).rowcount
+        self._entry_count = count
+
+    def invalidate(self, endpoint: str, params: dict[str, Any] | None = None) -> None:
+        """删除指定接口的缓存, 未指定请求参数时删除该接口全部缓存"""
+        if params is None:
+            self.connection.execute('DELETE FROM metadata WHERE endpoint=?', (endpoint,))
+        else:
+            self.connection.execute(
+                'DELETE FROM metadata WHERE endpoint=? AND params=?', (endpoint, self._key(params))
+            )
+
+    def stats(self) -> dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'expired': self.expired}
+
+
+__all__ = [
+    'DEFAULT_TTL',
+    'MetadataCache'
+]
@@ -0,0 +1,308 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/17 20:00
+@FileName       : metrics.py
+@Project        : BilibiliMangaDownloader
+@Description    : per-stage metrics registry with json and prometheus textfile export
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import json
+import time
+import bisect
+import asyncio
+import pathlib
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import Any, Iterator
+
+from aiohttp import TraceConfig
+from aiohttp import TraceConnectionCreateEndParams, TraceDnsResolveHostEndParams, TraceRequestEndParams
+
+from .logger import logger
+
+
+DEFAULT_BUCKETS: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+"""延迟直方图的默认分桶上界, 单位秒"""
+METRIC_PREFIX: str = 'bilibili_manga'
+"""导出 Prometheus 指标时使用的名称前缀"""
+
+_LabelKey = tuple[tuple[str, str], ...]
+
+
+def _label_key(labels: dict[str, Any]) -> _LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram(object):
+    """固定分桶的直方图"""
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float | None:
+        """根据分桶估算分位数, 返回所在分桶的上界, 落在最后一个分桶之外时返回 inf"""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for upper, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return upper
+        return float('inf')
+
+    def cumulative_counts(self) -> list[tuple[str, int]]:
+        """Prometheus 格式的累计分桶计数"""
+        result = []
+        cumulative = 0
+        for upper, count in zip(self.buckets, self.counts):
+            cumulative += count
+            result.append((repr(upper), cumulative))
+        result.append(('+Inf', self.count))
+        return result
+
+
+class MetricsRegistry(object):
+    """指标注册表, 按名称及标签记录计数器、仪表及直方图"""
+
+    def __init__(self):
+        self._counters: dict[str, dict[_LabelKey, float]] = {}
+        self._gauges: dict[str, dict[_LabelKey, float]] = {}
+        self._histograms: dict[str, dict[_LabelKey, Histogram]] = {}
+        self._help: dict[str, str] = {}
+        self.started_at = time.time()
+
+    def __repr__(self) -> str:
+        return (f'<MetricsRegistry(counters={len(self._counters)}, gauges={len(self._gauges)}, '
+                f'histograms={len(self._histograms)})>')
+
+    def describe(self, name: str, help_text: str) -> None:
+        """设置指标的说明, 导出 Prometheus 格式时写入 HELP 行"""
+        self._help[name] = help_text
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        """计数器增加 value"""
+        series = self._counters.setdefault(name, {})
+        key = _label_key(labels)
+        series[key] = series.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels: Any) -> None:
+        self._gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        """向直方图记录一个样本"""
+        series = self._histograms.setdefault(name, {})
+        key = _label_key(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram()
+        histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels: Any) -> Iterator[None]:
+        """记录块内耗时, 单位秒, 可以包裹 await"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def get_counter(self, name: str, **labels: Any) -> float:
+        return self._counters.get(name, {}).get(_label_key(labels), 0)
+
+    def get_histogram(self, name: str, **labels: Any) -> Histogram | None:
+        return self._histograms.get(name, {}).get(_label_key(labels))
+
+    def clear(self) -> None:
+        self._counters.clear()
+        self._gauges.clear()
+        self._histograms.clear()
+        self.started_at = time.time()
+
+    def snapshot(self) -> dict[str, Any]:
+        """当前全部指标的快照"""
+        return {
+            'started_at': self.started_at,
+            'time': time.time(),
+            'counters': {
+                name: [{'labels': dict(key), 'value': value} for key, value in series.items()]
+                for name, series in self._counters.items()
+            },
+            'gauges': {
+                name: [{'labels': dict(key), 'value': value} for key, value in series.items()]
+                for name, series in self._gauges.items()
+            },
+            'histograms': {
+                name: [{
+                    'labels': dict(key),
+                    'count': x.count,
+                    'sum': x.sum,
+                    'p50': x.quantile(0.5),
+                    'p95': x.quantile(0.95),
+                    'p99': x.quantile(0.99),
+                    'buckets': dict(x.cumulative_counts())
+                } for key, x in series.items()]
+                for name, series in self._histograms.items()
+            }
+        }
+
+    def to_prometheus(self) -> str:
+        """Prometheus 文本格式"""
+
+        def _format_labels(key: _LabelKey, extra: tuple[tuple[str, str], ...] = ()) -> str:
+            items = key + extra
+            if not items:
+                return ''
+            escaped = (f'{k}="{_escape_label_value(v)}"' for k, v in items)
+            return '{' + ','.join(escaped) + '}'
+
+        lines: list[str] = []
+        for metric_type, metrics in (('counter', self._counters), ('gauge', self._gauges)):
+            for name, series in metrics.items():
+                full_name = f'{METRIC_PREFIX}_{name}'
+                if name in self._help:
+                    lines.append(f'# HELP {full_name} {self._help[name]}')
+                lines.append(f'# TYPE {full_name} {metric_type}')
+                lines.extend(f'{full_name}{_format_labels(key)} {value}' for key, value in series.items())
+
+        for name, series in self._histograms.items():
+            full_name = f'{METRIC_PREFIX}_{name}'
+            if name in self._help:
+                lines.append(f'# HELP {full_name} {self._help[name]}')
+            lines.append(f'# TYPE {full_name} histogram')
+            for key, histogram in series.items():
+                for upper, count in histogram.cumulative_counts():
+                    lines.append(f'{full_name}_bucket{_format_labels(key, (("le", upper),))} {count}')
+                lines.append(f'{full_name}_sum{_format_labels(key)} {histogram.sum}')
+                lines.append(f'{full_name}_count{_format_labels(key)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _atomic_write(path: pathlib.Path, content: str) -> None:
+        # node exporter 可能在任意时刻读取文件, 先写入临时文件再重命名
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f'{path.name}.tmp')
+        temp_path.write_text(content, encoding='utf-8')
+        temp_path.replace(path)
+
+    def export_json(self, path: pathlib.Path) -> None:
+        self._atomic_write(path, json.dumps(self.snapshot(), ensure_ascii=False, indent=2))
+
+    def export_prometheus(self, path: pathlib.Path) -> None:
+        self._atomic_write(path, self.to_prometheus())
+
+    def export(self, *, json_file: pathlib.Path | None = None, prometheus_file: pathlib.Path | None = None) -> None:
+        if json_file is not None:
+            self.export_json(json_file)
+        if prometheus_file is not None:
+            self.export_prometheus(prometheus_file)
+
+    async def export_periodically(
+            self,
+            *,
+            json_file: pathlib.Path | None = None,
+            prometheus_file: pathlib.Path | None = None,
+            interval: float = 15
+    ) -> None:
+        """定时导出指标, 直到被取消, 取消时再导出一次最终结果
+
+        :param json_file: JSON 文件路径
+        :param prometheus_file: Prometheus textfile 路径
+        :param interval: 导出间隔, 单位秒
+        """
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    self.export(json_file=json_file, prometheus_file=prometheus_file)
+                except OSError as e:
+                    logger.warning(f'导出指标失败, {e}')
+        finally:
+            self.export(json_file=json_file, prometheus_file=prometheus_file)
+
+
+metrics_registry = MetricsRegistry()
+"""全局默认指标注册表"""
+metrics_registry.describe('http_dns_seconds', 'DNS resolution time')
+metrics_registry.describe('http_connect_seconds', 'Time to establish a new connection')
+metrics_registry.describe('http_ttfb_seconds', 'Time from request start to response headers')
+metrics_registry.describe('http_requests_total', 'Finished http requests')
+metrics_registry.describe('http_body_seconds', 'Response body transfer time')
+metrics_registry.describe('http_bytes_total', 'Response body bytes received')
+metrics_registry.describe('rate_limit_wait_seconds', 'Time spent waiting for a request rate limit token')
+metrics_registry.describe('rate_limited_total', 'Requests delayed by the request rate limit')
+metrics_registry.describe('identity_assigned_total', 'Chapters assigned to each request identity')
+metrics_registry.describe('identity_quarantined_total', 'Times a request identity was taken out of rotation')
+metrics_registry.describe('retries_total', 'Retries performed by the retry decorator')
+metrics_registry.describe('token_resolve_seconds', 'Image token resolution time per request')
+metrics_registry.describe('tokens_resolved_total', 'Image tokens requested from the api')
+metrics_registry.describe('token_refresh_total', 'Image downloads retried with a freshly resolved token')
+metrics_registry.describe('disk_write_seconds', 'Time spent writing image data to disk')
+metrics_registry.describe('archive_seconds', 'Time to finish one chapter archive')
+metrics_registry.describe('blob_hits_total', 'Pages linked from the blob store instead of downloaded')
+metrics_registry.describe('stage_seconds', 'Handler time per pipeline stage item')
+metrics_registry.describe('stage_items_total', 'Items processed per pipeline stage')
+metrics_registry.describe('stage_queue_depth', 'Items waiting in each pipeline stage queue')
+metrics_registry.describe('stage_backpressure_total', 'Submissions that waited on a full stage queue')
+
+
+def create_trace_config(registry: MetricsRegistry = metrics_registry) -> TraceConfig:
+    """创建记录 DNS 解析、建立连接及首字节耗时的 aiohttp TraceConfig"""
+
+    async def _on_request_start(session, context: SimpleNamespace, params) -> None:
+        context.start = time.perf_counter()
+
+    async def _on_dns_start(session, context: SimpleNamespace, params) -> None:
+        context.dns_start = time.perf_counter()
+
+    async def _on_dns_end(session, context: SimpleNamespace, params: TraceDnsResolveHostEndParams) -> None:
+        registry.observe('http_dns_seconds', time.perf_counter() - context.dns_start, host=params.host)
+
+    async def _on_connection_start(session, context: SimpleNamespace, params) -> None:
+        context.connect_start = time.perf_counter()
+
+    async def _on_connection_end(session, context: SimpleNamespace, params: TraceConnectionCreateEndParams) -> None:
+        registry.observe('http_connect_seconds', time.perf_counter() - context.connect_start)
+
+    async def _on_request_end(session, context: SimpleNamespace, params: TraceRequestEndParams) -> None:
+        # on_request_end 在收到响应头后触发, 不包含读取响应体的时间
+        host = params.url.host
+        registry.observe('http_ttfb_seconds', time.perf_counter() - context.start, host=host)
+        registry.inc('http_requests_total', host=host, status=params.response.status)
+
+    async def _on_request_exception(session, context: SimpleNamespace, params) -> None:
+        registry.inc('http_requests_total', host=params.url.host, status=params.exception.__class__.__name__)
+
+    trace_config = TraceConfig()
+    trace_config.on_request_start.append(_on_request_start)
+    trace_config.on_dns_resolvehost_start.append(_on_dns_start)
+    trace_config.on_dns_resolvehost_end.append(_on_dns_end)
+    trace_config.on_connection_create_start.append(_on_connection_start)
+    trace_config.on_connection_create_end.append(_on_connection_end)
+    trace_config.on_request_end.append(_on_request_end)
+    trace_config.on_request_exception.append(_on_request_exception)
+    return trace_config
+
+
+__all__ = [
+    'DEFAULT_BUCKETS',
+    'Histogram',
+    'MetricsRegistry',
+    'create_trace_config',
+    'metrics_registry'
+]
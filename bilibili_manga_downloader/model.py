@@ -2,98 +2,285 @@
 @Author         : Ailitonia
 @Date           : 2022/05/25 19:51
 @FileName       : model.py
-@Project        : BilibiliMangaDownloader 
+@Project        : BilibiliMangaDownloader
 @Description    : downloader model
 @GitHub         : https://github.com/Ailitonia
-@Software       : PyCharm 
+@Software       : PyCharm
 """
 
-from pydantic import BaseModel, AnyUrl
+from typing import Any, Callable
 
 
-class _VerifyData(BaseModel):
+class ModelParseError(ValueError):
+    """接口返回数据与 model 不符"""
+
+
+def _int(value: Any) -> int:
+    if isinstance(value, int):
+        return int(value)
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        return int(value.strip())
+    raise TypeError(f'value is not a valid integer: {value!r}')
+
+
+def _str(value: Any) -> str:
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise TypeError(f'value is not a valid string: {value!r}')
+
+
+_TRUE_VALUES = frozenset((1, '1', 'on', 't', 'true', 'y', 'yes'))
+_FALSE_VALUES = frozenset((0, '0', 'off', 'f', 'false', 'n', 'no'))
+
+
+def _bool(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        value = value.lower()
+    if value in _TRUE_VALUES:
+        return True
+    if value in _FALSE_VALUES:
+        return False
+    raise TypeError(f'value is not a valid boolean: {value!r}')
+
+
+def _list_of(converter: Callable[[Any], Any]) -> Callable[[Any], list]:
+    def _convert(value: Any) -> list:
+        if not isinstance(value, list):
+            raise TypeError(f'value is not a valid list: {type(value).__name__}')
+        return [converter(x) for x in value]
+    return _convert
+
+
+class _Model(object):
+    """使用 __slots__ 的轻量 model 基类, 只在 parse_obj 时按 _fields 转换一次字段, 不做其他校验
+
+    :cvar _fields: 字段名称及其转换函数
+    :cvar _optional: 允许缺失或为 null 的字段
+    """
+
+    __slots__ = ()
+    _fields: dict[str, Callable[[Any], Any]] = {}
+    _optional: frozenset[str] = frozenset()
+
+    def __init__(self, **kwargs: Any):
+        for name in self._fields:
+            setattr(self, name, kwargs.get(name))
+
+    @classmethod
+    def _parse_fields(cls, obj: Any, fields: dict[str, Callable[[Any], Any]], model: "_Model | None" = None):
+        if not isinstance(obj, dict):
+            raise ModelParseError(f'{cls.__name__} expected dict, not {type(obj).__name__}')
+
+        model = cls.__new__(cls) if model is None else model
+        for name, converter in fields.items():
+            value = obj.get(name)
+            if value is None:
+                if name not in cls._optional:
+                    raise ModelParseError(f'{cls.__name__}.{name} field required')
+            else:
+                try:
+                    value = converter(value)
+                except ModelParseError as e:
+                    raise ModelParseError(f'{cls.__name__}.{name} -> {e}') from e
+                except (TypeError, ValueError) as e:
+                    raise ModelParseError(f'{cls.__name__}.{name}: {e}') from e
+            setattr(model, name, value)
+        return model
+
+    @classmethod
+    def parse_obj(cls, obj: Any):
+        """从接口返回的 json 数据创建 model
+
+        :raise ModelParseError: 数据缺少必要字段或字段类型错误
+        """
+        return cls._parse_fields(obj, cls._fields)
+
+    def dict(self) -> dict[str, Any]:
+        def _export(value: Any) -> Any:
+            if isinstance(value, _Model):
+                return value.dict()
+            if isinstance(value, list):
+                return [_export(x) for x in value]
+            return value
+        return {name: _export(getattr(self, name)) for name in self._fields}
+
+    def __eq__(self, other: object) -> bool:
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self._fields)
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({", ".join(f"{x}={getattr(self, x)!r}" for x in self._fields)})'
+
+
+class _VerifyData(_Model):
     """cookie 验证 data"""
+    __slots__ = ('isLogin', 'uname', 'mid')
+    _fields = {'isLogin': _bool, 'uname': _str, 'mid': _str}
+    _optional = frozenset(('uname', 'mid'))
+
     isLogin: bool
     uname: str | None
     mid: str | None
 
 
-class VerifyResult(BaseModel):
+class VerifyResult(_Model):
     """cookie 验证结果"""
+    __slots__ = ('code', 'message', 'data')
+    _fields = {'code': _int, 'message': _str, 'data': _VerifyData.parse_obj}
+
     code: int
     message: str
     data: _VerifyData
 
 
-class _BiliApiBaseModel(BaseModel):
-    """bilibili api 返回数据 model 基类"""
+class _BiliApiBaseModel(_Model):
+    """bilibili api 返回数据 model 基类, code 不为 0 时不解析 data, data 为 None"""
+    __slots__ = ('code', 'msg', 'data')
+    _fields = {'code': _int, 'msg': _str}
+    _status_fields = {'code': _int, 'msg': _str}
+
     code: int
     msg: str
 
+    @classmethod
+    def parse_obj(cls, obj: Any):
+        model = cls._parse_fields(obj, cls._status_fields)
+        if model.code != 0:
+            model.data = None
+            return model
+        return cls._parse_fields(obj, {'data': cls._fields['data']}, model)
+
+
+class _EpInfo(_Model):
+    __slots__ = ('id', 'ord', 'title', 'short_title', 'cover')
+    _fields = {'id': _int, 'ord': _int, 'title': _str, 'short_title': _str, 'cover': _str}
+
+    id: int
+    ord: int
+    title: str
+    short_title: str
+    cover: str
+
+
+class _MangaEpData(_Model):
+    __slots__ = (
+        'id', 'title', 'horizontal_cover', 'square_cover', 'vertical_cover', 'last_ord', 'is_finish', 'evaluate',
+        'total', 'ep_list'
+    )
+    _fields = {
+        'id': _int,
+        'title': _str,
+        'horizontal_cover': _str,
+        'square_cover': _str,
+        'vertical_cover': _str,
+        'last_ord': _int,
+        'is_finish': _int,
+        'evaluate': _str,
+        'total': _int,
+        'ep_list': _list_of(_EpInfo.parse_obj)
+    }
+
+    id: int
+    title: str
+    horizontal_cover: str
+    square_cover: str
+    vertical_cover: str
+    last_ord: int
+    is_finish: int
+    evaluate: str
+    total: int
+    ep_list: list[_EpInfo]
+
 
 class MangaEp(_BiliApiBaseModel):
     """漫画的全部章节"""
+    __slots__ = ('_ep_index',)
+    _fields = {'code': _int, 'msg': _str, 'data': _MangaEpData.parse_obj}
+
+    _Data = _MangaEpData
+    data: _MangaEpData
 
-    class _Data(BaseModel):
-        class _EpInfo(BaseModel):
-            id: int
-            ord: int
-            title: str
-            short_title: str
-            cover: AnyUrl
-
-        id: int
-        title: str
-        horizontal_cover: AnyUrl
-        square_cover: AnyUrl
-        vertical_cover: AnyUrl
-        last_ord: int
-        is_finish: int
-        evaluate: str
-        total: int
-        ep_list: list[_EpInfo]
-
-    data: _Data
+    @property
+    def ep_index(self) -> dict[int, _EpInfo]:
+        """章节 id 到章节的索引, 第一次访问时创建"""
+        ep_index = getattr(self, '_ep_index', None)
+        if ep_index is None:
+            ep_index = self._ep_index = {x.id: x for x in self.data.ep_list}
+        return ep_index
 
     @property
     def all_ep_list(self) -> list[int]:
-        return [x.id for x in self.data.ep_list]
+        return list(self.ep_index)
 
 
-class EpImage(_BiliApiBaseModel):
-    """漫画章节的全部图片"""
+class _Images(_Model):
+    __slots__ = ('path', 'x', 'y')
+    _fields = {'path': _str, 'x': _int, 'y': _int}
 
-    class _Data(BaseModel):
-        class _Images(BaseModel):
-            path: str
-            x: int
-            y: int
+    path: str
+    x: int
+    y: int
 
-        path: str
-        images: list[_Images]
 
-    data: _Data
+class _EpImageData(_Model):
+    __slots__ = ('path', 'images')
+    _fields = {'path': _str, 'images': _list_of(_Images.parse_obj)}
+
+    path: str
+    images: list[_Images]
+
+
+class EpImage(_BiliApiBaseModel):
+    """漫画章节的全部图片"""
+    __slots__ = ('_all_image_path',)
+    _fields = {'code': _int, 'msg': _str, 'data': _EpImageData.parse_obj}
+
+    _Data = _EpImageData
+    data: _EpImageData
 
     @property
     def all_image_path(self) -> list[str]:
-        return [x.path for x in self.data.images]
+        """章节全部图片的 path, 第一次访问时创建"""
+        all_image_path = getattr(self, '_all_image_path', None)
+        if all_image_path is None:
+            all_image_path = self._all_image_path = [x.path for x in self.data.images]
+        return all_image_path
+
+
+class _TokenData(_Model):
+    __slots__ = ('url', 'token')
+    _fields = {'url': _str, 'token': _str}
+
+    url: str
+    token: str
 
 
 class ImageToken(_BiliApiBaseModel):
     """漫画章节图片获取 token"""
+    __slots__ = ()
+    _fields = {'code': _int, 'msg': _str, 'data': _list_of(_TokenData.parse_obj)}
 
-    class _Data(BaseModel):
-        url: str
-        token: str
-
-    data: list[_Data]
+    _Data = _TokenData
+    data: list[_TokenData]
 
     @property
     def resource_url(self) -> str:
         return f'{self.data[0].url}?token={self.data[0].token}'
 
+    @property
+    def all_resource_url(self) -> list[str]:
+        return [f'{x.url}?token={x.token}' for x in self.data]
+
 
 __all__ = [
+    'ModelParseError',
     'VerifyResult',
     'MangaEp',
     'EpImage',
@@ -0,0 +1,213 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 01:00
+@FileName       : rate_limiter.py
+@Project        : BilibiliMangaDownloader
+@Description    : per endpoint group token bucket request rate limiter
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import os
+import time
+import struct
+import asyncio
+import pathlib
+import weakref
+from contextvars import ContextVar
+
+from pydantic import BaseModel
+
+from .logger import logger
+from .metrics import metrics_registry
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+RATE_GROUPS: tuple[str, ...] = ('account', 'manga', 'cdn')
+"""请求速率分组: 账号 api、漫画 api 及图片 CDN"""
+
+_STATE = struct.Struct('<dd')
+"""跨进程共享的令牌桶状态: 剩余令牌数, 上次更新时间"""
+
+_LOCK_RETRY_DELAY: float = 0.0005
+_LOCK_RETRY_MAX_DELAY: float = 0.02
+"""共享令牌桶文件锁被其他进程持有时, 事件循环中重试加锁的初始及最大间隔, 单位秒"""
+
+_rate_wait: ContextVar[float] = ContextVar('rate_wait', default=0.0)
+
+
+class TokenBucketConfig(BaseModel):
+    """令牌桶配置"""
+    rate: float = 0
+    """持续请求速率, 单位次/秒, 不大于 0 时不限制"""
+    burst: int = 1
+    """突发请求数上限, 即令牌桶容量"""
+
+
+class RateLimitConfig(BaseModel):
+    """请求速率限制配置"""
+    enabled: bool = True
+    """是否启用速率限制"""
+    account: TokenBucketConfig = TokenBucketConfig(rate=2, burst=4)
+    """账号 api 的请求速率"""
+    manga: TokenBucketConfig = TokenBucketConfig(rate=10, burst=10)
+    """漫画 api 的请求速率, 包括章节列表、图片列表及图片 token"""
+    cdn: TokenBucketConfig = TokenBucketConfig(rate=200, burst=100)
+    """图片 CDN 的请求速率"""
+    shared_dir: str | None = None
+    """跨进程共享令牌桶状态的目录, 同一台机器上使用相同目录的进程共同遵守同一速率, 为 None 时只在进程内限制"""
+
+
+def rate_wait_seconds() -> float:
+    """当前上下文(asyncio 任务)中累计等待速率限制的时间, 单位秒, 用于从请求耗时中扣除排队时间"""
+    return _rate_wait.get()
+
+
+class TokenBucket(object):
+    """进程内令牌桶
+
+    获取令牌时先预留再等待, 令牌数可以为负, 表示已被预留的未来令牌, 因此等待方按预留顺序依次放行, 无需加锁
+    """
+
+    def __init__(self, name: str, config: TokenBucketConfig):
+        if config.burst < 1:
+            raise ValueError(f'burst of rate limit group "{name}" must be greater than 0')
+        self.name = name
+        self.rate = config.rate
+        self.burst = config.burst
+        self._tokens = float(config.burst)
+        self._updated = time.monotonic()
+
+    def __repr__(self) -> str:
+        return f'<{type(self).__name__}(name={self.name}, rate={self.rate}, burst={self.burst})>'
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate <= 0
+
+    def _take(self, tokens: float, updated: float, now: float) -> tuple[float, float]:
+        """根据上次状态补充令牌并预留一个令牌, 返回预留后的令牌数及需要等待的时间"""
+        tokens = min(float(self.burst), tokens + max(now - updated, 0.0) * self.rate) - 1
+        return tokens, (0.0 if tokens >= 0 else -tokens / self.rate)
+
+    def reserve(self) -> float:
+        """预留一个令牌, 返回取得该令牌前需要等待的时间, 单位秒"""
+        now = time.monotonic()
+        self._tokens, delay = self._take(self._tokens, self._updated, now)
+        self._updated = now
+        return delay
+
+    async def reserve_async(self) -> float:
+        """在事件循环中预留一个令牌, 不阻塞事件循环"""
+        return self.reserve()
+
+    async def acquire(self) -> float:
+        """等待取得一个令牌, 返回等待时间"""
+        if self.unlimited:
+            return 0.0
+        delay = await self.reserve_async()
+        if delay > 0:
+            metrics_registry.inc('rate_limited_total', group=self.name)
+            await asyncio.sleep(delay)
+        metrics_registry.observe('rate_limit_wait_seconds', delay, group=self.name)
+        return delay
+
+    def snapshot(self) -> dict[str, object]:
+        return {'rate': self.rate, 'burst': self.burst, 'tokens': round(self._tokens, 3)}
+
+
+class SharedTokenBucket(TokenBucket):
+    """使用文件保存状态并以 fcntl 文件锁同步的令牌桶, 同一台机器上共享同一文件的进程共同遵守同一速率
+
+    状态中的时间为系统时间, 以便在不同进程之间比较; 事件循环中以非阻塞方式加锁,
+    锁被其他进程持有时让出事件循环并退避重试, 不会因其他进程(例如被挂起的进程)持有锁而阻塞全部请求
+    """
+
+    def __init__(self, name: str, config: TokenBucketConfig, *, state_file: pathlib.Path):
+        if fcntl is None:
+            raise RuntimeError('Shared rate limit requires fcntl, which is not available on this platform')
+        super().__init__(name, config)
+        self.state_file = state_file
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        self._fd = os.open(self.state_file, os.O_RDWR | os.O_CREAT, 0o644)
+        weakref.finalize(self, os.close, self._fd)
+
+    def _reserve_locked(self) -> float:
+        """已持有文件锁时读取状态并预留一个令牌"""
+        try:
+            data = os.pread(self._fd, _STATE.size, 0)
+            now = time.time()
+            tokens, updated = _STATE.unpack(data) if len(data) == _STATE.size else (float(self.burst), now)
+            self._tokens, delay = self._take(tokens, updated, now)
+            os.pwrite(self._fd, _STATE.pack(self._tokens, now), 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return delay
+
+    def reserve(self) -> float:
+        """阻塞等待文件锁后预留一个令牌, 只在事件循环之外使用"""
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self._reserve_locked()
+
+    async def reserve_async(self) -> float:
+        retry_delay = _LOCK_RETRY_DELAY
+        while True:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, _LOCK_RETRY_MAX_DELAY)
+                continue
+            return self._reserve_locked()
+
+
+class RateLimiter(object):
+    """按请求分组划分的请求速率限制, 每个分组使用独立的令牌桶"""
+
+    def __init__(self, config: RateLimitConfig | None = None):
+        self.config = RateLimitConfig() if config is None else config
+        self.buckets: dict[str, TokenBucket] = {
+            group: self._create_bucket(group, getattr(self.config, group)) for group in RATE_GROUPS
+        }
+
+    def __repr__(self) -> str:
+        return f'<RateLimiter(buckets={list(self.buckets.values())})>'
+
+    def _create_bucket(self, group: str, config: TokenBucketConfig) -> TokenBucket:
+        if self.config.shared_dir is None or config.rate <= 0:
+            return TokenBucket(group, config)
+        if fcntl is None:
+            logger.warning(f'当前平台不支持跨进程速率限制, 请求分组 {group} 只在进程内限制')
+            return TokenBucket(group, config)
+        return SharedTokenBucket(group, config, state_file=pathlib.Path(self.config.shared_dir) / f'{group}.bucket')
+
+    async def acquire(self, group: str) -> float:
+        """等待指定分组的一个请求令牌, 返回等待时间, 单位秒
+
+        :param group: 请求分组, account、manga 或 cdn
+        """
+        if not self.config.enabled:
+            return 0.0
+        delay = await self.buckets[group].acquire()
+        if delay > 0:
+            _rate_wait.set(_rate_wait.get() + delay)
+        return delay
+
+    def snapshot(self) -> dict[str, dict[str, object]]:
+        """各分组的速率配置及当前令牌数"""
+        return {group: bucket.snapshot() for group, bucket in self.buckets.items()}
+
+
+__all__ = [
+    'RATE_GROUPS',
+    'RateLimitConfig',
+    'RateLimiter',
+    'SharedTokenBucket',
+    'TokenBucket',
+    'TokenBucketConfig',
+    'rate_wait_seconds'
+]
@@ -0,0 +1,145 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/17 17:00
+@FileName       : retry_policy.py
+@Project        : BilibiliMangaDownloader
+@Description    : retry policy with backoff, error classification and retry budget
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import random
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from aiohttp import ClientError, ClientResponseError
+from asyncio.exceptions import TimeoutError as _TimeoutError
+from pydantic import BaseModel
+
+
+RETRYABLE: str = 'retryable'
+"""临时性错误, 可以原样重试"""
+FATAL: str = 'fatal'
+"""不可恢复的错误, 重试没有意义"""
+REFRESH_TOKEN: str = 'refresh_token'
+"""资源 url 中的 token 已失效, 需要重新获取 token 后再请求"""
+
+_RETRYABLE_STATUS: frozenset[int] = frozenset({408, 412, 425, 429})
+"""可以重试的 4xx 状态码, 5xx 状态码总是可以重试"""
+_TOKEN_EXPIRED_STATUS: frozenset[int] = frozenset({401, 403})
+"""请求携带 token 的资源 url 时表示资源 token 已失效的状态码, 请求 api 时表示认证失败或无权访问"""
+
+
+class TokenExpiredError(Exception):
+    """资源 url 中的 token 已失效异常, 需要由获取 token 的一方重新获取后再请求"""
+
+
+class RetryBudgetExhaustedError(Exception):
+    """本次运行的重试预算已耗尽异常"""
+
+
+class RetryBudget(object):
+    """单次运行的全局重试预算
+
+    允许的重试次数为 min_retries 加上已发出请求数乘以 ratio,
+    因此少量偶发错误总能重试, 而在 CDN 整体不可用时重试量与请求量成比例, 不会形成重试风暴
+    """
+
+    def __init__(self, *, ratio: float = 0.2, min_retries: int = 100):
+        """
+        :param ratio: 每个请求可额外获得的重试次数
+        :param min_retries: 不依赖请求数的保底重试次数
+        """
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.requests: int = 0
+        self.retries: int = 0
+
+    def __repr__(self) -> str:
+        return f'<RetryBudget(requests={self.requests}, retries={self.retries}, available={self.available})>'
+
+    @property
+    def available(self) -> int:
+        return max(int(self.min_retries + self.requests * self.ratio) - self.retries, 0)
+
+    def record_request(self) -> None:
+        """记录一次首次发出的请求"""
+        self.requests += 1
+
+    def try_acquire(self) -> bool:
+        """尝试占用一次重试, 预算已耗尽时返回 False"""
+        if self.available <= 0:
+            return False
+        self.retries += 1
+        return True
+
+
+def _parse_retry_after(value: str | None) -> float | None:
+    """解析 Retry-After 头, 支持秒数及 http 日期两种格式"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class RetryPolicy(BaseModel):
+    """重试策略, 指数退避并附加随机抖动"""
+    attempt_limit: int = 3
+    """单次调用的尝试次数上限"""
+    base_delay: float = 0.5
+    """第一次重试前的基础等待时间, 单位秒"""
+    max_delay: float = 30.0
+    """单次等待时间上限, 单位秒, 同样限制 Retry-After"""
+    multiplier: float = 2.0
+    """每次重试等待时间的增长倍数"""
+    jitter: float = 1.0
+    """随机抖动比例, 为 1 时在 [0, 退避时间] 内均匀取值(full jitter), 为 0 时不抖动"""
+    refresh_token: bool = False
+    """请求的是否为携带 token 的资源 url, 为 True 时 401/403 表示 token 失效, 否则 401/403 为不可恢复的错误"""
+
+    def classify(self, exception: BaseException) -> str:
+        """判断异常属于可重试、不可恢复或需要刷新 token 中的哪一类"""
+        if isinstance(exception, TokenExpiredError):
+            return REFRESH_TOKEN
+        if isinstance(exception, ClientResponseError):
+            if exception.status in _TOKEN_EXPIRED_STATUS:
+                return REFRESH_TOKEN if self.refresh_token else FATAL
+            if exception.status >= 500 or exception.status in _RETRYABLE_STATUS or exception.status < 400:
+                return RETRYABLE
+            return FATAL
+        if isinstance(exception, (_TimeoutError, ClientError, ConnectionError)):
+            return RETRYABLE
+        return FATAL
+
+    def compute_delay(self, attempt: int, exception: BaseException | None = None) -> float:
+        """计算第 attempt 次失败后重试前的等待时间, 服务端提供 Retry-After 时优先使用
+
+        :param attempt: 已失败的次数, 从 1 开始
+        :param exception: 本次失败的异常
+        """
+        if isinstance(exception, ClientResponseError) and exception.headers is not None:
+            retry_after = _parse_retry_after(exception.headers.get('Retry-After'))
+            if retry_after is not None:
+                return min(retry_after, self.max_delay)
+
+        backoff = min(self.base_delay * self.multiplier ** (attempt - 1), self.max_delay)
+        return backoff * (1 - self.jitter) + random.uniform(0, backoff * self.jitter)
+
+
+__all__ = [
+    'FATAL',
+    'REFRESH_TOKEN',
+    'RETRYABLE',
+    'RetryBudget',
+    'RetryBudgetExhaustedError',
+    'RetryPolicy',
+    'TokenExpiredError'
+]
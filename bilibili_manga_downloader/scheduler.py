@@ -0,0 +1,240 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/17 12:00
+@FileName       : scheduler.py
+@Project        : BilibiliMangaDownloader
+@Description    : global staged work scheduler
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import TypeVar, AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable
+from urllib.parse import urlsplit
+
+from pydantic import BaseModel
+
+from .concurrency import AdaptiveLimitConfig, AdaptiveLimiter
+from .logger import logger
+from .metrics import metrics_registry
+
+
+T = TypeVar("T")
+
+
+class SchedulerConfig(BaseModel):
+    """调度器配置"""
+    host_limit: int | None = None
+    """单个 host 的全局并发请求数上限, 为 None 时取 api 及 CDN 自适应并发上限中的较大值, 使其不低于自适应并发上限"""
+    queue_size: int = 64
+    """各阶段之间队列的长度上限"""
+    index_workers: int = 2
+    """获取章节图片列表阶段的 worker 数"""
+    token_workers: int = 2
+    """获取图片 token 阶段的 worker 数"""
+    fetch_workers: int = 64
+    """下载图片阶段的 worker 数"""
+    write_workers: int = 4
+    """写入图片阶段的 worker 数"""
+    archive_workers: int = 2
+    """创建章节压缩文件阶段的 worker 数"""
+    api_limit: AdaptiveLimitConfig = AdaptiveLimitConfig(initial=4, max=16, latency_target=1.0)
+    """api 请求的自适应并发限制"""
+    cdn_limit: AdaptiveLimitConfig = AdaptiveLimitConfig(initial=16, max=64, latency_target=5.0)
+    """图片 CDN 请求的自适应并发限制"""
+
+    def resolved_host_limit(self) -> int:
+        """实际使用的单个 host 并发请求数上限"""
+        if self.host_limit is not None:
+            return self.host_limit
+        return max(self.api_limit.max, self.cdn_limit.max)
+
+
+class _Stage(object):
+    """调度器中的单个处理阶段"""
+
+    def __init__(
+            self,
+            name: str,
+            handler: Callable[[T], Awaitable[None]],
+            *,
+            worker_num: int,
+            queue_size: int,
+            on_error: Callable[[T, Exception], Awaitable[None]] | None = None
+    ):
+        if worker_num < 1:
+            raise ValueError(f'worker_num of stage "{name}" must be greater than 0')
+        self.name = name
+        self.handler = handler
+        self.on_error = on_error
+        self.worker_num = worker_num
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.workers: list[asyncio.Task] = []
+
+    def __repr__(self) -> str:
+        return f'<Stage(name={self.name}, workers={self.worker_num}, queued={self.queue.qsize()})>'
+
+    async def _work(self) -> None:
+        while True:
+            item = await self.queue.get()
+            start = time.perf_counter()
+            try:
+                await self.handler(item)
+            except Exception as e:
+                logger.opt(exception=e).error(f'Scheduler stage "{self.name}" unhandled exception, {e}')
+                await self._handle_error(item, e)
+            finally:
+                self.queue.task_done()
+                metrics_registry.observe('stage_seconds', time.perf_counter() - start, stage=self.name)
+                metrics_registry.inc('stage_items_total', stage=self.name)
+                metrics_registry.set_gauge('stage_queue_depth', self.queue.qsize(), stage=self.name)
+
+    async def _handle_error(self, item: T, exception: Exception) -> None:
+        """将处理函数未处理的异常交给 on_error, 使任务仍能被标记为失败, 而不是停留在未完成状态"""
+        if self.on_error is None:
+            return
+        try:
+            await self.on_error(item, exception)
+        except Exception as e:
+            logger.opt(exception=e).error(f'Scheduler stage "{self.name}" error handler failed, {e}')
+
+    def start(self) -> None:
+        self.workers = [asyncio.create_task(self._work(), name=f'{self.name}-{i}') for i in range(self.worker_num)]
+
+    async def stop(self) -> None:
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers.clear()
+
+
+class DownloadScheduler(object):
+    """全局下载任务调度器
+
+    任务按添加顺序依次流经各处理阶段, 阶段之间使用有界队列连接,
+    上游阶段在下游队列已满时阻塞, 因此任务只在下游有空闲时才会被创建;
+    所有阶段共享按 host 划分的全局并发请求数限制, 以及 api 请求和 CDN 请求各自的自适应并发限制
+    """
+
+    def __init__(self, config: SchedulerConfig | None = None):
+        self.config = SchedulerConfig() if config is None else config
+        self._stages: dict[str, _Stage] = {}
+        self._host_semaphores: dict[str, asyncio.Semaphore] = {}
+        self.limiters: dict[str, AdaptiveLimiter] = {
+            'api': AdaptiveLimiter('api', config=self.config.api_limit),
+            'cdn': AdaptiveLimiter('cdn', config=self.config.cdn_limit),
+        }
+        self._running = False
+
+    def __repr__(self) -> str:
+        return f'<DownloadScheduler(stages={list(self._stages.values())})>'
+
+    async def __aenter__(self) -> "DownloadScheduler":
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.stop()
+
+    def add_stage(
+            self,
+            name: str,
+            handler: Callable[[T], Awaitable[None]],
+            *,
+            worker_num: int,
+            queue_size: int | None = None,
+            on_error: Callable[[T, Exception], Awaitable[None]] | None = None
+    ) -> None:
+        """添加处理阶段, 需要在调度器启动前按任务流经顺序添加
+
+        :param name: 阶段名称
+        :param handler: 处理单个任务的异步函数, 可在其中调用 submit 将任务交给下一阶段
+        :param worker_num: 该阶段的 worker 数
+        :param queue_size: 该阶段队列长度上限, 默认使用调度器配置
+        :param on_error: handler 抛出异常时以任务及异常调用, 用于将任务标记为失败
+        """
+        if self._running:
+            raise RuntimeError('Can not add stage to a running scheduler')
+        if name in self._stages:
+            raise ValueError(f'Stage "{name}" already exists')
+        queue_size = self.config.queue_size if queue_size is None else queue_size
+        self._stages[name] = _Stage(name, handler, worker_num=worker_num, queue_size=queue_size, on_error=on_error)
+
+    def queue_depth(self) -> dict[str, int]:
+        """各阶段当前排队的任务数"""
+        return {name: stage.queue.qsize() for name, stage in self._stages.items()}
+
+    async def submit(self, stage_name: str, item: T) -> None:
+        """向指定阶段提交任务, 队列已满时等待"""
+        queue = self._stages[stage_name].queue
+        if queue.full():
+            # 下游处理速度跟不上时记录背压次数, 用于判断瓶颈所在阶段
+            metrics_registry.inc('stage_backpressure_total', stage=stage_name)
+        await queue.put(item)
+        metrics_registry.set_gauge('stage_queue_depth', queue.qsize(), stage=stage_name)
+
+    @asynccontextmanager
+    async def host_slot(self, url: str) -> AsyncIterator[None]:
+        """占用目标 host 的一个并发请求名额"""
+        host = urlsplit(url).netloc
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = self._host_semaphores.setdefault(host, asyncio.Semaphore(self.config.resolved_host_limit()))
+        async with semaphore:
+            yield
+
+    @asynccontextmanager
+    async def request_slot(self, url: str, *, group: str) -> AsyncIterator[None]:
+        """占用目标 host 及请求分组(api 或 cdn)的并发请求名额, 块内的耗时及异常用于调整该分组的并发限制
+
+        先占用 host 名额再占用分组名额, 等待 host 名额的时间不计入请求耗时, 自适应并发限制不会因自身排队而降低
+
+        :param url: 请求地址
+        :param group: 请求分组
+        """
+        async with self.host_slot(url), self.limiters[group].slot():
+            yield
+
+    def limits(self) -> dict[str, dict[str, object]]:
+        """各请求分组当前的并发限制及最近一次调整原因"""
+        return {name: limiter.snapshot() for name, limiter in self.limiters.items()}
+
+    def start(self) -> None:
+        if self._running:
+            return
+        for stage in self._stages.values():
+            stage.start()
+        self._running = True
+
+    async def join(self) -> None:
+        """按阶段顺序等待全部已提交的任务处理完成"""
+        for stage in self._stages.values():
+            await stage.queue.join()
+
+    async def stop(self) -> None:
+        for stage in self._stages.values():
+            await stage.stop()
+        self._running = False
+
+    async def run(self, source: Iterable[T] | AsyncIterable[T], stage_name: str) -> None:
+        """将任务源中的任务逐个提交到指定阶段, 并等待全部任务处理完成
+
+        :param source: 任务源, 仅在入口队列有空位时才会从中取出下一个任务
+        :param stage_name: 入口阶段名称
+        """
+        async with self:
+            if isinstance(source, AsyncIterable):
+                async for item in source:
+                    await self.submit(stage_name, item)
+            else:
+                for item in source:
+                    await self.submit(stage_name, item)
+            await self.join()
+
+
+__all__ = [
+    'DownloadScheduler',
+    'SchedulerConfig'
+]
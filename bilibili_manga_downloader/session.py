@@ -0,0 +1,143 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/17 18:00
+@FileName       : session.py
+@Project        : BilibiliMangaDownloader
+@Description    : shared ClientSession and connection pool factory
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import asyncio
+from functools import lru_cache
+from urllib.parse import urlsplit
+from weakref import WeakKeyDictionary
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+from pydantic import BaseModel
+
+from .file_handler import root_folder
+from .logger import logger
+from .metrics import create_trace_config
+from .rate_limiter import RateLimitConfig, RateLimiter
+
+
+class SessionConfig(BaseModel):
+    """连接池配置"""
+    limit: int = 128
+    """连接池的总连接数上限, 为 0 时不限制"""
+    limit_per_host: int = 64
+    """单个 host 的连接数上限, 为 0 时不限制, 低于调度器的单个 host 并发请求数上限时多出的请求在连接池中排队"""
+    use_dns_cache: bool = True
+    """是否缓存 DNS 解析结果"""
+    ttl_dns_cache: int | None = 300
+    """DNS 解析结果缓存时间, 单位秒, 为 None 时永久缓存"""
+    keepalive_timeout: float = 30.0
+    """空闲连接保持时间, 单位秒"""
+    timeout: float = 60.0
+    """单个请求的默认总超时时间, 单位秒, 各请求函数可单独指定"""
+    proxy: str | None = None
+    """代理地址, 例如 http://127.0.0.1:7890"""
+    trust_env: bool = False
+    """是否读取环境变量中的代理配置"""
+    warm_up_connections: int = 4
+    """获取到第一个图片 token 后预先建立的图片 host 连接数, 为 0 时不预热"""
+    trace: bool = True
+    """是否记录 DNS 解析、建立连接及首字节耗时指标"""
+    rate_limit: RateLimitConfig = RateLimitConfig()
+    """各请求分组的请求速率限制"""
+
+
+RATE_LIMIT_DIR_NAME: str = '.ratelimit'
+"""未指定共享目录时, 跨进程共享的令牌桶状态在下载文件夹中的目录名"""
+
+
+_session_proxies: "WeakKeyDictionary[ClientSession, str]" = WeakKeyDictionary()
+"""由 create_session 创建的 session 所使用的代理"""
+_session_rate_limiters: "WeakKeyDictionary[ClientSession, RateLimiter]" = WeakKeyDictionary()
+"""由 create_session 创建的 session 所使用的速率限制"""
+
+
+@lru_cache(maxsize=32)
+def client_timeout(total: float | None) -> ClientTimeout:
+    """获取总超时时间为 total 的 ClientTimeout, 相同参数复用同一个对象"""
+    return ClientTimeout(total=total)
+
+
+def session_proxy(session: ClientSession) -> str | None:
+    """获取 session 配置的代理地址"""
+    return _session_proxies.get(session)
+
+
+def session_rate_limiter(session: ClientSession) -> RateLimiter | None:
+    """获取 session 使用的请求速率限制, 不是由 create_session 创建的 session 不限制速率"""
+    return _session_rate_limiters.get(session)
+
+
+def default_rate_limit_dir() -> str:
+    """跨进程共享令牌桶状态的默认目录"""
+    return str(root_folder() / RATE_LIMIT_DIR_NAME)
+
+
+def create_session(config: SessionConfig | None = None, **kwargs) -> ClientSession:
+    """按连接池配置创建 ClientSession, 需要在事件循环中调用
+
+    :param config: 连接池配置
+    :param kwargs: 其他传递给 ClientSession 的参数
+    """
+    config = SessionConfig() if config is None else config
+    connector = TCPConnector(
+        limit=config.limit,
+        limit_per_host=config.limit_per_host,
+        use_dns_cache=config.use_dns_cache,
+        ttl_dns_cache=config.ttl_dns_cache,
+        keepalive_timeout=config.keepalive_timeout
+    )
+    if config.trace:
+        kwargs.setdefault('trace_configs', []).append(create_trace_config())
+    session = ClientSession(
+        connector=connector, timeout=client_timeout(config.timeout), trust_env=config.trust_env, **kwargs
+    )
+    if config.proxy:
+        _session_proxies[session] = config.proxy
+    if config.rate_limit.enabled:
+        _session_rate_limiters[session] = RateLimiter(config.rate_limit)
+    return session
+
+
+async def warm_up(session: ClientSession, url: str, *, connections: int = 4, timeout: float = 5) -> int:
+    """预先与目标 host 建立连接并放回连接池, 使后续请求跳过 DNS 解析及 TCP/TLS 握手
+
+    :param session: ClientSession
+    :param url: 目标 host 下的任意地址
+    :param connections: 预先建立的连接数
+    :param timeout: 单个连接的超时时间, 单位秒
+    :return: 成功建立的连接数
+    """
+    parsed_url = urlsplit(url)
+    root_url = f'{parsed_url.scheme}://{parsed_url.netloc}/'
+    proxy = session_proxy(session)
+
+    async def _connect() -> bool:
+        try:
+            async with session.head(root_url, proxy=proxy, timeout=client_timeout(timeout), allow_redirects=False):
+                return True
+        except Exception as e:
+            logger.debug(f'预热连接 {parsed_url.netloc} 失败, {e}')
+            return False
+
+    results = await asyncio.gather(*(_connect() for _ in range(connections)))
+    logger.debug(f'已预热 {parsed_url.netloc} 连接 {sum(results)} 个')
+    return sum(results)
+
+
+__all__ = [
+    'RATE_LIMIT_DIR_NAME',
+    'SessionConfig',
+    'client_timeout',
+    'create_session',
+    'default_rate_limit_dir',
+    'session_proxy',
+    'session_rate_limiter',
+    'warm_up'
+]
@@ -0,0 +1,198 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/17 14:00
+@FileName       : sync.py
+@Project        : BilibiliMangaDownloader
+@Description    : library-wide incremental sync
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import asyncio
+from aiohttp import ClientSession
+from contextlib import nullcontext
+from typing import Any, AsyncIterator, Iterable, NamedTuple
+
+from .api import MANGA_API_URL, BilibiliApiError, query_manga_ep
+from .blob_store import BlobStore
+from .download_config import DownloaderConfig
+from .downloader import (
+    BLOB_STORE_DIR_NAME,
+    MANIFEST_FILE_NAME,
+    METADATA_CACHE_FILE_NAME,
+    ChapterJob,
+    DownloadPipeline,
+    check_archive_suffix,
+    create_chapter_jobs
+)
+from .file_handler import FileHandler
+from .identity_pool import IdentityPool
+from .logger import logger
+from .manifest import DownloadManifest
+from .metadata_cache import MetadataCache
+from .model import MangaEp
+from .scheduler import DownloadScheduler
+from .session import create_session
+
+
+class SyncReport(NamedTuple):
+    """单部漫画的同步结果"""
+    comic_id: int
+    title: str | None
+    total: int
+    stored: int
+    new: int
+    failed: int
+    error: str | None = None
+
+
+def read_comic_ids(file: FileHandler) -> list[int]:
+    """从文件中读取漫画 id 列表, 每行一个, 忽略空行及 # 开头的注释"""
+    comic_ids: list[int] = []
+    with file.path.open('r', encoding='utf-8') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            if not line.isdigit():
+                raise ValueError(f'{line} 不是可用的漫画 id! 漫画 id 应当为纯数字!')
+            comic_ids.append(int(line))
+    return list(dict.fromkeys(comic_ids))
+
+
+async def query_comic(
+        comic_id: int,
+        *,
+        session: ClientSession,
+        scheduler: DownloadScheduler,
+        cache: MetadataCache | None = None
+) -> tuple[int, MangaEp | Exception]:
+    """获取漫画章节列表, 出错时返回异常而不抛出
+
+    :param comic_id: 漫画 id
+    :param session: 共享的 ClientSession
+    :param scheduler: 提供 api 请求并发限制的调度器
+    :param cache: 元数据缓存
+    """
+    try:
+        async with scheduler.request_slot(MANGA_API_URL, group='api'):
+            manga_ep = await query_manga_ep(comic_id=comic_id, session=session, cache=cache)
+            if manga_ep.code != 0:
+                raise BilibiliApiError(code=manga_ep.code, message=manga_ep.msg)
+    except Exception as e:
+        return comic_id, e
+    return comic_id, manga_ep
+
+
+async def _iter_new_chapters(
+        comic_ids: list[int],
+        *,
+        session: ClientSession,
+        pipeline: DownloadPipeline,
+        manifest: DownloadManifest,
+        archive_suffix: str,
+        reports: dict[int, SyncReport]
+) -> AsyncIterator[ChapterJob]:
+    """并发获取各漫画章节列表, 按获取完成顺序逐个产出本地尚未完整下载的章节"""
+    tasks = [
+        asyncio.create_task(query_comic(
+            x, session=session, scheduler=pipeline.scheduler, cache=pipeline.metadata_cache
+        )) for x in comic_ids
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            comic_id, manga_ep = await next_done
+            if isinstance(manga_ep, Exception):
+                logger.error(f'获取漫画({comic_id})章节失败, {manga_ep}')
+                reports[comic_id] = SyncReport(comic_id=comic_id, title=None, total=0, stored=0, new=0, failed=0,
+                                               error=str(manga_ep))
+                continue
+
+            new_chapters = list(create_chapter_jobs(manga_ep, archive_suffix=archive_suffix, manifest=manifest))
+            total = len(manga_ep.data.ep_list)
+            reports[comic_id] = SyncReport(
+                comic_id=comic_id, title=manga_ep.data.title, total=total,
+                stored=total - len(new_chapters), new=len(new_chapters), failed=0
+            )
+            logger.info(f'漫画"{manga_ep.data.title}"共 {total} 章, 新增 {len(new_chapters)} 章')
+            for chapter in new_chapters:
+                yield chapter
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def sync_library(
+        comic_ids: Iterable[int],
+        *,
+        config: DownloaderConfig | None = None,
+        session: ClientSession | None = None,
+        **options: Any
+) -> list[SyncReport]:
+    """增量同步多部漫画, 只下载本地尚未完整下载的章节
+
+    所有漫画共享同一个 ClientSession 及调度器并发限制, cookie 只验证一次,
+    已下载章节由下载清单判断, 同步使用固定的下载目录, 忽略配置中的 resume
+
+    :param comic_ids: 漫画 id 列表
+    :param config: 下载配置, 所有漫画共享
+    :param session: 共享的 ClientSession, 提供时不会在同步完成后关闭
+    :param options: 覆盖 config 中的同名配置项
+    :return: 各漫画的同步结果
+    """
+    config = DownloaderConfig.with_options(config, **options)
+    comic_ids = list(dict.fromkeys(comic_ids))
+    check_archive_suffix(config.archive_suffix, single_pass=config.single_pass)
+    reports: dict[int, SyncReport] = {}
+
+    blob_store = BlobStore(root=FileHandler('download', BLOB_STORE_DIR_NAME)) if config.dedup else None
+    with DownloadManifest(file=FileHandler('download', MANIFEST_FILE_NAME)) as manifest, \
+            MetadataCache(file=FileHandler('download', METADATA_CACHE_FILE_NAME),
+                          force_refresh=config.refresh_metadata) as metadata_cache, \
+            (blob_store if blob_store is not None else nullcontext()):
+        async with (create_session(config.session_config) if session is None else nullcontext(session)) as session:
+            identity_pool = IdentityPool(config.identity_pool)
+            await identity_pool.verify(session=session)
+
+            pipeline = DownloadPipeline(
+                session=session, scheduler_config=config.scheduler_config, chunk_size=config.chunk_size,
+                byte_budget=config.byte_budget, single_pass=config.single_pass, manifest=manifest,
+                metadata_cache=metadata_cache, warm_up_connections=config.session_config.warm_up_connections,
+                archive_config=config.archive_config, writer_config=config.writer_config,
+                image_variant=config.image_variant, blob_store=blob_store, validate_images=config.validate_images,
+                identity_pool=identity_pool
+            )
+            logger.info(f'开始同步 {len(comic_ids)} 部漫画')
+            await pipeline.run(_iter_new_chapters(
+                comic_ids, session=session, pipeline=pipeline, manifest=manifest,
+                archive_suffix=config.archive_suffix, reports=reports
+            ))
+
+    results: list[SyncReport] = []
+    for comic_id in comic_ids:
+        report = reports.get(comic_id)
+        if report is None:
+            continue
+        report = report._replace(failed=pipeline.comic_fail_chapter_count[comic_id])
+        results.append(report)
+        if report.error is not None:
+            logger.error(f'漫画({comic_id})同步失败, {report.error}')
+        elif report.new:
+            logger.info(f'漫画"{report.title}"同步完成, 已有: {report.stored}, '
+                        f'新增: {report.new - report.failed}, 失败: {report.failed}')
+        else:
+            logger.debug(f'漫画"{report.title}"没有新章节')
+
+    new_count = sum(x.new for x in results)
+    fail_count = sum(x.failed for x in results)
+    logger.success(f'同步完成, 共 {len(results)} 部漫画, 新增章节: {new_count - fail_count}, 失败: {fail_count}')
+    logger.debug(f'元数据缓存命中: {metadata_cache.hits}, 未命中: {metadata_cache.misses}')
+    return results
+
+
+__all__ = [
+    'SyncReport',
+    'query_comic',
+    'read_comic_ids',
+    'sync_library'
+]
@@ -0,0 +1,110 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/17 10:00
+@FileName       : token_resolver.py
+@Project        : BilibiliMangaDownloader
+@Description    : batched image token resolver
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import time
+from typing import Awaitable, Callable, Iterable
+
+from .api import BilibiliApiError
+from .metrics import metrics_registry
+from .model import ImageToken
+
+
+class _ResolvedToken(object):
+    """已获取的图片资源 url 及其签发时间"""
+    __slots__ = ('url', 'issued_at')
+
+    def __init__(self, url: str, issued_at: float):
+        self.url = url
+        self.issued_at = issued_at
+
+
+class ImageTokenResolver(object):
+    """批量获取图片 token, 并缓存已签发的资源 url
+
+    ImageToken 接口本身支持一次传入多个图片 path, 按 chunk_size 分批请求,
+    只对缺失或已过期的 path 重新请求 token
+    """
+
+    def __init__(
+            self,
+            query_func: Callable[[list[str]], Awaitable[ImageToken]],
+            *,
+            chunk_size: int = 64,
+            token_ttl: float = 300
+    ):
+        """
+        :param query_func: 根据一批图片 path 获取 ImageToken 的异步函数
+        :param chunk_size: 单次请求的图片 path 数量上限
+        :param token_ttl: token 有效时间, 单位秒
+        """
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be greater than 0')
+        self._query_func = query_func
+        self._chunk_size = chunk_size
+        self._token_ttl = token_ttl
+        self._tokens: dict[str, _ResolvedToken] = {}
+
+    def __repr__(self) -> str:
+        return f'<ImageTokenResolver(cached={len(self._tokens)}, chunk_size={self._chunk_size})>'
+
+    def _is_valid(self, image_path: str, now: float) -> bool:
+        token = self._tokens.get(image_path)
+        return token is not None and now - token.issued_at < self._token_ttl
+
+    def is_valid(self, image_path: str) -> bool:
+        """图片 path 是否已有未过期的 token, 是则 resolve 时不会发出请求"""
+        return self._is_valid(image_path, time.monotonic())
+
+    def invalidate(self, image_path: str) -> None:
+        """使某个图片 path 已缓存的 token 失效, 下次 resolve 时将重新请求"""
+        self._tokens.pop(image_path, None)
+
+    def clear(self) -> None:
+        self._tokens.clear()
+
+    async def _resolve_chunk(self, image_paths: list[str]) -> None:
+        issued_at = time.monotonic()
+        with metrics_registry.timer('token_resolve_seconds'):
+            image_token = await self._query_func(image_paths)
+        metrics_registry.inc('tokens_resolved_total', len(image_paths))
+        if image_token.code != 0:
+            raise BilibiliApiError(code=image_token.code, message=image_token.msg)
+
+        resource_urls = image_token.all_resource_url
+        if len(resource_urls) != len(image_paths):
+            raise RuntimeError(f'bilibili api error: requested {len(image_paths)} tokens, '
+                               f'but {len(resource_urls)} returned')
+
+        for image_path, url in zip(image_paths, resource_urls):
+            self._tokens[image_path] = _ResolvedToken(url=url, issued_at=issued_at)
+
+    async def resolve(self, image_paths: Iterable[str]) -> dict[str, str]:
+        """获取一批图片 path 对应的资源 url
+
+        :param image_paths: 图片 path 序列
+        :return: {image_path: resource_url}
+        """
+        image_paths = list(dict.fromkeys(image_paths))
+        now = time.monotonic()
+        missing = [x for x in image_paths if not self._is_valid(x, now)]
+
+        for index in range(0, len(missing), self._chunk_size):
+            await self._resolve_chunk(missing[index:index + self._chunk_size])
+
+        return {x: self._tokens[x].url for x in image_paths}
+
+    async def resolve_one(self, image_path: str) -> str:
+        """获取单个图片 path 对应的资源 url"""
+        return (await self.resolve([image_path]))[image_path]
+
+
+__all__ = [
+    'ImageTokenResolver'
+]
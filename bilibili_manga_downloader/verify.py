@@ -0,0 +1,277 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 06:30
+@FileName       : verify.py
+@Project        : BilibiliMangaDownloader
+@Description    : verify downloaded pages and repair only the bad ones
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import os
+import re
+import zipfile
+from aiohttp import ClientSession
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from itertools import groupby
+from typing import Any, Iterable, NamedTuple
+
+from .blob_store import BlobStore
+from .download_config import DownloaderConfig
+from .downloader import (
+    BLOB_STORE_DIR_NAME,
+    MANIFEST_FILE_NAME,
+    METADATA_CACHE_FILE_NAME,
+    ChapterJob,
+    DownloadPipeline
+)
+from .file_handler import FileHandler, run_sync
+from .identity_pool import IdentityPool
+from .integrity import ImageIntegrityError, ImageValidator, validate_file
+from .logger import logger
+from .manifest import STATUS_DONE, STATUS_FAILED, DownloadManifest, PageRecord
+from .metadata_cache import MetadataCache
+from .model import EpImage
+from .session import create_session
+
+
+_ARCHIVE_ENTRY_SEPARATOR: str = '!/'
+"""单次写入模式下清单中压缩文件路径与条目名之间的分隔符"""
+_PAGE_FILE_PATTERN = re.compile(r'_page_(\d+)\.[^./]+$')
+
+
+class PageIssue(NamedTuple):
+    """校验失败的图片"""
+    comic_id: int
+    ep_id: int
+    image_path: str
+    file_path: str
+    reason: str
+
+
+class VerifyReport(NamedTuple):
+    """已下载图片的校验结果"""
+    checked: int
+    """校验的图片数"""
+    issues: list[PageIssue]
+    """校验失败的图片"""
+    repaired: int = 0
+    """重新下载后全部图片均已完成的章节数"""
+
+    @property
+    def ok(self) -> bool:
+        return not self.issues
+
+    @property
+    def chapters(self) -> list[tuple[int, int]]:
+        """有图片校验失败的章节"""
+        return list(dict.fromkeys((x.comic_id, x.ep_id) for x in self.issues))
+
+
+def _expected_sizes(metadata_cache: MetadataCache, ep_id: int) -> dict[str, tuple[int, int]]:
+    """从已缓存的图片列表中获取各原图的尺寸, 图片列表未缓存时不校验尺寸"""
+    result = metadata_cache.get('GetImageIndex', {'ep_id': str(ep_id)})
+    if result is None:
+        return {}
+    return {x.path: (x.x, x.y) for x in EpImage.parse_obj(result).data.images}
+
+
+def _check_chapter(
+        pages: list[tuple[str, PageRecord]],
+        sizes: dict[str, tuple[int, int]]
+) -> list[tuple[str, str, str]]:
+    """校验单个章节的全部图片, 只读取各图片文件的开头及结尾
+
+    :param pages: 章节中各图片的 path 及下载记录
+    :param sizes: 图片列表中各原图的尺寸
+    :return: 校验失败的图片 path、文件位置及原因
+    """
+    issues: list[tuple[str, str, str]] = []
+    archive: zipfile.ZipFile | None = None
+    try:
+        for image_path, record in pages:
+            if record.status != STATUS_DONE:
+                issues.append((image_path, record.file_path, 'download failed'))
+                continue
+            width, height = sizes.get(image_path.split('@', 1)[0], (None, None))
+            exact = '@' not in image_path
+            archive_path, sep, entry = record.file_path.partition(_ARCHIVE_ENTRY_SEPARATOR)
+            try:
+                if sep:
+                    if archive is None:
+                        archive = zipfile.ZipFile(archive_path)
+                    data = archive.read(entry)
+                    if record.size is not None and len(data) != record.size:
+                        raise ImageIntegrityError(f'Entry size is {len(data)}, expected {record.size}')
+                    ImageValidator(width=width, height=height, exact=exact).validate(data)
+                else:
+                    size = os.stat(record.file_path).st_size
+                    if record.size is not None and size != record.size:
+                        raise ImageIntegrityError(f'File size is {size}, expected {record.size}')
+                    validate_file(record.file_path, width=width, height=height, exact=exact)
+            except (OSError, KeyError, zipfile.BadZipFile, ImageIntegrityError) as e:
+                issues.append((image_path, record.file_path, str(e) or e.__class__.__name__))
+    finally:
+        if archive is not None:
+            archive.close()
+    return issues
+
+
+def scan_downloads(
+        manifest: DownloadManifest,
+        metadata_cache: MetadataCache,
+        *,
+        comic_ids: Iterable[int] | None = None,
+        workers: int = 8
+) -> VerifyReport:
+    """按章节并行校验下载清单中记录的全部图片
+
+    :param manifest: 下载清单
+    :param metadata_cache: 元数据缓存, 用于获取图片尺寸, 不会发出请求
+    :param comic_ids: 需要校验的漫画 id, 默认为全部漫画
+    :param workers: 校验线程数
+    """
+    if comic_ids is None:
+        rows = manifest.list_pages()
+    else:
+        rows = [x for comic_id in dict.fromkeys(comic_ids) for x in manifest.list_pages(comic_id)]
+
+    chapters: list[tuple[int, int, list[tuple[str, PageRecord]]]] = [
+        (comic_id, ep_id, [(x[2], x[3]) for x in group])
+        for (comic_id, ep_id), group in groupby(rows, key=lambda x: (x[0], x[1]))
+    ]
+    sizes = [_expected_sizes(metadata_cache, ep_id) for _, ep_id, _ in chapters]
+
+    issues: list[PageIssue] = []
+    with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix='verify') as executor:
+        results = executor.map(_check_chapter, (x[2] for x in chapters), sizes)
+        for (comic_id, ep_id, _), chapter_issues in zip(chapters, results):
+            issues.extend(PageIssue(comic_id, ep_id, *x) for x in chapter_issues)
+    return VerifyReport(checked=len(rows), issues=issues)
+
+
+def _create_repair_job(
+        comic_id: int,
+        ep_id: int,
+        pages: dict[str, PageRecord],
+        sizes: dict[str, tuple[int, int]],
+        *,
+        archive_suffix: str
+) -> tuple[ChapterJob, bool]:
+    """根据清单记录重建章节任务, 使用原有的目录及图片 path, 不受当前图片规格配置影响
+
+    :return: 章节任务及章节是否为单次写入模式下载
+    """
+    indexed_paths = {}
+    for image_path, record in pages.items():
+        matched = _PAGE_FILE_PATTERN.search(record.file_path)
+        if matched is not None:
+            indexed_paths[int(matched.group(1))] = image_path
+
+    file_path = next(iter(pages.values())).file_path
+    archive_path, sep, _ = file_path.partition(_ARCHIVE_ENTRY_SEPARATOR)
+    if sep:
+        folder_path, archive_suffix = archive_path.rsplit('.', 1)
+    else:
+        folder_path = os.path.dirname(file_path)
+
+    chapter = ChapterJob(comic_id=comic_id, ep_id=ep_id, folder=FileHandler(folder_path),
+                         archive_suffix=archive_suffix)
+    # 清单中缺少部分图片的记录时无法还原完整的图片列表, 由流水线重新获取
+    if sorted(indexed_paths) == list(range(len(indexed_paths))):
+        chapter.image_paths = [indexed_paths[x] for x in range(len(indexed_paths))]
+        chapter.image_sizes = [sizes.get(x.split('@', 1)[0], (0, 0)) for x in chapter.image_paths]
+    return chapter, bool(sep)
+
+
+async def verify_downloads(
+        comic_ids: Iterable[int] | None = None,
+        *,
+        workers: int = 8,
+        repair: bool = False,
+        config: DownloaderConfig | None = None,
+        session: ClientSession | None = None,
+        **options: Any
+) -> VerifyReport:
+    """校验下载目录中已下载的图片, 只检查文件大小、文件头及结尾, 不解码图片
+
+    修复时删除校验失败的图片并只重新下载这些图片, 章节中其余图片通过下载清单校验后保留, 然后重新创建章节压缩文件;
+    单次写入模式下载的章节没有单独的图片文件, 其余图片从图片内容存储中获取, 未使用存储时整个章节重新下载
+
+    :param comic_ids: 需要校验的漫画 id, 默认为全部漫画
+    :param workers: 校验线程数
+    :param repair: 是否重新下载校验失败的图片
+    :param config: 下载配置, 仅在修复时使用
+    :param session: 共享的 ClientSession, 提供时不会在修复完成后关闭
+    :param options: 覆盖 config 中的同名配置项
+    """
+    config = DownloaderConfig.with_options(config, **options)
+    cache_file = FileHandler('download', METADATA_CACHE_FILE_NAME)
+    with DownloadManifest(file=FileHandler('download', MANIFEST_FILE_NAME)) as manifest:
+        with MetadataCache(file=cache_file, offline=True) as metadata_cache:
+            report = await run_sync(scan_downloads)(
+                manifest, metadata_cache, comic_ids=comic_ids, workers=workers
+            )
+            sizes = {ep_id: _expected_sizes(metadata_cache, ep_id) for _, ep_id in report.chapters}
+
+        for issue in report.issues:
+            logger.warning('漫画章节({})图片({})校验失败, {}, 文件路径: {}',
+                           issue.ep_id, issue.image_path, issue.reason, issue.file_path)
+        logger.info(f'校验完成, 共 {report.checked} 张图片, 校验失败: {len(report.issues)}, '
+                    f'涉及 {len(report.chapters)} 个章节')
+        if not repair or report.ok:
+            return report
+
+        blob_store = BlobStore(root=FileHandler('download', BLOB_STORE_DIR_NAME)) if config.dedup else None
+        jobs: dict[bool, list[ChapterJob]] = {False: [], True: []}
+        with (blob_store if blob_store is not None else nullcontext()):
+            for comic_id, ep_id in report.chapters:
+                archive = manifest.get_archive(comic_id, ep_id)
+                chapter, single_pass = _create_repair_job(
+                    comic_id, ep_id, manifest.get_pages(comic_id, ep_id), sizes[ep_id],
+                    archive_suffix=config.archive_suffix if archive is None else archive.file_path.rsplit('.', 1)[-1]
+                )
+                jobs[single_pass].append(chapter)
+
+            for issue in report.issues:
+                if _ARCHIVE_ENTRY_SEPARATOR not in issue.file_path:
+                    FileHandler(issue.file_path).delete()
+                if blob_store is not None:
+                    # 损坏的图片可能已存入图片内容存储, 不能再从存储中链接
+                    blob_store.forget(issue.image_path)
+                manifest.record_page(issue.comic_id, issue.ep_id, issue.image_path, file_path=issue.file_path,
+                                     status=STATUS_FAILED)
+
+            with MetadataCache(file=cache_file, force_refresh=config.refresh_metadata) as metadata_cache:
+                async with (create_session(config.session_config) if session is None
+                            else nullcontext(session)) as session:
+                    identity_pool = IdentityPool(config.identity_pool)
+                    await identity_pool.verify(session=session)
+
+                    for single_pass, chapters in jobs.items():
+                        if not chapters:
+                            continue
+                        pipeline = DownloadPipeline(
+                            session=session, scheduler_config=config.scheduler_config, chunk_size=config.chunk_size,
+                            byte_budget=config.byte_budget, single_pass=single_pass, manifest=manifest,
+                            metadata_cache=metadata_cache,
+                            warm_up_connections=config.session_config.warm_up_connections,
+                            archive_config=config.archive_config, writer_config=config.writer_config,
+                            image_variant=config.image_variant, blob_store=blob_store,
+                            validate_images=config.validate_images, identity_pool=identity_pool
+                        )
+                        await pipeline.run(chapters)
+
+    repaired = sum(1 for x in (*jobs[False], *jobs[True]) if x.error is None and not x.fail_count)
+    logger.success(f'修复完成, 共 {len(report.chapters)} 个章节, 成功: {repaired}, '
+                   f'失败: {len(report.chapters) - repaired}')
+    return report._replace(repaired=repaired)
+
+
+__all__ = [
+    'PageIssue',
+    'VerifyReport',
+    'scan_downloads',
+    'verify_downloads'
+]
@@ -8,11 +8,17 @@
 @Software       : PyCharm 
 """
 
+import os
 import sys
-import asyncio
+import pathlib
 from argparse import ArgumentParser
-from bilibili_manga_downloader import download_manga
-from bilibili_manga_downloader.logger import logger
+from typing import TYPE_CHECKING, Any, Coroutine
+from bilibili_manga_downloader.formats import ARCHIVE_FORMATS, IMAGE_FORMATS
+
+if TYPE_CHECKING:
+    from bilibili_manga_downloader.daemon import DownloadDaemon
+    from bilibili_manga_downloader.download_config import DownloaderConfig
+    from bilibili_manga_downloader.logger import LoggingConfig
 
 
 def _create_argument_parser() -> ArgumentParser:
@@ -20,14 +26,241 @@ def _create_argument_parser() -> ArgumentParser:
     parser = ArgumentParser(description='bilibili漫画下载')
     parser.add_argument('-c', '--comic-id', type=str, default='', help='漫画id')
     parser.add_argument('-e', '--ep-index', type=str, default='', help='章节id')
+    parser.add_argument('-s', '--sync', type=str, default='',
+                        help='增量同步模式, 从指定文件中读取漫画 id 列表(每行一个), 只下载本地尚未下载的章节')
+    parser.add_argument('--enqueue', type=str, default='',
+                        help='多节点下载的协调者, 从指定文件中读取漫画 id 列表(每行一个), 将全部章节加入任务队列后退出')
+    parser.add_argument('--worker', action='store_true',
+                        help='多节点下载的 worker, 从任务队列中领取章节下载, 直到队列中没有等待领取或正在下载的章节')
+    parser.add_argument('--queue', type=str, default='',
+                        help='任务队列文件, 多个节点需指定同一共享文件系统上的路径, 默认为下载文件夹中的 job_queue.sqlite3')
+    parser.add_argument('--worker-id', type=str, default=None, help='worker 标识, 默认由主机名及进程 id 组成')
+    parser.add_argument('--lease-seconds', type=float, default=300,
+                        help='章节租约时长, 单位秒, worker 超过该时长未续约时章节重新分配给其他 worker')
+    parser.add_argument('--refresh-metadata', action='store_true', help='忽略已缓存的章节列表及图片列表, 重新请求')
+    parser.add_argument('--plan', action='store_true', help='仅使用本地缓存的元数据离线列出漫画的下载计划, 不进行下载')
+    parser.add_argument('--resume', action='store_true', help='断点续传, 使用固定的下载目录并跳过已下载的章节及图片')
+    parser.add_argument('--api-concurrency', type=int, default=16, help='api 请求自适应并发数上限')
+    parser.add_argument('--cdn-concurrency', type=int, default=64, help='图片下载自适应并发数上限')
+    parser.add_argument('--host-limit', type=int, default=None,
+                        help='单个 host 的并发请求数及连接数上限, 默认取 api 及图片下载并发数上限中的较大值')
+    parser.add_argument('--connection-limit', type=int, default=128, help='连接池总连接数上限')
+    parser.add_argument('--manga-rate', type=float, default=None,
+                        help='漫画 api 每秒请求数上限, 包括章节列表、图片列表及图片 token 请求, 为 0 时不限制')
+    parser.add_argument('--manga-burst', type=int, default=None, help='漫画 api 突发请求数上限')
+    parser.add_argument('--cdn-rate', type=float, default=None, help='图片 CDN 每秒请求数上限, 为 0 时不限制')
+    parser.add_argument('--cdn-burst', type=int, default=None, help='图片 CDN 突发请求数上限')
+    parser.add_argument('--rate-limit-shared', type=str, nargs='?', default=None, const='',
+                        help='与同一台机器上的其他下载进程共享请求速率限制, 可指定共享状态目录, 默认为下载文件夹中的 .ratelimit')
+    parser.add_argument('--identities', type=str, default='',
+                        help='身份池配置文件(JSON), 包含多组 cookies(sessdata, bili_jct)及出口代理(proxy), '
+                             '章节任务在各身份之间分配, 默认使用 .env 中配置的 cookies')
+    parser.add_argument('--identity-strategy', type=str, default=None, choices=('round_robin', 'least_loaded'),
+                        help='分配章节任务时选择身份的策略, 默认为 least_loaded')
+    parser.add_argument('--proxy', type=str, default=None, help='代理地址, 例如 http://127.0.0.1:7890')
+    parser.add_argument('--single-pass', action='store_true', help='将图片直接写入章节压缩文件, 不保留单独的图片文件')
+    parser.add_argument('--archive-format', type=str, default='zip', choices=ARCHIVE_FORMATS,
+                        help='章节压缩文件格式, 单次写入模式下只支持 zip 或 cbz')
+    parser.add_argument('--archive-processes', type=int, default=None,
+                        help='章节压缩进程数, 默认为 CPU 核心数, 为 0 时在线程池中压缩')
+    parser.add_argument('--compression-level', type=int, default=None, help='章节压缩级别, 0 为不压缩')
+    parser.add_argument('--writer-threads', type=int, default=None, help='图片文件写入线程数, 默认为 4')
+    parser.add_argument('--fsync', action='store_true', help='图片文件完成写入前 fsync, 断电时不丢失已完成的图片')
+    parser.add_argument('--image-format', type=str, default=None, choices=IMAGE_FORMATS,
+                        help='下载的图片格式, 默认为原图格式')
+    parser.add_argument('--image-width', type=int, default=None, help='下载的图片宽度上限, 默认为原图宽度')
+    parser.add_argument('--image-quality', type=int, default=None, help='下载的图片质量, 1-100')
+    parser.add_argument('--dedup', action='store_true',
+                        help='使用图片内容存储, 已下载过的图片直接从存储中链接, 内容相同的图片只保存一份')
+    parser.add_argument('--gc', action='store_true', help='删除图片内容存储中已没有任何章节目录引用的图片后退出')
+    parser.add_argument('--gc-dry-run', action='store_true', help='与 --gc 一起使用, 只统计可以删除的图片, 不删除')
+    parser.add_argument('--no-validate', action='store_true',
+                        help='下载时不校验图片格式、尺寸及是否完整, 默认校验失败的图片单独重新下载')
+    parser.add_argument('--verify', action='store_true',
+                        help='校验下载目录中已下载的图片并列出损坏的图片后退出, 可使用 -c 只校验指定的漫画')
+    parser.add_argument('--repair', action='store_true', help='与 --verify 一起使用, 只重新下载校验失败的图片')
+    parser.add_argument('--verify-workers', type=int, default=8, help='校验图片的线程数')
+    parser.add_argument('--daemon', action='store_true',
+                        help='守护进程模式, 复用连接池及已验证的 cookie, 通过本地 HTTP 接口接收下载任务')
+    parser.add_argument('--daemon-host', type=str, default='127.0.0.1', help='守护进程监听地址')
+    parser.add_argument('--daemon-port', type=int, default=8700, help='守护进程监听端口')
+    parser.add_argument('--daemon-socket', type=str, default=None, help='守护进程监听的 Unix socket 路径')
+    parser.add_argument('--log-level', type=str, default='TRACE', help='终端日志级别, 例如 DEBUG、INFO')
+    parser.add_argument('--log-module-level', type=str, action='append', default=[], metavar='MODULE=LEVEL',
+                        help='单独指定某个模块的日志级别, 可重复使用, 例如 bilibili_manga_downloader.http_fetcher=WARNING')
+    parser.add_argument('--log-background', action='store_true',
+                        help='在后台线程中写入日志, 避免终端输出缓慢时阻塞下载')
+    parser.add_argument('--log-json', type=str, default='', help='同时将日志以 JSON lines 格式写入指定文件')
+    parser.add_argument('--log-json-level', type=str, default='DEBUG', help='JSON lines 日志级别')
+    parser.add_argument('--metrics-json', type=str, default='', help='将各阶段耗时等指标定时导出为 JSON 文件')
+    parser.add_argument('--metrics-prom', type=str, default='',
+                        help='将指标定时导出为 Prometheus textfile, 供 node exporter 采集')
+    parser.add_argument('--metrics-interval', type=float, default=15, help='指标导出间隔, 单位秒')
     return parser
 
 
+def _create_logging_config(arg) -> "LoggingConfig":
+    """根据命令行参数创建日志配置"""
+    from bilibili_manga_downloader.logger import LoggingConfig
+
+    module_levels: dict[str, str] = {}
+    for item in arg.log_module_level:
+        module, sep, level = item.partition('=')
+        if not sep or not module or not level:
+            raise SystemExit(f'--log-module-level 参数格式应为 MODULE=LEVEL: {item}')
+        module_levels[module] = level.upper()
+    return LoggingConfig(
+        level=arg.log_level.upper(),
+        module_levels=module_levels,
+        background=arg.log_background,
+        json_file=arg.log_json or None,
+        json_level=arg.log_json_level.upper()
+    )
+
+
+def _create_downloader_config(arg) -> "DownloaderConfig":
+    """根据命令行参数创建下载配置"""
+    from bilibili_manga_downloader.archive_pool import ArchiveConfig
+    from bilibili_manga_downloader.download_config import DownloaderConfig
+    from bilibili_manga_downloader.fs import WriterConfig
+    from bilibili_manga_downloader.identity_pool import IdentityPoolConfig, load_identity_pool_config
+    from bilibili_manga_downloader.image_variant import ImageVariantPolicy
+    from bilibili_manga_downloader.rate_limiter import RateLimitConfig
+    from bilibili_manga_downloader.scheduler import SchedulerConfig
+    from bilibili_manga_downloader.session import SessionConfig, default_rate_limit_dir
+
+    scheduler_config = SchedulerConfig()
+    scheduler_config.api_limit.max = arg.api_concurrency
+    scheduler_config.cdn_limit.max = arg.cdn_concurrency
+    scheduler_config.fetch_workers = max(scheduler_config.fetch_workers, arg.cdn_concurrency)
+    scheduler_config.host_limit = arg.host_limit
+    archive_config = ArchiveConfig()
+    if arg.archive_processes is not None:
+        archive_config.processes = arg.archive_processes
+    if arg.compression_level is not None:
+        archive_config.compression_levels[arg.archive_format] = arg.compression_level
+    writer_config = WriterConfig(fsync=arg.fsync)
+    if arg.writer_threads is not None:
+        writer_config.threads = arg.writer_threads
+    rate_limit = RateLimitConfig()
+    for bucket, rate, burst in ((rate_limit.manga, arg.manga_rate, arg.manga_burst),
+                                (rate_limit.cdn, arg.cdn_rate, arg.cdn_burst)):
+        if rate is not None:
+            bucket.rate = rate
+        if burst is not None:
+            bucket.burst = burst
+    if arg.rate_limit_shared is not None:
+        rate_limit.shared_dir = arg.rate_limit_shared or default_rate_limit_dir()
+    identity_pool = load_identity_pool_config(arg.identities) if arg.identities else IdentityPoolConfig()
+    if arg.identity_strategy is not None:
+        identity_pool.strategy = arg.identity_strategy
+    return DownloaderConfig(
+        single_pass=arg.single_pass,
+        archive_suffix=arg.archive_format,
+        resume=arg.resume,
+        refresh_metadata=arg.refresh_metadata,
+        dedup=arg.dedup,
+        validate_images=not arg.no_validate,
+        scheduler_config=scheduler_config,
+        session_config=SessionConfig(limit=arg.connection_limit, limit_per_host=scheduler_config.resolved_host_limit(),
+                                     proxy=arg.proxy, rate_limit=rate_limit),
+        archive_config=archive_config,
+        writer_config=writer_config,
+        image_variant=ImageVariantPolicy(width=arg.image_width, quality=arg.image_quality, format=arg.image_format),
+        identity_pool=identity_pool
+    )
+
+
+async def _run_with_metrics(main_coro: Coroutine[Any, Any, Any], arg) -> Any:
+    """运行主任务, 同时按配置定时导出指标"""
+    if not arg.metrics_json and not arg.metrics_prom:
+        return await main_coro
+
+    from bilibili_manga_downloader.metrics import metrics_registry
+
+    exporter = asyncio.create_task(metrics_registry.export_periodically(
+        json_file=pathlib.Path(arg.metrics_json) if arg.metrics_json else None,
+        prometheus_file=pathlib.Path(arg.metrics_prom) if arg.metrics_prom else None,
+        interval=arg.metrics_interval
+    ))
+    try:
+        return await main_coro
+    finally:
+        exporter.cancel()
+        await asyncio.gather(exporter, return_exceptions=True)
+
+
+async def _serve_daemon(daemon: "DownloadDaemon") -> None:
+    """运行守护进程, 收到 SIGTERM 时等待已进入流水线的章节完成后退出"""
+    stop_event = asyncio.Event()
+    if not sys.platform.startswith('win'):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop_event.set)
+    await daemon.serve(stop_event=stop_event)
+
+
 if __name__ == '__main__':
+    arg = _create_argument_parser().parse_args(args=sys.argv[1:])
+
+    # 解析参数后再导入 asyncio 及下载相关模块, 使 -h 及参数错误时无需等待 aiohttp、pydantic 等依赖导入
+    import asyncio
+    import signal
+    from bilibili_manga_downloader import DownloadDaemon, download_manga, enqueue_library, run_worker, sync_library
+    from bilibili_manga_downloader.daemon import DaemonConfig
+    from bilibili_manga_downloader.downloader import gc_blob_store, plan_download
+    from bilibili_manga_downloader.file_handler import FileHandler
+    from bilibili_manga_downloader.logger import configure_logging, logger
+    from bilibili_manga_downloader.sync import read_comic_ids
+    from bilibili_manga_downloader.verify import verify_downloads
+
+    configure_logging(_create_logging_config(arg))
+
     if sys.version_info[0] == 3 and sys.version_info[1] >= 8 and sys.platform.startswith('win'):
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
-    arg = _create_argument_parser().parse_args(args=sys.argv[1:])
+    downloader_config = _create_downloader_config(arg)
+
+    if arg.gc:
+        gc_blob_store(dry_run=arg.gc_dry_run)
+        sys.exit()
+
+    if arg.verify:
+        if arg.comic_id and not arg.comic_id.isdigit():
+            logger.error(f'{arg.comic_id} 不是可用的漫画 id! 漫画 id 应当为纯数字!')
+            sys.exit()
+        verify_report = asyncio.run(_run_with_metrics(verify_downloads(
+            comic_ids=[int(arg.comic_id)] if arg.comic_id else None, workers=arg.verify_workers,
+            repair=arg.repair, config=downloader_config
+        ), arg))
+        sys.exit(0 if verify_report.ok or verify_report.repaired == len(verify_report.chapters) else 1)
+
+    if arg.daemon:
+        daemon = DownloadDaemon(
+            DaemonConfig(host=arg.daemon_host, port=arg.daemon_port, unix_socket=arg.daemon_socket),
+            downloader_config=downloader_config
+        )
+        try:
+            asyncio.run(_run_with_metrics(_serve_daemon(daemon), arg))
+        except KeyboardInterrupt:
+            pass
+        sys.exit()
+
+    queue_file = FileHandler(os.path.abspath(arg.queue)) if arg.queue else None
+
+    if arg.enqueue:
+        comic_ids = read_comic_ids(FileHandler(os.path.abspath(arg.enqueue)))
+        asyncio.run(enqueue_library(comic_ids=comic_ids, queue_file=queue_file, config=downloader_config))
+        sys.exit()
+
+    if arg.worker:
+        asyncio.run(_run_with_metrics(run_worker(
+            queue_file=queue_file, worker_id=arg.worker_id, lease_seconds=arg.lease_seconds, config=downloader_config
+        ), arg))
+        sys.exit()
+
+    if arg.sync:
+        comic_ids = read_comic_ids(FileHandler(os.path.abspath(arg.sync)))
+        asyncio.run(_run_with_metrics(sync_library(comic_ids=comic_ids, config=downloader_config), arg))
+        sys.exit()
 
     if not arg.comic_id:
         logger.opt(colors=True).info('您没有指定需要下载的漫画 id, 通常漫画 id 可以在漫画主页 url 中找到, '
@@ -42,6 +275,12 @@ if __name__ == '__main__':
 
     comic_id = int(comic_id)
 
+    if arg.plan:
+        for item in plan_download(comic_id=comic_id):
+            page_count = '未缓存' if item.page_count is None else f'{item.page_count} 张图片'
+            logger.info(f'章节({item.ep_id}) {item.title}: {page_count}')
+        sys.exit()
+
     if not arg.ep_index:
         logger.opt(colors=True).info('您没有指定需要下载的漫画章节 id, 将会下载该漫画全部章节')
         ep_index = None
@@ -52,4 +291,6 @@ if __name__ == '__main__':
             sys.exit()
         ep_index = int(ep_index)
 
-    asyncio.run(download_manga(comic_id=comic_id, ep_index=ep_index))
+    asyncio.run(_run_with_metrics(
+        download_manga(comic_id=comic_id, ep_index=ep_index, config=downloader_config), arg
+    ))
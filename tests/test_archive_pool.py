@@ -0,0 +1,77 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 09:40
+@FileName       : test_archive_pool.py
+@Project        : BilibiliMangaDownloader
+@Description    : process pool chapter archive packing tests
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import os
+import pathlib
+import tarfile
+import zipfile
+
+import pytest
+
+from bilibili_manga_downloader.archive_pool import pack_directory
+
+
+def _chapter(folder: pathlib.Path, *, mtime: int = 1_700_000_000) -> pathlib.Path:
+    folder.mkdir(parents=True)
+    for index in (0, 1, 2, 10):
+        page = folder / f'chapter_page_{index}.jpg'
+        page.write_bytes(bytes([index]) * 2048)
+        os.utime(page, (mtime, mtime))
+    return folder
+
+
+def test_pack_zip_skips_temp_files(tmp_path: pathlib.Path):
+    folder = _chapter(tmp_path / 'chapter')
+    (folder / 'chapter_page_3.jpg.part').write_bytes(b'partial')
+    (folder / '.chapter_page_4.jpg.tmp').write_bytes(b'partial')
+    output = tmp_path / 'chapter.zip'
+    pack_directory(str(folder), str(output), 'zip', 6)
+
+    with zipfile.ZipFile(output) as zip_f:
+        assert zip_f.namelist() == [f'chapter_page_{x}.jpg' for x in (0, 1, 2, 10)]
+    assert not output.with_name('chapter.zip.part').exists()
+
+
+def test_pack_zip_compression_per_entry(tmp_path: pathlib.Path):
+    folder = _chapter(tmp_path / 'chapter')
+    (folder / 'info.txt').write_bytes(b'text' * 512)
+    output = tmp_path / 'chapter.cbz'
+    pack_directory(str(folder), str(output), 'cbz', 6)
+
+    with zipfile.ZipFile(output) as zip_f:
+        methods = {x.filename: x.compress_type for x in zip_f.infolist()}
+        assert zip_f.testzip() is None
+    assert methods.pop('info.txt') == zipfile.ZIP_DEFLATED
+    assert set(methods.values()) == {zipfile.ZIP_STORED}
+
+
+@pytest.mark.parametrize('archive_format', ['zip', 'tar', 'tar.gz', 'tar.xz'])
+def test_pack_reproducible(tmp_path: pathlib.Path, archive_format: str):
+    """相同内容在不同目录、不同修改时间下生成完全相同的压缩文件"""
+    first = tmp_path / f'first.{archive_format}'
+    second = tmp_path / f'second.{archive_format}'
+    pack_directory(str(_chapter(tmp_path / 'a' / 'chapter')), str(first), archive_format, 6, reproducible=True)
+    pack_directory(str(_chapter(tmp_path / 'b' / 'chapter', mtime=1_600_000_000)), str(second), archive_format, 6,
+                   reproducible=True)
+    assert first.read_bytes() == second.read_bytes()
+
+
+def test_pack_tar_page_order(tmp_path: pathlib.Path):
+    output = tmp_path / 'chapter.tar'
+    pack_directory(str(_chapter(tmp_path / 'chapter')), str(output), 'tar', 0)
+    with tarfile.open(output) as tar_f:
+        assert tar_f.getnames() == [f'chapter_page_{x}.jpg' for x in (0, 1, 2, 10)]
+
+
+def test_pack_unsupported_format(tmp_path: pathlib.Path):
+    output = tmp_path / 'chapter.rar'
+    with pytest.raises(ValueError):
+        pack_directory(str(_chapter(tmp_path / 'chapter')), str(output), 'rar', 6)
+    assert not output.with_name('chapter.rar.part').exists()
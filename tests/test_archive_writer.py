@@ -0,0 +1,62 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 09:50
+@FileName       : test_archive_writer.py
+@Project        : BilibiliMangaDownloader
+@Description    : single-pass chapter archive writer tests
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import asyncio
+import pathlib
+import zipfile
+
+import pytest
+
+from bilibili_manga_downloader.archive_writer import ChapterArchiveWriter
+from bilibili_manga_downloader.file_handler import FileHandler
+
+
+async def _write(output: pathlib.Path, order: list[int], *, skip: tuple[int, ...] = (), **kwargs) -> None:
+    async with ChapterArchiveWriter(FileHandler(str(output)), page_count=len(order), **kwargs) as writer:
+        for index in order:
+            if index in skip:
+                await writer.skip_page(index)
+            else:
+                await writer.add_page(index, f'page_{index}.jpg', bytes([index]) * 1024)
+
+
+def test_out_of_order_pages_written_in_order(tmp_path: pathlib.Path):
+    output = tmp_path / 'chapter.zip'
+    asyncio.run(_write(output, [3, 1, 0, 2, 4], skip=(2,)))
+    with zipfile.ZipFile(output) as zip_f:
+        assert zip_f.namelist() == ['page_0.jpg', 'page_1.jpg', 'page_3.jpg', 'page_4.jpg']
+        assert {x.compress_type for x in zip_f.infolist()} == {zipfile.ZIP_STORED}
+    assert not (tmp_path / 'chapter.zip.part').exists()
+
+
+def test_reproducible_independent_of_arrival_order(tmp_path: pathlib.Path):
+    first = tmp_path / 'first.cbz'
+    second = tmp_path / 'second.cbz'
+    asyncio.run(_write(first, [0, 1, 2, 3], reproducible=True))
+    asyncio.run(_write(second, [2, 3, 1, 0], reproducible=True))
+    assert first.read_bytes() == second.read_bytes()
+
+
+def test_abort_removes_temp_file(tmp_path: pathlib.Path):
+    output = tmp_path / 'chapter.zip'
+
+    async def _abort() -> None:
+        async with ChapterArchiveWriter(FileHandler(str(output)), page_count=2) as writer:
+            await writer.add_page(0, 'page_0.jpg', b'data')
+            raise RuntimeError('download failed')
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(_abort())
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_unsupported_suffix(tmp_path: pathlib.Path):
+    with pytest.raises(ValueError):
+        ChapterArchiveWriter(FileHandler(str(tmp_path / 'chapter.tar')), page_count=1)
@@ -0,0 +1,107 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 09:30
+@FileName       : test_blob_store.py
+@Project        : BilibiliMangaDownloader
+@Description    : content addressed blob store reference and gc tests
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import hashlib
+import pathlib
+from typing import Iterator
+
+import pytest
+
+from bilibili_manga_downloader.blob_store import BlobRecord, BlobStore, GcReport
+from bilibili_manga_downloader.file_handler import FileHandler
+
+
+@pytest.fixture
+def store(tmp_path: pathlib.Path) -> Iterator[BlobStore]:
+    with BlobStore(root=FileHandler(str(tmp_path / 'blobs'))) as store:
+        yield store
+
+
+def _page(path: pathlib.Path, data: bytes) -> tuple[FileHandler, str]:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return FileHandler(str(path)), hashlib.sha256(data).hexdigest()
+
+
+def test_put_file_shares_identical_content(store: BlobStore, tmp_path: pathlib.Path):
+    first, digest = _page(tmp_path / 'a' / 'page_0.jpg', b'same image')
+    second, _ = _page(tmp_path / 'b' / 'page_0.jpg', b'same image')
+    store.put_file('/bfs/manga/a.jpg', first, digest)
+    store.put_file('/bfs/manga/b.jpg', second, digest)
+
+    blob_path = store.blob_file(digest).path
+    assert blob_path.read_bytes() == b'same image'
+    assert blob_path.stat().st_nlink == 3
+    assert store.lookup_many(['/bfs/manga/a.jpg', '/bfs/manga/b.jpg', '/bfs/manga/c.jpg']) == {
+        '/bfs/manga/a.jpg': BlobRecord(digest, 10),
+        '/bfs/manga/b.jpg': BlobRecord(digest, 10)
+    }
+
+
+def test_lookup_ignores_missing_blob(store: BlobStore):
+    digest = hashlib.sha256(b'image').hexdigest()
+    store.put_bytes('/bfs/manga/a.jpg', b'image', digest)
+    assert store.lookup('/bfs/manga/a.jpg') == BlobRecord(digest, 5)
+
+    store.blob_file(digest).path.unlink()
+    assert store.lookup('/bfs/manga/a.jpg') is None
+
+
+def test_forget(store: BlobStore):
+    digest = hashlib.sha256(b'image').hexdigest()
+    store.put_bytes('/bfs/manga/a.jpg', b'image', digest)
+    store.forget('/bfs/manga/a.jpg')
+    assert store.lookup('/bfs/manga/a.jpg') is None
+    assert store.read_bytes(digest) == b'image'
+
+
+def test_link_to(store: BlobStore, tmp_path: pathlib.Path):
+    digest = hashlib.sha256(b'image').hexdigest()
+    store.put_bytes('/bfs/manga/a.jpg', b'image', digest)
+    target = FileHandler(str(tmp_path / 'chapter' / 'page_0.jpg'))
+    store.link_to(digest, target)
+    assert target.path.read_bytes() == b'image'
+    assert store.gc() == GcReport(removed=0, freed_bytes=0, kept=1)
+
+
+def test_gc_keeps_referenced_blobs(store: BlobStore, tmp_path: pathlib.Path):
+    page, digest = _page(tmp_path / 'a' / 'page_0.jpg', b'referenced')
+    store.put_file('/bfs/manga/a.jpg', page, digest)
+    assert store.gc() == GcReport(removed=0, freed_bytes=0, kept=1)
+
+    page.path.unlink()
+    assert store.gc(dry_run=True) == GcReport(removed=1, freed_bytes=10, kept=0)
+    assert store.blob_file(digest).path.exists()
+
+    assert store.gc() == GcReport(removed=1, freed_bytes=10, kept=0)
+    assert not store.blob_file(digest).path.exists()
+    assert store.lookup('/bfs/manga/a.jpg') is None
+
+
+def test_gc_copied_reference(store: BlobStore, tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch):
+    """不支持硬链接时根据引用记录判断复制的文件是否仍存在"""
+    def _link(*_):
+        raise OSError('hard links are not supported')
+
+    monkeypatch.setattr('os.link', _link)
+    page, digest = _page(tmp_path / 'a' / 'page_0.jpg', b'copied')
+    store.put_file('/bfs/manga/a.jpg', page, digest)
+    assert store.blob_file(digest).path.stat().st_nlink == 1
+    assert store.gc() == GcReport(removed=0, freed_bytes=0, kept=1)
+
+    page.path.unlink()
+    assert store.gc() == GcReport(removed=1, freed_bytes=6, kept=0)
+
+
+def test_gc_min_age(store: BlobStore):
+    digest = hashlib.sha256(b'fresh').hexdigest()
+    store.put_bytes('/bfs/manga/a.jpg', b'fresh', digest)
+    assert store.gc(min_age=3600) == GcReport(removed=0, freed_bytes=0, kept=1)
+    assert store.gc() == GcReport(removed=1, freed_bytes=5, kept=0)
@@ -0,0 +1,140 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 10:30
+@FileName       : test_concurrency.py
+@Project        : BilibiliMangaDownloader
+@Description    : AIMD adaptive concurrency limiter and scheduler slot tests
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import asyncio
+
+from aiohttp import ClientResponseError
+
+from bilibili_manga_downloader.concurrency import AdaptiveLimitConfig, AdaptiveLimiter
+from bilibili_manga_downloader.scheduler import DownloadScheduler, SchedulerConfig
+
+
+def _limiter(**kwargs) -> AdaptiveLimiter:
+    config = AdaptiveLimitConfig(**{'initial': 8, 'min': 1, 'max': 16, 'window': 4, 'latency_target': 1.0, **kwargs})
+    return AdaptiveLimiter('cdn', config=config)
+
+
+def _fill(limiter: AdaptiveLimiter, latency: float, *, busy: bool = True) -> None:
+    """记录一个窗口的样本, busy 时模拟并发已接近限制"""
+    limiter._in_flight = limiter.limit if busy else 0
+    for _ in range(limiter.config.window):
+        limiter.record(limiter._epoch, latency)
+    limiter._in_flight = 0
+
+
+def test_additive_increase_when_saturated():
+    limiter = _limiter()
+    _fill(limiter, 0.1)
+    assert limiter.limit == 9
+    _fill(limiter, 0.1)
+    assert limiter.limit == 10
+    assert limiter.last_change.reason.startswith('healthy')
+
+
+def test_no_increase_when_not_saturated():
+    limiter = _limiter()
+    _fill(limiter, 0.1, busy=False)
+    assert limiter.limit == 8
+
+
+def test_increase_capped_at_max():
+    limiter = _limiter(initial=16)
+    _fill(limiter, 0.1)
+    assert limiter.limit == 16
+
+
+def test_multiplicative_decrease_on_latency():
+    limiter = _limiter()
+    _fill(limiter, 2.0)
+    assert limiter.limit == 4
+    assert limiter.last_change.reason.startswith('p95 latency')
+
+
+def test_multiplicative_decrease_on_error_rate():
+    limiter = _limiter()
+    limiter.record(limiter._epoch, 0.1, exception=ConnectionResetError())
+    for _ in range(3):
+        limiter.record(limiter._epoch, 0.1)
+    assert limiter.limit == 4
+    assert limiter.last_change.reason.startswith('error rate')
+
+
+def test_throttle_decreases_once_per_epoch():
+    limiter = _limiter()
+    epoch = limiter._epoch
+    throttled = ClientResponseError(None, (), status=429)  # type: ignore[arg-type]
+    limiter.record(epoch, 0.1, exception=throttled)
+    assert limiter.limit == 4
+    # 调整前发出的请求返回的错误不会再次降低并发限制
+    limiter.record(epoch, 0.1, exception=throttled)
+    assert limiter.limit == 4
+    limiter.record(limiter._epoch, 0.1, exception=asyncio.TimeoutError())
+    assert limiter.limit == 2
+    assert limiter.last_change.reason == 'timeout'
+
+
+def test_decrease_floor():
+    limiter = _limiter(initial=1)
+    limiter.record(limiter._epoch, 0.1, exception=asyncio.TimeoutError())
+    assert limiter.limit == 1
+
+
+def test_disabled_limiter_keeps_initial():
+    limiter = _limiter(enabled=False)
+    limiter.record(limiter._epoch, 0.1, exception=asyncio.TimeoutError())
+    _fill(limiter, 0.1)
+    assert limiter.limit == 8
+
+
+def test_slot_limits_concurrency():
+    limiter = _limiter(initial=2, enabled=False)
+    peak = 0
+
+    async def _request() -> None:
+        nonlocal peak
+        async with limiter.slot():
+            peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0.01)
+
+    async def _main() -> None:
+        await asyncio.gather(*(_request() for _ in range(6)))
+
+    asyncio.run(_main())
+    assert peak == 2
+    assert limiter.in_flight == 0
+
+
+def test_default_host_limit_follows_limiter_max():
+    config = SchedulerConfig()
+    config.cdn_limit.max = 128
+    assert config.resolved_host_limit() == 128
+    assert SchedulerConfig(host_limit=8).resolved_host_limit() == 8
+
+
+def test_request_slot_excludes_host_wait_from_latency():
+    """等待 host 名额的时间不计入自适应并发限制的延迟样本"""
+    config = SchedulerConfig(host_limit=1)
+    config.cdn_limit = AdaptiveLimitConfig(initial=4, max=4, window=1000)
+    scheduler = DownloadScheduler(config)
+    limiter = scheduler.limiters['cdn']
+    latencies: list[float] = []
+    record = limiter.record
+    limiter.record = lambda epoch, latency, exception=None: (latencies.append(latency), record(epoch, latency))
+
+    async def _request() -> None:
+        async with scheduler.request_slot('https://manga.hdslb.com/bfs/manga/1.jpg', group='cdn'):
+            await asyncio.sleep(0.02)
+
+    async def _main() -> None:
+        await asyncio.gather(*(_request() for _ in range(4)))
+
+    asyncio.run(_main())
+    assert len(latencies) == 4
+    assert max(latencies) < 0.04
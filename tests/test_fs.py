@@ -0,0 +1,77 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 11:40
+@FileName       : test_fs.py
+@Project        : BilibiliMangaDownloader
+@Description    : pooled file writing tests
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import asyncio
+import pathlib
+
+from bilibili_manga_downloader.archive_pool import ArchiveConfig
+from bilibili_manga_downloader.downloader import DownloadPipeline
+from bilibili_manga_downloader.fs import DirectoryCache, WriterConfig, WriterPool
+from bilibili_manga_downloader.identity_pool import IdentityConfig, IdentityPool, IdentityPoolConfig
+
+
+def _write(tmp_path: pathlib.Path, chunks: list[bytes], *, buffer_size: int, commit: bool = True) -> WriterPool:
+    async def _main() -> WriterPool:
+        async with WriterPool(WriterConfig(buffer_size=buffer_size)) as pool:
+            file = pool.open(tmp_path / 'sub' / 'file.part', size=sum(len(x) for x in chunks) + 16)
+            for chunk in chunks:
+                await file.write(chunk)
+            if commit:
+                await file.commit(tmp_path / 'sub' / 'file')
+            else:
+                file.discard()
+        return pool
+
+    return asyncio.run(_main())
+
+
+def test_pooled_file_buffers_until_buffer_size(tmp_path: pathlib.Path):
+    pool = _write(tmp_path, [b'a' * 3, b'b' * 3, b'c' * 3], buffer_size=4)
+    assert (tmp_path / 'sub' / 'file').read_bytes() == b'aaabbbccc'
+    assert not (tmp_path / 'sub' / 'file.part').exists()
+    # 第二个数据块后缓冲达到 buffer_size 写入一次, 剩余数据在完成文件时写入
+    assert pool.job_count == 2
+
+
+def test_pooled_file_small_file_written_once(tmp_path: pathlib.Path):
+    pool = _write(tmp_path, [b'a', b'b'], buffer_size=1024)
+    assert (tmp_path / 'sub' / 'file').read_bytes() == b'ab'
+    assert pool.job_count == 1
+
+
+def test_pooled_file_discard(tmp_path: pathlib.Path):
+    _write(tmp_path, [b'a' * 8], buffer_size=4, commit=False)
+    assert not (tmp_path / 'sub' / 'file.part').exists()
+    assert not (tmp_path / 'sub' / 'file').exists()
+
+
+def test_directory_cache_recreates_forgotten_directory(tmp_path: pathlib.Path):
+    cache = DirectoryCache()
+    directory = tmp_path / 'a' / 'b'
+    cache.ensure(directory)
+    directory.rmdir()
+    cache.ensure(directory)
+    assert not directory.exists()
+    cache.forget(directory)
+    cache.ensure(directory)
+    assert directory.is_dir()
+
+
+def test_pipeline_writer_buffer_within_chunk_size():
+    """写入缓冲中的数据不计入在途数据量, 因此下载流水线中缓冲不超过一个数据块"""
+    identity_pool = IdentityPool(IdentityPoolConfig(identities=[IdentityConfig(name='test')]))
+    pipeline = DownloadPipeline(session=None, identity_pool=identity_pool, archive_config=ArchiveConfig(processes=0),
+                                chunk_size=16 * 1024, writer_config=WriterConfig(buffer_size=256 * 1024, threads=2))
+    assert pipeline.writer_pool.config.buffer_size == 16 * 1024
+    assert pipeline.writer_pool.config.threads == 2
+
+    pipeline = DownloadPipeline(session=None, identity_pool=identity_pool, archive_config=ArchiveConfig(processes=0),
+                                chunk_size=1024 * 1024, writer_config=WriterConfig(buffer_size=256 * 1024))
+    assert pipeline.writer_pool.config.buffer_size == 256 * 1024
@@ -0,0 +1,128 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 09:00
+@FileName       : test_identity_pool.py
+@Project        : BilibiliMangaDownloader
+@Description    : identity error classification and quarantine tests
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import asyncio
+
+import pytest
+from aiohttp import ClientResponseError, ClientSession, RequestInfo
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+from bilibili_manga_downloader.api import BilibiliApiError
+from bilibili_manga_downloader.http_fetcher import fetch_bytes, fetch_post_json
+from bilibili_manga_downloader.identity_pool import (
+    AUTH_ERROR,
+    DENIED_ERROR,
+    SOURCE_CDN,
+    THROTTLE_ERROR,
+    IdentityConfig,
+    IdentityPool,
+    IdentityPoolConfig,
+    classify_identity_error
+)
+from bilibili_manga_downloader.retry_policy import RetryPolicy, TokenExpiredError
+
+from .utils import local_server, status_handler
+
+
+@pytest.fixture(autouse=True)
+def _no_backoff(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(RetryPolicy, 'compute_delay', lambda self, attempt, exception=None: 0.0)
+
+
+def _response_error(status: int) -> ClientResponseError:
+    url = URL('https://manga.bilibili.com/twirp/comic.v1.Comic/GetImageIndex')
+    request_info = RequestInfo(url=url, method='POST', headers=CIMultiDictProxy(CIMultiDict()), real_url=url)
+    return ClientResponseError(request_info, (), status=status, message='')
+
+
+def _raised(fetch, status: int) -> BaseException:
+    """通过带有 retry 装饰器的真实请求函数请求总是返回 status 的本地服务, 返回最终抛出的异常"""
+    async def _main() -> BaseException:
+        async with local_server({'/resource': status_handler(status)}) as url:
+            async with ClientSession() as session:
+                try:
+                    await fetch(f'{url}/resource', session)
+                except Exception as e:
+                    return e
+        raise AssertionError('request did not fail')
+
+    return asyncio.run(_main())
+
+
+def _pool(size: int = 2) -> IdentityPool:
+    return IdentityPool(IdentityPoolConfig(identities=[IdentityConfig(name=f'id-{x}') for x in range(size)]))
+
+
+@pytest.mark.parametrize('status, category', [(401, AUTH_ERROR), (403, AUTH_ERROR), (412, THROTTLE_ERROR),
+                                              (429, THROTTLE_ERROR), (404, None), (500, None)])
+def test_classify_api_status(status: int, category: str | None):
+    assert classify_identity_error(_response_error(status)) == category
+    assert classify_identity_error(_raised(fetch_post_json, status)) == category
+
+
+def test_classify_denied():
+    assert classify_identity_error(BilibiliApiError(1, 'no permission')) == DENIED_ERROR
+
+
+@pytest.mark.parametrize('status', [401, 403])
+def test_classify_cdn_token_expired(status: int):
+    """图片 token 失效时 retry 装饰器抛出 TokenExpiredError from ClientResponseError, 只有来自 api 时才是认证失败"""
+    exception = _raised(fetch_bytes, status)
+    assert isinstance(exception, TokenExpiredError)
+    assert classify_identity_error(exception, source=SOURCE_CDN) is None
+    assert classify_identity_error(exception) == AUTH_ERROR
+
+
+def test_classify_token_expired_without_cause():
+    assert classify_identity_error(TokenExpiredError('token expired')) is None
+
+
+@pytest.mark.parametrize('status', [401, 403])
+def test_classify_cdn_auth_status_is_not_identity_error(status: int):
+    assert classify_identity_error(_response_error(status), source=SOURCE_CDN) is None
+
+
+def test_classify_cdn_throttle():
+    assert classify_identity_error(_response_error(429), source=SOURCE_CDN) == THROTTLE_ERROR
+
+
+def test_report_cdn_token_expired_keeps_identity_available():
+    pool = _pool()
+    identity = pool.identities[0]
+    exception = _raised(fetch_bytes, 403)
+    assert pool.report(identity, exception, ep_id=1, source=SOURCE_CDN) is None
+    assert identity.quarantined_until == 0.0
+    assert identity.error_count == 0
+
+
+def test_report_api_auth_quarantines_identity():
+    pool = _pool()
+    identity = pool.identities[0]
+    assert pool.report(identity, _response_error(401), ep_id=1) == AUTH_ERROR
+    assert identity.quarantined_until > 0
+    assert identity.quarantine_reason.startswith(AUTH_ERROR)
+
+
+def test_report_never_quarantines_last_identity():
+    pool = _pool(1)
+    identity = pool.identities[0]
+    assert pool.report(identity, _response_error(429)) == THROTTLE_ERROR
+    assert identity.quarantined_until == 0.0
+
+
+def test_report_denied_records_chapter():
+    pool = _pool()
+    identity = pool.identities[0]
+    pool.record_entitled(identity, 1)
+    assert pool.report(identity, BilibiliApiError(1, 'no permission'), ep_id=1) == DENIED_ERROR
+    assert identity.denied_ep_ids == {1}
+    assert not identity.entitled_ep_ids
+    assert identity.quarantined_until == 0.0
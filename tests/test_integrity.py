@@ -0,0 +1,126 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 09:20
+@FileName       : test_integrity.py
+@Project        : BilibiliMangaDownloader
+@Description    : header-only image validation tests
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import zlib
+
+import pytest
+
+from bilibili_manga_downloader.integrity import (
+    ImageIntegrityError,
+    ImageValidator,
+    parse_image_header,
+    validate_file
+)
+
+
+def _payload(size: int) -> bytes:
+    """固定的图片数据, 不包含 0xFF, 截断后的结尾不会恰好是文件结尾标记"""
+    return bytes(range(1, 255)) * (size // 254) + bytes(range(1, size % 254 + 1))
+
+
+def _jpeg(width: int, height: int, size: int = 4096) -> bytes:
+    app0 = b'\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+    sof = b'\xff\xc0\x00\x11\x08' + height.to_bytes(2, 'big') + width.to_bytes(2, 'big') + b'\x03' + bytes(9)
+    head = b'\xff\xd8' + app0 + sof + b'\xff\xda\x00\x02'
+    return head + _payload(size - len(head) - 2) + b'\xff\xd9'
+
+
+def _png(width: int, height: int, size: int = 4096) -> bytes:
+    ihdr = b'IHDR' + width.to_bytes(4, 'big') + height.to_bytes(4, 'big') + bytes((8, 2, 0, 0, 0))
+    head = b'\x89PNG\r\n\x1a\n' + (13).to_bytes(4, 'big') + ihdr + zlib.crc32(ihdr).to_bytes(4, 'big')
+    tail = b'\x00\x00\x00\x00IEND\xaeB`\x82'
+    return head + _payload(size - len(head) - len(tail)) + tail
+
+
+def _webp(width: int, height: int, size: int = 4096) -> bytes:
+    head = (b'RIFF' + (size - 8).to_bytes(4, 'little') + b'WEBP' + b'VP8X' + (10).to_bytes(4, 'little')
+            + bytes(4) + (width - 1).to_bytes(3, 'little') + (height - 1).to_bytes(3, 'little'))
+    return head + _payload(size - len(head))
+
+
+_IMAGES = {'jpg': _jpeg, 'png': _png, 'webp': _webp}
+
+
+@pytest.mark.parametrize('image_format', list(_IMAGES))
+def test_valid_image(image_format: str):
+    info = ImageValidator(width=1100, height=1600).validate(_IMAGES[image_format](1100, 1600))
+    assert (info.format, info.width, info.height) == (image_format, 1100, 1600)
+
+
+@pytest.mark.parametrize('image_format', list(_IMAGES))
+@pytest.mark.parametrize('chunk_size', [1, 7, 1024])
+def test_streamed_chunks(image_format: str, chunk_size: int):
+    data = _IMAGES[image_format](1100, 1600)
+    validator = ImageValidator(width=1100, height=1600)
+    for index in range(0, len(data), chunk_size):
+        validator.update(data[index:index + chunk_size])
+    assert validator.finish(len(data)).format == image_format
+
+
+@pytest.mark.parametrize('image_format', list(_IMAGES))
+def test_truncated_image(image_format: str):
+    data = _IMAGES[image_format](1100, 1600)
+    with pytest.raises(ImageIntegrityError):
+        ImageValidator().validate(data[:len(data) // 2])
+
+
+@pytest.mark.parametrize('size', [0, 5, 20])
+def test_truncated_header(size: int):
+    with pytest.raises(ImageIntegrityError):
+        ImageValidator().validate(_jpeg(1100, 1600)[:size])
+
+
+def test_jpeg_without_frame_header():
+    data = _jpeg(1100, 1600)
+    sof_index = data.index(b'\xff\xc0')
+    with pytest.raises(ImageIntegrityError, match='frame header'):
+        ImageValidator().validate(data[:sof_index] + data[sof_index + 19:])
+
+
+def test_html_error_page_rejected_on_first_chunk():
+    validator = ImageValidator()
+    with pytest.raises(ImageIntegrityError, match='Unrecognized'):
+        validator.update(b'<!DOCTYPE html><html><body>403 Forbidden</body></html>')
+
+
+def test_partial_header_waits_for_more_data():
+    assert parse_image_header(_png(1100, 1600)[:16]) is None
+    with pytest.raises(ImageIntegrityError):
+        parse_image_header(_png(1100, 1600)[:16], final=True)
+
+
+def test_dimension_mismatch():
+    with pytest.raises(ImageIntegrityError, match='expected 1100x1600'):
+        ImageValidator(width=1100, height=1600).validate(_jpeg(1000, 1600))
+
+
+def test_downscaled_dimensions():
+    validator = ImageValidator(width=1100, height=1600, exact=False)
+    assert validator.validate(_webp(550, 800)).width == 550
+    with pytest.raises(ImageIntegrityError, match='not a downscale'):
+        validator.validate(_webp(550, 1000))
+    with pytest.raises(ImageIntegrityError, match='not a downscale'):
+        validator.validate(_webp(1200, 1745))
+
+
+def test_webp_declared_size():
+    data = _webp(1100, 1600)
+    with pytest.raises(ImageIntegrityError, match='declares'):
+        ImageValidator().validate(data + b'extra')
+
+
+def test_validate_file(tmp_path):
+    path = tmp_path / 'page.png'
+    path.write_bytes(_png(1100, 1600, size=300 * 1024))
+    assert validate_file(path, width=1100, height=1600).format == 'png'
+
+    path.write_bytes(path.read_bytes()[:-4])
+    with pytest.raises(ImageIntegrityError, match='IEND'):
+        validate_file(path)
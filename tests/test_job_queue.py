@@ -0,0 +1,166 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 09:10
+@FileName       : test_job_queue.py
+@Project        : BilibiliMangaDownloader
+@Description    : lease-based job queue fencing tests
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import types
+from typing import Iterator
+
+import pytest
+
+from bilibili_manga_downloader import job_queue
+from bilibili_manga_downloader.file_handler import FileHandler
+from bilibili_manga_downloader.job_queue import ChapterEntry, JobQueue, QueueOptions, QueueStats
+
+
+class _Clock(object):
+    """替换 job_queue 模块使用的系统时间, 用于控制租约到期"""
+
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> _Clock:
+    clock = _Clock()
+    monkeypatch.setattr(job_queue, 'time', types.SimpleNamespace(time=clock.time))
+    return clock
+
+
+@pytest.fixture
+def queue(tmp_path, clock) -> Iterator[JobQueue]:
+    with JobQueue(FileHandler(str(tmp_path / 'queue.sqlite3')), lease_seconds=60, max_attempts=2) as queue:
+        queue.add_chapters([ChapterEntry(1, ep_id, ep_id, 'comic', f'chapter-{ep_id}') for ep_id in (10, 11)])
+        yield queue
+
+
+def test_claim_in_order(queue: JobQueue):
+    leases = queue.claim('a', limit=1)
+    assert [(x.ep_id, x.attempt) for x in leases] == [(10, 1)]
+    assert [x.ep_id for x in queue.claim('b', limit=5)] == [11]
+    assert queue.claim('c') == []
+    assert queue.stats() == QueueStats(pending=0, leased=2, done=0, failed=0)
+
+
+def test_add_chapters_keeps_existing(queue: JobQueue):
+    lease = queue.claim('a')[0]
+    assert queue.add_chapters([ChapterEntry(1, 10, 10, 'comic', 'renamed')]) == 0
+    assert queue.complete(lease, 'a')
+
+
+def test_expired_lease_is_reassigned_and_fenced(queue: JobQueue, clock: _Clock):
+    old = queue.claim('a')[0]
+    clock.now += 61
+    new = next(x for x in queue.claim('b', limit=2) if x.ep_id == old.ep_id)
+    assert new.attempt == old.attempt + 1
+
+    # 旧的持有者既不能续约也不能完成, 不会覆盖新持有者的结果
+    assert queue.heartbeat('a', [old]) == [old]
+    assert not queue.complete(old, 'a')
+    assert queue.heartbeat('b', [new]) == []
+    assert queue.complete(new, 'b')
+    assert queue.stats().done == 1
+
+
+def test_heartbeat_extends_lease(queue: JobQueue, clock: _Clock):
+    lease = queue.claim('a')[0]
+    clock.now += 50
+    assert queue.heartbeat('a', [lease]) == []
+    clock.now += 50
+    assert all(x.ep_id != lease.ep_id for x in queue.claim('b', limit=2))
+    assert queue.complete(lease, 'a')
+
+
+def test_same_attempt_from_other_worker_is_fenced(queue: JobQueue):
+    lease = queue.claim('a')[0]
+    assert queue.heartbeat('b', [lease]) == [lease]
+    assert not queue.complete(lease, 'b')
+
+
+def test_failed_chapter_retried_until_max_attempts(queue: JobQueue):
+    lease = queue.claim('a')[0]
+    assert queue.complete(lease, 'a', error='boom')
+    assert queue.stats().pending == 2
+
+    lease = queue.claim('a')[0]
+    assert lease.attempt == 2
+    assert queue.complete(lease, 'a', error='boom again')
+    assert queue.failed_chapters() == [(1, 10, 'boom again')]
+
+    # 重新加入已失败的章节后重新计算领取次数, 防护令牌继续增加
+    assert queue.add_chapters([ChapterEntry(1, 10, 10, 'comic', 'chapter-10')]) == 1
+    lease = queue.claim('a')[0]
+    assert lease.attempt == 3
+    assert queue.complete(lease, 'a', error='boom')
+    assert queue.stats().pending == 2
+
+
+def test_expired_lease_at_max_attempts_fails(queue: JobQueue, clock: _Clock):
+    queue.claim('a')
+    clock.now += 61
+    queue.claim('b')
+    clock.now += 61
+    assert [x.ep_id for x in queue.claim('c', limit=2)] == [11]
+    assert queue.failed_chapters() == [(1, 10, 'lease expired')]
+
+
+def test_release_does_not_count_attempt(queue: JobQueue, clock: _Clock):
+    leases = queue.claim('a', limit=2)
+    assert queue.release('a') == 2
+    assert queue.stats() == QueueStats(pending=2, leased=0, done=0, failed=0)
+
+    # 归还后重新领取时防护令牌仍然增加, 归还的租约由新的持有者使用
+    reclaimed = queue.claim('b', limit=2)
+    assert [x.attempt for x in reclaimed] == [2, 2]
+    assert not queue.complete(leases[0], 'a')
+
+    # 归还的领取不计入次数上限, 失败一次后仍可再次领取, 租约过期也不会直接标记为失败
+    assert queue.complete(reclaimed[0], 'b', error='boom')
+    assert queue.stats() == QueueStats(pending=1, leased=1, done=0, failed=0)
+    clock.now += 61
+    assert [x.ep_id for x in queue.claim('c', limit=2)] == [10, 11]
+    assert queue.failed_chapters() == []
+
+
+def test_release_fences_same_worker(queue: JobQueue):
+    """同一 worker 归还后重新领取同一章节, 归还前的旧租约不能续约或完成"""
+    old = queue.claim('a')[0]
+    assert queue.release('a') == 1
+    new = queue.claim('a')[0]
+    assert new.ep_id == old.ep_id
+    assert new.attempt == old.attempt + 1
+    assert queue.heartbeat('a', [old]) == [old]
+    assert not queue.complete(old, 'a', error='stale')
+    assert queue.complete(new, 'a')
+    assert queue.stats().done == 1
+
+
+def test_open_adds_released_column(tmp_path):
+    file = FileHandler(str(tmp_path / 'queue.sqlite3'))
+    with JobQueue(file) as queue:
+        queue.connection.execute('ALTER TABLE chapters DROP COLUMN released')
+    with JobQueue(file) as queue:
+        queue.add_chapters([ChapterEntry(1, 10, 10, 'comic', 'chapter-10')])
+        queue.claim('a')
+        assert queue.release('a') == 1
+
+
+def test_release_only_own_leases(queue: JobQueue):
+    queue.claim('a')
+    queue.claim('b')
+    assert queue.release('a') == 1
+    assert queue.stats() == QueueStats(pending=1, leased=1, done=0, failed=0)
+
+
+def test_options_round_trip(queue: JobQueue):
+    assert queue.get_options() is None
+    queue.set_options(QueueOptions(archive_suffix='cbz', single_pass=True))
+    assert queue.get_options() == QueueOptions(archive_suffix='cbz', single_pass=True)
@@ -0,0 +1,83 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 12:40
+@FileName       : test_manifest.py
+@Project        : BilibiliMangaDownloader
+@Description    : download manifest resume record tests
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import hashlib
+import pathlib
+from typing import Iterator
+
+import pytest
+
+from bilibili_manga_downloader.file_handler import FileHandler
+from bilibili_manga_downloader.manifest import STATUS_DONE, STATUS_FAILED, DownloadManifest
+
+
+@pytest.fixture
+def manifest(tmp_path: pathlib.Path) -> Iterator[DownloadManifest]:
+    with DownloadManifest(FileHandler(str(tmp_path / 'manifest.sqlite3'))) as manifest:
+        yield manifest
+
+
+def _file(tmp_path: pathlib.Path, data: bytes = b'page') -> FileHandler:
+    file = FileHandler(str(tmp_path / 'page.jpg'))
+    file.path.write_bytes(data)
+    return file
+
+
+def _record_page(manifest: DownloadManifest, file: FileHandler, data: bytes = b'page', **kwargs) -> None:
+    record = {'file_path': file.resolve_path, 'status': STATUS_DONE, 'size': len(data),
+              'checksum': hashlib.sha256(data).hexdigest(), **kwargs}
+    manifest.record_page(1, 10, '/bfs/manga/0.jpg', **record)
+
+
+def test_page_record_round_trip(tmp_path: pathlib.Path, manifest: DownloadManifest):
+    file = _file(tmp_path)
+    _record_page(manifest, file)
+    record = manifest.get_page(1, 10, '/bfs/manga/0.jpg')
+    assert manifest.get_pages(1, 10) == {'/bfs/manga/0.jpg': record}
+    assert manifest.list_pages(1) == [(1, 10, '/bfs/manga/0.jpg', record)]
+    assert manifest.list_pages(2) == []
+    assert manifest.verify_file(record, file, verify_checksum=True)
+
+
+def test_verify_file_rejects_changed_file(tmp_path: pathlib.Path, manifest: DownloadManifest):
+    file = _file(tmp_path)
+    _record_page(manifest, file)
+    record = manifest.get_page(1, 10, '/bfs/manga/0.jpg')
+
+    # 大小相同但内容被替换的文件只有校验 sha256 时才能发现
+    file.path.write_bytes(b'PAGE')
+    assert manifest.verify_file(record, file)
+    assert not manifest.verify_file(record, file, verify_checksum=True)
+
+    file.path.write_bytes(b'truncated page')
+    assert not manifest.verify_file(record, file)
+    file.path.unlink()
+    assert not manifest.verify_file(record, file)
+    assert not manifest.verify_file(None, file)
+
+
+def test_verify_file_rejects_failed_or_moved_record(tmp_path: pathlib.Path, manifest: DownloadManifest):
+    file = _file(tmp_path)
+    _record_page(manifest, file, status=STATUS_FAILED)
+    assert not manifest.verify_file(manifest.get_page(1, 10, '/bfs/manga/0.jpg'), file)
+    _record_page(manifest, file, file_path=str(tmp_path / 'other.jpg'))
+    assert not manifest.verify_file(manifest.get_page(1, 10, '/bfs/manga/0.jpg'), file)
+
+
+def test_verify_archive_requires_no_failed_pages(tmp_path: pathlib.Path, manifest: DownloadManifest):
+    file = _file(tmp_path, b'archive')
+    for ep_id, fail_count in ((10, 0), (11, 1)):
+        manifest.record_archive(1, ep_id, file_path=file.resolve_path, status=STATUS_DONE,
+                                page_count=3, fail_count=fail_count, size=len(b'archive'))
+    archives = manifest.get_archives(1)
+    assert archives[10] == manifest.get_archive(1, 10)
+    assert manifest.verify_archive(archives[10], file)
+    assert not manifest.verify_archive(archives[11], file)
+    assert not manifest.verify_archive(None, file)
@@ -0,0 +1,84 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 12:10
+@FileName       : test_metadata_cache.py
+@Project        : BilibiliMangaDownloader
+@Description    : api metadata cache tests
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import pathlib
+import types
+
+import pytest
+
+from bilibili_manga_downloader import metadata_cache as metadata_cache_module
+from bilibili_manga_downloader.file_handler import FileHandler
+from bilibili_manga_downloader.metadata_cache import MetadataCache
+
+
+class _Clock(object):
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> _Clock:
+    clock = _Clock()
+    monkeypatch.setattr(metadata_cache_module, 'time', types.SimpleNamespace(time=clock.time))
+    return clock
+
+
+def _cache(tmp_path: pathlib.Path, **kwargs) -> MetadataCache:
+    return MetadataCache(FileHandler(str(tmp_path / 'metadata.db')), **kwargs)
+
+
+def test_get_set_and_ttl(tmp_path: pathlib.Path, clock: _Clock):
+    with _cache(tmp_path, ttl={'ComicDetail': 10}) as cache:
+        assert cache.get('ComicDetail', {'comic_id': 1}) is None
+        cache.set('ComicDetail', {'comic_id': 1}, {'title': 'a'})
+        assert cache.get('ComicDetail', {'comic_id': 1}) == {'title': 'a'}
+        clock.now += 10
+        assert cache.get('ComicDetail', {'comic_id': 1}) is None
+        assert cache.stats() == {'hits': 1, 'misses': 2, 'expired': 1}
+
+
+def test_offline_and_force_refresh(tmp_path: pathlib.Path, clock: _Clock):
+    with _cache(tmp_path) as cache:
+        cache.set('ComicDetail', {'comic_id': 1}, [1])
+    clock.now += 24 * 60 * 60
+    with _cache(tmp_path, offline=True) as cache:
+        assert cache.get('ComicDetail', {'comic_id': 1}) == [1]
+    with _cache(tmp_path, offline=True, force_refresh=True) as cache:
+        assert cache.get('ComicDetail', {'comic_id': 1}) is None
+
+
+def test_evict_least_recently_accessed(tmp_path: pathlib.Path, clock: _Clock):
+    with _cache(tmp_path, max_entries=10) as cache:
+        for x in range(10):
+            clock.now += 1
+            cache.set('GetImageIndex', {'ep_id': x}, x)
+        clock.now += 1
+        assert cache.get('GetImageIndex', {'ep_id': 0}) == 0
+        cache.set('GetImageIndex', {'ep_id': 10}, 10)
+        assert cache._count_entries() == 9
+        kept = [x for x in range(11) if cache.get('GetImageIndex', {'ep_id': x}) is not None]
+        assert kept == [0, 3, 4, 5, 6, 7, 8, 9, 10]
+
+
+def test_set_does_not_count_every_insert(tmp_path: pathlib.Path, clock: _Clock):
+    """条目数未超过上限时写入不统计条目数, 淘汰后至少再写入上限的 10% 才会再次统计"""
+    with _cache(tmp_path, max_entries=100) as cache:
+        statements: list[str] = []
+        cache.connection.set_trace_callback(statements.append)
+        for x in range(300):
+            clock.now += 1
+            cache.set('GetImageIndex', {'ep_id': x}, x)
+        # 第 101 次写入时第一次淘汰至 90 条, 之后每 11 次写入统计并淘汰一次
+        assert sum('COUNT(*)' in x for x in statements) == 19
+        assert cache._count_entries() <= 100
+        assert cache.get('GetImageIndex', {'ep_id': 299}) == 299
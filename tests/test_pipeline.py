@@ -0,0 +1,149 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 10:40
+@FileName       : test_pipeline.py
+@Project        : BilibiliMangaDownloader
+@Description    : download pipeline stage failure accounting tests
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import asyncio
+import hashlib
+import pathlib
+
+import pytest
+
+from bilibili_manga_downloader.archive_pool import ArchiveConfig
+from bilibili_manga_downloader.blob_store import BlobStore
+from bilibili_manga_downloader.downloader import ChapterJob, DownloadPipeline, PageJob
+from bilibili_manga_downloader.events import ChapterArchived, ChapterFailed, ChapterPlanned, DownloadEvent, PageDone
+from bilibili_manga_downloader.file_handler import FileHandler
+from bilibili_manga_downloader.http_fetcher import ByteBudget
+from bilibili_manga_downloader.identity_pool import IdentityConfig, IdentityPool, IdentityPoolConfig
+from bilibili_manga_downloader.manifest import DownloadManifest
+from bilibili_manga_downloader.model import ImageToken
+from bilibili_manga_downloader.token_resolver import ImageTokenResolver
+
+
+_IMAGE_PATHS: list[str] = [f'/bfs/manga/{x}.jpg' for x in range(3)]
+
+
+class _Failure(RuntimeError):
+    """事件回调中模拟的异常, 例如用户回调或清单数据库出错"""
+
+
+def _run(
+        tmp_path: pathlib.Path,
+        *,
+        fail_on: type[DownloadEvent] | None = None,
+        **kwargs
+) -> tuple[DownloadPipeline, ChapterJob, list[ChapterJob], list[DownloadEvent]]:
+    """从图片内容存储中获取全部图片并运行流水线, 不发出任何请求
+
+    :param fail_on: 收到该类型的事件时抛出异常
+    :param kwargs: 其他流水线参数
+    """
+    events: list[DownloadEvent] = []
+    finished: list[ChapterJob] = []
+
+    def _on_event(event: DownloadEvent) -> None:
+        events.append(event)
+        if fail_on is not None and isinstance(event, fail_on):
+            raise _Failure(f'{event.kind} handler failed')
+
+    async def _main() -> tuple[DownloadPipeline, ChapterJob]:
+        with BlobStore(root=FileHandler(str(tmp_path / 'blobs'))) as blob_store:
+            for image_path in _IMAGE_PATHS:
+                data = image_path.encode() * 64
+                blob_store.put_bytes(image_path, data, hashlib.sha256(data).hexdigest())
+            identity_pool = IdentityPool(IdentityPoolConfig(identities=[IdentityConfig(name='test')]))
+            pipeline = DownloadPipeline(
+                session=None, blob_store=blob_store, identity_pool=identity_pool,
+                archive_config=ArchiveConfig(processes=0), on_chapter_finished=finished.append, on_event=_on_event,
+                **kwargs
+            )
+            chapter = ChapterJob(comic_id=1, ep_id=10, folder=FileHandler(str(tmp_path / 'comic' / 'chapter')))
+            chapter.image_paths = list(_IMAGE_PATHS)
+            await asyncio.wait_for(pipeline.run([chapter]), timeout=10)
+        return pipeline, chapter
+
+    pipeline, chapter = asyncio.run(_main())
+    return pipeline, chapter, finished, events
+
+
+def test_pipeline_success(tmp_path: pathlib.Path):
+    pipeline, chapter, finished, events = _run(tmp_path)
+    assert finished == [chapter]
+    assert chapter.error is None
+    assert chapter.finished_count == 3
+    assert chapter.archive_file.path.is_file()
+    assert pipeline.fail_chapter_count == 0
+    assert pipeline.identity_pool.identities[0].in_flight == 0
+    assert sum(isinstance(x, ChapterArchived) for x in events) == 1
+
+
+@pytest.mark.parametrize('fail_on', [ChapterPlanned, PageDone, ChapterArchived])
+def test_stage_failure_finishes_chapter(tmp_path: pathlib.Path, fail_on: type[DownloadEvent]):
+    """阶段处理函数抛出未处理的异常时, 章节仍以失败结束, 回调只调用一次且身份被释放"""
+    pipeline, chapter, finished, events = _run(tmp_path, fail_on=fail_on)
+    assert finished == [chapter]
+    assert isinstance(chapter.error, _Failure)
+    assert pipeline.fail_chapter_count == 1
+    assert pipeline.comic_fail_chapter_count[1] == 1
+    assert pipeline.identity_pool.identities[0].in_flight == 0
+    assert [x.error for x in events if isinstance(x, ChapterFailed)] == [chapter.error]
+    if fail_on is not ChapterArchived:
+        assert not chapter.archive_file.path.exists()
+
+
+def test_single_pass_holds_byte_budget_until_written(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch):
+    """单次写入模式下图片内容从获取到写入压缩文件期间一直占用全局在途数据量"""
+    page_size = len(_IMAGE_PATHS[0].encode() * 64)
+    peak = 0
+    acquire = ByteBudget.acquire
+
+    async def _acquire(self: ByteBudget, size: int) -> int:
+        nonlocal peak
+        size = await acquire(self, size)
+        peak = max(peak, self.in_flight)
+        return size
+
+    monkeypatch.setattr(ByteBudget, 'acquire', _acquire)
+    pipeline, chapter, finished, _ = _run(tmp_path, single_pass=True, byte_budget=page_size)
+    assert chapter.error is None
+    assert chapter.archive_file.path.is_file()
+    assert peak == page_size
+    assert pipeline.byte_budget.in_flight == 0
+
+
+def test_token_refresh_uses_api_slot(tmp_path: pathlib.Path):
+    """单个图片 token 失效后重新获取时占用 api 请求名额, token 有效时不占用"""
+    in_flight: list[int] = []
+
+    async def _query(image_paths: list[str]) -> ImageToken:
+        in_flight.append(pipeline.scheduler.limiters['api'].in_flight)
+        return ImageToken.parse_obj({'code': 0, 'msg': '', 'data': [{'url': x, 'token': 't'} for x in image_paths]})
+
+    async def _main() -> list[str]:
+        chapter = ChapterJob(comic_id=1, ep_id=10, folder=FileHandler(str(tmp_path / 'chapter')))
+        page = PageJob(chapter, 0, _IMAGE_PATHS[0])
+        token_resolver = ImageTokenResolver(_query)
+        return [await pipeline._resolve_token(page, token_resolver) for _ in range(2)]
+
+    identity_pool = IdentityPool(IdentityPoolConfig(identities=[IdentityConfig(name='test')]))
+    pipeline = DownloadPipeline(session=None, identity_pool=identity_pool, archive_config=ArchiveConfig(processes=0))
+    assert asyncio.run(_main()) == [f'{_IMAGE_PATHS[0]}?token=t'] * 2
+    assert in_flight == [1]
+    assert pipeline.scheduler.limiters['api'].in_flight == 0
+
+
+def test_manifest_records_finished_chapter(tmp_path: pathlib.Path):
+    """章节完成后清单中的图片及压缩文件记录与磁盘上的文件一致, 再次运行时可以跳过该章节"""
+    with DownloadManifest(FileHandler(str(tmp_path / 'manifest.sqlite3'))) as manifest:
+        _, chapter, _, _ = _run(tmp_path, manifest=manifest)
+        assert chapter.error is None
+        pages = manifest.get_pages(1, 10)
+        assert sorted(pages) == sorted(_IMAGE_PATHS)
+        assert all(manifest.verify_file(x, FileHandler(x.file_path), verify_checksum=True) for x in pages.values())
+        assert manifest.verify_archive(manifest.get_archive(1, 10), chapter.archive_file)
@@ -0,0 +1,120 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 10:00
+@FileName       : test_rate_limiter.py
+@Project        : BilibiliMangaDownloader
+@Description    : token bucket rate limiter tests
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import os
+import time
+import asyncio
+import pathlib
+import types
+
+import pytest
+
+from bilibili_manga_downloader import rate_limiter
+from bilibili_manga_downloader.rate_limiter import (
+    RateLimitConfig,
+    RateLimiter,
+    SharedTokenBucket,
+    TokenBucket,
+    TokenBucketConfig
+)
+
+
+class _Clock(object):
+    """替换 rate_limiter 模块使用的时间"""
+
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    monotonic = time
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> _Clock:
+    clock = _Clock()
+    monkeypatch.setattr(rate_limiter, 'time', types.SimpleNamespace(time=clock.time, monotonic=clock.monotonic))
+    return clock
+
+
+def test_burst_then_reserve_future_tokens(clock: _Clock):
+    bucket = TokenBucket('cdn', TokenBucketConfig(rate=10, burst=3))
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    # 令牌耗尽后按预留顺序依次等待
+    assert [round(bucket.reserve(), 6) for _ in range(3)] == [0.1, 0.2, 0.3]
+
+
+def test_refill_capped_at_burst(clock: _Clock):
+    bucket = TokenBucket('cdn', TokenBucketConfig(rate=10, burst=2))
+    bucket.reserve()
+    bucket.reserve()
+    clock.now += 0.125
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() > 0
+
+    clock.now += 60
+    assert [bucket.reserve() for _ in range(2)] == [0.0, 0.0]
+    assert bucket.reserve() > 0
+
+
+def test_invalid_burst():
+    with pytest.raises(ValueError):
+        TokenBucket('cdn', TokenBucketConfig(rate=10, burst=0))
+
+
+def test_shared_bucket_state_across_instances(clock: _Clock, tmp_path: pathlib.Path):
+    config = TokenBucketConfig(rate=10, burst=2)
+    first = SharedTokenBucket('cdn', config, state_file=tmp_path / 'cdn.bucket')
+    second = SharedTokenBucket('cdn', config, state_file=tmp_path / 'cdn.bucket')
+    assert first.reserve() == 0.0
+    assert second.reserve() == 0.0
+    assert round(first.reserve(), 6) == 0.1
+    clock.now += 1
+    assert second.reserve() == 0.0
+
+
+@pytest.mark.skipif(rate_limiter.fcntl is None, reason='fcntl is not available')
+def test_shared_bucket_does_not_block_event_loop(tmp_path: pathlib.Path):
+    """其他进程持有文件锁时, 等待令牌不阻塞事件循环中的其他任务"""
+    fcntl = rate_limiter.fcntl
+    state_file = tmp_path / 'cdn.bucket'
+    bucket = SharedTokenBucket('cdn', TokenBucketConfig(rate=100, burst=10), state_file=state_file)
+    # 单独打开的文件描述符持有独立的 flock, 与另一个进程持有锁的效果相同
+    fd = os.open(state_file, os.O_RDWR)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+
+    async def _main() -> int:
+        ticks = 0
+
+        async def _ticker() -> None:
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.001)
+
+        ticker = asyncio.create_task(_ticker())
+        asyncio.get_running_loop().call_later(0.05, fcntl.flock, fd, fcntl.LOCK_UN)
+        start = time.monotonic()
+        assert await bucket.acquire() == 0.0
+        assert time.monotonic() - start >= 0.04
+        ticker.cancel()
+        return ticks
+
+    try:
+        assert asyncio.run(_main()) > 5
+    finally:
+        os.close(fd)
+
+
+def test_disabled_rate_limiter():
+    limiter = RateLimiter(RateLimitConfig(enabled=False, cdn=TokenBucketConfig(rate=1, burst=1)))
+    assert asyncio.run(limiter.acquire('cdn')) == 0.0
+    assert asyncio.run(limiter.acquire('cdn')) == 0.0
@@ -0,0 +1,108 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 10:20
+@FileName       : test_retry_policy.py
+@Project        : BilibiliMangaDownloader
+@Description    : retry classification tests for api and resource requests
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+import asyncio
+import pathlib
+
+import pytest
+from aiohttp import ClientResponseError, ClientSession
+
+from bilibili_manga_downloader.file_handler import FileHandler
+from bilibili_manga_downloader.http_fetcher import (
+    ExceededAttemptError,
+    download_file,
+    fetch_bytes,
+    fetch_get_json,
+    fetch_post_json
+)
+from bilibili_manga_downloader.retry_policy import (
+    FATAL,
+    REFRESH_TOKEN,
+    RETRYABLE,
+    RetryPolicy,
+    TokenExpiredError
+)
+
+from .utils import local_server, status_handler
+
+
+_POLICY = RetryPolicy()
+
+
+@pytest.fixture(autouse=True)
+def _no_backoff(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(RetryPolicy, 'compute_delay', lambda self, attempt, exception=None: 0.0)
+
+
+def _response_error(status: int) -> ClientResponseError:
+    return ClientResponseError(None, (), status=status)  # type: ignore[arg-type]
+
+
+@pytest.mark.parametrize('status, category', [(401, FATAL), (403, FATAL), (404, FATAL), (429, RETRYABLE),
+                                              (412, RETRYABLE), (500, RETRYABLE), (503, RETRYABLE)])
+def test_classify_api(status: int, category: str):
+    assert _POLICY.classify(_response_error(status)) == category
+
+
+@pytest.mark.parametrize('status, category', [(401, REFRESH_TOKEN), (403, REFRESH_TOKEN), (404, FATAL),
+                                              (429, RETRYABLE)])
+def test_classify_resource(status: int, category: str):
+    assert _POLICY.copy(update={'refresh_token': True}).classify(_response_error(status)) == category
+
+
+def test_classify_connection_errors():
+    assert _POLICY.classify(asyncio.TimeoutError()) == RETRYABLE
+    assert _POLICY.classify(ConnectionResetError()) == RETRYABLE
+    assert _POLICY.classify(ValueError()) == FATAL
+
+
+@pytest.mark.parametrize('fetch', [fetch_get_json, fetch_post_json])
+@pytest.mark.parametrize('status', [401, 403])
+def test_api_auth_error_is_fatal(fetch, status: int):
+    """api 的 401/403 是认证失败, 不重试也不会被当作资源 token 失效"""
+    calls: list[str] = []
+
+    async def _main() -> None:
+        async with local_server({'/api': status_handler(status, calls=calls)}) as url:
+            async with ClientSession() as session:
+                await fetch(f'{url}/api', session)
+
+    with pytest.raises(ClientResponseError) as exc_info:
+        asyncio.run(_main())
+    assert exc_info.value.status == status
+    assert len(calls) == 1
+
+
+def test_api_server_error_is_retried():
+    calls: list[str] = []
+
+    async def _main() -> None:
+        async with local_server({'/api': status_handler(503, calls=calls)}) as url:
+            async with ClientSession() as session:
+                await fetch_post_json(f'{url}/api', session)
+
+    with pytest.raises(ExceededAttemptError):
+        asyncio.run(_main())
+    assert len(calls) == 3
+
+
+@pytest.mark.parametrize('status', [401, 403])
+def test_resource_auth_error_is_token_expired(tmp_path: pathlib.Path, status: int):
+    async def _main() -> None:
+        async with local_server({'/image.jpg': status_handler(status)}) as url:
+            async with ClientSession() as session:
+                with pytest.raises(TokenExpiredError) as exc_info:
+                    await fetch_bytes(f'{url}/image.jpg', session)
+                assert exc_info.value.__cause__.status == status
+                with pytest.raises(TokenExpiredError):
+                    await download_file(f'{url}/image.jpg', FileHandler(str(tmp_path / 'page.jpg')), session)
+
+    asyncio.run(_main())
+    assert list(tmp_path.iterdir()) == []
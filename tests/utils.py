@@ -0,0 +1,50 @@
+"""
+@Author         : Ailitonia
+@Date           : 2026/10/18 10:10
+@FileName       : utils.py
+@Project        : BilibiliMangaDownloader
+@Description    : shared helpers for tests
+@GitHub         : https://github.com/Ailitonia
+@Software       : PyCharm
+"""
+
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable
+
+from aiohttp import web
+
+
+Handler = Callable[[web.Request], Awaitable[web.StreamResponse]]
+
+
+@asynccontextmanager
+async def local_server(routes: dict[str, Handler]) -> AsyncIterator[str]:
+    """在本机随机端口启动只包含指定路由的 http 服务, 返回服务地址
+
+    :param routes: 路径及处理函数, 同一路径同时接受 GET 及 POST
+    """
+    app = web.Application()
+    for path, handler in routes.items():
+        app.router.add_route('*', path, handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    try:
+        port = runner.addresses[0][1]
+        yield f'http://127.0.0.1:{port}'
+    finally:
+        await runner.cleanup()
+
+
+def status_handler(status: int, *, calls: list[str] | None = None) -> Handler:
+    """总是返回指定状态码的处理函数
+
+    :param calls: 提供时记录每次请求的方法
+    """
+    async def _handler(request: web.Request) -> web.Response:
+        if calls is not None:
+            calls.append(request.method)
+        return web.json_response({'code': status}, status=status)
+
+    return _handler